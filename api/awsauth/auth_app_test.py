@@ -0,0 +1,191 @@
+import pytest
+
+from awsauth import auth_app
+from awsauth.api_key_cache import APIKeyCache
+from awsauth.api_key_repo import APIKeyRepo
+from awsauth.the_registry import registry
+from awsauth.usage_event_shipper import UsageEventShipper
+import stub_clients
+
+
+@pytest.fixture
+def dynamodb_client(monkeypatch):
+    stub_clients.init_test_config(
+        EMAIL_BLOCKLIST=["blocked@example.com"], FIREHOSE_FLUSH_IN_BACKGROUND=False
+    )
+    client = stub_clients.StubDynamoDBClient()
+    registry.initialize(
+        dynamodb_client=client,
+        firehose_client=stub_clients.StubFirehoseClient(),
+        ses_client=None,
+        hubspot_client=None,
+    )
+    monkeypatch.setattr(auth_app, "API_KEY_CACHE", None)
+    monkeypatch.setattr(auth_app, "USAGE_EVENT_SHIPPER", None)
+    APIKeyRepo.add_api_key("user@example.com", "valid-key", False)
+    APIKeyRepo.add_api_key("blocked@example.com", "blocked-key", False)
+    client.calls = 0
+    return client
+
+
+def _request_event(api_key: str) -> dict:
+    request = {"uri": "/v2/states.json", "clientIp": "1.2.3.4", "querystring": f"apiKey={api_key}"}
+    return {"Records": [{"cf": {"request": request}}]}
+
+
+def test_check_api_key_edge_caches_records(dynamodb_client):
+    for _ in range(3):
+        assert auth_app.check_api_key_edge(_request_event("valid-key"), None)["uri"]
+        assert auth_app.check_api_key_edge(_request_event("bad-key"), None)["status"] == 403
+        assert auth_app.check_api_key_edge(_request_event("blocked-key"), None)["status"] == 403
+
+    # Each key, including the invalid one, is queried once.
+    assert dynamodb_client.calls == 3
+    assert auth_app.API_KEY_CACHE.stats.hits == 6
+    assert auth_app.API_KEY_CACHE.stats.negative_hits == 2
+    # By default the usage record of each request is shipped before it returns.
+    assert [r["email"] for r in registry.firehose_client.records] == ["user@example.com"] * 3
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_api_key_cache_expiry_and_size():
+    fetched = []
+
+    def fetch(api_key):
+        fetched.append(api_key)
+        return {"email": api_key} if api_key.startswith("valid") else None
+
+    clock = _Clock()
+    cache = APIKeyCache(fetch, ttl_seconds=10, negative_ttl_seconds=2, max_size=2, clock=clock)
+
+    assert cache.get("valid1") == {"email": "valid1"}
+    assert cache.get("bad") is None
+    clock.now = 5
+    assert cache.get("valid1") == {"email": "valid1"}
+    assert cache.get("bad") is None
+    assert fetched == ["valid1", "bad", "bad"]
+
+    # valid1 was used more recently than bad, so bad is dropped.
+    cache.get("valid2")
+    assert len(cache) == 2
+    assert cache.stats.evictions == 1
+    clock.now = 11
+    cache.get("valid1")
+    assert fetched == ["valid1", "bad", "bad", "valid2", "valid1"]
+
+
+def test_api_key_cache_refresh_ahead():
+    records = {"valid": {"email": "old@example.com"}}
+    clock = _Clock()
+    cache = APIKeyCache(
+        records.get,
+        ttl_seconds=10,
+        negative_ttl_seconds=10,
+        max_size=10,
+        refresh_ahead_seconds=5,
+        clock=clock,
+    )
+    cache.get("valid")
+    records["valid"] = {"email": "new@example.com"}
+    clock.now = 6
+
+    # The cached record is returned while it is refreshed in the background.
+    assert cache.get("valid") == {"email": "old@example.com"}
+    cache.wait_for_refreshes()
+    assert cache.stats.refreshes == 1
+    clock.now = 8
+    assert cache.get("valid") == {"email": "new@example.com"}
+    assert cache.stats.misses == 1
+
+
+def test_usage_event_shipper_flushes_by_count_size_and_age():
+    client = stub_clients.StubFirehoseClient()
+    clock = _Clock()
+    shipper = UsageEventShipper(
+        client, "stream", max_records=3, max_bytes=100, max_age_seconds=10, clock=clock
+    )
+
+    shipper.add({"i": 0})
+    shipper.add({"i": 1})
+    assert client.calls == 0
+    shipper.add({"i": 2})
+    assert client.calls == 1
+    shipper.add({"padding": "x" * 100})
+    assert client.calls == 2
+    shipper.add({"i": 3})
+    clock.now = 10
+    shipper.add({"i": 4})
+    assert client.calls == 3
+    assert len(client.records) == 6
+    assert shipper.stats.records_shipped == 6
+
+
+def test_usage_event_shipper_retries_failed_records_in_later_flushes():
+    client = stub_clients.StubFirehoseClient(failure_rate=0.5)
+    shipper = UsageEventShipper(client, "stream", max_attempts=20)
+
+    for i in range(100):
+        shipper.add({"i": i})
+    shipper.flush()
+    assert 0 < shipper.stats.records_shipped < 100
+    for _ in range(19):
+        shipper.flush()
+
+    assert sorted(record["i"] for record in client.records) == list(range(100))
+    assert shipper.stats.retries > 0
+    assert shipper.stats.records_dropped == 0
+
+    client.failure_rate = 1
+    shipper = UsageEventShipper(client, "stream", max_attempts=2)
+    shipper.add({"i": 100})
+    shipper.flush()
+    assert shipper.stats.records_dropped == 0
+    shipper.flush()
+    assert shipper.stats.records_dropped == 1
+
+
+def test_usage_event_shipper_ships_failed_record_with_next_record():
+    client = stub_clients.StubFirehoseClient(failure_rate=1)
+    shipper = UsageEventShipper(client, "stream", max_records=1)
+
+    shipper.add({"i": 0})
+    assert client.records == []
+    client.failure_rate = 0
+    shipper.add({"i": 1})
+
+    assert [record["i"] for record in client.records] == [0, 1]
+
+
+def test_usage_event_shipper_in_background():
+    client = stub_clients.StubFirehoseClient()
+    shipper = UsageEventShipper(client, "stream", max_records=2, background=True)
+
+    for i in range(5):
+        shipper.add({"i": i})
+    shipper.flush()
+    shipper.wait()
+
+    assert [record["i"] for record in client.records] == list(range(5))
+
+
+def test_check_api_key_edge_ships_old_records_before_returning(dynamodb_client):
+    clock = _Clock()
+    auth_app.USAGE_EVENT_SHIPPER = UsageEventShipper(
+        registry.firehose_client, "stream", max_age_seconds=10, background=True, clock=clock
+    )
+
+    auth_app.check_api_key_edge(_request_event("valid-key"), None)
+    assert registry.firehose_client.records == []
+
+    # The container was idle. The next request, even an unauthorized one, ships the old record
+    # and waits for the put in the background thread.
+    clock.now = 60
+    auth_app.check_api_key_edge(_request_event("bad-key"), None)
+    assert [r["email"] for r in registry.firehose_client.records] == ["user@example.com"]
@@ -0,0 +1,147 @@
+from typing import Optional, Dict, Any, Callable, List
+import collections
+import concurrent.futures
+import dataclasses
+import threading
+import time
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    # Hits of keys cached as invalid, included in `hits`.
+    negative_hits: int = 0
+    refreshes: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        requests = self.hits + self.misses
+        return self.hits / requests if requests else 0.0
+
+
+@dataclasses.dataclass
+class _Entry:
+    # None for an invalid API key.
+    record: Optional[Dict[str, Any]]
+    expires_at: float
+    refreshing: bool = False
+
+
+class APIKeyCache:
+    """In-process cache of the records of API keys.
+
+    Lambda containers are reused across invocations so records cached in one request are used by
+    later requests to the same container, avoiding a DynamoDB query per request. Records of
+    valid keys are cached for `ttl_seconds` and invalid keys for `negative_ttl_seconds`. When the
+    cache is full the least recently used key is dropped.
+
+    If `refresh_ahead_seconds` is set, a hit on a record that expires within that many seconds
+    returns the cached record and fetches it again in a background thread, so that frequently
+    used keys are not fetched on the critical path of a request.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[str], Optional[Dict[str, Any]]],
+        ttl_seconds: float,
+        negative_ttl_seconds: float,
+        max_size: int,
+        refresh_ahead_seconds: float = 0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Args:
+            fetch: Function returning the record of an API key or None if it is invalid.
+            ttl_seconds: Seconds that the record of a valid key is cached.
+            negative_ttl_seconds: Seconds that an invalid key is cached.
+            max_size: Maximum number of keys cached.
+            refresh_ahead_seconds: Seconds before expiry that a hit refreshes a record in the
+                background. 0 to disable background refresh.
+            clock: Function returning the current time in seconds.
+        """
+        self._fetch = fetch
+        self._ttl_seconds = ttl_seconds
+        self._negative_ttl_seconds = negative_ttl_seconds
+        self._max_size = max_size
+        self._refresh_ahead_seconds = refresh_ahead_seconds
+        self._clock = clock
+        self._entries: "collections.OrderedDict[str, _Entry]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._refreshes: List[concurrent.futures.Future] = []
+        self.stats = CacheStats()
+
+    def get(self, api_key: str) -> Optional[Dict[str, Any]]:
+        """Returns the record of `api_key`, or None if it is invalid."""
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(api_key)
+            if entry and entry.expires_at > now:
+                self._entries.move_to_end(api_key)
+                self.stats.hits += 1
+                if entry.record is None:
+                    self.stats.negative_hits += 1
+                elif (
+                    self._refresh_ahead_seconds
+                    and entry.expires_at - now < self._refresh_ahead_seconds
+                    and not entry.refreshing
+                ):
+                    entry.refreshing = True
+                    self._refreshes.append(self._refresh_executor().submit(self._refresh, api_key))
+                return entry.record
+            self.stats.misses += 1
+
+        record = self._fetch(api_key)
+        self._store(api_key, record)
+        return record
+
+    def wait_for_refreshes(self):
+        """Waits for the background refreshes started so far to finish."""
+        with self._lock:
+            refreshes, self._refreshes = self._refreshes, []
+        concurrent.futures.wait(refreshes)
+
+    def invalidate(self, api_key: Optional[str] = None):
+        """Drops `api_key`, or all keys if None, from the cache."""
+        with self._lock:
+            if api_key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(api_key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _store(self, api_key: str, record: Optional[Dict[str, Any]]):
+        ttl = self._ttl_seconds if record is not None else self._negative_ttl_seconds
+        with self._lock:
+            self._entries[api_key] = _Entry(record, self._clock() + ttl)
+            self._entries.move_to_end(api_key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def _refresh(self, api_key: str):
+        try:
+            record = self._fetch(api_key)
+        except Exception:
+            # The cached record is used until it expires and is fetched by a request.
+            _logger.exception("Failed to refresh API key record")
+            with self._lock:
+                entry = self._entries.get(api_key)
+                if entry:
+                    entry.refreshing = False
+            return
+        self._store(api_key, record)
+        with self._lock:
+            self.stats.refreshes += 1
+
+    def _refresh_executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        if not self._executor:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        return self._executor
@@ -7,12 +7,15 @@ import re
 import json
 import pathlib
 import logging
+from typing import Optional
 
 import sentry_sdk
 from sentry_sdk.integrations.aws_lambda import AwsLambdaIntegration
 
 from awsauth import ses_client
+from awsauth.api_key_cache import APIKeyCache
 from awsauth.api_key_repo import APIKeyRepo
+from awsauth.usage_event_shipper import UsageEventShipper
 from awsauth.email_repo import EmailRepo
 from awsauth.config import Config
 from awsauth.the_registry import registry
@@ -28,6 +31,14 @@ _logger = logging.getLogger(__name__)
 
 FIREHOSE_CLIENT = None
 
+# Cache of API key records, reused by invocations in the same container. Created by
+# `_get_api_key_cache` on first use.
+API_KEY_CACHE: Optional[APIKeyCache] = None
+
+# Buffer of usage records put to Firehose in batches. Created by `_get_usage_event_shipper` on
+# first use.
+USAGE_EVENT_SHIPPER: Optional[UsageEventShipper] = None
+
 # Headers needed to return for CORS OPTIONS request
 CORS_OPTIONS_HEADERS = {
     "access-control-allow-origin": [{"key": "Access-Control-Allow-Origin", "value": "*"}],
@@ -43,9 +54,11 @@ CORS_OPTIONS_HEADERS = {
 
 
 def init():
-    global FIREHOSE_CLIENT
+    global FIREHOSE_CLIENT, API_KEY_CACHE, USAGE_EVENT_SHIPPER
     Config.init()
     registry.initialize()
+    API_KEY_CACHE = None
+    USAGE_EVENT_SHIPPER = None
 
     sentry_sdk.init(
         dsn=Config.Constants.SENTRY_DSN,
@@ -122,6 +135,33 @@ def _get_or_create_api_key(email: str, is_crs_user: bool):
     return api_key
 
 
+def _get_api_key_cache() -> APIKeyCache:
+    global API_KEY_CACHE
+    if API_KEY_CACHE is None:
+        API_KEY_CACHE = APIKeyCache(
+            APIKeyRepo.get_record_for_api_key,
+            ttl_seconds=Config.Constants.API_KEY_CACHE_TTL_SECONDS,
+            negative_ttl_seconds=Config.Constants.API_KEY_CACHE_NEGATIVE_TTL_SECONDS,
+            max_size=Config.Constants.API_KEY_CACHE_MAX_SIZE,
+            refresh_ahead_seconds=Config.Constants.API_KEY_CACHE_REFRESH_AHEAD_SECONDS,
+        )
+    return API_KEY_CACHE
+
+
+def _get_usage_event_shipper() -> UsageEventShipper:
+    global USAGE_EVENT_SHIPPER
+    if USAGE_EVENT_SHIPPER is None:
+        USAGE_EVENT_SHIPPER = UsageEventShipper(
+            registry.firehose_client,
+            Config.Constants.FIREHOSE_TABLE_NAME,
+            max_records=Config.Constants.FIREHOSE_BATCH_MAX_RECORDS,
+            max_bytes=Config.Constants.FIREHOSE_BATCH_MAX_BYTES,
+            max_age_seconds=Config.Constants.FIREHOSE_BATCH_MAX_AGE_SECONDS,
+            background=Config.Constants.FIREHOSE_FLUSH_IN_BACKGROUND,
+        )
+    return USAGE_EVENT_SHIPPER
+
+
 def _record_successful_request(request: dict, record: dict):
     data = {
         "timestamp": datetime.datetime.utcnow().isoformat().replace("T", " "),
@@ -131,10 +171,20 @@ def _record_successful_request(request: dict, record: dict):
         "is_covid_response_simulator_user": record.get("is_covid_response_simulator_user", False),
     }
 
-    registry.firehose_client.put_data(Config.Constants.FIREHOSE_TABLE_NAME, data)
+    _get_usage_event_shipper().add(data)
 
 
 def check_api_key_edge(event, context):
+    try:
+        return _check_api_key(event)
+    finally:
+        # Ship old usage records, including those of earlier requests, before Lambda freezes the
+        # container.
+        if USAGE_EVENT_SHIPPER is not None:
+            USAGE_EVENT_SHIPPER.flush_if_due()
+
+
+def _check_api_key(event) -> dict:
     request = event["Records"][0]["cf"]["request"]
 
     query_parameters = urllib.parse.parse_qs(request["querystring"])
@@ -146,7 +196,7 @@ def check_api_key_edge(event, context):
     if not api_key:
         return {"status": 403, "statusDescription": "Unauthorized"}
 
-    record = APIKeyRepo.get_record_for_api_key(api_key)
+    record = _get_api_key_cache().get(api_key)
     if not record:
         return {"status": 403, "statusDescription": "Unauthorized"}
 
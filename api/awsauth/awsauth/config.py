@@ -27,6 +27,34 @@ class EnvConstants(pydantic.BaseSettings):
 
     EMAIL_BLOCKLIST: List[str]
 
+    # Seconds that the record of a valid API key is cached by each Lambda container.
+    API_KEY_CACHE_TTL_SECONDS: float = 300
+
+    # Seconds that an invalid API key is cached.
+    API_KEY_CACHE_NEGATIVE_TTL_SECONDS: float = 60
+
+    # Maximum number of API keys cached by each Lambda container.
+    API_KEY_CACHE_MAX_SIZE: int = 10000
+
+    # Seconds before a cached record expires that a request refreshes it in the background.
+    # 0 disables background refresh.
+    API_KEY_CACHE_REFRESH_AHEAD_SECONDS: float = 0
+
+    # Usage records are put to Firehose in batches of up to this many records, bytes or seconds
+    # since the first record of the batch. The default of 1 ships the record of each request before
+    # it returns. Larger batches save a Firehose round trip on most requests, but the records
+    # buffered by an idle container are lost if it is shut down.
+    FIREHOSE_BATCH_MAX_RECORDS: int = 1
+
+    FIREHOSE_BATCH_MAX_BYTES: int = 1024 * 1024
+
+    FIREHOSE_BATCH_MAX_AGE_SECONDS: float = 10
+
+    # If true, batches are put by a background thread instead of the request that fills them. The
+    # request still waits for the put before returning because Lambda freezes the container after
+    # it returns, so this only helps outside Lambda.
+    FIREHOSE_FLUSH_IN_BACKGROUND: bool = False
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
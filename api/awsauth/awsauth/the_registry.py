@@ -28,14 +28,26 @@ class Registry(object):
     def __init__(self):
         self._initialized_objects = {}
 
-    def initialize(self):
+    def initialize(self, **overrides):
+        """Creates the registered objects.
+
+        Args:
+            overrides: Objects used instead of those created by `RegistryProvider`, such as
+                stub clients in tests, keyed by property name.
+        """
         properties = [
             prop for prop, obj in inspect.getmembers(self.__class__) if isinstance(obj, property)
         ]
+        unknown = set(overrides) - set(properties)
+        if unknown:
+            raise ValueError(f"Unknown registry properties: {unknown}")
         provider = RegistryProvider()
 
         for prop in properties:
-            self._initialized_objects[prop] = getattr(provider, prop)
+            if prop in overrides:
+                self._initialized_objects[prop] = overrides[prop]
+            else:
+                self._initialized_objects[prop] = getattr(provider, prop)
 
     @property
     def ses_client(self) -> SESClient:
@@ -0,0 +1,179 @@
+from typing import Callable, List, Optional, Tuple
+import collections
+import concurrent.futures
+import dataclasses
+import threading
+import time
+import logging
+
+from awsauth.firehose_client import FirehoseClient
+
+_logger = logging.getLogger(__name__)
+
+# Limits of a Firehose PutRecordBatch request.
+MAX_BATCH_RECORDS = 500
+MAX_BATCH_BYTES = 4 * 1024 * 1024
+
+
+@dataclasses.dataclass
+class ShipperStats:
+    records_added: int = 0
+    records_shipped: int = 0
+    # Records dropped after failing `max_attempts` times.
+    records_dropped: int = 0
+    batches: int = 0
+    # Records put back in the buffer after failing.
+    retries: int = 0
+
+
+class UsageEventShipper:
+    """Buffers usage records and puts them to a Firehose delivery stream in batches.
+
+    Records are added by each request to the Lambda container and flushed with PutRecordBatch
+    when the buffer reaches `max_records` records or `max_bytes` bytes or its oldest record is
+    `max_age_seconds` old. Records that Firehose fails to put are put back in the buffer and
+    retried by the next flush, up to `max_attempts` times, so a flush never sleeps. If
+    `background` is True, flushes run in a background thread so that a request doesn't wait for
+    Firehose.
+
+    The age of the buffer is only checked when the container handles a request, by `add` and
+    `flush_if_due`. A container that goes idle keeps up to `max_records - 1` records, and any
+    failed records, until its next request and they are lost if the container is shut down first.
+    With `max_records=1` every record is shipped by the request that adds it. Lambda also freezes
+    a container between requests, so `background` must be False there or `flush_if_due` called
+    before a request returns.
+    """
+
+    def __init__(
+        self,
+        client: FirehoseClient,
+        stream: str,
+        max_records: int = MAX_BATCH_RECORDS,
+        max_bytes: int = MAX_BATCH_BYTES,
+        max_age_seconds: float = 10,
+        max_attempts: int = 4,
+        background: bool = False,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._client = client
+        self._stream = stream
+        self._max_records = max_records
+        self._max_bytes = max_bytes
+        self._max_age_seconds = max_age_seconds
+        self._max_attempts = max_attempts
+        self._clock = clock
+        # Records and the number of times they failed to be put.
+        self._buffer: List[Tuple[str, int]] = []
+        self._buffer_bytes = 0
+        self._buffer_started_at: Optional[float] = None
+        self._lock = threading.Lock()
+        self._executor = (
+            concurrent.futures.ThreadPoolExecutor(max_workers=1) if background else None
+        )
+        self._flushes: List[concurrent.futures.Future] = []
+        self.stats = ShipperStats()
+
+    def add(self, data: dict):
+        """Adds a record, flushing the buffer if it is full or old."""
+        record = FirehoseClient.encode(data)
+        now = self._clock()
+        with self._lock:
+            if self._buffer_started_at is None:
+                self._buffer_started_at = now
+            self._buffer.append((record, 0))
+            self._buffer_bytes += len(record.encode())
+            self.stats.records_added += 1
+            should_flush = (
+                len(self._buffer) >= self._max_records
+                or self._buffer_bytes >= self._max_bytes
+                or now - self._buffer_started_at >= self._max_age_seconds
+            )
+        if should_flush:
+            self.flush()
+
+    def flush(self):
+        """Ships the buffered records, in the background thread if there is one."""
+        with self._lock:
+            records, self._buffer = self._buffer, []
+            self._buffer_bytes = 0
+            self._buffer_started_at = None
+        if not records:
+            return
+        if self._executor:
+            with self._lock:
+                self._flushes.append(self._executor.submit(self._ship, records))
+        else:
+            self._ship(records)
+
+    def flush_if_due(self):
+        """Ships the buffered records if the oldest is `max_age_seconds` old and waits for
+        flushes running in the background thread. Call before a request returns."""
+        with self._lock:
+            is_due = (
+                self._buffer_started_at is not None
+                and self._clock() - self._buffer_started_at >= self._max_age_seconds
+            )
+        if is_due:
+            self.flush()
+        self.wait()
+
+    def wait(self):
+        """Waits for flushes running in the background thread to finish."""
+        with self._lock:
+            flushes, self._flushes = self._flushes, []
+        concurrent.futures.wait(flushes)
+
+    def _ship(self, records: List[Tuple[str, int]]):
+        for batch in _batches(records, self._max_records, self._max_bytes):
+            self._ship_batch(batch)
+
+    def _ship_batch(self, batch: List[Tuple[str, int]]):
+        self.stats.batches += 1
+        records = [record for record, _ in batch]
+        try:
+            failed = collections.Counter(self._client.put_data_batch(self._stream, records))
+        except Exception:
+            _logger.exception("Failed to put usage records")
+            failed = collections.Counter(records)
+        retry = []
+        for record, attempts in batch:
+            if failed[record]:
+                failed[record] -= 1
+                retry.append((record, attempts + 1))
+        self.stats.records_shipped += len(batch) - len(retry)
+        dropped = [record for record, attempts in retry if attempts >= self._max_attempts]
+        if dropped:
+            _logger.error(
+                f"Dropping {len(dropped)} usage records after {self._max_attempts} attempts"
+            )
+            self.stats.records_dropped += len(dropped)
+        self._requeue([item for item in retry if item[1] < self._max_attempts])
+
+    def _requeue(self, records: List[Tuple[str, int]]):
+        """Puts failed records back at the front of the buffer, for the next flush."""
+        if not records:
+            return
+        with self._lock:
+            self._buffer = records + self._buffer
+            self._buffer_bytes += sum(len(record.encode()) for record, _ in records)
+            if self._buffer_started_at is None:
+                self._buffer_started_at = self._clock()
+            self.stats.retries += len(records)
+
+
+def _batches(
+    records: List[Tuple[str, int]], max_records: int, max_bytes: int
+) -> List[List[Tuple[str, int]]]:
+    """Splits records into batches within the limits of a PutRecordBatch request."""
+    max_records = min(max_records, MAX_BATCH_RECORDS)
+    max_bytes = min(max_bytes, MAX_BATCH_BYTES)
+    batches = [[]]
+    batch_bytes = 0
+    for record in records:
+        size = len(record[0].encode())
+        if batches[-1] and (len(batches[-1]) >= max_records or batch_bytes + size > max_bytes):
+            batches.append([])
+            batch_bytes = 0
+        batches[-1].append(record)
+        batch_bytes += size
+    return [batch for batch in batches if batch]
@@ -0,0 +1,115 @@
+"""Load test of `check_api_key_edge` against stub AWS clients.
+
+Sends requests for a skewed mix of valid and invalid API keys through the edge handler in one
+process, as a Lambda container would, and reports the API key cache hit rate, usage records
+shipped to Firehose and request latency. The stub clients sleep for `--dynamodb-latency-ms` and
+`--firehose-latency-ms` per call to simulate a round trip.
+
+    python load_harness.py --requests 20000 --keys 2000
+    # Putting usage records in batches of 10, which loses records of idle containers.
+    python load_harness.py --firehose-batch-records 10
+    # Without a cache, for comparison.
+    python load_harness.py --cache-size 0
+"""
+import argparse
+import random
+import statistics
+import time
+
+from awsauth import auth_app
+from awsauth.api_key_repo import APIKeyRepo
+from awsauth.the_registry import registry
+import stub_clients
+
+
+def _percentile(sorted_values, fraction):
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+def _request_event(api_key: str) -> dict:
+    request = {"uri": "/v2/states.json", "clientIp": "1.2.3.4", "querystring": f"apiKey={api_key}"}
+    return {"Records": [{"cf": {"request": request}}]}
+
+
+def run(args) -> dict:
+    stub_clients.init_test_config(
+        API_KEY_CACHE_TTL_SECONDS=args.ttl,
+        API_KEY_CACHE_MAX_SIZE=args.cache_size,
+        API_KEY_CACHE_REFRESH_AHEAD_SECONDS=args.refresh_ahead,
+        FIREHOSE_BATCH_MAX_RECORDS=args.firehose_batch_records,
+        FIREHOSE_FLUSH_IN_BACKGROUND=args.background_flush,
+    )
+    dynamodb_client = stub_clients.StubDynamoDBClient()
+    firehose_client = stub_clients.StubFirehoseClient(
+        args.firehose_latency_ms / 1000, failure_rate=args.firehose_failure_rate
+    )
+    registry.initialize(
+        dynamodb_client=dynamodb_client,
+        firehose_client=firehose_client,
+        ses_client=None,
+        hubspot_client=None,
+    )
+    auth_app.API_KEY_CACHE = None
+    auth_app.USAGE_EVENT_SHIPPER = None
+
+    keys = [f"key{i}" for i in range(args.keys)]
+    for i, key in enumerate(keys):
+        APIKeyRepo.add_api_key(f"user{i}@example.com", key, False)
+    dynamodb_client.latency_seconds = args.dynamodb_latency_ms / 1000
+    dynamodb_client.calls = 0
+
+    rng = random.Random(args.seed)
+    # A few keys make most requests, as in production.
+    weights = [1 / (rank + 1) for rank in range(len(keys))]
+    requested = rng.choices(keys, weights=weights, k=args.requests)
+    latencies = []
+    for key in requested:
+        if rng.random() < args.invalid_fraction:
+            key = f"invalid{rng.randrange(args.keys)}"
+        start = time.perf_counter()
+        auth_app.check_api_key_edge(_request_event(key), None)
+        latencies.append(time.perf_counter() - start)
+
+    latencies.sort()
+    shipper = auth_app.USAGE_EVENT_SHIPPER
+    shipper.flush()
+    shipper.wait()
+    stats = auth_app.API_KEY_CACHE.stats
+    return {
+        "requests": args.requests,
+        "hit_rate": stats.hit_rate,
+        "negative_hits": stats.negative_hits,
+        "dynamodb_calls": dynamodb_client.calls,
+        "firehose_calls": firehose_client.calls,
+        "usage_records_shipped": shipper.stats.records_shipped,
+        "usage_records_dropped": shipper.stats.records_dropped,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+        "mean_ms": statistics.mean(latencies) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--keys", type=int, default=2000, help="Number of valid API keys.")
+    parser.add_argument("--invalid-fraction", type=float, default=0.05)
+    parser.add_argument("--dynamodb-latency-ms", type=float, default=5)
+    parser.add_argument("--firehose-latency-ms", type=float, default=20)
+    parser.add_argument("--firehose-failure-rate", type=float, default=0)
+    parser.add_argument("--firehose-batch-records", type=int, default=1)
+    parser.add_argument(
+        "--background-flush",
+        action="store_true",
+        help="Put batches of usage records from a background thread.",
+    )
+    parser.add_argument("--ttl", type=float, default=300)
+    parser.add_argument("--cache-size", type=int, default=10000)
+    parser.add_argument("--refresh-ahead", type=float, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    for name, value in run(parser.parse_args()).items():
+        print(f"{name}: {value:.4g}" if isinstance(value, float) else f"{name}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""In-memory stand-ins for the AWS clients in `awsauth.the_registry`, for tests and load tests.
+
+Install them with `registry.initialize(dynamodb_client=StubDynamoDBClient(), ...)`.
+"""
+from typing import Dict, List, Any, Optional
+import json
+import random
+import time
+
+from awsauth.config import Config
+from awsauth.config import EnvConstants
+
+
+def init_test_config(**constants):
+    """Sets `Config.Constants` without reading the environment."""
+    defaults = dict(
+        API_KEY_TABLE_NAME="api-keys",
+        FIREHOSE_TABLE_NAME="api-requests",
+        SENTRY_DSN="",
+        SENTRY_ENVIRONMENT="test",
+        EMAILS_ENABLED=False,
+        HUBSPOT_API_KEY="",
+        HUBSPOT_ENABLED=False,
+        EMAIL_BLOCKLIST=[],
+    )
+    Config.Constants = EnvConstants(_env_file=None, **{**defaults, **constants})
+
+
+class StubDynamoDBClient:
+    """Implements the methods of `DynamoDBClient` with dicts.
+
+    Items are keyed by their first attribute, such as "email" for the API key table.
+    """
+
+    def __init__(self, latency_seconds: float = 0):
+        """
+        Args:
+            latency_seconds: Time each call sleeps, to simulate a round trip to DynamoDB.
+        """
+        self._tables: Dict[str, Dict[Any, Dict[str, Any]]] = {}
+        self.latency_seconds = latency_seconds
+        self.calls = 0
+
+    def _call(self, table: str) -> Dict[Any, Dict[str, Any]]:
+        self.calls += 1
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        return self._tables.setdefault(table, {})
+
+    def get_item(self, table: str, key: Dict[str, Any]) -> Optional[Dict[Any, Any]]:
+        (value,) = key.values()
+        return self._call(table).get(value)
+
+    def query_index(self, table: str, index: str, key: str, value: Any) -> List[dict]:
+        return [item for item in self._call(table).values() if item.get(key) == value]
+
+    def put_item(self, table: str, item: Dict[str, Any]) -> None:
+        self._call(table)[next(iter(item.values()))] = dict(item)
+
+    def update_item(self, table: str, key: dict, **updates):
+        (value,) = key.values()
+        self._call(table).setdefault(value, dict(key)).update(updates)
+
+
+class StubFirehoseClient:
+    """Records the data put by `FirehoseClient.put_data` and `put_data_batch`."""
+
+    def __init__(self, latency_seconds: float = 0, failure_rate: float = 0, seed: int = 0):
+        """
+        Args:
+            latency_seconds: Time each call sleeps, to simulate a round trip to Firehose.
+            failure_rate: Fraction of the records of a batch that fail to be put.
+        """
+        self.records: List[dict] = []
+        self.latency_seconds = latency_seconds
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self.calls = 0
+
+    def _call(self):
+        self.calls += 1
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+
+    def put_data(self, stream: str, data: dict):
+        self._call()
+        self.records.append(data)
+
+    def put_data_batch(self, stream: str, records: List[str]) -> List[str]:
+        self._call()
+        failed = []
+        for record in records:
+            if self._random.random() < self.failure_rate:
+                failed.append(record)
+            else:
+                self.records.append(json.loads(record))
+        return failed
@@ -0,0 +1,92 @@
+import concurrent.futures
+import threading
+import time
+import urllib.request
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks import synthetic_dataset
+from libs import api_v2_query_server
+from libs import api_v2_query_store
+from libs.datasets import AggregationLevel
+from libs.pipelines import api_v2_pipeline
+
+# Number of requests sent, and of clients sending them at once, by the latency benchmark.
+REQUESTS = 1000
+CLIENTS = 8
+
+
+@pytest.fixture(scope="module")
+def api_root(dataset, tmp_path_factory):
+    all_timeseries = [
+        api_v2_pipeline.build_timeseries_for_region(
+            api_v2_pipeline.RegionalInput.from_one_regions(region, one_region, None, None)
+        )
+        for region, one_region in dataset.iter_one_regions()
+    ]
+    root = tmp_path_factory.mktemp("api")
+    api_v2_pipeline.deploy_single_level(all_timeseries, AggregationLevel.COUNTY, root)
+    return root
+
+
+@pytest.fixture(scope="module")
+def store_path(api_root, tmp_path_factory):
+    path = tmp_path_factory.mktemp("store") / "store.sqlite"
+    api_v2_query_store.build(api_root, path)
+    return path
+
+
+def test_build_query_store(benchmark, api_root, tmp_path):
+    regions = benchmark.pedantic(
+        api_v2_query_store.build, args=(api_root, tmp_path / "store.sqlite"), rounds=1
+    )
+
+    assert regions
+
+
+def test_query_server_latency(benchmark, dataset_spec, store_path):
+    regions = synthetic_dataset.county_regions(dataset_spec.counties)
+    fips = [region.fips for region in regions]
+    states = sorted({region.state for region in regions})
+    end_date = pd.Timestamp(dataset_spec.start_date) + pd.Timedelta(days=dataset_spec.days - 1)
+    start = (end_date - pd.Timedelta(days=30)).date().isoformat()
+    # A mix of the queries expected from dashboards: one county, the counties of a state in the
+    # last month and the summaries of a state.
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(REQUESTS):
+        if i % 3 == 0:
+            paths.append(f"/v2/timeseries?fips={rng.choice(fips)}")
+        elif i % 3 == 1:
+            paths.append(
+                f"/v2/timeseries?state={rng.choice(states)}&start={start}"
+                f"&fields=actuals.cases,metrics.testPositivityRatio"
+            )
+        else:
+            paths.append(f"/v2/regions?state={rng.choice(states)}&level=county")
+
+    server = api_v2_query_server.QueryServer(("127.0.0.1", 0), store_path)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def request(path: str) -> float:
+        start_time = time.perf_counter()
+        with urllib.request.urlopen(server.url + path) as response:
+            response.read()
+        return time.perf_counter() - start_time
+
+    def run_all():
+        with concurrent.futures.ThreadPoolExecutor(CLIENTS) as executor:
+            return list(executor.map(request, paths))
+
+    try:
+        latencies = benchmark.pedantic(run_all, rounds=1)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    benchmark.extra_info["requests"] = REQUESTS
+    benchmark.extra_info["clients"] = CLIENTS
+    benchmark.extra_info["p50_ms"] = float(np.percentile(latencies, 50) * 1000)
+    benchmark.extra_info["p99_ms"] = float(np.percentile(latencies, 99) * 1000)
@@ -0,0 +1,81 @@
+import os
+import pathlib
+import tempfile
+import time
+
+import pytest
+
+from libs import dataset_deployer
+
+# Latency added to each file written on the simulated slow filesystem, about the round trip of a
+# network volume.
+SLOW_FS_LATENCY_SECONDS = 0.002
+
+# Size of each file, about that of a county timeseries.
+FILE_BYTES = 20_000
+
+
+@pytest.fixture
+def output_root(tmp_path):
+    # Set BENCHMARK_OUTPUT_DIR to measure writes to another filesystem, such as a network volume.
+    parent = os.getenv("BENCHMARK_OUTPUT_DIR")
+    if not parent:
+        return tmp_path
+    return pathlib.Path(tempfile.mkdtemp(dir=parent))
+
+
+@pytest.fixture
+def files(dataset_spec):
+    # A summary and a timeseries for every county.
+    return [
+        (pathlib.Path(f"county/{i:05}{suffix}"), os.urandom(FILE_BYTES // 2).hex().encode())
+        for i in range(dataset_spec.counties)
+        for suffix in [".json", ".timeseries.json"]
+    ]
+
+
+@pytest.fixture(params=["local", "slow"])
+def latency(request, monkeypatch) -> float:
+    if request.param == "local":
+        return 0.0
+    write_file = dataset_deployer.write_file_atomically
+
+    def slow_write(path, body, fsync=False):
+        time.sleep(SLOW_FS_LATENCY_SECONDS)
+        write_file(path, body, fsync)
+
+    monkeypatch.setattr(dataset_deployer, "write_file_atomically", slow_write)
+    return SLOW_FS_LATENCY_SECONDS
+
+
+def test_write_sequentially(benchmark, output_root, files, latency):
+    """The writes of `deploy_json_api_output` without a writer, for comparison."""
+    (output_root / "county").mkdir()
+
+    def run():
+        for path, body in files:
+            if latency:
+                time.sleep(latency)
+            (output_root / path).write_bytes(body)
+
+    benchmark.pedantic(run, rounds=3)
+
+
+@pytest.mark.parametrize("threads", [0, 8])
+@pytest.mark.parametrize("compression", [None, dataset_deployer.Compression.GZIP])
+def test_artifact_writer(benchmark, output_root, files, latency, threads, compression):
+    (output_root / "county").mkdir()
+
+    def run():
+        writer = dataset_deployer.ArtifactWriter(
+            output_root,
+            compressions=[compression] if compression else [],
+            skip_unchanged=False,
+            threads=threads,
+        )
+        for path, body in files:
+            writer.write(output_root / path, body)
+        writer.close()
+        return writer.written
+
+    assert benchmark.pedantic(run, rounds=3) == len(files)
@@ -0,0 +1,39 @@
+import pytest
+
+from benchmarks import synthetic_dataset
+from libs.datasets import timeseries
+
+# Dataset shapes selected with --synthetic-scale. Baselines are only comparable between runs of
+# the same scale.
+SCALES = {
+    "small": synthetic_dataset.SyntheticDatasetSpec(counties=200, days=120),
+    "full": synthetic_dataset.SyntheticDatasetSpec(),
+}
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--synthetic-scale",
+        choices=sorted(SCALES),
+        default="small",
+        help="Size of the synthetic datasets used by the benchmarks. 'full' is about the size of "
+        "a production run.",
+    )
+
+
+@pytest.fixture(scope="session")
+def dataset_spec(request) -> synthetic_dataset.SyntheticDatasetSpec:
+    return SCALES[request.config.getoption("--synthetic-scale")]
+
+
+@pytest.fixture(scope="session")
+def dataset(dataset_spec) -> timeseries.MultiRegionDataset:
+    return timeseries.add_new_cases(synthetic_dataset.build_dataset(dataset_spec))
+
+
+@pytest.fixture(autouse=True)
+def _record_scale(request, dataset_spec):
+    # Saved with each result so that runs at different scales are not mistaken for each other.
+    if "benchmark" in request.fixturenames:
+        request.getfixturevalue("benchmark").extra_info["counties"] = dataset_spec.counties
+        request.getfixturevalue("benchmark").extra_info["days"] = dataset_spec.days
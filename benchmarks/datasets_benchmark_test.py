@@ -0,0 +1,78 @@
+import dataclasses
+import datetime
+import pathlib
+
+from covidactnow.datapublic.common_fields import CommonFields
+
+from benchmarks import synthetic_dataset
+from libs import github_utils
+from libs.datasets import dataset_pointer
+from libs.datasets import timeseries
+from libs.datasets.tail_filter import TailFilter
+
+
+def _make_dataset_pointer(tmp_path: pathlib.Path) -> dataset_pointer.DatasetPointer:
+    git_summary = github_utils.GitSummary(sha="", branch="", is_dirty=False)
+    return dataset_pointer.DatasetPointer(
+        dataset_type=dataset_pointer.DatasetType.MULTI_REGION,
+        path=tmp_path / "multiregion.csv",
+        data_git_info=git_summary,
+        model_git_info=git_summary,
+        updated_at=datetime.datetime.utcnow(),
+    )
+
+
+def test_write_to_dataset_pointer(benchmark, dataset, tmp_path):
+    pointer = _make_dataset_pointer(tmp_path)
+
+    benchmark.pedantic(dataset.write_to_dataset_pointer, args=(pointer,), rounds=3)
+
+
+def test_read_from_pointer(benchmark, dataset, tmp_path):
+    pointer = _make_dataset_pointer(tmp_path)
+    dataset.write_to_dataset_pointer(pointer)
+
+    result = benchmark.pedantic(
+        timeseries.MultiRegionDataset.read_from_pointer, args=(pointer,), rounds=3
+    )
+
+    assert set(result.static.index) == set(dataset.static.index)
+
+
+def test_combined_datasets(benchmark, dataset_spec, dataset):
+    # A second source with different values, like the several sources of a field in production.
+    other = synthetic_dataset.build_dataset(dataclasses.replace(dataset_spec, seed=1))
+    field_datasets = {field: [dataset, other] for field in dataset_spec.fields}
+    static_datasets = {CommonFields.POPULATION: [dataset, other]}
+
+    benchmark.pedantic(
+        timeseries.combined_datasets, args=(field_datasets, static_datasets), rounds=3
+    )
+
+
+def test_tail_filter(benchmark, dataset):
+    benchmark.pedantic(
+        TailFilter.run, args=(dataset, synthetic_dataset.CUMULATIVE_FIELDS), rounds=3
+    )
+
+
+def test_aggregate_regions(benchmark, dataset):
+    aggregate_map = synthetic_dataset.county_to_state_map(
+        [region for region, _ in dataset.iter_one_regions()]
+    )
+
+    result = benchmark.pedantic(
+        timeseries.aggregate_regions,
+        args=(dataset, aggregate_map),
+        kwargs={"reporting_ratio_required_to_aggregate": 0.95},
+        rounds=3,
+    )
+
+    assert result.static.index.str.match(r"^iso1:us#iso2:us-\w\w$").all()
+
+
+def test_iter_one_regions(benchmark, dataset):
+    def consume():
+        return sum(1 for _ in dataset.iter_one_regions())
+
+    assert benchmark.pedantic(consume, rounds=3) == len(dataset.static)
@@ -0,0 +1,86 @@
+import itertools
+from typing import List
+from typing import Tuple
+
+import pytest
+import structlog
+
+from api.can_api_v2_definition import RegionSummaryWithTimeseries
+from libs.datasets import AggregationLevel
+from libs.datasets import timeseries
+from libs.metrics import top_level_metrics
+from libs.pipeline import Region
+from libs.pipelines import api_v2_pipeline
+from pyseir.rt import infer_rt
+
+# The per region stages are run on a sample of regions; their time scales linearly with the
+# number of regions.
+SAMPLE_REGIONS = 20
+SAMPLE_RT_REGIONS = 5
+
+
+@pytest.fixture(scope="module")
+def one_regions(dataset) -> List[Tuple[Region, timeseries.OneRegionTimeseriesDataset]]:
+    return list(itertools.islice(dataset.iter_one_regions(), SAMPLE_REGIONS))
+
+
+@pytest.fixture(scope="module")
+def all_timeseries(dataset) -> List[RegionSummaryWithTimeseries]:
+    return [
+        api_v2_pipeline.build_timeseries_for_region(
+            api_v2_pipeline.RegionalInput.from_one_regions(region, one_region, None, None)
+        )
+        for region, one_region in dataset.iter_one_regions()
+    ]
+
+
+def test_run_rt(benchmark, one_regions):
+    regional_inputs = [
+        infer_rt.RegionalInput.from_regional_data(one_region)
+        for _, one_region in one_regions[:SAMPLE_RT_REGIONS]
+    ]
+
+    def run_all():
+        return [infer_rt.run_rt(regional_input, plot=False) for regional_input in regional_inputs]
+
+    results = benchmark.pedantic(run_all, rounds=1)
+
+    # Regions with too few cases are skipped, as in production.
+    assert any(not result.empty for result in results)
+
+
+def test_calculate_metrics_for_timeseries(benchmark, one_regions):
+    log = structlog.get_logger()
+
+    def run_all():
+        return [
+            top_level_metrics.calculate_metrics_for_timeseries(one_region, None, None, log)
+            for _, one_region in one_regions
+        ]
+
+    benchmark.pedantic(run_all, rounds=3)
+
+
+def test_build_timeseries_for_region(benchmark, one_regions):
+    regional_inputs = [
+        api_v2_pipeline.RegionalInput.from_one_regions(region, one_region, None, None)
+        for region, one_region in one_regions
+    ]
+
+    def run_all():
+        return [
+            api_v2_pipeline.build_timeseries_for_region(regional_input)
+            for regional_input in regional_inputs
+        ]
+
+    results = benchmark.pedantic(run_all, rounds=3)
+
+    assert all(results)
+
+
+def test_deploy_single_level(benchmark, all_timeseries, tmp_path):
+    benchmark.pedantic(
+        api_v2_pipeline.deploy_single_level,
+        args=(all_timeseries, AggregationLevel.COUNTY, tmp_path),
+        rounds=1,
+    )
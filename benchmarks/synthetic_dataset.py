@@ -0,0 +1,164 @@
+"""Generators of synthetic MultiRegionDataset objects at production scale.
+
+The datasets built by `tests.test_helpers` have a few regions and days. These generators build
+datasets with thousands of counties and hundreds of days so that benchmarks exercise the same
+amount of data as a production run, without depending on covid-data-public.
+"""
+import dataclasses
+from typing import List
+from typing import Mapping
+from typing import Sequence
+
+import numpy as np
+import pandas as pd
+import us
+from covidactnow.datapublic.common_fields import CommonFields
+from covidactnow.datapublic.common_fields import FieldName
+from covidactnow.datapublic.common_fields import PdFields
+from typing_extensions import final
+
+from libs.datasets import AggregationLevel
+from libs.datasets import timeseries
+from libs.datasets.timeseries import MultiRegionDataset
+from libs.datasets.timeseries import TagField
+from libs.datasets.timeseries import TagType
+from libs.pipeline import Region
+
+# Cumulative fields are generated as a running sum of non-negative daily values.
+CUMULATIVE_FIELDS = [
+    CommonFields.CASES,
+    CommonFields.DEATHS,
+    CommonFields.POSITIVE_TESTS,
+    CommonFields.NEGATIVE_TESTS,
+    CommonFields.VACCINES_DISTRIBUTED,
+    CommonFields.VACCINATIONS_INITIATED,
+    CommonFields.VACCINATIONS_COMPLETED,
+]
+
+# Fields read when building the API output of a region.
+DEFAULT_FIELDS = CUMULATIVE_FIELDS + [
+    CommonFields.TEST_POSITIVITY,
+    CommonFields.CONTACT_TRACERS_COUNT,
+    CommonFields.CURRENT_HOSPITALIZED,
+    CommonFields.CURRENT_ICU,
+    CommonFields.CURRENT_ICU_TOTAL,
+    CommonFields.ICU_BEDS,
+]
+
+# Range of the random daily increase of cumulative fields, per person.
+_DAILY_RATE_RANGE = {
+    CommonFields.DEATHS: (1e-7, 2e-5),
+    CommonFields.NEGATIVE_TESTS: (1e-4, 5e-3),
+}
+_DEFAULT_DAILY_RATE_RANGE = (1e-5, 1e-3)
+
+# Sources that are found in api.can_api_v2_definition.FieldSource.
+_PROVENANCE_SOURCES = ["NYTimes", "CDCTesting", "HHSHospital", "Valorum"]
+
+
+@final
+@dataclasses.dataclass(frozen=True)
+class SyntheticDatasetSpec:
+    """Shape of a synthetic dataset. The defaults are about the size of a production run."""
+
+    # Number of counties, spread evenly across the states.
+    counties: int = 3200
+    # Number of days in every timeseries.
+    days: int = 365
+    fields: Sequence[FieldName] = tuple(DEFAULT_FIELDS)
+    # Fraction of timeseries with an annotation tag. Every timeseries has a provenance tag.
+    tag_density: float = 0.1
+    # Fraction of observations, except those on the last day, that are NaN.
+    nan_ratio: float = 0.05
+    start_date: str = "2020-03-01"
+    seed: int = 42
+
+
+def county_regions(count: int) -> List[Region]:
+    """Returns `count` counties with plausible FIPS, spread evenly across the states."""
+    states = us.STATES
+    return [
+        Region.from_fips(states[i % len(states)].fips + f"{2 * (i // len(states)) + 1:03d}")
+        for i in range(count)
+    ]
+
+
+def county_to_state_map(regions: Sequence[Region]) -> Mapping[Region, Region]:
+    return {region: region.get_state_region() for region in regions}
+
+
+def build_dataset(spec: SyntheticDatasetSpec = SyntheticDatasetSpec()) -> MultiRegionDataset:
+    """Returns a dataset of counties with random timeseries, static values and tags."""
+    rng = np.random.default_rng(spec.seed)
+    regions = county_regions(spec.counties)
+    location_ids = [region.location_id for region in regions]
+    fields = list(spec.fields)
+    dates = pd.date_range(spec.start_date, periods=spec.days, freq="D", name=CommonFields.DATE)
+
+    populations = rng.integers(1_000, 2_000_000, size=len(regions))
+    values = np.empty((len(regions), len(fields), spec.days))
+    for i, field in enumerate(fields):
+        if field in CUMULATIVE_FIELDS:
+            low, high = _DAILY_RATE_RANGE.get(field, _DEFAULT_DAILY_RATE_RANGE)
+            daily_rate = rng.uniform(low, high, size=(len(regions), 1))
+            daily = rng.poisson(daily_rate * populations[:, None], size=(len(regions), spec.days))
+            values[:, i, :] = daily.cumsum(axis=1)
+        elif field == CommonFields.TEST_POSITIVITY:
+            values[:, i, :] = rng.uniform(0.01, 0.3, size=(len(regions), spec.days))
+        else:
+            scale = rng.uniform(1e-5, 1e-3, size=(len(regions), 1)) * populations[:, None]
+            values[:, i, :] = np.round(scale * rng.uniform(0.5, 1.5, (len(regions), spec.days)))
+    # Keep the last day real so that every field has a latest value.
+    nan_mask = rng.random(values.shape) < spec.nan_ratio
+    nan_mask[:, :, -1] = False
+    values[nan_mask] = np.nan
+
+    index = pd.MultiIndex.from_product(
+        [location_ids, fields], names=[CommonFields.LOCATION_ID, PdFields.VARIABLE]
+    )
+    wide_dates_df = pd.DataFrame(
+        values.reshape(len(regions) * len(fields), spec.days), index=index, columns=dates
+    )
+    dataset = MultiRegionDataset.from_timeseries_wide_dates_df(wide_dates_df)
+
+    static_df = pd.DataFrame(
+        {
+            CommonFields.LOCATION_ID: location_ids,
+            CommonFields.FIPS: [region.fips for region in regions],
+            CommonFields.STATE: [region.state for region in regions],
+            CommonFields.COUNTRY: "USA",
+            CommonFields.AGGREGATE_LEVEL: AggregationLevel.COUNTY.value,
+            CommonFields.COUNTY: [f"County {region.fips}" for region in regions],
+            CommonFields.POPULATION: populations,
+            # Scale factors of timeseries.WEIGHTED_AGGREGATIONS.
+            CommonFields.MAX_BED_COUNT: np.round(populations * 2.5e-3),
+            CommonFields.ICU_BEDS: np.round(populations * 2.5e-4),
+            CommonFields.CAN_LOCATION_PAGE_URL: [
+                f"https://covidactnow.org/us/county/{region.fips}" for region in regions
+            ],
+        }
+    )
+    dataset = dataset.add_static_values(static_df)
+
+    return dataset.append_tag_df(_build_tag_df(rng, index, dates, spec.tag_density))
+
+
+def _build_tag_df(
+    rng: np.random.Generator, index: pd.MultiIndex, dates: pd.DatetimeIndex, tag_density: float
+) -> pd.DataFrame:
+    provenance_df = index.to_frame(index=False)
+    provenance_df[TagField.TYPE] = TagType.PROVENANCE
+    provenance_df[TagField.CONTENT] = rng.choice(_PROVENANCE_SOURCES, size=len(index))
+
+    annotated = index[rng.random(len(index)) < tag_density]
+    annotation_df = annotated.to_frame(index=False)
+    annotation_df[TagField.TYPE] = TagType.CUMULATIVE_TAIL_TRUNCATED
+    annotation_df[TagField.CONTENT] = [
+        timeseries.CumulativeTailTruncated(
+            original_observation=float(rng.integers(100)), date=dates[rng.integers(len(dates))]
+        ).content
+        for _ in range(len(annotated))
+    ]
+    return pd.concat([provenance_df, annotation_df], ignore_index=True).rename(
+        columns={PdFields.VARIABLE: TagField.VARIABLE}
+    )
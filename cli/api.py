@@ -1,6 +1,7 @@
 import logging
 import json
 import pathlib
+from typing import List
 from typing import Mapping
 from typing import Optional
 
@@ -11,9 +12,6 @@ from covidactnow.datapublic.common_fields import CommonFields
 from covidactnow.datapublic.common_fields import PdFields
 
 import api
-import pyseir.cli
-import pyseir.run
-
 from api import update_open_api_spec
 from api import data_overview_builder
 from libs.datasets import timeseries
@@ -22,10 +20,13 @@ from libs.metrics import test_positivity
 from libs.datasets import combined_datasets
 from libs.datasets.dataset_utils import REPO_ROOT
 from libs.datasets.dataset_utils import AggregationLevel
-import pyseir.utils
 import pandas as pd
 
-from libs.pipelines import api_v2_pipeline
+from libs import api_v2_query_server
+from libs import api_v2_query_store
+from libs import dataset_deployer
+from libs import timing_utils
+from libs.datasets import statistical_areas
 
 PROD_BUCKET = "data.covidactnow.org"
 
@@ -149,8 +150,61 @@ def _write_dataset_map(
 @click.option("--level", "-l", type=AggregationLevel)
 @click.option("--state")
 @click.option("--fips")
-def generate_api_v2(model_output_dir, output, level, state, fips):
+@click.option(
+    "--compression",
+    "-c",
+    type=click.Choice([compression.value for compression in dataset_deployer.Compression]),
+    multiple=True,
+    help="Also write a copy of every file compressed with this Content-Encoding, with suffix "
+    ".gz or .br. May be repeated.",
+)
+@click.option(
+    "--compressed-only",
+    default=False,
+    is_flag=True,
+    type=bool,
+    help="Only write the compressed copies of files.",
+)
+@click.option(
+    "--rewrite-unchanged",
+    default=False,
+    is_flag=True,
+    type=bool,
+    help="Write every file, including those whose content is unchanged since the last build in "
+    "the output directory.",
+)
+@click.option(
+    "--write-threads",
+    default=dataset_deployer.DEFAULT_WRITE_THREADS,
+    show_default=True,
+    type=int,
+    help="Number of threads compressing and writing files. 0 writes each file as it is built.",
+)
+@click.option(
+    "--fsync",
+    default=False,
+    is_flag=True,
+    type=bool,
+    help="Sync each file to disk before renaming it into place.",
+)
+@timing_utils.run_report("generate_api_v2")
+def generate_api_v2(
+    model_output_dir,
+    output,
+    level,
+    state,
+    fips,
+    compression: List[str],
+    compressed_only: bool,
+    rewrite_unchanged: bool,
+    write_threads: int,
+    fsync: bool,
+):
     """The entry function for invocation"""
+    # Imported here because they import pyseir and numba, which are slow to import and not needed
+    # by the other commands.
+    import pyseir.run
+    from libs.pipelines import api_v2_pipeline
 
     # Load all API Regions
     selected_dataset = combined_datasets.load_us_timeseries_dataset().get_subset(
@@ -158,5 +212,53 @@ def generate_api_v2(model_output_dir, output, level, state, fips):
     )
     _logger.info(f"Loading all regional inputs.")
 
+    writer = dataset_deployer.ArtifactWriter(
+        output,
+        compressions=[dataset_deployer.Compression(value) for value in compression],
+        write_uncompressed=not compressed_only,
+        skip_unchanged=not rewrite_unchanged,
+        threads=write_threads,
+        fsync=fsync,
+    )
     model_output = pyseir.run.PyseirOutputDatasets.read(model_output_dir)
-    api_v2_pipeline.generate_from_loaded_data(model_output, output, selected_dataset, _logger)
+    try:
+        api_v2_pipeline.generate_from_loaded_data(
+            model_output, output, selected_dataset, _logger, writer=writer
+        )
+    finally:
+        writer.close()
+
+
+@main.command()
+@click.argument("api-output-dir", type=pathlib.Path)
+@click.option(
+    "--db",
+    default="results/api_v2_query_store.sqlite",
+    type=pathlib.Path,
+    help="Path of the query store, replaced if it exists.",
+)
+def build_query_store(api_output_dir: pathlib.Path, db: pathlib.Path):
+    """Builds a query store from the output of generate-api-v2."""
+    county_to_cbsa = statistical_areas.CountyToCBSAAggregator.from_local_public_data().county_map
+    api_v2_query_store.build(api_output_dir, db, county_to_cbsa=county_to_cbsa)
+
+
+@main.command()
+@click.option(
+    "--db",
+    default="results/api_v2_query_store.sqlite",
+    type=pathlib.Path,
+    help="Path of a store written by build-query-store.",
+)
+@click.option("--host", default="127.0.0.1")
+@click.option("--port", default=8080, type=int)
+def serve_query_store(db: pathlib.Path, host: str, port: int):
+    """Serves queries of a query store over HTTP until interrupted."""
+    server = api_v2_query_server.QueryServer((host, port), db)
+    _logger.info(f"Serving {db} at {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -1,6 +1,7 @@
 from typing import List
 from typing import Mapping
 from typing import Optional
+import datetime
 import logging
 import pathlib
 import os
@@ -12,10 +13,11 @@ import click
 from covidactnow.datapublic.common_fields import CommonFields
 from covidactnow.datapublic.common_fields import FieldName
 
-from libs import google_sheet_helpers
 from libs import pipeline
+from libs import timing_utils
 from libs.datasets import combined_dataset_utils
 from libs.datasets import custom_aggregations
+from libs.datasets import snapshot_store
 from libs.datasets import statistical_areas
 from libs.datasets.combined_datasets import (
     ALL_TIMESERIES_FEATURE_DEFINITION,
@@ -80,47 +82,58 @@ def update_forecasts(filename):
 )
 @click.option("--state", type=str, help="For testing, a two letter state abbr")
 @click.option("--fips", type=str, help="For testing, a 5 digit county fips")
+@timing_utils.run_report("data update")
 def update(aggregate_to_country: bool, state: Optional[str], fips: Optional[str]):
     """Updates latest and timeseries datasets to the current checked out covid data public commit"""
     path_prefix = dataset_utils.DATA_DIRECTORY.relative_to(dataset_utils.REPO_ROOT)
 
-    timeseries_field_datasets = load_datasets_by_field(
-        ALL_TIMESERIES_FEATURE_DEFINITION, state=state, fips=fips
-    )
-    static_field_datasets = load_datasets_by_field(
-        ALL_FIELDS_FEATURE_DEFINITION, state=state, fips=fips
-    )
-
-    multiregion_dataset = timeseries.combined_datasets(
-        timeseries_field_datasets, static_field_datasets
-    )
-    # Filter for stalled cumulative values before deriving NEW_CASES from CASES.
-    _, multiregion_dataset = TailFilter.run(multiregion_dataset, CUMULATIVE_FIELDS_TO_FILTER,)
-    multiregion_dataset = timeseries.add_new_cases(multiregion_dataset)
-    multiregion_dataset = timeseries.drop_new_case_outliers(multiregion_dataset)
-    multiregion_dataset = timeseries.backfill_vaccination_initiated(multiregion_dataset)
-    multiregion_dataset = timeseries.drop_regions_without_population(
-        multiregion_dataset, KNOWN_LOCATION_ID_WITHOUT_POPULATION, structlog.get_logger()
-    )
-    multiregion_dataset = timeseries.aggregate_puerto_rico_from_counties(multiregion_dataset)
-    multiregion_dataset = custom_aggregations.aggregate_to_new_york_city(multiregion_dataset)
-    multiregion_dataset = custom_aggregations.replace_dc_county_with_state_data(multiregion_dataset)
+    with timing_utils.span("load datasets"):
+        timeseries_field_datasets = load_datasets_by_field(
+            ALL_TIMESERIES_FEATURE_DEFINITION, state=state, fips=fips
+        )
+        static_field_datasets = load_datasets_by_field(
+            ALL_FIELDS_FEATURE_DEFINITION, state=state, fips=fips
+        )
 
-    aggregator = statistical_areas.CountyToCBSAAggregator.from_local_public_data()
-    cbsa_dataset = aggregator.aggregate(
-        multiregion_dataset, reporting_ratio_required_to_aggregate=DEFAULT_REPORTING_RATIO
-    )
-    multiregion_dataset = multiregion_dataset.append_regions(cbsa_dataset)
+    with timing_utils.span("combine and clean"):
+        multiregion_dataset = timeseries.combined_datasets(
+            timeseries_field_datasets, static_field_datasets
+        )
+        # Filter for stalled cumulative values before deriving NEW_CASES from CASES.
+        _, multiregion_dataset = TailFilter.run(multiregion_dataset, CUMULATIVE_FIELDS_TO_FILTER,)
+        multiregion_dataset = timeseries.add_new_cases(multiregion_dataset)
+        multiregion_dataset = timeseries.drop_new_case_outliers(multiregion_dataset)
+        multiregion_dataset = timeseries.backfill_vaccination_initiated(multiregion_dataset)
+        multiregion_dataset = timeseries.drop_regions_without_population(
+            multiregion_dataset, KNOWN_LOCATION_ID_WITHOUT_POPULATION, structlog.get_logger()
+        )
+        multiregion_dataset = timeseries.aggregate_puerto_rico_from_counties(multiregion_dataset)
+        multiregion_dataset = custom_aggregations.aggregate_to_new_york_city(multiregion_dataset)
+        multiregion_dataset = custom_aggregations.replace_dc_county_with_state_data(
+            multiregion_dataset
+        )
 
-    if aggregate_to_country:
-        country_dataset = timeseries.aggregate_regions(
-            multiregion_dataset,
-            pipeline.us_states_to_country_map(),
-            reporting_ratio_required_to_aggregate=DEFAULT_REPORTING_RATIO,
+    with timing_utils.span("aggregate"):
+        aggregator = statistical_areas.CountyToCBSAAggregator.from_local_public_data()
+        cbsa_dataset = aggregator.aggregate(
+            multiregion_dataset, reporting_ratio_required_to_aggregate=DEFAULT_REPORTING_RATIO
         )
-        multiregion_dataset = multiregion_dataset.append_regions(country_dataset)
+        multiregion_dataset = multiregion_dataset.append_regions(cbsa_dataset)
 
-    combined_dataset_utils.persist_dataset(multiregion_dataset, path_prefix)
+        if aggregate_to_country:
+            country_dataset = timeseries.aggregate_regions(
+                multiregion_dataset,
+                pipeline.us_states_to_country_map(),
+                reporting_ratio_required_to_aggregate=DEFAULT_REPORTING_RATIO,
+            )
+            multiregion_dataset = multiregion_dataset.append_regions(country_dataset)
+
+    with timing_utils.span(
+        "persist",
+        regions=len(multiregion_dataset.timeseries.index.unique(CommonFields.LOCATION_ID)),
+        rows=len(multiregion_dataset.timeseries),
+    ):
+        combined_dataset_utils.persist_dataset(multiregion_dataset, path_prefix)
 
 
 @main.command()
@@ -188,12 +201,33 @@ def run_bad_tails_filter(output_path: pathlib.Path):
 @main.command()
 @click.option("--name", envvar="DATA_AVAILABILITY_SHEET_NAME", default="Data Availability - Dev")
 @click.option("--share-email")
-def update_availability_report(name: str, share_email: Optional[str]):
+@click.option(
+    "--output-dir",
+    type=pathlib.Path,
+    help="Write the report of each source to a file in this directory instead of updating the "
+    "Google Sheet.",
+)
+@click.option(
+    "--output-format", type=click.Choice(["csv", "parquet"]), default="csv", show_default=True
+)
+def update_availability_report(
+    name: str, share_email: Optional[str], output_dir: Optional[pathlib.Path], output_format: str
+):
+    from libs import google_sheet_helpers
     from libs.qa import data_availability
 
+    data_sources_by_source_name = data_availability.load_all_latest_sources()
+
+    if output_dir:
+        for source_name, dataset in data_sources_by_source_name.items():
+            report = data_availability.build_data_availability_report(dataset)
+            path = output_dir / f"{source_name}.{output_format}"
+            data_availability.write_data_availability_report(report, path)
+            _logger.info(f"Wrote {source_name} availability report to {path}")
+        return
+
     sheet = google_sheet_helpers.open_or_create_spreadsheet(name, share_email=share_email)
     info_worksheet = google_sheet_helpers.update_info_sheet(sheet)
-    data_sources_by_source_name = data_availability.load_all_latest_sources()
 
     for name, dataset in data_sources_by_source_name.items():
         _logger.info(f"Updating {name}")
@@ -211,6 +245,37 @@ def update_availability_report(name: str, share_email: Optional[str]):
     _logger.info("Finished updating data availability report")
 
 
+@main.command()
+@click.option(
+    "--days",
+    type=int,
+    default=14,
+    show_default=True,
+    help="Materialize the versions committed in this many past days.",
+)
+@click.option("--commit", "commit_shas", multiple=True, help="Also materialize this commit.")
+@click.option(
+    "--store-dir",
+    type=pathlib.Path,
+    default=snapshot_store.DEFAULT_STORE_DIR,
+    show_default=True,
+    envvar="DATASET_SNAPSHOT_DIR",
+)
+def materialize_snapshots(days: int, commit_shas: List[str], store_dir: pathlib.Path):
+    """Saves versions of the combined dataset committed to this repo in a local snapshot store.
+
+    Load a version with `SnapshotStore().load(before=...)` or `load(commit_sha=...)`.
+    """
+    store = snapshot_store.SnapshotStore(store_dir)
+    store.update_index()
+    since = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days)
+    entries = [entry for entry in store.entries if entry.committed_at >= since]
+    entries.extend(store.find(commit_sha=commit_sha) for commit_sha in commit_shas)
+    for entry in entries:
+        entry = store.materialize(entry)
+        _logger.info(f"Materialized {entry.commit_sha} ({entry.committed_at}) as {entry.digest}")
+
+
 @main.command()
 def update_case_based_icu_utilization_weights():
     """
@@ -1,17 +1,20 @@
 from typing import Optional
+import hashlib
 import logging
 import pathlib
 import subprocess
+import time
 from datetime import datetime
 from io import BytesIO
 
 import click
 import git
+import pandas as pd
 
 from covidactnow.datapublic import common_df
 from libs import github_utils
-from libs import update_api_user_metrics
-from libs import google_sheet_helpers
+from libs import stage_runner
+from libs import timing_utils
 from libs.datasets import combined_datasets
 from libs.datasets import dataset_utils
 
@@ -101,18 +104,101 @@ def csv_diff(csv_path_or_rev_left, csv_path_right):
     print(differ_r)
 
 
+@main.command()
+@click.argument("old_report", type=pathlib.Path)
+@click.argument("new_report", type=pathlib.Path)
+def compare_run_reports(old_report: pathlib.Path, new_report: pathlib.Path):
+    """Compare the resources used by each stage in 2 run reports.
+
+    Run reports are written when the RUN_REPORT_DIR env var is set."""
+    old_spans = {span.name: span for span in timing_utils.read_run_report(old_report).flatten()}
+    new_spans = {span.name: span for span in timing_utils.read_run_report(new_report).flatten()}
+    rows = []
+    for name in list(old_spans) + [name for name in new_spans if name not in old_spans]:
+        old = old_spans.get(name, timing_utils.Span(name))
+        new = new_spans.get(name, timing_utils.Span(name))
+        rows.append(
+            {
+                "stage": name,
+                "old_wall_seconds": old.wall_seconds,
+                "new_wall_seconds": new.wall_seconds,
+                "wall_change": new.wall_seconds / old.wall_seconds if old.wall_seconds else None,
+                "old_cpu_seconds": old.cpu_seconds,
+                "new_cpu_seconds": new.cpu_seconds,
+                "old_peak_rss_delta_mb": old.peak_rss_delta_bytes / 2 ** 20,
+                "new_peak_rss_delta_mb": new.peak_rss_delta_bytes / 2 ** 20,
+            }
+        )
+    with pd.option_context("display.max_rows", None, "display.width", None):
+        print(pd.DataFrame(rows).set_index("stage").to_string(float_format="%.2f"))
+
+
+@main.command()
+@click.argument("data-dir", type=pathlib.Path)
+@click.argument("output-dir", type=pathlib.Path)
+@click.option(
+    "--stage",
+    "stages",
+    multiple=True,
+    help="Run only this stage and the stages it depends on. May be repeated.",
+)
+@click.option("--force", is_flag=True, help="Rerun stages even if their inputs are unchanged.")
+@click.option("--max-workers", type=int, default=4, show_default=True)
+def run_pipeline(data_dir: pathlib.Path, output_dir: pathlib.Path, stages, force, max_workers):
+    """Run the stages of run.sh, skipping those whose inputs and code are unchanged.
+
+    DATA_DIR is the covid-data-public directory and OUTPUT_DIR the API output directory."""
+    output_dir = output_dir.resolve()
+    output_dir_key = hashlib.sha256(str(output_dir).encode()).hexdigest()[:16]
+    runner = stage_runner.StageRunner(
+        stage_runner.run_sh_stages(data_dir.resolve(), output_dir),
+        state_path=stage_runner.DEFAULT_STATE_DIR / f"{output_dir_key}.json",
+        max_workers=max_workers,
+    )
+    start = time.perf_counter()
+    with timing_utils.run_report("run_pipeline") as report:
+        results = runner.run(stages or None, force=force)
+        for result in results:
+            report.child(result.name).merge(
+                timing_utils.Span(
+                    result.name,
+                    calls=1,
+                    wall_seconds=result.wall_seconds,
+                    counts={result.status.value: 1},
+                )
+            )
+    print(stage_runner.format_summary(results, time.perf_counter() - start))
+    failed = [result.name for result in results if result.status is stage_runner.StageStatus.FAILED]
+    if failed:
+        raise click.ClickException(f"Stages failed: {', '.join(failed)}")
+
+
 @main.command()
 @click.option("--table-name", envvar="API_TABLE_NAME", required=True)
 @click.option("--database-name", envvar="API_DATABASE_NAME", required=True)
 @click.option("--name", envvar="API_USERS_SHEET_NAME", default="API Usage - Test")
 @click.option("--sheet-id", envvar="API_USERS_SHEET_ID")
 @click.option("--share-email")
+@click.option(
+    "--hubspot-state-path",
+    type=pathlib.Path,
+    default=pathlib.Path(".cache/api_user_usage/hubspot_state.json"),
+    show_default=True,
+    help="File recording the activity pushed to HubSpot, so unchanged users are skipped.",
+)
+@click.option(
+    "--query-cache-dir",
+    type=pathlib.Path,
+    help="If set, Athena query results are cached in this directory for the rest of the day.",
+)
 def update_api_user_usage(
     table_name: str,
     database_name: str,
     name: str,
     share_email: Optional[str],
     sheet_id: Optional[str],
+    hubspot_state_path: pathlib.Path,
+    query_cache_dir: Optional[pathlib.Path],
 ):
     """Update API User Usage sheet.
 
@@ -122,12 +208,20 @@ def update_api_user_usage(
         name: Sheet name.
         sheet_id: Google Sheets ID of existing sheet.
         share_email: Email to share created sheet with if new sheet.
+        hubspot_state_path: File recording the activity last pushed to HubSpot.
+        query_cache_dir: Directory caching Athena query results.
     """
+    # Imported here because gspread and boto3 are slow to import.
+    from libs import google_sheet_helpers
+    from libs import update_api_user_metrics
+
     if sheet_id:
         sheet = google_sheet_helpers.open_spreadsheet(sheet_id)
     else:
         sheet = google_sheet_helpers.open_or_create_spreadsheet(name, share_email=share_email)
 
-    rows = update_api_user_metrics.run_user_activity_summary_query(table_name, database_name)
+    rows = update_api_user_metrics.run_user_activity_summary_query(
+        table_name, database_name, cache_dir=query_cache_dir
+    )
     update_api_user_metrics.update_google_sheet(sheet, "API Usage Activity Report", rows)
-    update_api_user_metrics.update_hubspot_users(rows)
+    update_api_user_metrics.update_hubspot_users(rows, state_path=hubspot_state_path)
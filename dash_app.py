@@ -1,3 +1,5 @@
+import hashlib
+
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
@@ -8,9 +10,10 @@ import plotly.express as px
 from covidactnow.datapublic.common_fields import CommonFields
 from dash.dependencies import Input, Output
 
-from libs import pipeline
 from libs.datasets import combined_datasets
-from libs.datasets.tail_filter import TagType
+from libs.datasets import dataset_pointer
+from libs.datasets import dataset_utils
+from libs.datasets.region_store import RegionStore
 from libs.datasets.timeseries import TagField
 
 
@@ -20,6 +23,22 @@ EXTERNAL_STYLESHEETS = ["https://codepen.io/chriddyp/pen/bWLwgP.css"]
 # not contain LOCATION_ID.
 TAG_TABLE_COLUMNS = [TagField.VARIABLE, TagField.TYPE, TagField.CONTENT]
 
+# Directory of the region tables of each version of the dataset.
+CACHE_DIR = dataset_utils.REPO_ROOT / ".cache" / "dash_app"
+
+
+def _load_dataset():
+    return combined_datasets.load_us_timeseries_dataset().get_subset(exclude_county_999=True)
+
+
+def make_region_store() -> RegionStore:
+    # The pointer file changes each time the dataset is written.
+    pointer_path = dataset_utils.DATA_DIRECTORY / dataset_pointer.form_filename(
+        dataset_utils.DatasetType.MULTI_REGION
+    )
+    version = hashlib.sha256(pointer_path.read_bytes()).hexdigest()[:16]
+    return RegionStore(_load_dataset, summary_path=CACHE_DIR / f"regions-{version}.pkl")
+
 
 def init_dashboard():
     # Consider something like https://hackersandslackers.com/plotly-dash-with-flask/ if we want
@@ -30,19 +49,11 @@ def init_dashboard():
     app.css.config.serve_locally = True
     app.scripts.config.serve_locally = True
 
-    ds = combined_datasets.load_us_timeseries_dataset().get_subset(exclude_county_999=True)
-
-    # A table of regions in a DataFrame.
-    df_regions = ds.static
-    df_regions["annotation_count"] = (
-        ds.tag.loc[
-            :, :, [TagType.CUMULATIVE_LONG_TAIL_TRUNCATED, TagType.CUMULATIVE_TAIL_TRUNCATED]
-        ]
-        .index.get_level_values(CommonFields.LOCATION_ID)
-        .value_counts()
-    )
-    df_regions = df_regions.reset_index()  # Move location_id from the index to a regular column
-    df_regions["id"] = df_regions[CommonFields.LOCATION_ID]
+    store = make_region_store()
+    # Start loading the timeseries while the region table, which is cached after the first run,
+    # is shown.
+    store.warm_up()
+    df_regions = store.region_summary()
 
     app.layout = html.Div(
         children=[
@@ -89,14 +100,10 @@ def init_dashboard():
         prevent_initial_call=True,
     )
     def update_figure(selected_rows):
-        one_region = ds.get_one_region(
-            pipeline.Region.from_location_id(more_itertools.one(selected_rows))
-        )
-        interesting_ts = one_region.data.set_index(CommonFields.DATE).select_dtypes(
-            include="number"
-        )
+        location_id = more_itertools.one(selected_rows)
+        interesting_ts = store.region_timeseries(location_id).select_dtypes(include="number")
         fig = px.scatter(interesting_ts.reset_index(), x="date", y=interesting_ts.columns.to_list())
-        tag_df = one_region.tag.reset_index()
+        tag_df = store.region_tag(location_id)
         assert list(tag_df.columns) == TAG_TABLE_COLUMNS
         return fig, tag_df.to_dict("records")
 
@@ -0,0 +1,202 @@
+"""A local HTTP server answering queries of an API v2 query store.
+
+Endpoints, all returning JSON:
+
+    /v2/fields                  Names of the timeseries fields.
+    /v2/regions?<filters>       Summaries of the matching regions.
+    /v2/timeseries?<filters>    One row per matching region and date, with parameters
+                                `fields` (comma separated, default all), `start` and `end`
+                                (inclusive YYYY-MM-DD dates).
+
+Regions are filtered by `fips` (comma separated), `state`, `cbsa` and `level`. Responses have a
+strong ETag so that clients revalidate with If-None-Match, and support a single byte range
+(`Range: bytes=first-last`) so that large responses can be fetched in parts.
+"""
+import contextlib
+import datetime
+import hashlib
+import http
+import http.server
+import json
+import pathlib
+import queue
+import re
+import urllib.parse
+from typing import Any
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import structlog
+
+from libs.api_v2_query_store import QueryError
+from libs.api_v2_query_store import QueryStore
+from libs.api_v2_query_store import RegionFilter
+from libs.datasets import AggregationLevel
+
+_log = structlog.get_logger(__name__)
+
+_RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _param(params: Dict[str, List[str]], name: str) -> Optional[str]:
+    values = params.get(name)
+    return values[-1] if values else None
+
+
+def _list_param(params: Dict[str, List[str]], name: str) -> List[str]:
+    return [item for value in params.get(name, []) for item in value.split(",") if item]
+
+
+def _date_param(params: Dict[str, List[str]], name: str) -> Optional[datetime.date]:
+    value = _param(params, name)
+    if value is None:
+        return None
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise QueryError(f"Bad date for {name}: {value}")
+
+
+def _region_filter(params: Dict[str, List[str]]) -> RegionFilter:
+    level = _param(params, "level")
+    try:
+        level = AggregationLevel(level) if level else None
+    except ValueError:
+        raise QueryError(f"Bad level: {level}")
+    return RegionFilter(
+        fips=_list_param(params, "fips"),
+        state=_param(params, "state"),
+        cbsa=_param(params, "cbsa"),
+        level=level,
+    )
+
+
+def query(store: QueryStore, path: str, params: Dict[str, List[str]]) -> Optional[Any]:
+    """Returns the response to a request for `path` or None if there is no such endpoint."""
+    if path == "/v2/fields":
+        return store.fields
+    if path == "/v2/regions":
+        return store.regions(_region_filter(params))
+    if path == "/v2/timeseries":
+        return store.timeseries(
+            _region_filter(params),
+            fields=_list_param(params, "fields"),
+            start=_date_param(params, "start"),
+            end=_date_param(params, "end"),
+        )
+    return None
+
+
+def byte_range(header: Optional[str], length: int) -> Optional[Tuple[int, int]]:
+    """Returns the first and last byte, inclusive, selected by a Range header.
+
+    Returns None if the whole body should be sent, because there is no header or it is not a
+    single byte range. Raises ValueError if the range is not satisfiable.
+    """
+    match = _RANGE_PATTERN.match(header or "")
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if not first:
+        # A suffix range with the last `last` bytes.
+        first, last = max(length - int(last), 0), length - 1
+    else:
+        first, last = int(first), min(int(last), length - 1) if last else length - 1
+    if first >= length or first > last:
+        raise ValueError(f"Range {header} not satisfiable for {length} bytes")
+    return first, last
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    server: "QueryServer"
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        try:
+            with self.server.store() as store:
+                result = query(store, url.path, urllib.parse.parse_qs(url.query))
+        except QueryError as e:
+            self._send_error(http.HTTPStatus.BAD_REQUEST, str(e))
+            return
+        if result is None:
+            self._send_error(http.HTTPStatus.NOT_FOUND, f"Unknown path {url.path}")
+            return
+        self._send_body(json.dumps(result, separators=(",", ":")).encode())
+
+    def _send_body(self, body: bytes):
+        etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        if self.headers.get("If-None-Match") in (etag, "*"):
+            self.send_response(http.HTTPStatus.NOT_MODIFIED)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        status = http.HTTPStatus.OK
+        content_range = None
+        # A Range with an If-Range for another version of the body gets the whole body.
+        if self.headers.get("If-Range") in (None, etag):
+            try:
+                selected = byte_range(self.headers.get("Range"), len(body))
+            except ValueError:
+                self.send_response(http.HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                self.send_header("Content-Range", f"bytes */{len(body)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if selected:
+                first, last = selected
+                status = http.HTTPStatus.PARTIAL_CONTENT
+                content_range = f"bytes {first}-{last}/{len(body)}"
+                body = body[first : last + 1]
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Accept-Ranges", "bytes")
+        if content_range:
+            self.send_header("Content-Range", content_range)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status: http.HTTPStatus, message: str):
+        body = json.dumps({"error": message}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        _log.debug("Request", message=format % args)
+
+
+class QueryServer(http.server.ThreadingHTTPServer):
+    """Serves the queries of the store at `db_path`, one thread per request."""
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], db_path: pathlib.Path):
+        super().__init__(address, _Handler)
+        self.db_path = db_path
+        # Connections not in use by a request, reused by later requests.
+        self._stores: "queue.LifoQueue[QueryStore]" = queue.LifoQueue()
+
+    @contextlib.contextmanager
+    def store(self) -> Iterator[QueryStore]:
+        try:
+            store = self._stores.get_nowait()
+        except queue.Empty:
+            store = QueryStore.open(self.db_path)
+        try:
+            yield store
+        finally:
+            self._stores.put(store)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
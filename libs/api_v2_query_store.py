@@ -0,0 +1,273 @@
+"""An indexed SQLite store of API v2 output for point lookups.
+
+`build` reads the single region `*.timeseries.json` files written by `api_v2_pipeline` and writes
+a `regions` table, with the summary of each region, and a `timeseries` table with one row per
+region and date and one column per flattened field such as "actuals.cases". Rows are keyed by
+location id and date so that a query for a few regions and a date range reads only those rows
+instead of a bulk file. Location ids are used because the FIPS of CBSAs and counties overlap.
+`QueryStore` answers the queries served by `libs.api_v2_query_server`.
+"""
+import dataclasses
+import datetime
+import json
+import pathlib
+import sqlite3
+from typing import Any
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Mapping
+from typing import Optional
+from typing import Sequence
+
+import structlog
+from typing_extensions import final
+
+from libs import dataset_deployer
+from libs.datasets import AggregationLevel
+from libs.pipelines.api_v2_paths import APIOutputPathBuilder
+
+_log = structlog.get_logger(__name__)
+
+# Keys of RegionSummaryWithTimeseries holding the timeseries, and the prefix of their fields in
+# the `timeseries` table.
+TIMESERIES_PREFIXES = {
+    "actualsTimeseries": "actuals",
+    "metricsTimeseries": "metrics",
+    "riskLevelsTimeseries": "riskLevels",
+}
+
+# Columns of the timeseries table that are not fields.
+_TIMESERIES_KEY_COLUMNS = ["location_id", "date"]
+
+# Columns identifying each row returned by `QueryStore.timeseries`.
+KEY_COLUMNS = ["fips", "date"]
+
+_SCHEMA = """
+CREATE TABLE regions (
+    location_id TEXT PRIMARY KEY,
+    fips TEXT NOT NULL,
+    level TEXT NOT NULL,
+    state TEXT,
+    county TEXT,
+    cbsa TEXT,
+    population INTEGER,
+    summary TEXT NOT NULL
+);
+CREATE INDEX regions_fips ON regions (fips);
+CREATE INDEX regions_level_state ON regions (level, state);
+CREATE INDEX regions_cbsa ON regions (cbsa);
+CREATE TABLE timeseries (
+    location_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    PRIMARY KEY (location_id, date)
+) WITHOUT ROWID;
+CREATE TABLE metadata (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+
+class QueryError(ValueError):
+    """Raised for a query that can't be answered, such as one with an unknown field."""
+
+
+def _quote(column: str) -> str:
+    return '"' + column.replace('"', '""') + '"'
+
+
+def _iter_region_files(api_root: pathlib.Path) -> Iterator[pathlib.Path]:
+    for level in AggregationLevel:
+        try:
+            subdir = APIOutputPathBuilder(api_root, level).region_subdir
+        except ValueError:
+            continue
+        yield from sorted(subdir.glob("*.timeseries.json"))
+
+
+def _timeseries_rows(region: dict) -> Dict[str, Dict[str, Any]]:
+    """Returns the flattened fields of each date of `region`, by date."""
+    rows = {}
+    for key, prefix in TIMESERIES_PREFIXES.items():
+        for row in region.get(key) or []:
+            fields = rows.setdefault(row["date"], {})
+            for name, value in dataset_deployer.flatten_dict(row).items():
+                # Skip lists, which SQLite can't store and no timeseries field currently has.
+                if name != "date" and not isinstance(value, list):
+                    fields[f"{prefix}.{name}"] = value
+    return rows
+
+
+def build(
+    api_root: pathlib.Path,
+    db_path: pathlib.Path,
+    county_to_cbsa: Optional[Mapping[str, str]] = None,
+) -> int:
+    """Builds a store at `db_path` from the API v2 output in `api_root`.
+
+    Args:
+        api_root: Directory written by `api_v2_pipeline.deploy_single_level`.
+        db_path: Path of the SQLite file, replaced if it exists.
+        county_to_cbsa: Map from county FIPS to the code of the CBSA containing it. Queries by
+            CBSA only find counties when it is set.
+
+    Returns: Number of regions in the store.
+    """
+    county_to_cbsa = county_to_cbsa or {}
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = db_path.with_name(db_path.name + ".tmp")
+    if tmp_path.exists():
+        tmp_path.unlink()
+    connection = sqlite3.connect(str(tmp_path))
+    regions = 0
+    try:
+        connection.executescript(_SCHEMA)
+        columns = set(_TIMESERIES_KEY_COLUMNS)
+        for path in _iter_region_files(api_root):
+            region = json.loads(path.read_text())
+            # The subdirectory of counties also holds bulk files of the counties of each state.
+            if not isinstance(region, dict):
+                continue
+            level = region["level"]
+            cbsa = region["fips"] if level == AggregationLevel.CBSA.value else None
+            if level == AggregationLevel.COUNTY.value:
+                cbsa = county_to_cbsa.get(region["fips"])
+            summary = {k: v for k, v in region.items() if k not in TIMESERIES_PREFIXES}
+            connection.execute(
+                "INSERT INTO regions VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    region["locationId"],
+                    region["fips"],
+                    level,
+                    region.get("state"),
+                    region.get("county"),
+                    cbsa,
+                    region.get("population"),
+                    json.dumps(summary),
+                ),
+            )
+
+            rows = _timeseries_rows(region)
+            for column in sorted({name for fields in rows.values() for name in fields} - columns):
+                connection.execute(f"ALTER TABLE timeseries ADD COLUMN {_quote(column)}")
+                columns.add(column)
+            for date, fields in rows.items():
+                names = _TIMESERIES_KEY_COLUMNS + list(fields)
+                connection.execute(
+                    f"INSERT INTO timeseries ({', '.join(_quote(n) for n in names)}) "
+                    f"VALUES ({', '.join('?' * len(names))})",
+                    [region["locationId"], date, *fields.values()],
+                )
+            regions += 1
+
+        connection.execute(
+            "INSERT INTO metadata VALUES ('built_at', ?)",
+            (datetime.datetime.utcnow().isoformat(),),
+        )
+        connection.commit()
+        connection.execute("VACUUM")
+    finally:
+        connection.close()
+    tmp_path.replace(db_path)
+    _log.info("Built API v2 query store", path=str(db_path), regions=regions)
+    return regions
+
+
+@final
+@dataclasses.dataclass(frozen=True)
+class RegionFilter:
+    """Selects regions. Regions match all of the set attributes."""
+
+    fips: Sequence[str] = ()
+    state: Optional[str] = None
+    cbsa: Optional[str] = None
+    level: Optional[AggregationLevel] = None
+
+    def where(self) -> (str, List[Any]):
+        """Returns a SQL condition on the regions table and its parameters."""
+        conditions = []
+        params: List[Any] = []
+        if self.fips:
+            conditions.append(f"regions.fips IN ({', '.join('?' * len(self.fips))})")
+            params.extend(self.fips)
+        if self.state:
+            conditions.append("regions.state = ?")
+            params.append(self.state.upper())
+        if self.cbsa:
+            conditions.append("regions.cbsa = ?")
+            params.append(self.cbsa)
+        if self.level:
+            conditions.append("regions.level = ?")
+            params.append(self.level.value)
+        return " AND ".join(conditions) or "1", params
+
+
+@final
+@dataclasses.dataclass(frozen=True)
+class QueryStore:
+    """Read only queries of a store built by `build`. Must not be used by two threads at once."""
+
+    connection: sqlite3.Connection
+
+    @staticmethod
+    def open(db_path: pathlib.Path) -> "QueryStore":
+        connection = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+        return QueryStore(connection)
+
+    @property
+    def fields(self) -> List[str]:
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(timeseries)")]
+        return [column for column in columns if column not in _TIMESERIES_KEY_COLUMNS]
+
+    @property
+    def built_at(self) -> str:
+        (value,) = self.connection.execute(
+            "SELECT value FROM metadata WHERE key = 'built_at'"
+        ).fetchone()
+        return value
+
+    def regions(self, region_filter: RegionFilter) -> List[dict]:
+        """Returns the summaries of the regions matching `region_filter`, ordered by fips."""
+        where, params = region_filter.where()
+        cursor = self.connection.execute(
+            f"SELECT summary FROM regions WHERE {where} ORDER BY fips, location_id", params
+        )
+        return [json.loads(summary) for (summary,) in cursor]
+
+    def timeseries(
+        self,
+        region_filter: RegionFilter,
+        fields: Sequence[str] = (),
+        start: Optional[datetime.date] = None,
+        end: Optional[datetime.date] = None,
+    ) -> List[dict]:
+        """Returns the rows of the regions matching `region_filter`, ordered by fips and date.
+
+        Args:
+            fields: Fields of each row. All fields if empty.
+            start: First date, inclusive.
+            end: Last date, inclusive.
+        """
+        all_fields = self.fields
+        unknown = set(fields) - set(all_fields)
+        if unknown:
+            raise QueryError(f"Unknown fields: {', '.join(sorted(unknown))}")
+        fields = list(fields or all_fields)
+        where, params = region_filter.where()
+        if start:
+            where += " AND timeseries.date >= ?"
+            params.append(start.isoformat())
+        if end:
+            where += " AND timeseries.date <= ?"
+            params.append(end.isoformat())
+        selected = ["regions.fips", "timeseries.date"]
+        selected += ["timeseries." + _quote(field) for field in fields]
+        cursor = self.connection.execute(
+            f"SELECT {', '.join(selected)} "
+            f"FROM regions JOIN timeseries ON timeseries.location_id = regions.location_id "
+            f"WHERE {where} ORDER BY regions.fips, regions.location_id, timeseries.date",
+            params,
+        )
+        columns = KEY_COLUMNS + fields
+        return [
+            {column: value for column, value in zip(columns, row) if value is not None}
+            for row in cursor
+        ]
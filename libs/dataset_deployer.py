@@ -1,12 +1,20 @@
-from typing import List, Optional
+from typing import Dict, List, Optional, Sequence, Set, Tuple, Union
+import concurrent.futures
+import dataclasses
 import enum
+import gzip
+import hashlib
+import json
 import os
 import pathlib
+import threading
 import csv
 import io
 import logging
 import pandas as pd
 
+from libs.datasets import dataset_utils
+
 _logger = logging.getLogger(__name__)
 
 
@@ -15,10 +23,17 @@ class DatasetDeployer(object):
 
     """
 
-    def __init__(self, key="filename.csv", body="a random data", output_dir="."):
+    def __init__(
+        self,
+        key="filename.csv",
+        body="a random data",
+        output_dir=".",
+        writer: Optional["ArtifactWriter"] = None,
+    ):
         self.key = key
         self.body = body
         self.output_dir = output_dir
+        self.writer = writer
 
     def _persist_to_local(self):
         """Persists specific data onto an s3 bucket.
@@ -26,11 +41,15 @@ class DatasetDeployer(object):
         """
         _logger.info(f"persisting {self.key} {self.output_dir}")
 
-        with open(os.path.join(self.output_dir, self.key), "wb") as f:
-            # hack to allow the local writer to take either bytes or a string
-            # note this assumes that all strings are given in utf-8 and not,
-            # like, ASCII
-            f.write(self.body.encode("UTF-8") if isinstance(self.body, str) else self.body)
+        path = pathlib.Path(self.output_dir) / self.key
+        # hack to allow the local writer to take either bytes or a string
+        # note this assumes that all strings are given in utf-8 and not,
+        # like, ASCII
+        body = self.body.encode("UTF-8") if isinstance(self.body, str) else self.body
+        if self.writer:
+            self.writer.write(path, body)
+        else:
+            write_file_atomically(path, body)
 
     def persist(self):
         self._persist_to_local()
@@ -81,6 +100,13 @@ def write_nested_csv(
         keys_to_skip: Keys to skip.  Keys can be flattened entries or top level keys.
 
     """
+    csv_text = nested_csv(data, keys_to_skip=keys_to_skip)
+    _logger.info(f"Writing to {output_path}")
+    write_file_atomically(output_path, csv_text.encode("UTF-8"))
+
+
+def nested_csv(data: List[dict], keys_to_skip: Optional[List[str]] = None) -> str:
+    """Returns the contents of the file written by `write_nested_csv`."""
     keys_to_skip = keys_to_skip or []
 
     if not data:
@@ -93,23 +119,249 @@ def write_nested_csv(
     header = [column for column in header if column not in keys_to_skip]
 
     header_set = set(header)
-    _logger.info(f"Writing to {output_path}")
-    with output_path.open("w") as csvfile:
-        writer = csv.DictWriter(csvfile, header)
-        writer.writeheader()
-
-        flattened_data = [flatten_dict(row) for row in data]
-
-        for flattened_row in flattened_data:
-            # if a nested key is optional (i.e. {a: Optional[dict]}) and there is no
-            # value for a, (i.e. {a: None}), don't write a, as it's not in the header.
-            flattened_row = {k: v for k, v in flattened_row.items() if k in header_set}
-            flattened_row = {k: v for k, v in flattened_row.items() if not pd.isnull(v)}
-            flattened_row = {
-                k: v.value if isinstance(v, enum.Enum) else v for k, v in flattened_row.items()
-            }
-
-            writer.writerow(flattened_row)
+    csvfile = io.StringIO()
+    writer = csv.DictWriter(csvfile, header)
+    writer.writeheader()
+
+    flattened_data = [flatten_dict(row) for row in data]
+
+    for flattened_row in flattened_data:
+        # if a nested key is optional (i.e. {a: Optional[dict]}) and there is no
+        # value for a, (i.e. {a: None}), don't write a, as it's not in the header.
+        flattened_row = {k: v for k, v in flattened_row.items() if k in header_set}
+        flattened_row = {k: v for k, v in flattened_row.items() if not pd.isnull(v)}
+        flattened_row = {
+            k: v.value if isinstance(v, enum.Enum) else v for k, v in flattened_row.items()
+        }
+
+        writer.writerow(flattened_row)
+
+    return csvfile.getvalue()
+
+
+class Compression(enum.Enum):
+    """Encodings of compressed copies of artifacts, by their HTTP Content-Encoding name."""
+
+    GZIP = "gzip"
+    BROTLI = "br"
+
+    @property
+    def suffix(self) -> str:
+        return ".gz" if self is Compression.GZIP else ".br"
+
+    def compress(self, body: bytes) -> bytes:
+        if self is Compression.GZIP:
+            # A fixed mtime makes the output depend only on `body`. `gzip.compress` only takes
+            # mtime in Python 3.8+.
+            buf = io.BytesIO()
+            with gzip.GzipFile(fileobj=buf, mode="wb", mtime=0) as f:
+                f.write(body)
+            return buf.getvalue()
+        import brotli
+
+        return brotli.compress(body)
+
+
+# Directory of the manifests holding the hash of the content of every file of each output tree.
+# They are kept outside the trees so that they are not published with the files.
+DEFAULT_MANIFEST_DIR = pathlib.Path(
+    os.getenv("ARTIFACT_MANIFEST_DIR", dataset_utils.REPO_ROOT / ".cache" / "artifact-manifests")
+)
+
+# Number of threads that write files in the pipelines. Writing is bound by filesystem latency, not
+# CPU, so more threads than cores help on network volumes.
+DEFAULT_WRITE_THREADS = int(os.getenv("ARTIFACT_WRITE_THREADS", "8"))
+
+
+def write_file_atomically(path: pathlib.Path, body: bytes, fsync: bool = False) -> None:
+    """Writes `body` to a temporary file in the directory of `path` and renames it to `path`, so
+    that readers see the old or the new content, never part of a file."""
+    # Unique while each thread writes one file at a time.
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+    try:
+        with tmp_path.open("wb") as f:
+            f.write(body)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if tmp_path.exists():
+            tmp_path.unlink()
+        raise
+
+
+def _fsync_directory(path: pathlib.Path) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+@dataclasses.dataclass
+class ArtifactWriter:
+    """Writes files of an output tree, with compressed copies, skipping unchanged files.
+
+    The sha256 of the content of every file written is kept in a manifest in `manifest_dir`, named
+    by the path of the tree so that the manifest isn't published with it. When the content of a
+    file has the same hash as in the manifest of the previous build and all its copies exist,
+    nothing is written. The modification times of unchanged files stay the same
+    so that `aws s3 sync` doesn't upload them again.
+
+    Every file is written to a temporary file and renamed. With `threads` set, files are
+    compressed and written in a pool of threads while the caller builds the next file, and `write`
+    blocks while `max_pending` writes are queued. Call `flush` or `save_manifest` to wait for the
+    queued writes; they raise the first error of a write.
+    """
+
+    root: pathlib.Path
+
+    # Compressed copies of each file to write, named by appending `Compression.suffix`.
+    compressions: Sequence[Compression] = ()
+
+    # If False, only the compressed copies are written.
+    write_uncompressed: bool = True
+
+    # If False, every file is written even when its content is unchanged.
+    skip_unchanged: bool = True
+
+    # Number of threads writing files. If 0, files are written by `write` before it returns.
+    threads: int = 0
+
+    # Maximum number of files queued to be written before `write` blocks.
+    max_pending: int = 256
+
+    # If True, each file is synced to disk before it is renamed and the directories of the
+    # renamed files are synced once per `flush`.
+    fsync: bool = False
+
+    # Directory of the manifest. Defaults to `DEFAULT_MANIFEST_DIR`.
+    manifest_dir: Optional[pathlib.Path] = None
+
+    written: int = dataclasses.field(default=0, init=False)
+    skipped: int = dataclasses.field(default=0, init=False)
+
+    # Hash of the content of each path, relative to `root`.
+    _manifest: Dict[str, str] = dataclasses.field(default_factory=dict, init=False, repr=False)
+
+    _executor: Optional[concurrent.futures.ThreadPoolExecutor] = dataclasses.field(
+        default=None, init=False, repr=False
+    )
+    # Key and future of each queued write.
+    _pending: List[Tuple[str, concurrent.futures.Future]] = dataclasses.field(
+        default_factory=list, init=False, repr=False
+    )
+    _slots: Optional[threading.BoundedSemaphore] = dataclasses.field(
+        default=None, init=False, repr=False
+    )
+    _lock: threading.Lock = dataclasses.field(
+        default_factory=threading.Lock, init=False, repr=False
+    )
+    # Directories of files renamed since the last flush, to be synced when `fsync` is set.
+    _dirty_dirs: Set[pathlib.Path] = dataclasses.field(default_factory=set, init=False, repr=False)
+
+    def __post_init__(self):
+        if not self.write_uncompressed and not self.compressions:
+            raise ValueError("Nothing to write without uncompressed files or compressions")
+        if self.manifest_path.exists():
+            self._manifest = json.loads(self.manifest_path.read_text())
+        if self.threads:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.threads, thread_name_prefix="artifact-writer"
+            )
+            self._slots = threading.BoundedSemaphore(self.max_pending)
+
+    @property
+    def manifest_path(self) -> pathlib.Path:
+        root_key = hashlib.sha256(str(pathlib.Path(self.root).resolve()).encode()).hexdigest()[:16]
+        return (self.manifest_dir or DEFAULT_MANIFEST_DIR) / f"{root_key}.json"
+
+    def output_paths(self, path: pathlib.Path) -> List[pathlib.Path]:
+        """Returns the paths of the files written for `path`."""
+        paths = [path] if self.write_uncompressed else []
+        return paths + [path.with_name(path.name + c.suffix) for c in self.compressions]
+
+    def write(self, path: pathlib.Path, body: Union[str, bytes]) -> bool:
+        """Writes `body` to `path` and its compressed copies. Returns False if skipped because
+        they are unchanged."""
+        if isinstance(body, str):
+            body = body.encode("UTF-8")
+        key = str(path.relative_to(self.root))
+        digest = hashlib.sha256(body).hexdigest()
+        output_paths = self.output_paths(path)
+        if (
+            self.skip_unchanged
+            and self._manifest.get(key) == digest
+            and all(p.exists() for p in output_paths)
+        ):
+            self.skipped += 1
+            return False
+
+        self._manifest[key] = digest
+        self.written += 1
+        if not self._executor:
+            self._write_copies(path, body)
+            return True
+
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self._write_copies, path, body)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        self._pending.append((key, future))
+        return True
+
+    def _write_copies(self, path: pathlib.Path, body: bytes) -> None:
+        if self.write_uncompressed:
+            write_file_atomically(path, body, fsync=self.fsync)
+        for compression in self.compressions:
+            write_file_atomically(
+                path.with_name(path.name + compression.suffix),
+                compression.compress(body),
+                fsync=self.fsync,
+            )
+        if self.fsync:
+            with self._lock:
+                self._dirty_dirs.add(path.parent)
+
+    def flush(self) -> None:
+        """Waits for the queued writes and syncs the directories written to if `fsync` is set."""
+        pending, self._pending = self._pending, []
+        concurrent.futures.wait([future for _, future in pending])
+        with self._lock:
+            dirty_dirs, self._dirty_dirs = self._dirty_dirs, set()
+        for directory in sorted(dirty_dirs):
+            _fsync_directory(directory)
+        failed = [(key, future.exception()) for key, future in pending if future.exception()]
+        if failed:
+            # Forget the failed files so that they are written again by the next build.
+            for key, _ in failed:
+                self._manifest.pop(key, None)
+            raise failed[0][1]
+
+    def close(self) -> None:
+        """Flushes the queued writes and stops the threads."""
+        try:
+            self.flush()
+        finally:
+            if self._executor:
+                self._executor.shutdown()
+                self._executor = None
+
+    def save_manifest(self) -> None:
+        self.flush()
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        write_file_atomically(
+            self.manifest_path,
+            json.dumps(self._manifest, indent=0, sort_keys=True).encode(),
+            fsync=self.fsync,
+        )
+        _logger.info(
+            f"Wrote {self.written} files, skipped {self.skipped} unchanged files in {self.root}"
+        )
 
 
 def upload_json(key_name, json: str, output_dir: str):
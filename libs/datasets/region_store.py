@@ -0,0 +1,134 @@
+from typing import Callable, Dict, Optional, Tuple
+import functools
+import pathlib
+import threading
+
+import numpy as np
+import pandas as pd
+import structlog
+from covidactnow.datapublic.common_fields import CommonFields
+
+from libs.datasets.timeseries import MultiRegionDataset
+from libs.datasets.timeseries import TagField
+from libs.datasets.timeseries import TagType
+
+_logger = structlog.getLogger(__name__)
+
+
+# Tag types counted in the `annotation_count` column of the region summary.
+SUMMARY_ANNOTATION_TYPES = [
+    TagType.CUMULATIVE_LONG_TAIL_TRUNCATED,
+    TagType.CUMULATIVE_TAIL_TRUNCATED,
+]
+
+
+def _region_positions(index: pd.Index) -> Dict[str, Tuple[int, int]]:
+    """Returns the (start, stop) positions of each location_id in a sorted index."""
+    location_ids = index.get_level_values(CommonFields.LOCATION_ID).to_numpy()
+    if not len(location_ids):
+        return {}
+    changes = np.flatnonzero(location_ids[1:] != location_ids[:-1]) + 1
+    starts = np.concatenate([[0], changes])
+    stops = np.concatenate([changes, [len(location_ids)]])
+    return dict(zip(location_ids[starts], zip(starts.tolist(), stops.tolist())))
+
+
+def build_region_summary(dataset: MultiRegionDataset) -> pd.DataFrame:
+    """Returns a table of regions with their static values and count of annotations."""
+    df_regions = dataset.static.copy()
+    annotations = dataset.tag[
+        dataset.tag.index.get_level_values(TagField.TYPE).isin(SUMMARY_ANNOTATION_TYPES)
+    ]
+    df_regions["annotation_count"] = annotations.index.get_level_values(
+        CommonFields.LOCATION_ID
+    ).value_counts()
+    df_regions = df_regions.reset_index()  # Move location_id from the index to a regular column
+    df_regions["id"] = df_regions[CommonFields.LOCATION_ID]
+    return df_regions
+
+
+class RegionStore:
+    """Serves the data of one region at a time from a MultiRegionDataset, for interactive use.
+
+    The dataset is loaded by `load` on first use, or in a background thread started by `warm_up`.
+    The positions of each region's rows in the sorted timeseries and tag are found once, so
+    getting a region slices its rows without searching the whole dataset, and the tables of the
+    `cache_size` most recently used regions are cached.
+
+    If `summary_path` is set, the region summary is saved there and read by later instances, so
+    the list of regions is available before the dataset is loaded. Include something that
+    changes with the dataset in the path.
+    """
+
+    def __init__(
+        self,
+        load: Callable[[], MultiRegionDataset],
+        summary_path: Optional[pathlib.Path] = None,
+        cache_size: int = 256,
+    ):
+        self._load = load
+        self._summary_path = summary_path
+        self._lock = threading.Lock()
+        self._dataset: Optional[MultiRegionDataset] = None
+        self._timeseries: Optional[pd.DataFrame] = None
+        self._tag: Optional[pd.Series] = None
+        self._timeseries_positions: Dict[str, Tuple[int, int]] = {}
+        self._tag_positions: Dict[str, Tuple[int, int]] = {}
+        self._summary: Optional[pd.DataFrame] = None
+        self._warm_up_thread: Optional[threading.Thread] = None
+        self.region_timeseries = functools.lru_cache(maxsize=cache_size)(self._region_timeseries)
+        self.region_tag = functools.lru_cache(maxsize=cache_size)(self._region_tag)
+
+    def warm_up(self) -> threading.Thread:
+        """Starts loading the dataset in a background thread."""
+        with self._lock:
+            if not self._warm_up_thread:
+                self._warm_up_thread = threading.Thread(
+                    target=self.dataset, name="region-store-warm-up", daemon=True
+                )
+                self._warm_up_thread.start()
+            return self._warm_up_thread
+
+    @property
+    def loaded(self) -> bool:
+        return self._dataset is not None
+
+    def dataset(self) -> MultiRegionDataset:
+        """Returns the dataset, loading it if it hasn't been loaded."""
+        with self._lock:
+            if self._dataset is None:
+                _logger.info("Loading dataset")
+                dataset = self._load()
+                self._timeseries = dataset.timeseries.sort_index()
+                self._tag = dataset.tag.sort_index(kind="mergesort")
+                self._timeseries_positions = _region_positions(self._timeseries.index)
+                self._tag_positions = _region_positions(self._tag.index)
+                self._dataset = dataset
+                _logger.info("Loaded dataset", regions=len(self._timeseries_positions))
+            return self._dataset
+
+    def region_summary(self) -> pd.DataFrame:
+        """Returns a table of regions, read from `summary_path` if it exists."""
+        if self._summary is None:
+            if self._summary_path and self._summary_path.exists():
+                self._summary = pd.read_pickle(self._summary_path)
+            else:
+                self._summary = build_region_summary(self.dataset())
+                if self._summary_path:
+                    self._summary_path.parent.mkdir(parents=True, exist_ok=True)
+                    tmp_path = self._summary_path.with_suffix(".tmp")
+                    self._summary.to_pickle(tmp_path)
+                    tmp_path.replace(self._summary_path)
+        return self._summary
+
+    def _region_timeseries(self, location_id: str) -> pd.DataFrame:
+        """Returns the timeseries of a region, indexed by date. Don't modify it."""
+        self.dataset()
+        start, stop = self._timeseries_positions.get(location_id, (0, 0))
+        return self._timeseries.iloc[start:stop].droplevel(CommonFields.LOCATION_ID)
+
+    def _region_tag(self, location_id: str) -> pd.DataFrame:
+        """Returns the tags of a region, with columns VARIABLE, TYPE and CONTENT."""
+        self.dataset()
+        start, stop = self._tag_positions.get(location_id, (0, 0))
+        return self._tag.iloc[start:stop].reset_index(TagField.LOCATION_ID, drop=True).reset_index()
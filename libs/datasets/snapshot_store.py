@@ -0,0 +1,218 @@
+"""
+Local store of historical versions of a combined dataset.
+
+Each version of the dataset committed to the repo is parsed once from its LFS files and saved as a
+pickle of the MultiRegionDataset frames, named by a digest of the dataset file blobs so that
+commits that didn't change the dataset share one file. An index maps each commit SHA and commit
+time to the digest, so loading a version, such as "the dataset as of 7 days ago", is a single
+local read after the version has been materialized.
+"""
+from typing import List, Optional
+import bisect
+import dataclasses
+import datetime
+import hashlib
+import io
+import json
+import os
+import pathlib
+import pickle
+
+import git
+import structlog
+from typing_extensions import final
+
+from libs import git_lfs_object_helpers
+from libs.datasets import dataset_pointer
+from libs.datasets import dataset_utils
+from libs.datasets.dataset_pointer import DatasetPointer
+from libs.datasets.dataset_utils import DatasetType
+from libs.datasets.timeseries import MultiRegionDataset
+from libs.datasets.timeseries import TAG_INDEX_FIELDS
+from libs.datasets.timeseries import TagField
+
+_logger = structlog.getLogger(__name__)
+
+DEFAULT_STORE_DIR = pathlib.Path(
+    os.getenv("DATASET_SNAPSHOT_DIR", dataset_utils.REPO_ROOT / ".cache" / "dataset_snapshots")
+)
+
+
+@final
+@dataclasses.dataclass(frozen=True)
+class SnapshotEntry:
+    commit_sha: str
+
+    committed_at: datetime.datetime
+
+    # Digest of the dataset files at the commit. None until the version is materialized.
+    digest: Optional[str] = None
+
+    def to_json(self) -> dict:
+        return {
+            "commit_sha": self.commit_sha,
+            "committed_at": self.committed_at.isoformat(),
+            "digest": self.digest,
+        }
+
+    @staticmethod
+    def from_json(data: dict) -> "SnapshotEntry":
+        return SnapshotEntry(
+            commit_sha=data["commit_sha"],
+            committed_at=datetime.datetime.fromisoformat(data["committed_at"]),
+            digest=data["digest"],
+        )
+
+
+def _as_utc(value: datetime.datetime) -> datetime.datetime:
+    if value.tzinfo is None:
+        return value.replace(tzinfo=datetime.timezone.utc)
+    return value.astimezone(datetime.timezone.utc)
+
+
+class SnapshotStore:
+    """Materializes versions of the dataset of `dataset_type` committed to `repo` in `store_dir`.
+
+    The index records the HEAD commit it was updated at. Lookups of the latest commit or the last
+    commit before a time update the index when HEAD has moved, so they never miss newer commits.
+    Lookups of a commit SHA only update the index when it has no matching entry.
+    """
+
+    def __init__(
+        self,
+        store_dir: pathlib.Path = DEFAULT_STORE_DIR,
+        repo: Optional[git.Repo] = None,
+        dataset_type: DatasetType = DatasetType.MULTI_REGION,
+    ):
+        self.store_dir = store_dir
+        self.repo = repo or git.Repo(dataset_utils.REPO_ROOT)
+        self.dataset_type = dataset_type
+        self._pointer_path = pathlib.Path("data") / dataset_pointer.form_filename(dataset_type)
+        self._index_path = store_dir / f"{dataset_type.value}-index.json"
+        # Entries ordered by commit time.
+        self._entries: List[SnapshotEntry] = []
+        # SHA of HEAD when the index was last updated.
+        self._head_sha: Optional[str] = None
+        if self._index_path.exists():
+            index = json.loads(self._index_path.read_text())
+            self._head_sha = index["head_sha"]
+            self._entries = [SnapshotEntry.from_json(entry) for entry in index["entries"]]
+
+    @property
+    def entries(self) -> List[SnapshotEntry]:
+        return list(self._entries)
+
+    def update_index(self) -> int:
+        """Adds the commits that changed the dataset pointer to the index.
+
+        Only commit metadata is read, so this is cheap. Returns the number of commits added.
+        """
+        known = {entry.commit_sha for entry in self._entries}
+        head_sha = self.repo.head.commit.hexsha
+        added = [
+            SnapshotEntry(commit.hexsha, _as_utc(commit.committed_datetime))
+            for commit in self.repo.iter_commits(head_sha, paths=str(self._pointer_path))
+            if commit.hexsha not in known
+        ]
+        if added or head_sha != self._head_sha:
+            self._entries = sorted(self._entries + added, key=lambda entry: entry.committed_at)
+            self._head_sha = head_sha
+            self._save_index()
+        return len(added)
+
+    def find(
+        self, commit_sha: Optional[str] = None, before: Optional[datetime.datetime] = None
+    ) -> SnapshotEntry:
+        """Returns the entry of a commit, the last commit before a time or the latest commit.
+
+        The index is updated from the repo if HEAD has moved since it was last updated and the
+        lookup isn't by `commit_sha`, or if it has no matching entry.
+        """
+        if not commit_sha and self.repo.head.commit.hexsha != self._head_sha:
+            self.update_index()
+        entry = self._find_in_index(commit_sha, before)
+        if entry is None and self.update_index():
+            entry = self._find_in_index(commit_sha, before)
+        if entry is None:
+            raise ValueError(f"No {self.dataset_type.value} dataset for {commit_sha or before}")
+        return entry
+
+    def _find_in_index(
+        self, commit_sha: Optional[str], before: Optional[datetime.datetime]
+    ) -> Optional[SnapshotEntry]:
+        if commit_sha:
+            matches = [e for e in self._entries if e.commit_sha.startswith(commit_sha)]
+            return matches[0] if len(matches) == 1 else None
+        if before:
+            times = [entry.committed_at for entry in self._entries]
+            position = bisect.bisect_left(times, _as_utc(before))
+            return self._entries[position - 1] if position else None
+        return self._entries[-1] if self._entries else None
+
+    def materialize(self, entry: SnapshotEntry) -> SnapshotEntry:
+        """Saves the dataset of `entry` in the store if it isn't already there."""
+        if entry.digest and self._object_path(entry.digest).exists():
+            return entry
+
+        commit = self.repo.commit(entry.commit_sha)
+        pointer = DatasetPointer.parse_raw(
+            git_lfs_object_helpers.read_data_for_commit(self.repo, self._pointer_path, commit)
+        )
+        dataset_path = pointer.path
+        if dataset_path.is_absolute():
+            dataset_path = dataset_path.relative_to(self.repo.working_dir)
+        paths = [
+            pathlib.Path(str(dataset_path).replace(".csv", suffix))
+            for suffix in ["-wide-dates.csv", "-static.csv", "-annotations.csv"]
+        ]
+        # Blob SHAs of LFS pointer files identify the content without fetching it from LFS.
+        blob_shas = [(commit.tree / str(path)).hexsha for path in paths]
+        digest = hashlib.sha256("\n".join(blob_shas).encode()).hexdigest()
+        object_path = self._object_path(digest)
+        if not object_path.exists():
+            _logger.info("Materializing dataset", commit=entry.commit_sha, digest=digest)
+            dataset = MultiRegionDataset.read_from_pointer_files(
+                *[
+                    io.BytesIO(git_lfs_object_helpers.read_data_for_commit(self.repo, path, commit))
+                    for path in paths
+                ]
+            )
+            frames = {
+                "timeseries": dataset.timeseries,
+                "static": dataset.static,
+                # TagField members can't be pickled so the tag is saved without its level names.
+                "tag": dataset.tag.rename_axis([None] * len(TAG_INDEX_FIELDS)).rename(None),
+            }
+            object_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = object_path.with_suffix(".tmp")
+            with tmp_path.open("wb") as f:
+                pickle.dump(frames, f, protocol=pickle.HIGHEST_PROTOCOL)
+            tmp_path.replace(object_path)
+
+        materialized = dataclasses.replace(entry, digest=digest)
+        self._entries = [materialized if e == entry else e for e in self._entries]
+        self._save_index()
+        return materialized
+
+    def load(
+        self, commit_sha: Optional[str] = None, before: Optional[datetime.datetime] = None
+    ) -> MultiRegionDataset:
+        """Loads the dataset at a commit, the last commit before a time or the latest commit."""
+        entry = self.materialize(self.find(commit_sha=commit_sha, before=before))
+        with self._object_path(entry.digest).open("rb") as f:
+            frames = pickle.load(f)
+        frames["tag"] = frames["tag"].rename_axis(TAG_INDEX_FIELDS).rename(TagField.CONTENT)
+        return MultiRegionDataset(**frames)
+
+    def _object_path(self, digest: str) -> pathlib.Path:
+        return self.store_dir / "objects" / f"{digest}.pkl"
+
+    def _save_index(self):
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self._index_path.with_suffix(".tmp")
+        index = {
+            "head_sha": self._head_sha,
+            "entries": [entry.to_json() for entry in self._entries],
+        }
+        tmp_path.write_text(json.dumps(index, indent=1))
+        tmp_path.replace(self._index_path)
@@ -14,7 +14,7 @@ from typing import ClassVar
 from typing import Collection
 from typing import Dict
 from typing import Iterable
-from typing import List, Optional, Union, TextIO
+from typing import List, Optional, Union, TextIO, BinaryIO
 from typing import Mapping
 from typing import MutableMapping
 from typing import Set
@@ -34,6 +34,7 @@ import numpy as np
 import structlog
 from covidactnow.datapublic import common_df
 from libs import pipeline
+from libs import precision
 from libs.datasets import dataset_pointer
 from libs.datasets import dataset_utils
 from libs.datasets.dataset_utils import AggregationLevel
@@ -580,6 +581,7 @@ class MultiRegionDataset:
             # NaN, which is a valid float. Apply to_numeric to columns so that int columns
             # are not modified.
             timeseries_df = timeseries_df.fillna(np.nan).apply(pd.to_numeric).sort_index()
+        timeseries_df = precision.downcast(timeseries_df)
         geodata_df = timeseries_and_geodata_df.loc[:, geodata_column_mask]
 
         static_df = _geodata_df_to_static_attribute_df(
@@ -656,7 +658,18 @@ class MultiRegionDataset:
 
     @staticmethod
     def read_from_pointer(pointer: dataset_pointer.DatasetPointer) -> "MultiRegionDataset":
-        wide_dates_df = pd.read_csv(pointer.path_wide_dates(), low_memory=False)
+        return MultiRegionDataset.read_from_pointer_files(
+            pointer.path_wide_dates(), pointer.path_static(), pointer.path_annotation()
+        )
+
+    @staticmethod
+    def read_from_pointer_files(
+        wide_dates: Union[pathlib.Path, BinaryIO],
+        static: Union[pathlib.Path, BinaryIO],
+        annotations: Union[pathlib.Path, BinaryIO],
+    ) -> "MultiRegionDataset":
+        """Reads the files written by `write_to_dataset_pointer`, from paths or buffers."""
+        wide_dates_df = pd.read_csv(wide_dates, low_memory=False)
         wide_dates_df = wide_dates_df.set_index([CommonFields.LOCATION_ID, PdFields.VARIABLE])
 
         # Extract provenance columns from wide date DataFrame so all columns are dates. This
@@ -675,16 +688,13 @@ class MultiRegionDataset:
                 provenance_df[TagField.TYPE] = TagType.PROVENANCE
                 tag_df_to_concat.append(provenance_df)
 
-        wide_dates_df = wide_dates_df.loc[:, ~provenance_column_mask]
+        wide_dates_df = precision.downcast(wide_dates_df.loc[:, ~provenance_column_mask])
         wide_dates_df.columns = pd.to_datetime(wide_dates_df.columns)
         wide_dates_df = wide_dates_df.rename_axis(columns=CommonFields.DATE)
 
-        static_df = pd.read_csv(
-            pointer.path_static(), dtype={CommonFields.FIPS: str}, low_memory=False
-        )
+        static_df = pd.read_csv(static, dtype={CommonFields.FIPS: str}, low_memory=False)
 
-        annotations = pd.read_csv(pointer.path_annotation(), low_memory=False)
-        tag_df_to_concat.append(annotations)
+        tag_df_to_concat.append(pd.read_csv(annotations, low_memory=False))
 
         return (
             MultiRegionDataset.from_timeseries_wide_dates_df(wide_dates_df)
@@ -777,9 +787,11 @@ class MultiRegionDataset:
 
     def get_one_region(self, region: Region) -> OneRegionTimeseriesDataset:
         try:
-            ts_df = self.timeseries.xs(
-                region.location_id, level=CommonFields.LOCATION_ID, drop_level=False
-            ).reset_index()
+            ts_df = precision.to_float64(
+                self.timeseries.xs(
+                    region.location_id, level=CommonFields.LOCATION_ID, drop_level=False
+                ).reset_index()
+            )
         except KeyError:
             ts_df = pd.DataFrame([], columns=[CommonFields.LOCATION_ID, CommonFields.DATE])
         latest_dict = self._location_id_latest_dict(region.location_id)
@@ -932,7 +944,7 @@ class MultiRegionDataset:
         latest_data = self.static.reset_index()
         _add_fips_if_missing(latest_data)
 
-        timeseries_data = self._geo_data.join(self.timeseries).reset_index()
+        timeseries_data = self._geo_data.join(precision.to_float64(self.timeseries)).reset_index()
         _add_fips_if_missing(timeseries_data)
 
         # A DataFrame with timeseries data and latest data (with DATE=NaT) together
@@ -1000,7 +1012,7 @@ class MultiRegionDataset:
             region = Region.from_location_id(location_id)
             tag = self.tag.loc[[region.location_id]].reset_index(TagField.LOCATION_ID, drop=True)
             yield region, OneRegionTimeseriesDataset(
-                region, timeseries_group.reset_index(), latest_dict, tag=tag
+                region, precision.to_float64(timeseries_group.reset_index()), latest_dict, tag=tag
             )
 
     def get_county_name(self, *, region: pipeline.Region) -> str:
@@ -1052,6 +1064,8 @@ def add_new_cases(dataset_in: MultiRegionDataset) -> MultiRegionDataset:
     # every date, even those with NA cases. This keeps the output identical when empty rows are
     # dropped or added.
     cases_wide_dates = dataset_in.timeseries_wide_dates().loc[(slice(None), CommonFields.CASES), :]
+    # Cumulative counts are too large to diff in float32.
+    cases_wide_dates = precision.to_float64(cases_wide_dates)
     # Calculating new cases using diff will remove the first detected value from the case series.
     # We want to capture the first day a region reports a case. Since our data sources have
     # been capturing cases in all states from the beginning of the pandemic, we are treating
@@ -1070,7 +1084,7 @@ def add_new_cases(dataset_in: MultiRegionDataset) -> MultiRegionDataset:
     new_cases[new_cases < 0] = pd.NA
     new_cases = new_cases.dropna()
 
-    new_cases_dataset = MultiRegionDataset(timeseries=new_cases)
+    new_cases_dataset = MultiRegionDataset(timeseries=precision.downcast(new_cases))
 
     dataset_out = dataset_in.join_columns(new_cases_dataset)
     return dataset_out
@@ -1366,7 +1380,9 @@ def _aggregate_dataframe_by_region(
     df.index = pd.MultiIndex.from_frame(old_idx)
 
     # Stack into a Series with several levels in the index.
-    long_all_values = df.rename_axis(columns=PdFields.VARIABLE).stack(dropna=True)
+    long_all_values = precision.to_float64(
+        df.rename_axis(columns=PdFields.VARIABLE).stack(dropna=True)
+    )
     assert long_all_values.index.names == [CommonFields.LOCATION_ID] + groupby_columns
 
     # Aggregate by location_id_agg, optional date and variable.
@@ -1386,6 +1402,8 @@ def _aggregate_dataframe_by_region(
         .reindex(columns=df_in.columns)
     )
     assert df_in.index.names == df_out.index.names
+    if CommonFields.DATE in df_out.index.names:
+        df_out = precision.downcast(df_out)
     return df_out
 
 
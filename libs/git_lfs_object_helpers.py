@@ -14,6 +14,9 @@ from libs.datasets import dataset_utils
 
 _logger = structlog.getLogger(__name__)
 
+# Start of the pointer file committed in place of a file stored in LFS.
+LFS_POINTER_PREFIX = b"version https://git-lfs.github.com/spec/"
+
 
 def find_commit(
     repo: git.Repo,
@@ -73,7 +76,12 @@ def read_data_for_commit(repo: git.Repo, path: pathlib.Path, commit: git.Commit)
 
     blob = commit.tree / str(path)
     pointer_text = blob.data_stream.read()
-    return subprocess.check_output(["git", "lfs", "smudge"], input=pointer_text)
+    if not pointer_text.startswith(LFS_POINTER_PREFIX):
+        # File isn't stored in LFS.
+        return pointer_text
+    return subprocess.check_output(
+        ["git", "lfs", "smudge"], input=pointer_text, cwd=repo.working_dir
+    )
 
 
 # TODO(chris): Streamline options for choosing the correct commit. Instead of passing specific
@@ -1,16 +1,17 @@
+import functools
 import multiprocessing
 import os
 import platform
 from typing import Callable, TypeVar, Iterable
 
-from pandarallel import pandarallel
 import pandas as pd
 import structlog
 
+from libs import timing_utils
+
 _log = structlog.get_logger()
 
 VISIBIBLE_PROGRESS_BAR = os.environ.get("PYSEIR_VERBOSITY") == "True"
-pandarallel.initialize(progress_bar=VISIBIBLE_PROGRESS_BAR)
 
 FORCE_MULTIPROCESSING = str(os.environ.get("FORCE_MULTIPROCESSING")).lower() in ["true", "1"]
 
@@ -29,7 +30,30 @@ SeriesOrDataFrame = TypeVar("SeriesOrDataFrame", pd.Series, pd.DataFrame)
 
 
 def parallel_map(func: Callable[[T], R], iterable: Iterable[T]) -> Iterable[R]:
-    """Runs func on each item in iterable, in parallel if possible."""
+    """Runs func on each item in iterable, in parallel if possible.
+
+    While recording a `timing_utils.run_report` the calls are recorded in a span named
+    "parallel_map:<name of func>" with the spans of all calls, including those made in worker
+    processes, aggregated in its "task" child.
+    """
+    if not timing_utils.recording():
+        return _map(func, iterable)
+
+    with timing_utils.span(f"parallel_map:{_func_name(func)}") as map_span:
+        results = []
+        for result, task_span in _map(timing_utils.RecordedCall(func), iterable):
+            map_span.child(task_span.name).merge(task_span)
+            results.append(result)
+    return iter(results)
+
+
+def _func_name(func: Callable) -> str:
+    while isinstance(func, functools.partial):
+        func = func.func
+    return getattr(func, "__qualname__", type(func).__name__)
+
+
+def _map(func: Callable[[T], R], iterable: Iterable[T]) -> Iterable[R]:
     if USE_MULTIPROCESSING:
         # Setting maxtasksperchild to one ensures that we minimize memory usage over time by creating
         # a new child for every task. Addresses OOMs we saw on highly parallel build machine.
@@ -45,6 +69,16 @@ def pandas_parallel_apply(
 ) -> SeriesOrDataFrame:
     """Calls parallel_apply() (from pandarallel) if safe, else just apply()."""
     if USE_MULTIPROCESSING:
+        _initialize_pandarallel()
         return series_or_dataframe.parallel_apply(func)
     else:
         return series_or_dataframe.apply(func)
+
+
+@functools.lru_cache(None)
+def _initialize_pandarallel() -> None:
+    # Initialized on first use instead of at import because importing pandarallel is slow and
+    # `initialize` sets up shared memory for workers that most commands never start.
+    from pandarallel import pandarallel
+
+    pandarallel.initialize(progress_bar=VISIBIBLE_PROGRESS_BAR)
@@ -1,6 +1,7 @@
-from typing import List, Optional, Dict, Any
+from typing import Collection, List, Optional, Dict, Any, Sequence
 from dataclasses import dataclass
 import pathlib
+import pickle
 import pandas as pd
 import pydantic
 import structlog
@@ -19,6 +20,7 @@ from libs.metrics import top_level_metrics
 from libs.metrics import top_level_metric_risk_levels
 from libs import parallel_utils
 from libs import pipeline
+from libs import timing_utils
 from libs import build_api_v2
 from libs.datasets import timeseries
 from libs.datasets.timeseries import OneRegionTimeseriesDataset
@@ -28,6 +30,9 @@ from libs.datasets import AggregationLevel
 logger = structlog.getLogger()
 PROD_BUCKET = "data.covidactnow.org"
 
+# Name of the file of API timeseries written by each shard of `pyseir build-all --shard`.
+TIMESERIES_FRAGMENT_FILENAME = "api-v2-timeseries.pkl"
+
 
 @dataclass(frozen=True)
 class RegionalInput:
@@ -96,8 +101,9 @@ class RegionalInput:
 def run_on_regions(
     regional_inputs: List[RegionalInput], sort_func=None, limit=None,
 ) -> List[RegionSummaryWithTimeseries]:
-    results = parallel_utils.parallel_map(build_timeseries_for_region, regional_inputs)
-    all_timeseries = [result for result in results if result]
+    with timing_utils.span("run_on_regions", regions=len(regional_inputs)):
+        results = parallel_utils.parallel_map(build_timeseries_for_region, regional_inputs)
+        all_timeseries = [result for result in results if result]
 
     if sort_func:
         all_timeseries.sort(key=sort_func)
@@ -173,6 +179,7 @@ def deploy_single_level(
     all_timeseries: List[RegionSummaryWithTimeseries],
     level: AggregationLevel,
     output_root: pathlib.Path,
+    writer: Optional[dataset_deployer.ArtifactWriter] = None,
 ) -> None:
     """Deploys all files for a single aggregate level.
 
@@ -181,6 +188,7 @@ def deploy_single_level(
     Args:
         all_timeseries: List of timeseries to deploy.
         output_root: Root of API output.
+        writer: Writes the files, by default uncompressed and unconditionally.
     """
 
     path_builder = APIOutputPathBuilder(output_root, level)
@@ -195,31 +203,37 @@ def deploy_single_level(
 
     logger.info(f"Deploying {level.value} output to {output_root}")
 
-    for summary in all_summaries:
-        output_path = path_builder.single_summary(summary, FileType.JSON)
-        deploy_json_api_output(summary, output_path)
+    with timing_utils.span(f"deploy_single_level:{level.value}", regions=len(all_timeseries)):
+        with timing_utils.span("deploy single region files"):
+            for summary in all_summaries:
+                output_path = path_builder.single_summary(summary, FileType.JSON)
+                deploy_json_api_output(summary, output_path, writer=writer)
 
-    for timeseries in all_timeseries:
-        output_path = path_builder.single_timeseries(timeseries, FileType.JSON)
-        deploy_json_api_output(timeseries, output_path)
+            for timeseries in all_timeseries:
+                output_path = path_builder.single_timeseries(timeseries, FileType.JSON)
+                deploy_json_api_output(timeseries, output_path, writer=writer)
 
-    deploy_bulk_files(path_builder, all_timeseries, all_summaries)
+        deploy_bulk_files(path_builder, all_timeseries, all_summaries, writer=writer)
 
-    if level is AggregationLevel.COUNTY:
-        for state in set(record.state for record in all_summaries):
-            state_timeseries = [record for record in all_timeseries if record.state == state]
-            state_summaries = [record for record in all_summaries if record.state == state]
-            deploy_bulk_files(path_builder, state_timeseries, state_summaries, state=state)
+        if level is AggregationLevel.COUNTY:
+            for state in set(record.state for record in all_summaries):
+                state_timeseries = [record for record in all_timeseries if record.state == state]
+                state_summaries = [record for record in all_summaries if record.state == state]
+                deploy_bulk_files(
+                    path_builder, state_timeseries, state_summaries, state=state, writer=writer
+                )
 
 
+@timing_utils.span("deploy_bulk_files")
 def deploy_bulk_files(
     path_builder,
     all_timeseries: List[RegionSummaryWithTimeseries],
     all_summaries: List[RegionSummary],
     state: Optional[str] = None,
+    writer: Optional[dataset_deployer.ArtifactWriter] = None,
 ):
 
-    timing_kwargs = {"region_level": path_builder.level.value, "state": state}
+    timing_utils.count("regions", len(all_timeseries))
 
     bulk_timeseries = AggregateRegionSummaryWithTimeseries(__root__=all_timeseries)
     bulk_summaries = AggregateRegionSummary(__root__=all_summaries)
@@ -239,13 +253,14 @@ def deploy_bulk_files(
             "metrics.vaccinationsInitiatedRatio",
             "metrics.vaccinationsCompletedRatio",
         ],
+        writer=writer,
     )
 
     output_path = path_builder.bulk_timeseries(bulk_timeseries, FileType.JSON, state=state)
-    deploy_json_api_output(bulk_timeseries, output_path)
+    deploy_json_api_output(bulk_timeseries, output_path, writer=writer)
 
     output_path = path_builder.bulk_summary(bulk_summaries, FileType.JSON, state=state)
-    deploy_json_api_output(bulk_summaries, output_path)
+    deploy_json_api_output(bulk_summaries, output_path, writer=writer)
 
     output_path = path_builder.bulk_summary(bulk_summaries, FileType.CSV, state=state)
     deploy_csv_api_output(
@@ -258,15 +273,23 @@ def deploy_bulk_files(
             "metrics.vaccinationsInitiatedRatio",
             "metrics.vaccinationsCompletedRatio",
         ],
+        writer=writer,
     )
 
 
-def deploy_json_api_output(region_result: pydantic.BaseModel, output_path: pathlib.Path) -> None:
+def deploy_json_api_output(
+    region_result: pydantic.BaseModel,
+    output_path: pathlib.Path,
+    writer: Optional[dataset_deployer.ArtifactWriter] = None,
+) -> None:
     # Excluding fields that are not specifically included in a model.
     # This lets a field be undefined and not included in the actual json.
     serialized_result = region_result.json(exclude_unset=True)
 
-    output_path.write_text(serialized_result)
+    if writer:
+        writer.write(output_path, serialized_result)
+    else:
+        output_path.write_text(serialized_result)
 
 
 def _model_to_dict(data: dict):
@@ -293,26 +316,37 @@ def deploy_csv_api_output(
     api_output: pydantic.BaseModel,
     output_path: pathlib.Path,
     keys_to_skip: Optional[List[str]] = None,
+    writer: Optional[dataset_deployer.ArtifactWriter] = None,
 ) -> None:
     if not hasattr(api_output, "__root__"):
         raise AssertionError("Missing root data")
 
     data = _model_to_dict(api_output.__dict__)
     rows = dataset_deployer.remove_root_wrapper(data)
-    dataset_deployer.write_nested_csv(rows, output_path, keys_to_skip=keys_to_skip)
+    if writer:
+        writer.write(output_path, dataset_deployer.nested_csv(rows, keys_to_skip=keys_to_skip))
+    else:
+        dataset_deployer.write_nested_csv(rows, output_path, keys_to_skip=keys_to_skip)
 
 
-def generate_from_loaded_data(
+def build_all_timeseries(
     model_output: pyseir.run.PyseirOutputDatasets,
-    output: pathlib.Path,
     selected_dataset: MultiRegionDataset,
     log,
-):
-    """Runs the API generation code using data in parameters, writing results to output."""
+    regions: Optional[Collection[pipeline.Region]] = None,
+) -> List[RegionSummaryWithTimeseries]:
+    """Builds the API timeseries of every region in `selected_dataset`, or only of `regions`.
+
+    Test positivity is calculated from all of `selected_dataset` even when `regions` is set
+    because the methods use the most recent date of the whole dataset.
+    """
     # If calculating test positivity succeeds join it with the combined_datasets into one
     # MultiRegionDataset
     log.info("Running test positivity.")
-    regions_data = test_positivity.run_and_maybe_join_columns(selected_dataset, log)
+    with timing_utils.span("test positivity"):
+        regions_data = test_positivity.run_and_maybe_join_columns(selected_dataset, log)
+    if regions is not None:
+        regions_data = regions_data.get_regions_subset(regions)
 
     log.info(f"Joining inputs by region.")
     icu_data_map = dict(model_output.icu.iter_one_regions())
@@ -328,9 +362,66 @@ def generate_from_loaded_data(
     ]
     # Build all region timeseries API Output objects.
     log.info("Generating all API Timeseries")
-    all_timeseries = run_on_regions(regional_inputs)
-    deploy_single_level(all_timeseries, AggregationLevel.COUNTY, output)
-    deploy_single_level(all_timeseries, AggregationLevel.STATE, output)
-    deploy_single_level(all_timeseries, AggregationLevel.CBSA, output)
-    deploy_single_level(all_timeseries, AggregationLevel.PLACE, output)
+    return run_on_regions(regional_inputs)
+
+
+def deploy_all_timeseries(
+    all_timeseries: List[RegionSummaryWithTimeseries],
+    output: pathlib.Path,
+    writer: dataset_deployer.ArtifactWriter,
+):
+    """Deploys the files of every aggregation level and saves the manifest of `writer`."""
+    with timing_utils.span("deploy_api_v2"):
+        deploy_single_level(all_timeseries, AggregationLevel.COUNTY, output, writer=writer)
+        deploy_single_level(all_timeseries, AggregationLevel.STATE, output, writer=writer)
+        deploy_single_level(all_timeseries, AggregationLevel.CBSA, output, writer=writer)
+        deploy_single_level(all_timeseries, AggregationLevel.PLACE, output, writer=writer)
+        writer.save_manifest()
+        timing_utils.count("files_written", writer.written)
+        timing_utils.count("files_skipped", writer.skipped)
+
+
+def write_timeseries_fragment(
+    all_timeseries: List[RegionSummaryWithTimeseries], path: pathlib.Path
+) -> None:
+    """Saves the timeseries built by one shard, to be deployed by `read_timeseries_fragments`."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with tmp_path.open("wb") as f:
+        pickle.dump(all_timeseries, f, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp_path.replace(path)
+
+
+def read_timeseries_fragments(paths: Sequence[pathlib.Path]) -> List[RegionSummaryWithTimeseries]:
+    """Returns the timeseries saved by `write_timeseries_fragment` in the order that
+    `build_all_timeseries` returns them for all regions."""
+    all_timeseries = []
+    for path in paths:
+        with path.open("rb") as f:
+            all_timeseries.extend(pickle.load(f))
+    return sorted(all_timeseries, key=lambda timeseries: timeseries.locationId)
+
+
+def generate_from_loaded_data(
+    model_output: pyseir.run.PyseirOutputDatasets,
+    output: pathlib.Path,
+    selected_dataset: MultiRegionDataset,
+    log,
+    writer: Optional[dataset_deployer.ArtifactWriter] = None,
+):
+    """Runs the API generation code using data in parameters, writing results to output.
+
+    By default unchanged files are not written again, see `dataset_deployer.ArtifactWriter`.
+    """
+    all_timeseries = build_all_timeseries(model_output, selected_dataset, log)
+    if writer:
+        deploy_all_timeseries(all_timeseries, output, writer)
+    else:
+        writer = dataset_deployer.ArtifactWriter(
+            output, threads=dataset_deployer.DEFAULT_WRITE_THREADS
+        )
+        try:
+            deploy_all_timeseries(all_timeseries, output, writer)
+        finally:
+            writer.close()
     log.info("Finished API generation.")
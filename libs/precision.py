@@ -0,0 +1,115 @@
+"""
+Precision of the float values held in `MultiRegionDataset` timeseries.
+
+By default timeseries are float64. With the env var PIPELINE_FLOAT_DTYPE=float32 the timeseries of
+datasets are stored as float32 when they are loaded or aggregated, halving the memory of the
+largest DataFrames of the pipeline. Datasets are written with 7 significant digits (see
+`MultiRegionDataset.write_to_dataset_pointer`), so a value read from a dataset file is stored as
+the float32 nearest to it and `to_float64` gets back the value read. Columns containing values
+that don't survive this, such as counts above 2**24, stay float64.
+
+float32 can't represent the sum or difference of large counts exactly, so sums and diffs are
+calculated on `to_float64` copies, and so are the calculations of one region, which get
+`OneRegionTimeseriesDataset` data as float64.
+"""
+from typing import Iterator, Union
+import contextlib
+import os
+
+import numpy as np
+import pandas as pd
+
+
+FLOAT_DTYPES = ("float64", "float32")
+
+# Significant digits kept when converting float32 values to float64, those of the dataset files.
+SIGNIFICANT_DIGITS = 7
+
+_float_dtype = np.dtype(os.getenv("PIPELINE_FLOAT_DTYPE", "float64"))
+if _float_dtype.name not in FLOAT_DTYPES:
+    raise ValueError(f"PIPELINE_FLOAT_DTYPE must be one of {FLOAT_DTYPES}")
+
+PandasObject = Union[pd.DataFrame, pd.Series]
+
+
+def float_dtype() -> np.dtype:
+    """Returns the dtype of timeseries values."""
+    return _float_dtype
+
+
+@contextlib.contextmanager
+def use_float_dtype(dtype: str) -> Iterator[None]:
+    """Sets the dtype of timeseries values in the block, for tests and benchmarks."""
+    global _float_dtype
+    if dtype not in FLOAT_DTYPES:
+        raise ValueError(f"dtype must be one of {FLOAT_DTYPES}")
+    saved = _float_dtype
+    _float_dtype = np.dtype(dtype)
+    try:
+        yield
+    finally:
+        _float_dtype = saved
+
+
+def _is_float(dtype, float_type) -> bool:
+    return isinstance(dtype, np.dtype) and dtype == float_type
+
+
+def downcast(values: PandasObject) -> PandasObject:
+    """Returns `values` with float64 columns converted to `float_dtype()` where `to_float64`
+    converts them back to the same values, to within a few float64 ulps. Other columns, such as
+    counts above 2**24 and the results of calculations, are not rounded by being stored as
+    float32."""
+    if _float_dtype == np.float64:
+        return values
+    if isinstance(values, pd.Series):
+        return values.astype(_float_dtype) if _is_lossless(values) else values
+    columns = [c for c in values.columns if _is_lossless(values[c])]
+    if not columns:
+        return values
+    return values.astype({column: _float_dtype for column in columns})
+
+
+def _is_lossless(series: pd.Series) -> bool:
+    if not _is_float(series.dtype, np.float64):
+        return False
+    original = series.to_numpy()
+    converted = _round_significant(original.astype(np.float32))
+    # Allow a few float64 ulps because the default parser of `pd.read_csv` isn't always
+    # correctly rounded.
+    error = np.abs(converted - original) <= 4 * np.spacing(np.abs(original))
+    return bool((error | np.isnan(original)).all())
+
+
+def _round_significant(values: np.ndarray) -> np.ndarray:
+    """Returns float32 `values` as the float64 values nearest their shortest decimal form with
+    SIGNIFICANT_DIGITS digits, so that 0.1 in float32 becomes 0.1, not 0.10000000149011612."""
+    values = values.astype(np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        exponents = SIGNIFICANT_DIGITS - 1 - np.floor(np.log10(np.abs(values)))
+        finite = np.isfinite(exponents)
+        exponents = np.where(finite, exponents, 0)
+        # Multiply or divide by an exact power of ten so that the result is correctly rounded.
+        scale = 10.0 ** np.abs(exponents)
+        rounded = np.where(
+            exponents >= 0, np.round(values * scale) / scale, np.round(values / scale) * scale,
+        )
+    return np.where(finite, rounded, values)
+
+
+def to_float64(values: PandasObject) -> PandasObject:
+    """Returns `values` with float32 columns converted to float64, for calculations that need
+    float64 precision."""
+    if isinstance(values, pd.Series):
+        if not _is_float(values.dtype, np.float32):
+            return values
+        return pd.Series(
+            _round_significant(values.to_numpy()), index=values.index, name=values.name
+        )
+    columns = [c for c, dtype in values.dtypes.items() if _is_float(dtype, np.float32)]
+    if not columns:
+        return values
+    values = values.copy()
+    for column in columns:
+        values[column] = _round_significant(values[column].to_numpy())
+    return values
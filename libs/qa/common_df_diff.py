@@ -45,8 +45,10 @@ FIPS 5 states (xx, yy, zz, ...) and 6 counties (xxyyy, xxyyy, ... OR by state TX
 
 """
 
-
+import dataclasses
+from typing import List
 from typing import Optional
+from typing import Tuple
 
 import pandas as pd
 import numpy as np
@@ -57,25 +59,31 @@ from covidactnow.datapublic.common_fields import CommonFields, PdFields
 
 TIMESERIES_KEYS = [CommonFields.LOCATION_ID, CommonFields.DATE]
 
+# Approximate upper bound on the memory used by the dense arrays of one chunk of regions in
+# `DatasetDiff.compare`. Each chunk holds a few arrays of shape (regions, variables, dates).
+DEFAULT_MAX_CHUNK_BYTES = 256 * 1024 * 1024
+# Number of float64 arrays of the shape of a chunk alive at once in `_compare_chunk`.
+_ARRAYS_PER_CHUNK = 16
+
 
 class DatasetDiff(BaseModel):
     # Duplicates that are dropped from consideration for the diff
     duplicates_dropped: pd.DataFrame
-    # The non-duplicated values pivoted/stacked/melted with new column 'value' and new index level
-    # 'variable'
-    melt: pd.DataFrame
+    # The non-duplicated numeric values, one column per variable, with index 'location_id', 'date'
+    wide: pd.DataFrame
     # MultiIndex with levels 'variable' and 'location_id'. Since a timeseries in a dataset is
     # identified
     # by a <variable, location_id> pair this is usable as the set of all timeseries in this dataset.
     all_variable_location_id: pd.MultiIndex
     # The subset of all_variable_location_id that appears in this dataset but not the other one
     my_ts: Optional[pd.MultiIndex] = None
-    # The timeseries that appear in both this dataset and the other one
-    common_location_id: Optional[pd.DataFrame] = None
     # Timeseries points that appear in this dataset but not the other one
-    my_ts_points: Optional[pd.DataFrame] = None
+    my_ts_points: Optional[pd.Series] = None
     # Diffs of overlapping parts of the timeseries, only set on the left dataset
     ts_diffs: Optional[pd.DataFrame] = None
+    # Changes of each timeseries that appears in both datasets, only set on the left dataset. See
+    # `_compare_chunk` for the columns.
+    ts_changes: Optional[pd.DataFrame] = None
 
     class Config:
         arbitrary_types_allowed = True
@@ -92,8 +100,12 @@ class DatasetDiff(BaseModel):
                 .sort_values("diff", ascending=False)
                 .head(20)
             )
+            most_changed_timeseries = self.ts_changes.sort_values(
+                "max_relative_diff", ascending=False
+            ).head(20)
             ts_diffs_str = f"""TS diffs:\n{most_diff_timeseries}
 TS diffs by variable and has_overlap:\n{most_diff_variables}
+TS changes:\n{most_changed_timeseries}
 """
 
         return f"""Duplicate rows in this file: {self.duplicates_dropped.index.unique(level='location_id')}
@@ -118,7 +130,7 @@ TS points only in this file: {self.my_ts_points.groupby('date').size().to_dict()
             CommonFields.COUNTRY,
             CommonFields.AGGREGATE_LEVEL,
         }.intersection(df.columns)
-        # Drop string columns because timeseries_diff can't handle them yet.
+        # Drop string columns because the diff can't handle them yet.
         for col in df.select_dtypes(include={"object", "string"}):
             if col != CommonFields.LOCATION_ID:
                 print(f"Dropping field '{col}' based on type")
@@ -126,23 +138,25 @@ TS points only in this file: {self.my_ts_points.groupby('date').size().to_dict()
         if columns_to_drop:
             df = df.drop(columns=columns_to_drop)
 
-        melt = (
-            df.melt(id_vars=TIMESERIES_KEYS)
-            .set_index([PdFields.VARIABLE] + TIMESERIES_KEYS)
-            .dropna()
-        )
-        # When Int64 and float64 columns are merged into one by melt the 'object' dtype is used, which
-        # is not supported by timeseries_diff. Force 'value' back to a numeric dtype.
-        melt["value"] = pd.to_numeric(melt["value"])
+        wide = df.set_index(TIMESERIES_KEYS).sort_index()
+        # convert_dtypes may have made nullable Int64 columns. Force all values to float64 so that
+        # they can be compared in one array.
+        wide = wide.apply(lambda column: pd.to_numeric(column).astype(float))
+        wide.columns.name = PdFields.VARIABLE
 
+        has_value = wide.notna().groupby(CommonFields.LOCATION_ID, sort=False).any()
         all_variable_locations = (
-            melt.groupby([PdFields.VARIABLE, CommonFields.LOCATION_ID]).first().index
+            has_value.stack()
+            .loc[lambda s: s]
+            .index.swaplevel()
+            .set_names([PdFields.VARIABLE, CommonFields.LOCATION_ID])
+            .sort_values()
         )
         return DatasetDiff(
-            duplicates_dropped=dups, melt=melt, all_variable_location_id=all_variable_locations
+            duplicates_dropped=dups, wide=wide, all_variable_location_id=all_variable_locations
         )
 
-    def compare(self, other: "DatasetDiff"):
+    def compare(self, other: "DatasetDiff", max_chunk_bytes: int = DEFAULT_MAX_CHUNK_BYTES):
         self.my_ts = self.all_variable_location_id.difference(other.all_variable_location_id)
         other.my_ts = other.all_variable_location_id.difference(self.all_variable_location_id)
 
@@ -151,70 +165,227 @@ TS points only in this file: {self.my_ts_points.groupby('date').size().to_dict()
         common_variable_location_id = self.all_variable_location_id.intersection(
             other.all_variable_location_id
         )
-        self.common_location_id = self.melt.loc[
-            self.melt.reset_index(CommonFields.DATE).index.isin(common_variable_location_id)
-        ]
-        other.common_location_id = other.melt.loc[
-            other.melt.reset_index(CommonFields.DATE).index.isin(common_variable_location_id)
+        variables = common_variable_location_id.unique(PdFields.VARIABLE).sort_values()
+        location_ids = common_variable_location_id.unique(CommonFields.LOCATION_ID).sort_values()
+        dates = (
+            self.wide.index.unique(CommonFields.DATE)
+            .union(other.wide.index.unique(CommonFields.DATE))
+            .sort_values()
+        )
+        # Both datasets are aligned on the union of their dates and compared a chunk of regions at
+        # a time, as dense arrays, so that memory use doesn't grow with the number of regions.
+        bytes_per_region = max(len(variables) * len(dates), 1) * 8 * _ARRAYS_PER_CHUNK
+        chunk_size = max(max_chunk_bytes // bytes_per_region, 1)
+        left = _DenseSource.make(self.wide, location_ids, variables, dates)
+        right = _DenseSource.make(other.wide, location_ids, variables, dates)
+        results = [
+            _compare_chunk(
+                left,
+                right,
+                common_variable_location_id,
+                location_ids,
+                slice(i, min(i + chunk_size, len(location_ids))),
+                variables,
+                dates,
+            )
+            for i in range(0, len(location_ids), chunk_size)
         ]
+        self.my_ts_points = _concat_series([r[0] for r in results], "value_l")
+        other.my_ts_points = _concat_series([r[1] for r in results], "value_r")
+        self.ts_diffs = _concat_frames([r[2] for r in results], _TS_DIFFS_COLUMNS)
+        self.ts_changes = _concat_frames([r[3] for r in results], _TS_CHANGES_COLUMNS)
+
+
+_TS_DIFFS_COLUMNS = {"diff": float, "points_overlap": int, "has_overlap": bool}
+_TS_CHANGES_COLUMNS = {
+    "points_changed": int,
+    "max_relative_diff": float,
+    "start_shift_days": float,
+    "end_shift_days": float,
+}
+_TS_POINTS_INDEX = [PdFields.VARIABLE, CommonFields.LOCATION_ID, CommonFields.DATE]
+_TS_INDEX = [PdFields.VARIABLE, CommonFields.LOCATION_ID]
+
 
-        joined_ts = pd.merge(
-            self.common_location_id["value"],
-            other.common_location_id["value"],
-            how="outer",
-            left_index=True,
-            right_index=True,
-            suffixes=("_l", "_r"),
+def _concat_series(series: List[pd.Series], name: str) -> pd.Series:
+    if not series:
+        index = pd.MultiIndex.from_arrays([[], [], pd.DatetimeIndex([])], names=_TS_POINTS_INDEX)
+        return pd.Series([], index=index, name=name, dtype=float)
+    return pd.concat(series).sort_index().rename(name)
+
+
+def _concat_frames(frames: List[pd.DataFrame], columns: dict) -> pd.DataFrame:
+    if not frames:
+        index = pd.MultiIndex.from_arrays([[], []], names=_TS_INDEX)
+        return pd.DataFrame(columns=list(columns), index=index).astype(columns)
+    return pd.concat(frames).sort_index()
+
+
+@dataclasses.dataclass(frozen=True)
+class _DenseSource:
+    """The values of a wide DataFrame and the position of each row in the aligned arrays."""
+
+    # Values of the compared variables, with one row per row of the wide DataFrame.
+    values: np.ndarray
+    # Position of the location_id and date of each row, -1 if it is not compared.
+    location_positions: np.ndarray
+    date_positions: np.ndarray
+
+    @staticmethod
+    def make(
+        wide: pd.DataFrame, location_ids: pd.Index, variables: pd.Index, dates: pd.DatetimeIndex
+    ) -> "_DenseSource":
+        return _DenseSource(
+            values=wide.reindex(columns=variables).to_numpy(dtype=float),
+            location_positions=location_ids.get_indexer(
+                wide.index.get_level_values(CommonFields.LOCATION_ID)
+            ),
+            date_positions=dates.get_indexer(wide.index.get_level_values(CommonFields.DATE)),
         )
-        joined_ts_notna = joined_ts.notna()
-        # Among the common timeseries, find points that appear in exactly one dataset.
-        self.my_ts_points = joined_ts.loc[
-            joined_ts_notna["value_l"] & ~joined_ts_notna["value_r"], "value_l"
-        ]
-        other.my_ts_points = joined_ts.loc[
-            joined_ts_notna["value_r"] & ~joined_ts_notna["value_l"], "value_r"
-        ]
-        # Find some kind of measure of difference between each common timeseries.
-        self.ts_diffs = joined_ts.groupby([PdFields.VARIABLE, CommonFields.LOCATION_ID]).apply(
-            timeseries_diff
+
+    def dense(self, locations: slice, variables: int, dates: int) -> np.ndarray:
+        """Returns the values of `locations` as an array of shape (locations * variables, dates)."""
+        rows = (self.location_positions >= locations.start) & (
+            self.location_positions < locations.stop
         )
+        dense = np.full((locations.stop - locations.start, dates, variables), np.nan)
+        dense[
+            self.location_positions[rows] - locations.start, self.date_positions[rows]
+        ] = self.values[rows]
+        return dense.transpose(0, 2, 1).reshape(-1, dates)
 
 
-def timeseries_diff(group_subframe: pd.DataFrame) -> pd.Series:
-    try:
-        ts = group_subframe.droplevel([PdFields.VARIABLE, CommonFields.LOCATION_ID])
-        right = ts["value_r"]
-        left = ts["value_l"]
-        # Ignoring gaps of NaN between real values, find the longest range of dates where the right
-        # and left overlap.
-        start = max(right.first_valid_index(), left.first_valid_index())
-        end = min(right.last_valid_index(), left.last_valid_index())
-
-        if start <= end:
-            right_common_ts = right.loc[start:end].interpolate(method="time")
-            left_common_ts = left.loc[start:end].interpolate(method="time")
-            # Sum before divide suggest by formula for SMAPE at
-            # https://en.wikipedia.org/wiki/Symmetric_mean_absolute_percentage_error
-            common_sum = right_common_ts.sum() + left_common_ts.sum()
-            common_abs_diff = (right_common_ts - left_common_ts).abs().sum()
-            if abs(common_sum) > 0.0001:
-                diff = common_abs_diff / common_sum
-            else:
-                # Hack to avoid dividing by a tiny number (or 0, bomb!) when common_sum is small.
-                diff = 0.0 if abs(common_abs_diff) < 0.0001 else 1.0
-
-            # if diff > 0.04:
-            #    print(f"diff over 0.04")
-            #    print(group_subframe)
-            #    print(f"from {start} to {end}")
-            #    print(f"common sum {common_sum} and diff {common_abs_diff}")
-            rv = pd.Series(
-                [diff, len(right_common_ts), True], index=["diff", "points_overlap", "has_overlap"]
-            )
-            return rv
-        else:
-            return pd.Series([1.0, 0, False], index=["diff", "points_overlap", "has_overlap"])
-    except:
-        ts.info()
-        print(ts)
-        raise
+def _compare_chunk(
+    left_source: _DenseSource,
+    right_source: _DenseSource,
+    common_variable_location_id: pd.MultiIndex,
+    location_ids: pd.Index,
+    chunk: slice,
+    variables: pd.Index,
+    dates: pd.DatetimeIndex,
+) -> Tuple[pd.Series, pd.Series, pd.DataFrame, pd.DataFrame]:
+    """Compares the common timeseries of the `chunk` of `location_ids`.
+
+    Returns the points only in the left, the points only in the right, the diff of each common
+    timeseries (see `timeseries_diff`) and the changes of each common timeseries with columns:
+      points_changed: Number of dates with a different real value in left and right.
+      max_relative_diff: Largest abs(left - right) / max(abs(left), abs(right)) of those dates.
+      start_shift_days, end_shift_days: Days from the first and last real value in left to those
+        in right.
+    """
+    left = left_source.dense(chunk, len(variables), len(dates))
+    right = right_source.dense(chunk, len(variables), len(dates))
+    location_ids = location_ids[chunk]
+    # Rows of the arrays, in the order of the location_id, variable product.
+    row_location_ids = np.repeat(location_ids.to_numpy(), len(variables))
+    row_variables = np.tile(variables.to_numpy(), len(location_ids))
+    ts_index = pd.MultiIndex.from_arrays([row_variables, row_location_ids], names=_TS_INDEX)
+    is_common = ts_index.isin(common_variable_location_id)
+    left, right = left[is_common], right[is_common]
+    ts_index = ts_index[is_common]
+    row_location_ids, row_variables = row_location_ids[is_common], row_variables[is_common]
+    left_valid, right_valid = ~np.isnan(left), ~np.isnan(right)
+
+    def points_only_in(values, valid, other_valid) -> pd.Series:
+        rows, columns = np.nonzero(valid & ~other_valid)
+        index = pd.MultiIndex.from_arrays(
+            [row_variables[rows], row_location_ids[rows], dates[columns]], names=_TS_POINTS_INDEX
+        )
+        return pd.Series(values[rows, columns], index=index)
+
+    left_only_points = points_only_in(left, left_valid, right_valid)
+    right_only_points = points_only_in(right, right_valid, left_valid)
+
+    left_first, left_last = _first_and_last(left_valid)
+    right_first, right_last = _first_and_last(right_valid)
+    days = ((dates - dates[0]) / pd.Timedelta(days=1)).to_numpy(dtype=float)
+    ts_diffs = timeseries_diff(
+        left, right, days, np.maximum(left_first, right_first), np.minimum(left_last, right_last)
+    )
+    ts_diffs.index = ts_index
+
+    both_valid = left_valid & right_valid
+    with np.errstate(invalid="ignore"):
+        abs_diff = np.abs(left - right)
+        scale = np.maximum(np.abs(left), np.abs(right))
+        relative_diff = np.where(abs_diff == 0, 0.0, abs_diff / scale)
+    ts_changes = pd.DataFrame(
+        {
+            "points_changed": (both_valid & (abs_diff != 0)).sum(axis=1),
+            "max_relative_diff": np.max(
+                np.where(both_valid, relative_diff, -np.inf), axis=1, initial=-np.inf
+            ),
+            "start_shift_days": days[right_first] - days[left_first],
+            "end_shift_days": days[right_last] - days[left_last],
+        },
+        index=ts_index,
+    )
+    # Timeseries without a date with a real value in both have no relative diff.
+    ts_changes["max_relative_diff"] = ts_changes["max_relative_diff"].replace(-np.inf, np.nan)
+    return left_only_points, right_only_points, ts_diffs, ts_changes
+
+
+def _first_and_last(valid: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the positions of the first and last True in each row of `valid`."""
+    return valid.argmax(axis=1), valid.shape[1] - 1 - valid[:, ::-1].argmax(axis=1)
+
+
+def _interpolate(values: np.ndarray, days: np.ndarray) -> np.ndarray:
+    """Interpolates the NaNs of each row of `values` like `pd.Series.interpolate(method="time")`.
+
+    NaNs between real values are interpolated linearly in `days`, NaNs after the last real value
+    are filled with it and NaNs before the first real value are kept.
+    """
+    valid = ~np.isnan(values)
+    length = values.shape[1]
+    positions = np.arange(length)
+    previous = np.maximum.accumulate(np.where(valid, positions, -1), axis=1)
+    next_ = np.minimum.accumulate(np.where(valid, positions, length)[:, ::-1], axis=1)[:, ::-1]
+    has_next = next_ < length
+    previous, next_ = np.clip(previous, 0, None), np.clip(next_, None, length - 1)
+    rows = np.arange(values.shape[0])[:, None]
+    previous_values, next_values = values[rows, previous], values[rows, next_]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fraction = (days - days[previous]) / (days[next_] - days[previous])
+        interpolated = previous_values + (next_values - previous_values) * fraction
+    return np.where(valid, values, np.where(has_next, interpolated, previous_values))
+
+
+def timeseries_diff(
+    left: np.ndarray, right: np.ndarray, days: np.ndarray, start: np.ndarray, end: np.ndarray
+) -> pd.DataFrame:
+    """Returns a measure of the difference between each row of `left` and `right`.
+
+    `start` and `end` are the positions, in each row, of the longest range of dates where the
+    right and left overlap, ignoring gaps of NaN between real values. Returns a DataFrame with
+    one row per row of the arrays and columns `diff`, `points_overlap` and `has_overlap`.
+    """
+    positions = np.arange(left.shape[1])
+    has_overlap = start <= end
+    in_overlap = (positions >= start[:, None]) & (positions <= end[:, None])
+    # Dates with a real value in left or right, which are the dates compared.
+    compared = in_overlap & (~np.isnan(left) | ~np.isnan(right))
+    right_common_ts = _interpolate(np.where(in_overlap, right, np.nan), days)
+    left_common_ts = _interpolate(np.where(in_overlap, left, np.nan), days)
+    # Sum before divide suggest by formula for SMAPE at
+    # https://en.wikipedia.org/wiki/Symmetric_mean_absolute_percentage_error
+    common_sum = np.nansum(np.where(compared, right_common_ts, np.nan), axis=1) + np.nansum(
+        np.where(compared, left_common_ts, np.nan), axis=1
+    )
+    common_abs_diff = np.nansum(
+        np.where(compared, np.abs(right_common_ts - left_common_ts), np.nan), axis=1
+    )
+    with np.errstate(invalid="ignore", divide="ignore"):
+        diff = np.where(
+            np.abs(common_sum) > 0.0001,
+            common_abs_diff / common_sum,
+            # Hack to avoid dividing by a tiny number (or 0, bomb!) when common_sum is small.
+            np.where(np.abs(common_abs_diff) < 0.0001, 0.0, 1.0),
+        )
+    return pd.DataFrame(
+        {
+            "diff": np.where(has_overlap, diff, 1.0),
+            "points_overlap": np.where(has_overlap, compared.sum(axis=1), 0),
+            "has_overlap": has_overlap,
+        }
+    )
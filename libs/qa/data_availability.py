@@ -1,4 +1,7 @@
+import pathlib
 from typing import List, Optional
+
+import numpy as np
 import pandas as pd
 
 from covidactnow.datapublic.common_fields import CommonFields
@@ -6,12 +9,15 @@ from libs import google_sheet_helpers
 from libs.datasets.sources import fips_population
 from libs import notebook_helpers
 from libs.datasets import combined_datasets
+from libs.datasets import AggregationLevel
 import gspread
 import gspread_formatting
 
 
 LOCATION_GROUP_KEY = "location_group"
 COMBINED_DATA_KEY = "Combined Data"
+# Location group of all states.
+STATE_DATA_GROUP = "state data"
 
 
 def load_all_latest_sources():
@@ -37,43 +43,65 @@ def load_all_latest_sources():
 def build_data_availability_report(data: pd.DataFrame) -> pd.DataFrame:
     """Builds report containing counts of locations with values.
 
+    Locations are grouped by state, except that all states are in one "state data" group. The
+    counts of each group are sums of notna over the rows of the group, computed for all columns
+    at once using the integer code of the group of each row.
+
     Args:
         data: Dataset to summarize.
 
-    Returns:
+    Returns: DataFrame with one row per location group, ordered by total population, and the
+        number of locations with a value in each column.
     """
-    if "population" not in data.columns:
+    if CommonFields.POPULATION in data.columns:
+        population = data[CommonFields.POPULATION]
+    else:
         pop = fips_population.FIPSPopulation.make_dataset()
         pop_map = pop.static.set_index("fips")["population"]
-        data["population"] = data["fips"].map(pop_map)
-
-    def classify_row(row):
-
-        if row.aggregate_level == "state":
-            return "state data"
-        return row.state
-
-    def count_with_values(x):
-        return x.apply(lambda y: sum(~y.isna()))
-
-    data[LOCATION_GROUP_KEY] = data.apply(classify_row, axis=1)
+        population = data["fips"].map(pop_map)
+        data = data.assign(**{CommonFields.POPULATION: population})
 
-    counts_per_location = data.groupby(LOCATION_GROUP_KEY).apply(count_with_values)
+    is_state = (data[CommonFields.AGGREGATE_LEVEL] == AggregationLevel.STATE.value).to_numpy()
+    location_group = np.where(is_state, STATE_DATA_GROUP, data[CommonFields.STATE].to_numpy())
+    # Rows without a location group, such as counties without a state, are not counted.
+    codes, groups = pd.factorize(location_group, sort=True)
+    has_group = codes >= 0
+    codes = codes[has_group]
 
     columns_to_drop = [
         CommonFields.STATE,
         CommonFields.COUNTY,
         CommonFields.AGGREGATE_LEVEL,
     ]
-    columns_to_drop = counts_per_location.columns.intersection(columns_to_drop)
-
-    counts_per_location = counts_per_location.drop(columns_to_drop, axis="columns")
-    counts_per_location["total_population"] = data.groupby(LOCATION_GROUP_KEY).population.sum()
-    counts_per_location = counts_per_location.sort_values("total_population", ascending=False).drop(
+    counted = data.drop(columns=data.columns.intersection(columns_to_drop))
+    has_value = counted.notna().to_numpy()[has_group].astype(int)
+    counts = pd.DataFrame(has_value, columns=counted.columns).groupby(codes).sum()
+    counts["num_locations"] = np.bincount(codes, minlength=len(groups))
+    counts.index = pd.Index(groups, name=LOCATION_GROUP_KEY)
+
+    counts["total_population"] = np.bincount(
+        codes, weights=population.fillna(0).to_numpy()[has_group], minlength=len(groups)
+    )
+    return counts.sort_values("total_population", ascending=False).drop(
         ["total_population"], axis="columns"
     )
 
-    return counts_per_location.rename({LOCATION_GROUP_KEY: "num_locations"}, axis="columns")
+
+def write_data_availability_report(report: pd.DataFrame, path: pathlib.Path):
+    """Writes a report built by `build_data_availability_report` to a CSV or Parquet file.
+
+    The format is chosen by the suffix of `path`, ".csv" or ".parquet". Raises ValueError for any
+    other suffix, before anything is written.
+    """
+    if path.suffix not in (".csv", ".parquet"):
+        raise ValueError(f"Unsupported report format: {path}")
+    report = report.reset_index()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.suffix == ".parquet":
+        # gzip because the default, snappy, needs python-snappy which isn't a requirement.
+        report.to_parquet(path, index=False, compression="gzip")
+    else:
+        report.to_csv(path, index=False)
 
 
 def update_google_sheet_with_data(sheet, data: pd.DataFrame, worksheet_name):
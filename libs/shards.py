@@ -0,0 +1,95 @@
+"""
+Deterministic partitioning of regions into shards, so that `pyseir build-all --shard i/N` can run
+on N machines (or N processes on one machine) and `pyseir merge-shards` can combine their output.
+
+Regions are grouped by state so that the counties of a state, which are patched and aggregated
+together, are in the same shard. Regions without a state, such as CBSAs, are groups of one. Groups
+are assigned largest first to the shard with the fewest regions, which balances the shards on
+county count and depends only on the set of regions.
+"""
+from typing import Dict, List, Sequence
+import dataclasses
+import pathlib
+import re
+import shutil
+
+from typing_extensions import final
+
+from libs.pipeline import Region
+
+
+# Directory, in the output directory, of the output of each shard.
+SHARDS_DIRNAME = "shards"
+
+
+def _group_key(region: Region) -> str:
+    return region.state or region.location_id
+
+
+def partition(regions: Sequence[Region], count: int) -> List[List[Region]]:
+    """Returns `regions` split into `count` lists, each sorted by location_id."""
+    groups: Dict[str, List[Region]] = {}
+    for region in sorted(set(regions), key=lambda r: r.location_id):
+        groups.setdefault(_group_key(region), []).append(region)
+
+    shards: List[List[Region]] = [[] for _ in range(count)]
+    for key in sorted(groups, key=lambda k: (-len(groups[k]), k)):
+        smallest = min(range(count), key=lambda i: (len(shards[i]), i))
+        shards[smallest].extend(groups[key])
+    return [sorted(shard, key=lambda r: r.location_id) for shard in shards]
+
+
+@final
+@dataclasses.dataclass(frozen=True)
+class Shard:
+    """Shard `index` of `count`, with 0 <= index < count."""
+
+    index: int
+
+    count: int
+
+    def __post_init__(self):
+        if not 0 <= self.index < self.count:
+            raise ValueError(f"Shard index {self.index} not in 0 to {self.count - 1}")
+
+    @staticmethod
+    def parse(value: str) -> "Shard":
+        """Parses a shard in the form "i/N"."""
+        match = re.fullmatch(r"(\d+)/(\d+)", value.strip())
+        if not match:
+            raise ValueError(f"Shard {value!r} not in the form i/N")
+        return Shard(int(match.group(1)), int(match.group(2)))
+
+    @staticmethod
+    def all(count: int) -> List["Shard"]:
+        return [Shard(index, count) for index in range(count)]
+
+    def __str__(self):
+        return f"{self.index}/{self.count}"
+
+    def regions(self, regions: Sequence[Region]) -> List[Region]:
+        """Returns the regions in this shard."""
+        return partition(regions, self.count)[self.index]
+
+    def directory(self, output_dir: pathlib.Path) -> pathlib.Path:
+        """Returns the directory in `output_dir` that the output of this shard is written to."""
+        return pathlib.Path(output_dir) / SHARDS_DIRNAME / f"{self.index}-of-{self.count}"
+
+
+def merge_files(sources: Sequence[pathlib.Path], destination: pathlib.Path) -> int:
+    """Copies the files in each of `sources`, such as the per region stores of each shard, to the
+    same relative path in `destination`. Missing sources are skipped. Returns the number of files
+    copied."""
+    copied = 0
+    for source in sources:
+        if not source.exists():
+            continue
+        for path in sorted(source.rglob("*")):
+            # Skip files left by a shard interrupted while writing them.
+            if not path.is_file() or path.name.endswith(".tmp"):
+                continue
+            target = destination / path.relative_to(source)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(path, target)
+            copied += 1
+    return copied
@@ -0,0 +1,370 @@
+"""
+Runs the stages of the pipeline as a DAG, skipping stages whose inputs and code are unchanged.
+
+Each `Stage` declares the files and directories it reads and writes. A stage that reads an output
+of another stage runs after it; stages that don't depend on each other run concurrently. A stage
+is skipped when the digest of its command, inputs and code matches the digest of its last
+successful run and its outputs exist, so changing the API code reruns only the API stages.
+Digests of files are cached by size and modification time in the state file, so unchanged files
+are not read again.
+"""
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+import concurrent.futures
+import dataclasses
+import enum
+import hashlib
+import json
+import os
+import pathlib
+import subprocess
+import time
+
+import structlog
+from typing_extensions import final
+
+from libs.datasets import dataset_utils
+
+_logger = structlog.getLogger(__name__)
+
+DEFAULT_STATE_DIR = pathlib.Path(
+    os.getenv("STAGE_RUNNER_STATE_DIR", dataset_utils.REPO_ROOT / ".cache" / "stages")
+)
+
+# Directories of code read by the Python stages of run.sh.
+PYTHON_CODE = ("run.py", "run.sh", "api", "cli", "libs", "pyseir", "requirements.txt")
+
+# Code imported by `pyseir build-all`, a subset of PYTHON_CODE without the API code so that changing
+# the API doesn't rerun the model. tests/libs/stage_runner_test.py checks that it contains every
+# module imported by pyseir.cli.
+MODEL_CODE = (
+    "run.sh",
+    "requirements.txt",
+    "pyseir",
+    "libs/__init__.py",
+    "libs/datasets",
+    "libs/github_utils.py",
+    "libs/parallel_utils.py",
+    "libs/pipeline.py",
+    "libs/precision.py",
+    "libs/shards.py",
+    "libs/timing_utils.py",
+    "libs/us_state_abbrev.py",
+)
+
+# Files of the combined dataset read by the model and API.
+COMBINED_DATASET = tuple(
+    pathlib.Path("data") / name
+    for name in [
+        "multiregion.json",
+        "multiregion-wide-dates.csv",
+        "multiregion-static.csv",
+        "multiregion-annotations.csv",
+    ]
+)
+
+
+class StageStatus(enum.Enum):
+    RAN = "ran"
+    CACHED = "cached"
+    FAILED = "failed"
+    # Not run because a stage it depends on failed.
+    SKIPPED = "skipped"
+
+
+_NOT_COMPLETED = (StageStatus.FAILED, StageStatus.SKIPPED)
+
+
+@final
+@dataclasses.dataclass(frozen=True)
+class Stage:
+    name: str
+
+    # Command run in the repo root.
+    command: Tuple[str, ...]
+
+    # Files and directories read by the stage. The stage depends on the stages that write them.
+    inputs: Tuple[pathlib.Path, ...] = ()
+
+    # Files and directories written by the stage.
+    outputs: Tuple[pathlib.Path, ...] = ()
+
+    # Files and directories of the code run by the stage.
+    code: Tuple[pathlib.Path, ...] = ()
+
+
+@final
+@dataclasses.dataclass(frozen=True)
+class StageResult:
+    name: str
+
+    status: StageStatus
+
+    wall_seconds: float = 0.0
+
+    # Digest of the command, inputs and code the stage ran with.
+    digest: Optional[str] = None
+
+
+def _overlaps(path: pathlib.Path, other: pathlib.Path) -> bool:
+    """Returns True if `path` and `other` are the same or one is in the other."""
+    return path == other or path in other.parents or other in path.parents
+
+
+def _iter_files(path: pathlib.Path) -> Iterable[pathlib.Path]:
+    if path.is_dir():
+        for root, dirs, files in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if d != "__pycache__")
+            for name in sorted(files):
+                if not name.endswith(".pyc"):
+                    yield pathlib.Path(root) / name
+    elif path.exists():
+        yield path
+
+
+class FileDigests:
+    """Digests of file contents, cached by path, size and modification time."""
+
+    def __init__(self, cache: Optional[Dict[str, list]] = None):
+        self.cache: Dict[str, list] = cache if cache is not None else {}
+        self.files_read = 0
+
+    def file_digest(self, path: pathlib.Path) -> str:
+        stat = path.stat()
+        cached = self.cache.get(str(path))
+        if cached and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return cached[2]
+        sha = hashlib.sha256()
+        with path.open("rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha.update(block)
+        self.files_read += 1
+        self.cache[str(path)] = [stat.st_size, stat.st_mtime_ns, sha.hexdigest()]
+        return sha.hexdigest()
+
+    def digest(self, path: pathlib.Path) -> str:
+        """Returns a digest of the names and contents of the files at `path`."""
+        sha = hashlib.sha256()
+        for file_path in _iter_files(path):
+            sha.update(f"{file_path.relative_to(path)}\0{self.file_digest(file_path)}\n".encode())
+        return sha.hexdigest() if path.exists() else "missing"
+
+
+def _run_command(stage: Stage, cwd: pathlib.Path) -> bool:
+    return subprocess.run(list(stage.command), cwd=cwd).returncode == 0
+
+
+class StageRunner:
+    """Runs `stages` in dependency order, up to `max_workers` at a time.
+
+    The digest of each stage's last successful run is kept in the JSON file at `state_path`.
+    """
+
+    def __init__(
+        self,
+        stages: Sequence[Stage],
+        state_path: pathlib.Path,
+        cwd: pathlib.Path = dataset_utils.REPO_ROOT,
+        max_workers: int = 4,
+        run_command: Callable[[Stage, pathlib.Path], bool] = _run_command,
+    ):
+        self.stages = {stage.name: stage for stage in stages}
+        if len(self.stages) != len(stages):
+            raise ValueError("Stage names must be unique")
+        self.state_path = state_path
+        self.cwd = cwd
+        self.max_workers = max_workers
+        self._run_command = run_command
+        self.dependencies: Dict[str, Set[str]] = {
+            stage.name: {
+                other.name
+                for other in stages
+                if other is not stage
+                and any(
+                    _overlaps(self._path(i), self._path(o))
+                    for i in stage.inputs
+                    for o in other.outputs
+                )
+            }
+            for stage in stages
+        }
+        self._check_acyclic()
+
+    def _path(self, path: pathlib.Path) -> pathlib.Path:
+        return self.cwd / path
+
+    def _check_acyclic(self):
+        ordered: Set[str] = set()
+        remaining = set(self.stages)
+        while remaining:
+            ready = {name for name in remaining if self.dependencies[name] <= ordered}
+            if not ready:
+                raise ValueError(f"Stages have a dependency cycle: {sorted(remaining)}")
+            ordered |= ready
+            remaining -= ready
+
+    def upstream(self, names: Iterable[str]) -> Set[str]:
+        """Returns `names` and the stages they depend on, directly or indirectly."""
+        selected: Set[str] = set()
+        pending = list(names)
+        while pending:
+            name = pending.pop()
+            if name not in self.stages:
+                raise ValueError(f"Unknown stage {name}")
+            if name not in selected:
+                selected.add(name)
+                pending.extend(self.dependencies[name])
+        return selected
+
+    def stage_digest(self, stage: Stage, digests: FileDigests) -> str:
+        sha = hashlib.sha256(json.dumps([stage.name, list(stage.command)]).encode())
+        for kind, paths in [("input", stage.inputs), ("code", stage.code)]:
+            for path in sorted(paths):
+                sha.update(f"{kind}\0{path}\0{digests.digest(self._path(path))}\n".encode())
+        return sha.hexdigest()
+
+    def _load_state(self) -> dict:
+        if self.state_path.exists():
+            return json.loads(self.state_path.read_text())
+        return {"stages": {}, "files": {}}
+
+    def _save_state(self, state: dict):
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.state_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(state))
+        tmp_path.replace(self.state_path)
+
+    def run(self, names: Optional[Iterable[str]] = None, force: bool = False) -> List[StageResult]:
+        """Runs the stages in `names` and the stages they depend on, by default all stages.
+
+        Stages are rerun even if they are unchanged when `force` is set.
+        """
+        selected = self.upstream(names) if names is not None else set(self.stages)
+        state = self._load_state()
+        digests = FileDigests(state["files"])
+        results: Dict[str, StageResult] = {}
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            running: Dict[concurrent.futures.Future, Tuple[str, str, float]] = {}
+            while len(results) < len(selected):
+                for name in sorted(selected - set(results) - {n for n, _, _ in running.values()}):
+                    dependencies = [results.get(dep) for dep in self.dependencies[name] & selected]
+                    if any(dep is None for dep in dependencies):
+                        continue
+                    if any(dep.status in _NOT_COMPLETED for dep in dependencies):
+                        results[name] = StageResult(name, StageStatus.SKIPPED)
+                        continue
+                    stage = self.stages[name]
+                    # Digests of the inputs are taken once the stages writing them have finished.
+                    digest = self.stage_digest(stage, digests)
+                    outputs_exist = all(self._path(path).exists() for path in stage.outputs)
+                    if not force and outputs_exist and state["stages"].get(name) == digest:
+                        _logger.info("Stage unchanged", stage=name)
+                        results[name] = StageResult(name, StageStatus.CACHED, digest=digest)
+                        continue
+                    # Forget the last run so that a stage interrupted part way isn't cached.
+                    state["stages"].pop(name, None)
+                    self._save_state(state)
+                    _logger.info("Running stage", stage=name, command=" ".join(stage.command))
+                    future = executor.submit(self._run_command, stage, self.cwd)
+                    running[future] = (name, digest, time.perf_counter())
+
+                if not running:
+                    continue
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    name, digest, started = running.pop(future)
+                    try:
+                        succeeded = future.result()
+                    except Exception:
+                        _logger.exception("Stage raised an exception", stage=name)
+                        succeeded = False
+                    wall_seconds = time.perf_counter() - started
+                    if succeeded:
+                        status = StageStatus.RAN
+                        state["stages"][name] = digest
+                        self._save_state(state)
+                    else:
+                        status = StageStatus.FAILED
+                    _logger.info("Stage finished", stage=name, status=status.value)
+                    results[name] = StageResult(name, status, wall_seconds, digest)
+
+        self._save_state(state)
+        _logger.info("Read files for stage digests", files=digests.files_read)
+        return [results[name] for name in self.stages if name in results]
+
+
+def format_summary(results: Sequence[StageResult], wall_seconds: float) -> str:
+    """Returns a table of the status and time of each stage."""
+    width = max([len("stage")] + [len(result.name) for result in results])
+    lines = [f"{'stage':<{width}}  {'status':<7}  seconds"]
+    for result in results:
+        lines.append(
+            f"{result.name:<{width}}  {result.status.value:<7}  {result.wall_seconds:7.1f}"
+        )
+    stage_seconds = sum(result.wall_seconds for result in results)
+    lines.append(f"{'total':<{width}}  {'':<7}  {wall_seconds:7.1f}")
+    lines.append(f"Sum of stage times: {stage_seconds:.1f}s")
+    return "\n".join(lines)
+
+
+def run_sh_stages(data_dir: pathlib.Path, output_dir: pathlib.Path) -> List[Stage]:
+    """Returns the stages of `run.sh DATA_DIR OUTPUT_DIR execute`, writing to `output_dir`.
+
+    The stages run the functions of run.sh so that the shell steps, such as zipping, are kept in
+    one place.
+    """
+
+    def run_sh(function: str) -> Tuple[str, ...]:
+        return ("./run.sh", str(data_dir), str(output_dir), function)
+
+    pyseir_output = (
+        output_dir / "rt_combined_metric.csv",
+        output_dir / "icu_combined_metric.csv",
+        output_dir / "pyseir.zip",
+    )
+    test_positivity_output = (
+        output_dir / "test-positivity-all.csv",
+        output_dir / "test-positivity-output.csv",
+        output_dir / "test-positivity-output-annotations.csv",
+    )
+    api_v2_output = (output_dir / "v2",)
+    code = tuple(pathlib.Path(path) for path in PYTHON_CODE)
+    model_code = tuple(pathlib.Path(path) for path in MODEL_CODE)
+    return [
+        Stage(
+            "model",
+            command=run_sh("execute_model"),
+            inputs=COMBINED_DATASET + (pathlib.Path("pyseir_data"),),
+            outputs=pyseir_output,
+            code=model_code,
+        ),
+        Stage(
+            "test_positivity",
+            command=(
+                "./run.py",
+                "api",
+                "generate-test-positivity",
+                "--output-dir",
+                str(output_dir),
+            ),
+            inputs=COMBINED_DATASET,
+            outputs=test_positivity_output,
+            code=code,
+        ),
+        Stage(
+            "api_v2",
+            command=run_sh("execute_api_v2"),
+            inputs=COMBINED_DATASET + pyseir_output[:2],
+            outputs=api_v2_output,
+            code=code,
+        ),
+        Stage(
+            "zip",
+            command=run_sh("execute_zip_folder"),
+            inputs=pyseir_output + test_positivity_output + api_v2_output,
+            outputs=(output_dir / "api-results.zip",),
+            code=(pathlib.Path("run.sh"),),
+        ),
+    ]
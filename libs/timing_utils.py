@@ -1,15 +1,228 @@
+"""Timing and resource instrumentation of pipeline stages.
+
+Inside a `run_report` block every `span` records its wall time, CPU time, peak RSS increase and
+counts of the items it processed, nested under the enclosing span. Calls of the same span under
+the same parent are aggregated, including calls made in `parallel_utils.parallel_map` worker
+processes. When the block exits the spans are written to a JSON report so that the resources
+used by production runs can be compared across days. Outside a `run_report` spans record nothing.
+"""
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import List
 from typing import Optional
+import dataclasses
+import datetime
+import json
+import os
+import pathlib
+import platform
+import re
+import resource
+import sys
 import time as time_stdlib
 import structlog
 import contextlib
 
 _logger = structlog.get_logger()
 
+# Directory that run reports are written to. No reports are written if not set.
+RUN_REPORT_DIR = os.environ.get("RUN_REPORT_DIR")
+
+# ru_maxrss is in bytes on macOS and kilobytes on Linux.
+_MAXRSS_UNIT_BYTES = 1 if platform.system() == "Darwin" else 1024
+
+
+def _peak_rss_bytes() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _MAXRSS_UNIT_BYTES
+
+
+@dataclasses.dataclass
+class Span:
+    """Resources used by all calls of a named stage with the same parent stage."""
+
+    name: str
+    calls: int = 0
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    # Largest increase of the peak resident set size of the process during one call.
+    peak_rss_delta_bytes: int = 0
+    counts: Dict[str, int] = dataclasses.field(default_factory=dict)
+    children: Dict[str, "Span"] = dataclasses.field(default_factory=dict)
+
+    def child(self, name: str) -> "Span":
+        if name not in self.children:
+            self.children[name] = Span(name)
+        return self.children[name]
+
+    def add_count(self, key: str, value: int = 1) -> None:
+        self.counts[key] = self.counts.get(key, 0) + value
+
+    def merge(self, other: "Span") -> None:
+        """Adds the calls recorded in `other`, which has the same name as this span."""
+        self.calls += other.calls
+        self.wall_seconds += other.wall_seconds
+        self.cpu_seconds += other.cpu_seconds
+        self.peak_rss_delta_bytes = max(self.peak_rss_delta_bytes, other.peak_rss_delta_bytes)
+        for key, value in other.counts.items():
+            self.add_count(key, value)
+        for child in other.children.values():
+            self.child(child.name).merge(child)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "calls": self.calls,
+            "wall_seconds": self.wall_seconds,
+            "cpu_seconds": self.cpu_seconds,
+            "peak_rss_delta_bytes": self.peak_rss_delta_bytes,
+            "counts": dict(self.counts),
+            "children": [child.to_dict() for child in self.children.values()],
+        }
+
+    @staticmethod
+    def from_dict(data: dict) -> "Span":
+        span = Span(
+            name=data["name"],
+            calls=data["calls"],
+            wall_seconds=data["wall_seconds"],
+            cpu_seconds=data["cpu_seconds"],
+            peak_rss_delta_bytes=data["peak_rss_delta_bytes"],
+            counts=dict(data["counts"]),
+        )
+        for child in data["children"]:
+            span.children[child["name"]] = Span.from_dict(child)
+        return span
+
+    def flatten(self, prefix: str = "") -> Iterator["Span"]:
+        """Yields this span and all descendants, each renamed to its '/' separated path."""
+        path = prefix + self.name
+        yield dataclasses.replace(self, name=path, children={})
+        for child in self.children.values():
+            yield from child.flatten(path + "/")
+
+
+# Stack of open spans of this process. Empty when not inside a `run_report`.
+_stack: List[Span] = []
+
+
+def recording() -> bool:
+    """Returns True if spans are being recorded."""
+    return bool(_stack)
+
+
+@contextlib.contextmanager
+def span(name: str, **counts: int) -> Iterator[Span]:
+    """Records the resources used by the block in a child of the current span.
+
+    Args:
+        name: Name of the stage.
+        counts: Counts of items, such as rows or regions, added to the span. More can be added
+            with `count` or `add_count` of the yielded Span.
+    """
+    if not _stack:
+        yield Span(name)
+        return
+
+    current = _stack[-1].child(name)
+    for key, value in counts.items():
+        current.add_count(key, value)
+    _stack.append(current)
+    start_wall = time_stdlib.perf_counter()
+    start_cpu = time_stdlib.process_time()
+    start_rss = _peak_rss_bytes()
+    try:
+        yield current
+    finally:
+        current.calls += 1
+        current.wall_seconds += time_stdlib.perf_counter() - start_wall
+        current.cpu_seconds += time_stdlib.process_time() - start_cpu
+        current.peak_rss_delta_bytes = max(
+            current.peak_rss_delta_bytes, _peak_rss_bytes() - start_rss
+        )
+        _stack.pop()
+
+
+def count(key: str, value: int = 1) -> None:
+    """Adds `value` to count `key` of the current span."""
+    if _stack:
+        _stack[-1].add_count(key, value)
+
 
 @contextlib.contextmanager
 def time(description: Optional[str] = None, **logging_args):
 
     start = time_stdlib.time()
-    yield
+    with span(description or "time"):
+        yield
     elapsed = time_stdlib.time() - start
     _logger.info(f"Elapsed: {elapsed:.1f}s", description=description, **logging_args)
+
+
+@dataclasses.dataclass(frozen=True)
+class RecordedCall:
+    """Wraps a function called by `parallel_map` so that the spans recorded while calling it,
+    possibly in a worker process, are returned with its result."""
+
+    func: Callable
+
+    # Name of the span recording each call.
+    TASK_SPAN_NAME = "task"
+
+    def __call__(self, item):
+        # Worker processes are forked with a copy of the parent's stack. Record the call in a
+        # stack of its own and restore the original afterwards.
+        saved_stack = list(_stack)
+        _stack[:] = [Span("")]
+        try:
+            with span(self.TASK_SPAN_NAME) as task_span:
+                result = self.func(item)
+        finally:
+            _stack[:] = saved_stack
+        return result, task_span
+
+
+@contextlib.contextmanager
+def run_report(name: str, output_dir: Optional[pathlib.Path] = None) -> Iterator[Span]:
+    """Records spans in the block and writes them as a JSON run report.
+
+    Args:
+        name: Name of the run, used as the name of the root span and in the report file name.
+        output_dir: Directory to write the report in, by default `RUN_REPORT_DIR`. The report is
+            not written if neither is set.
+
+    A `run_report` inside another is recorded as a span of the outer report.
+    """
+    if _stack:
+        with span(name) as nested:
+            yield nested
+        return
+
+    output_dir = output_dir or RUN_REPORT_DIR
+    started_at = datetime.datetime.utcnow()
+    # The root span is held by a container span so that it is timed like any other span.
+    _stack.append(Span(""))
+    try:
+        with span(name) as root:
+            yield root
+    finally:
+        _stack.clear()
+
+    if output_dir:
+        report = {
+            "name": name,
+            "started_at": started_at.isoformat(),
+            "hostname": platform.node(),
+            "argv": sys.argv,
+            "root": root.to_dict(),
+        }
+        slug = re.sub(r"[^\w-]", "_", name)
+        path = pathlib.Path(output_dir) / f"{slug}-{started_at.strftime('%Y%m%dT%H%M%S')}.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(report, indent=2))
+        _logger.info("Wrote run report", path=str(path))
+
+
+def read_run_report(path: pathlib.Path) -> Span:
+    """Returns the root span of the run report at `path`."""
+    return Span.from_dict(json.loads(pathlib.Path(path).read_text())["root"])
@@ -1,5 +1,12 @@
 from typing import Optional, List, Callable, Dict, Any
+import collections
+import concurrent.futures
+import dataclasses
+import hashlib
+import json
 import os
+import pathlib
+import threading
 import time
 import datetime
 from datetime import timedelta
@@ -26,50 +33,49 @@ GROUP BY email
 
 ATHENA_BUCKET = "s3://covidactnow-athena-results"
 HUBSPOT_API_KEY = os.getenv("HUBSPOT_API_KEY")
+HUBSPOT_API_URL = "https://api.hubapi.com"
+
+# Maximum number of contacts updated by one request to the HubSpot batch endpoint.
+HUBSPOT_BATCH_SIZE = 100
+# HubSpot allows 100 requests per 10 seconds for each API key. Stay a bit under the limit.
+HUBSPOT_RATE_LIMIT_REQUESTS = 90
+HUBSPOT_RATE_LIMIT_SECONDS = 10.0
 
 
 class CloudWatchQueryError(Exception):
     """Raised on a failed query to CloudWatch"""
 
 
-def update_hubspot_activity(email, latest_active_at, days_active):
-    """Updates Hubspot contact with latest activity dates."""
-    contacts_url = "https://api.hubapi.com/crm/v3/objects/contacts"
-
-    query_string = {"hapikey": HUBSPOT_API_KEY}
+def _query_cache_path(cache_dir: pathlib.Path, database: str, query: str) -> pathlib.Path:
+    """Returns the path caching the results of `query` run today."""
+    today = datetime.datetime.utcnow().date().isoformat()
+    key = hashlib.sha256(f"{database}\n{query}\n{today}".encode()).hexdigest()
+    return cache_dir / f"{key}.json"
 
-    # Hubspot date field should be at UTC midnight. When the %z directive is provided to the
-    # strptime() method, a TZ aware datetime object will be produced.
-    date = datetime.datetime.strptime(latest_active_at + " +0000", "%Y-%m-%d %z")
-    url = f"https://api.hubapi.com/contacts/v1/contact/createOrUpdate/email/{email}"
 
-    response = requests.post(
-        url,
-        params=query_string,
-        json={
-            "email": email,
-            "properties": [
-                {"property": "last_api_request_at", "value": int(date.timestamp()) * 1000},
-                {"property": "api_days_active", "value": days_active},
-            ],
-        },
-    )
-    if not response.ok:
-        _logger.warning(f"Failed to update hubspot activity for {email}")
-        return
-
-    _logger.info(f"Successfully updated {email}")
-
-
-def _run_query(database: str, query: str,) -> List[dict]:
+def _run_query(database: str, query: str, cache_dir: Optional[pathlib.Path] = None) -> List[dict]:
     """Runs athena query.
 
     Args:
         database: Name of Athena database.
         query: Query to run.
+        cache_dir: If set, results are cached in this directory, keyed by the database, query text
+            and date, and a query that already ran today isn't run again.
 
     Returns: List of {<field_name>: <value>, ...} records.
     """
+    if cache_dir:
+        cache_path = _query_cache_path(cache_dir, database, query)
+        if cache_path.exists():
+            _logger.info(f"Using cached query results {cache_path}")
+            return json.loads(cache_path.read_text())
+        results = _run_query(database, query)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(results))
+        tmp_path.replace(cache_path)
+        return results
+
     client = boto3.client("athena")
     start_query_response = client.start_query_execution(
         QueryExecutionContext={"Database": database},
@@ -129,7 +135,9 @@ def _prepare_results(
     return rows
 
 
-def run_user_activity_summary_query(table_name: str, database) -> List[Dict[str, Any]]:
+def run_user_activity_summary_query(
+    table_name: str, database, cache_dir: Optional[pathlib.Path] = None
+) -> List[Dict[str, Any]]:
     query = TOTAL_USERS_QUERY.format(table=table_name)
 
     # Transforms datestring to YYY-MM-DD format
@@ -143,7 +151,7 @@ def run_user_activity_summary_query(table_name: str, database) -> List[Dict[str,
         "latestDate": to_date_string,
     }
 
-    results = _run_query(database, query)
+    results = _run_query(database, query, cache_dir=cache_dir)
     return _prepare_results(results, field_transformations=field_transformations)
 
 
@@ -167,22 +175,202 @@ def update_google_sheet(
     worksheet.update(rows, raw=False)
 
 
-def update_hubspot_users(data: List[Dict[str, Any]], only_update_recent: bool = True):
+class RateLimiter:
+    """Blocks callers so that at most `max_requests` are made in any `period_seconds`."""
+
+    def __init__(
+        self,
+        max_requests: int,
+        period_seconds: float,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self._max_requests = max_requests
+        self._period_seconds = period_seconds
+        self._clock = clock
+        self._sleep = sleep
+        self._request_times: "collections.deque[float]" = collections.deque()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = self._clock()
+                while self._request_times and now - self._request_times[0] >= self._period_seconds:
+                    self._request_times.popleft()
+                if len(self._request_times) < self._max_requests:
+                    self._request_times.append(now)
+                    return
+                wait = self._period_seconds - (now - self._request_times[0])
+            self._sleep(wait)
+
+
+@dataclasses.dataclass
+class HubSpotSyncStats:
+    updated: int = 0
+    # Contacts whose properties are the same as those last pushed.
+    unchanged: int = 0
+    failed: int = 0
+    requests: int = 0
+
+
+class HubSpotSync:
+    """Pushes contact properties to HubSpot.
+
+    Contacts are updated with the batch endpoint, up to `batch_size` per request, from
+    `max_workers` threads. HubSpot rejects a whole batch if one contact is invalid, so the contacts
+    of a rejected batch are updated one at a time. Requests are throttled to HubSpot's rate limit
+    and retried after a 429 or 5xx response.
+
+    If `state_path` is set, the properties pushed for each contact are saved there and contacts
+    whose properties haven't changed since are skipped by later syncs.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = HUBSPOT_API_URL,
+        state_path: Optional[pathlib.Path] = None,
+        batch_size: int = HUBSPOT_BATCH_SIZE,
+        max_workers: int = 4,
+        rate_limiter: Optional[RateLimiter] = None,
+        max_attempts: int = 5,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self._api_key = api_key
+        self._base_url = base_url
+        self._state_path = state_path
+        self._batch_size = batch_size
+        self._max_workers = max_workers
+        self._rate_limiter = rate_limiter or RateLimiter(
+            HUBSPOT_RATE_LIMIT_REQUESTS, HUBSPOT_RATE_LIMIT_SECONDS
+        )
+        self._max_attempts = max_attempts
+        self._sleep = sleep
+        self._sessions = threading.local()
+        self._stats_lock = threading.Lock()
+        self.stats = HubSpotSyncStats()
+
+    def sync(self, contacts: Dict[str, Dict[str, Any]]) -> HubSpotSyncStats:
+        """Updates contacts.
+
+        Args:
+            contacts: Properties to set, by contact email.
+        """
+        pushed = self._load_state()
+        changed = {email: props for email, props in contacts.items() if pushed.get(email) != props}
+        self.stats.unchanged += len(contacts) - len(changed)
+
+        emails = list(changed)
+        batches = [
+            emails[i : i + self._batch_size] for i in range(0, len(emails), self._batch_size)
+        ]
+        with concurrent.futures.ThreadPoolExecutor(self._max_workers) as executor:
+            results = executor.map(lambda batch: self._update_batch(batch, changed), batches)
+            rejected = [email for batch, ok in zip(batches, results) if not ok for email in batch]
+            if rejected:
+                _logger.info(f"Updating {len(rejected)} contacts of rejected batches one at a time")
+            results = executor.map(lambda email: self._update_contact(email, changed), rejected)
+            failed = {email for email, ok in zip(rejected, results) if not ok}
+
+        self.stats.failed += len(failed)
+        self.stats.updated += len(changed) - len(failed)
+        pushed.update({email: props for email, props in changed.items() if email not in failed})
+        self._save_state(pushed)
+        return self.stats
+
+    def _load_state(self) -> Dict[str, Dict[str, Any]]:
+        if not self._state_path or not self._state_path.exists():
+            return {}
+        return json.loads(self._state_path.read_text())
+
+    def _save_state(self, pushed: Dict[str, Dict[str, Any]]):
+        if not self._state_path:
+            return
+        self._state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self._state_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(pushed, sort_keys=True))
+        tmp_path.replace(self._state_path)
+
+    @staticmethod
+    def _contact(email: str, properties: Dict[str, Any]) -> dict:
+        return {
+            "email": email,
+            "properties": [{"property": key, "value": value} for key, value in properties.items()],
+        }
+
+    def _update_batch(self, emails: List[str], contacts: Dict[str, Dict[str, Any]]) -> bool:
+        body = [self._contact(email, contacts[email]) for email in emails]
+        return self._post("/contacts/v1/contact/batch/", body)
+
+    def _update_contact(self, email: str, contacts: Dict[str, Dict[str, Any]]) -> bool:
+        url = f"/contacts/v1/contact/createOrUpdate/email/{email}"
+        if not self._post(url, self._contact(email, contacts[email])):
+            _logger.warning(f"Failed to update hubspot activity for {email}")
+            return False
+        return True
+
+    def _post(self, path: str, body: Any) -> bool:
+        session = getattr(self._sessions, "session", None)
+        if not session:
+            session = self._sessions.session = requests.Session()
+        for attempt in range(self._max_attempts):
+            self._rate_limiter.acquire()
+            with self._stats_lock:
+                self.stats.requests += 1
+            response = session.post(
+                self._base_url + path, params={"hapikey": self._api_key}, json=body
+            )
+            if response.ok:
+                return True
+            if response.status_code != 429 and response.status_code < 500:
+                return False
+            retry_after = response.headers.get("Retry-After")
+            self._sleep(float(retry_after) if retry_after else 2 ** attempt)
+        return False
+
+
+def hubspot_activity_properties(latest_active_at: str, days_active: int) -> Dict[str, Any]:
+    """Returns the HubSpot contact properties recording API activity."""
+    # Hubspot date field should be at UTC midnight. When the %z directive is provided to the
+    # strptime() method, a TZ aware datetime object will be produced.
+    date = datetime.datetime.strptime(latest_active_at + " +0000", "%Y-%m-%d %z")
+    return {
+        "last_api_request_at": int(date.timestamp()) * 1000,
+        "api_days_active": days_active,
+    }
+
+
+def update_hubspot_users(
+    data: List[Dict[str, Any]],
+    only_update_recent: bool = True,
+    state_path: Optional[pathlib.Path] = None,
+    base_url: str = HUBSPOT_API_URL,
+) -> Optional[HubSpotSyncStats]:
     """Updates hubspot users with usage activity.
 
     Args:
         data: List of query results.
         only_update_recent: If True only updates users with usage in the past 2 days.
+        state_path: File recording the properties pushed to HubSpot. Users whose properties
+            haven't changed since they were last pushed are skipped.
+        base_url: URL of the HubSpot API.
     """
     if not HUBSPOT_API_KEY:
         _logger.warning("Hubspot API key not provided, skipping hubspot update")
-        return
+        return None
 
     recent_activity_date = datetime.datetime.now() - timedelta(days=2)
+    contacts = {}
     for row in data:
         last_activity_date = datetime.datetime.strptime(row["latestDate"], "%Y-%m-%d")
         if only_update_recent and last_activity_date < recent_activity_date:
-            _logger.info(f"{row['email']} has no recent usage, skipping")
             continue
+        contacts[row["email"]] = hubspot_activity_properties(row["latestDate"], row["daysActive"])
 
-        update_hubspot_activity(row["email"], row["latestDate"], row["daysActive"])
+    stats = HubSpotSync(HUBSPOT_API_KEY, base_url=base_url, state_path=state_path).sync(contacts)
+    _logger.info(
+        f"Updated {stats.updated} hubspot users, {stats.unchanged} unchanged, "
+        f"{stats.failed} failed, {len(data) - len(contacts)} without recent usage"
+    )
+    return stats
@@ -1,4 +1,6 @@
+import functools
 import pathlib
+import re
 from typing import Optional, List
 import dataclasses
 import sys
@@ -11,18 +13,19 @@ import click
 from covidactnow.datapublic import common_init
 from covidactnow.datapublic.common_fields import CommonFields
 
-from libs.pipelines import api_v2_pipeline
 from libs import parallel_utils
 from libs import pipeline
+from libs import shards
+from libs import timing_utils
 from libs.datasets import AggregationLevel
 from libs.datasets import combined_datasets
-from pyseir.icu import infer_icu
 import pyseir.rt.patches
 
 import pyseir.utils
-from pyseir.rt import infer_rt
-from pyseir.rt.utils import NEW_ORLEANS_FIPS
-from pyseir.run import OneRegionPipeline
+from pyseir.rt import diagnostics
+
+# The Rt and ICU models and pyseir.run are imported by the commands that use them because they
+# import numba and scipy, which are slow to import and not needed by `--help` or other commands.
 
 sys.path.insert(0, os.path.join(os.path.abspath(os.path.dirname(__file__)), ".."))
 
@@ -36,6 +39,8 @@ def _cache_global_datasets():
     # will make sure cache is populated for subprocesses.  Return value
     # is not needed as the only goal is to populate the cache.
     # Access data here to populate the property cache.
+    from pyseir.icu import infer_icu
+
     combined_datasets.load_us_timeseries_dataset()
     infer_icu.get_region_weight_map()
 
@@ -44,6 +49,8 @@ def _cache_global_datasets():
 def entry_point():
     """Basic entrypoint for cortex subcommands"""
     common_init.configure_logging()
+    # matplotlib is only imported when plotting; never use an interactive backend.
+    os.environ.setdefault("MPLBACKEND", "Agg")
 
 
 def _states_region_list(state: Optional[str], default: List[str]) -> List[pipeline.Region]:
@@ -55,9 +62,11 @@ def _states_region_list(state: Optional[str], default: List[str]) -> List[pipeli
 
 
 def _patch_nola_infection_rate_in_pipelines(
-    pipelines: List[OneRegionPipeline],
-) -> List[OneRegionPipeline]:
+    pipelines: List["pyseir.run.OneRegionPipeline"],
+) -> List["pyseir.run.OneRegionPipeline"]:
     """Returns a new list of pipeline objects with New Orleans infection rate patched."""
+    from pyseir.rt.utils import NEW_ORLEANS_FIPS
+
     pipeline_map = {p.region: p for p in pipelines}
 
     input_regions = set(pipeline_map.keys())
@@ -90,6 +99,15 @@ def _patch_nola_infection_rate_in_pipelines(
     return list(pipeline_map.values())
 
 
+def _parse_shard(ctx, param, value: Optional[str]) -> Optional[shards.Shard]:
+    if value is None:
+        return None
+    try:
+        return shards.Shard.parse(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
 @entry_point.command()
 @click.option(
     "--state", help="State to generate files for. If no state is given, all states are computed."
@@ -103,6 +121,8 @@ def _patch_nola_infection_rate_in_pipelines(
     "level regions",
 )
 def run_infer_rt(state, states_only):
+    from pyseir.rt import infer_rt
+
     for state in _states_region_list(state=state, default=ALL_STATES):
         infer_rt.run_rt(infer_rt.RegionalInput.from_region(state))
 
@@ -140,36 +160,365 @@ def run_infer_rt(state, states_only):
     type=bool,
     help="Generate API v2 output after PySEIR finishes",
 )
-def build_all(states, output_dir, level, fips, location_id_matches: str, generate_api_v2: bool):
+@click.option(
+    "--rt-plots",
+    default=False,
+    is_flag=True,
+    type=bool,
+    help="Render Rt PDFs for every region while building. By default Rt diagnostics are recorded "
+    "instead and PDFs are made on demand with `render-rt-plots`.",
+)
+@click.option(
+    "--checkpoint-dir",
+    type=pathlib.Path,
+    help="Directory of per region results. Regions whose inputs are unchanged since they were "
+    "checkpointed are not run again and Rt inference of other regions resumes from the "
+    "posteriors stored in the rt_posteriors subdirectory. Defaults to output/pyseir/checkpoints, "
+    "or pyseir/checkpoints in the output directory of the shard with --shard.",
+)
+@click.option(
+    "--ignore-checkpoints",
+    default=False,
+    is_flag=True,
+    type=bool,
+    help="Run every region, overwriting existing checkpoints.",
+)
+@click.option(
+    "--shard",
+    callback=_parse_shard,
+    help="Only run shard i/N (0 <= i < N) of the regions, writing the output, checkpoints and Rt "
+    "diagnostics to OUTPUT_DIR/shards/i-of-N. Combine the output of all shards with "
+    "`merge-shards`.",
+)
+@timing_utils.run_report("build_all")
+def build_all(
+    states,
+    output_dir,
+    level,
+    fips,
+    location_id_matches: str,
+    generate_api_v2: bool,
+    rt_plots: bool,
+    checkpoint_dir: Optional[pathlib.Path],
+    ignore_checkpoints: bool,
+    shard: Optional[shards.Shard],
+):
+    import pyseir.run
+    from pyseir import kernels
+    from pyseir.rt import infer_rt
+    from pyseir.rt import posterior_state
+    from pyseir.run import OneRegionPipeline
+
     # split columns by ',' and remove whitespace
     states = [c.strip() for c in states]
     states = [us.states.lookup(state).abbr for state in states]
     states = [state for state in states if state in ALL_STATES]
 
     # prepare data
-    _cache_global_datasets()
-
-    regions_dataset = combined_datasets.load_us_timeseries_dataset().get_subset(
-        fips=fips,
-        aggregation_level=level,
-        exclude_county_999=True,
-        states=states,
-        location_id_matches=location_id_matches,
-    )
-    regions = [one_region for _, one_region in regions_dataset.iter_one_regions()]
+    with timing_utils.span("load datasets"):
+        _cache_global_datasets()
+
+        regions_dataset = combined_datasets.load_us_timeseries_dataset().get_subset(
+            fips=fips,
+            aggregation_level=level,
+            exclude_county_999=True,
+            states=states,
+            location_id_matches=location_id_matches,
+        )
+        regions = [one_region for _, one_region in regions_dataset.iter_one_regions()]
+    shard_regions = None
+    if shard:
+        shard_regions = set(shard.regions([one_region.region for one_region in regions]))
+        regions = [one_region for one_region in regions if one_region.region in shard_regions]
+        output_dir = shard.directory(output_dir)
+        root.info(f"Running shard {shard} in {output_dir}")
+    # The per region stores of a shard are in its output directory so that `merge-shards` collects
+    # them from shards run on other machines.
+    stores_dir = output_dir if shard else pyseir.OUTPUT_DIR
+    if checkpoint_dir is None:
+        checkpoint_dir = pathlib.Path(pyseir.utils.CHECKPOINT_FOLDER(stores_dir))
+    timing_utils.count("regions", len(regions))
     root.info(f"Executing pipeline for {len(regions)} regions")
-    region_pipelines: List[OneRegionPipeline] = parallel_utils.parallel_map(
-        OneRegionPipeline.run, regions
+    checkpoint_store = pyseir.run.CheckpointStore(checkpoint_dir)
+    posterior_store = posterior_state.PosteriorStateStore(checkpoint_dir / "rt_posteriors")
+    if rt_plots:
+        run_region = functools.partial(
+            OneRegionPipeline.run,
+            plot_rt=True,
+            checkpoint_store=checkpoint_store,
+            reuse_checkpoints=not ignore_checkpoints,
+            posterior_store=posterior_store,
+        )
+    else:
+        rt_diagnostics_store = diagnostics.RtDiagnosticsStore(
+            pathlib.Path(pyseir.utils.RT_DIAGNOSTICS_FOLDER(stores_dir))
+        )
+        run_region = functools.partial(
+            OneRegionPipeline.run,
+            plot_rt=False,
+            rt_diagnostics_store=rt_diagnostics_store,
+            checkpoint_store=checkpoint_store,
+            reuse_checkpoints=not ignore_checkpoints,
+            posterior_store=posterior_store,
+        )
+    # Compile the kernels before forking so that the workers inherit them.
+    kernels.warm_up([infer_rt.__name__])
+    region_pipelines: List[OneRegionPipeline] = list(
+        parallel_utils.parallel_map(run_region, regions)
     )
+    rt_reused = sum(p.rt_from_checkpoint for p in region_pipelines)
+    timing_utils.count("regions_rt_from_checkpoint", rt_reused)
+    root.info(f"Reused Rt checkpoints for {rt_reused} of {len(region_pipelines)} regions")
     region_pipelines = _patch_nola_infection_rate_in_pipelines(region_pipelines)
 
-    model_output = pyseir.run.PyseirOutputDatasets.from_pipeline_output(region_pipelines)
-    model_output.write(output_dir, root)
+    with timing_utils.span("write output"):
+        model_output = pyseir.run.PyseirOutputDatasets.from_pipeline_output(region_pipelines)
+        model_output.write(output_dir, root)
+
+    # Imported here so that the model doesn't depend on the API code, see
+    # `stage_runner.MODEL_CODE`.
+    from libs.pipelines import api_v2_pipeline
 
-    if generate_api_v2:
+    if generate_api_v2 and shard:
+        # Only the timeseries are saved because the bulk files need the timeseries of all shards.
+        all_timeseries = api_v2_pipeline.build_all_timeseries(
+            model_output, regions_dataset, root, regions=shard_regions
+        )
+        api_v2_pipeline.write_timeseries_fragment(
+            all_timeseries, output_dir / api_v2_pipeline.TIMESERIES_FRAGMENT_FILENAME
+        )
+    elif generate_api_v2:
         api_v2_pipeline.generate_from_loaded_data(model_output, output_dir, regions_dataset, root)
 
 
+@entry_point.command()
+@click.option(
+    "--output-dir",
+    default="output/",
+    type=pathlib.Path,
+    help="Output directory passed to `build-all --shard`.",
+)
+@click.option("--shards", "shard_count", type=int, required=True, help="Number of shards, N.")
+@timing_utils.run_report("merge_shards")
+def merge_shards(output_dir: pathlib.Path, shard_count: int):
+    """Combines the output of `build-all --shard i/N` for every i into the output of build-all.
+
+    The checkpoints and Rt diagnostics of the shards are copied to output/pyseir, where
+    `build-all` and `render-rt-plots` find them by default. If the shards were run with
+    --generate-api-v2 the API is written too, including the bulk files."""
+    import pyseir.run
+    from libs import dataset_deployer
+    from libs.pipelines import api_v2_pipeline
+
+    shard_dirs = [shard.directory(output_dir) for shard in shards.Shard.all(shard_count)]
+    missing = [
+        str(path)
+        for shard_dir in shard_dirs
+        for path in [
+            shard_dir / pyseir.utils.SummaryArtifact.RT_METRIC_COMBINED.value,
+            shard_dir / pyseir.utils.SummaryArtifact.ICU_METRIC_COMBINED.value,
+        ]
+        if not path.exists()
+    ]
+    if missing:
+        raise click.ClickException(f"Missing shard output: {', '.join(missing)}")
+
+    with timing_utils.span("merge model output"):
+        model_output = pyseir.run.PyseirOutputDatasets.merge(
+            [pyseir.run.PyseirOutputDatasets.read(shard_dir) for shard_dir in shard_dirs]
+        )
+        model_output.write(output_dir, root)
+
+    with timing_utils.span("merge region stores"):
+        for folder in (pyseir.utils.CHECKPOINT_FOLDER, pyseir.utils.RT_DIAGNOSTICS_FOLDER):
+            shards.merge_files(
+                [pathlib.Path(folder(shard_dir)) for shard_dir in shard_dirs],
+                pathlib.Path(folder(pyseir.OUTPUT_DIR)),
+            )
+
+    fragments = [
+        shard_dir / api_v2_pipeline.TIMESERIES_FRAGMENT_FILENAME for shard_dir in shard_dirs
+    ]
+    found = [path for path in fragments if path.exists()]
+    if found and len(found) != len(fragments):
+        missing = sorted(set(map(str, fragments)) - set(map(str, found)))
+        raise click.ClickException(f"Missing shard API output: {', '.join(missing)}")
+    if found:
+        with timing_utils.span("merge api output"):
+            all_timeseries = api_v2_pipeline.read_timeseries_fragments(fragments)
+        timing_utils.count("regions", len(all_timeseries))
+        writer = dataset_deployer.ArtifactWriter(
+            output_dir, threads=dataset_deployer.DEFAULT_WRITE_THREADS
+        )
+        try:
+            api_v2_pipeline.deploy_all_timeseries(all_timeseries, output_dir, writer)
+        finally:
+            writer.close()
+
+
+@entry_point.command()
+@click.option(
+    "--aot",
+    default=False,
+    is_flag=True,
+    type=bool,
+    help="Also compile the kernels that support it ahead of time into an extension module in the "
+    "pyseir package. Needs a C compiler.",
+)
+def warm_up_kernels(aot: bool):
+    """Compiles the numba kernels into numba's on-disk cache.
+
+    Run when building a deployment so that no process of a run compiles a kernel.
+    """
+    from pyseir import kernels
+
+    if aot:
+        kernels.compile_aot()
+    for name, seconds in kernels.warm_up().items():
+        root.info(f"{name}: {seconds:.2f}s")
+
+
+def _render_rt_plots(store: diagnostics.RtDiagnosticsStore, region: pipeline.Region):
+    try:
+        diagnostics.render(store, region)
+    except Exception:
+        root.exception(f"Failed to render Rt plots for {region}")
+
+
+@entry_point.command()
+@click.option(
+    "--diagnostics-dir",
+    default=pyseir.utils.RT_DIAGNOSTICS_FOLDER(pyseir.OUTPUT_DIR),
+    type=pathlib.Path,
+    help="Directory of Rt diagnostics recorded by `build-all`.",
+)
+@click.option(
+    "--states", "-s", multiple=True, help="States to render. If not set, all states are rendered.",
+)
+@click.option("--fips", help="Only render the region with this FIPS code.")
+@click.option("--level", "-l", type=AggregationLevel)
+@click.option(
+    "--location-id-matches",
+    help="If set only location_id matching this regular expression are rendered",
+)
+def render_rt_plots(diagnostics_dir, states, fips, level, location_id_matches: str):
+    """Renders Rt smoothing and inference PDFs from diagnostics recorded by `build-all`."""
+    states = [us.states.lookup(state.strip()).abbr for state in states]
+    store = diagnostics.RtDiagnosticsStore(diagnostics_dir)
+
+    regions = [
+        region
+        for region in store.regions()
+        if (not states or region.state in states)
+        and (not fips or region.fips == fips)
+        and (not level or region.level is level)
+        and (not location_id_matches or re.match(location_id_matches, region.location_id))
+    ]
+    # County report paths include the county name, which is looked up in the combined dataset.
+    # Load it before forking so that each worker doesn't load it again.
+    combined_datasets.load_us_timeseries_dataset()
+
+    root.info(f"Rendering Rt plots for {len(regions)} regions")
+    list(parallel_utils.parallel_map(functools.partial(_render_rt_plots, store), regions))
+
+
+@entry_point.command()
+@click.option("--members", default=1000, help="Number of models in the ensemble.")
+@click.option("--days", default=200, help="Number of days to simulate.")
+@click.option(
+    "--odeint-sample",
+    default=100,
+    help="Number of members run with SEIRModel.run, scaled up to estimate the full runtime.",
+)
+def benchmark_seir_ensemble(members: int, days: int, odeint_sample: int):
+    """Compares the runtime of SEIRModelEnsemble with calling SEIRModel.run for each member."""
+    # Imported here because the models import matplotlib.
+    import time
+    import numpy as np
+    from pyseir.models import suppression_policies
+    from pyseir.models.seir_ensemble import SEIRModelEnsemble
+    from pyseir.models.seir_model import SEIRModel
+
+    t_list = np.linspace(0, days, days + 1)
+    rng = np.random.RandomState(42)
+    population = 10_000_000
+
+    def make_models():
+        return [
+            SEIRModel(
+                N=population,
+                t_list=t_list,
+                suppression_policy=suppression_policies.piecewise_parametric_policy(
+                    rng.uniform(0.4, 1.2, 4), t_list
+                ),
+                R0=rng.uniform(1.2, 4.0),
+                A_initial=700,
+                I_initial=1000,
+                beds_general=population / 1000,
+                beds_ICU=population / 1000,
+                ventilators=population / 1000,
+            )
+            for _ in range(members)
+        ]
+
+    # Compile the numba kernels, or load them from the cache, outside of the timed runs.
+    SEIRModelEnsemble(make_models()[:1]).run()
+    SEIRModelEnsemble(make_models()[:1], adaptive=True).run()
+
+    models = make_models()
+    start = time.time()
+    for model in models[:odeint_sample]:
+        model.run()
+    odeint_seconds = (time.time() - start) * members / min(members, odeint_sample)
+    root.info(f"SEIRModel.run: {odeint_seconds:.2f}s (estimated from {odeint_sample} members)")
+
+    for adaptive in (False, True):
+        models = make_models()
+        start = time.time()
+        SEIRModelEnsemble(models, adaptive=adaptive).run()
+        seconds = time.time() - start
+        root.info(
+            f"SEIRModelEnsemble(adaptive={adaptive}): {seconds:.2f}s, "
+            f"{odeint_seconds / seconds:.1f}x faster"
+        )
+
+
+@entry_point.command()
+@click.option("--rt-steps", default=100, help="Number of R(t) values in the scan.")
+def benchmark_nowcast_batch(rt_steps: int):
+    """Compares the runtime of a run_stationary scan with ModelRunBatch and with ModelRun."""
+    # Imported here because the models import matplotlib.
+    import time
+    import numpy as np
+    from pyseir.models.nowcast_batch import run_stationary_batch
+    from pyseir.models.nowcast_seir_model import NowcastingSEIRModel
+
+    model = NowcastingSEIRModel()
+    # Same scan as scan_rt in tests/nowcast_seir_model_basic_test.py, with a finer R(t) grid.
+    scenarios = [
+        (rt, 38.0, t_over_x, x_is_new_cases)
+        for t_over_x in [0.03, 0.1, 0.3, 1.0, 3.0, 10.0, 30.0]
+        for rt in np.linspace(0.5, 2.5, rt_steps)
+        for x_is_new_cases in (True, False)
+    ]
+
+    # Compile the numba kernels, or load them from the cache, outside of the timed runs.
+    run_stationary_batch(model, scenarios[:1])
+
+    start = time.time()
+    expected = [model.run_stationary(*scenario) for scenario in scenarios]
+    list_seconds = time.time() - start
+    root.info(f"ModelRun.execute_lists_ratios: {list_seconds:.2f}s for {len(scenarios)} runs")
+
+    start = time.time()
+    output = run_stationary_batch(model, scenarios)
+    seconds = time.time() - start
+    root.info(
+        f"ModelRunBatch: {seconds:.2f}s, {list_seconds / seconds:.1f}x faster, "
+        f"identical results: {output == expected}"
+    )
+
+
 if __name__ == "__main__":
     try:
         entry_point()  # pylint: disable=no-value-for-parameter
@@ -0,0 +1,169 @@
+"""Registry of the numba kernels called by pyseir.
+
+Kernels registered with `kernel` are compiled with numba's on-disk cache, so a kernel is compiled
+once per deployment instead of once per process. Set `NUMBA_CACHE_DIR` where the source tree is
+not writable. `warm_up` compiles, or loads from the cache, the signatures declared at
+registration. It is run by `pyseir warm-up-kernels` when building a deployment and by `build-all`
+before forking workers, which inherit the compiled code. The time it takes is recorded in the
+"compile kernels" span of the run report, including in every worker.
+
+Kernels registered with `aot=True` can also be compiled ahead of time with `numba.pycc` into an
+extension module by `pyseir warm-up-kernels --aot`. The AOT function replaces the JIT dispatcher
+when the module exists and was built from the current source of the kernel. AOT functions can
+only be called from Python, not from other kernels.
+"""
+import dataclasses
+import hashlib
+import importlib
+import inspect
+import json
+import os
+import pathlib
+import time
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+
+import numba
+import structlog
+from typing_extensions import final
+
+from libs import timing_utils
+
+_log = structlog.get_logger(__name__)
+
+# Modules that register kernels. They are imported by `warm_up` and `compile_aot`.
+KERNEL_MODULES = [
+    "pyseir.rt.infer_rt",
+    "pyseir.models.seir_ensemble",
+    "pyseir.models.nowcast_batch",
+]
+
+# Name of the extension module built by `compile_aot`, in the pyseir package.
+AOT_MODULE_NAME = "_aot_kernels"
+AOT_DIR = pathlib.Path(__file__).parent
+# Hash of the source of each kernel compiled into the AOT module, by export name.
+AOT_MANIFEST_PATH = AOT_DIR / f"{AOT_MODULE_NAME}.json"
+
+# Set to "True" to always use the JIT dispatchers, even when an AOT module exists.
+DISABLE_AOT = os.environ.get("PYSEIR_DISABLE_AOT_KERNELS") == "True"
+
+
+@final
+@dataclasses.dataclass(frozen=True)
+class Kernel:
+    """A numba kernel and the signatures it is compiled for."""
+
+    py_func: Callable
+    dispatcher: numba.core.registry.CPUDispatcher
+    # Signatures, in numba's string syntax, that the kernel is called with.
+    signatures: Sequence[str]
+    aot: bool
+
+    @property
+    def name(self) -> str:
+        return f"{self.py_func.__module__}.{self.py_func.__qualname__}"
+
+    @property
+    def export_name(self) -> str:
+        """Name of the function in the AOT module."""
+        return self.name.replace(".", "__")
+
+    @property
+    def source_hash(self) -> str:
+        return hashlib.sha256(inspect.getsource(self.py_func).encode()).hexdigest()
+
+
+_registry: Dict[str, Kernel] = {}
+
+
+def kernel(*signatures: str, aot: bool = False, **jit_options):
+    """Decorator that compiles a function with `numba.njit(cache=True)` and registers it.
+
+    Args:
+        signatures: Signatures that `warm_up` compiles, such as "void(float64[:, ::1], int64)".
+            Use C contiguous array types (`::1`) for arrays created by numpy.
+        aot: If True, the kernel is also compiled by `compile_aot`. It must have exactly one
+            signature, no `jit_options` and not be called from other kernels.
+        jit_options: Other options passed to `numba.njit`, such as `fastmath`. `numba.pycc`
+            doesn't take them, so an AOT kernel can't have any, otherwise it would compute
+            different results from the JIT kernel.
+    """
+
+    def decorator(func):
+        dispatcher = numba.njit(cache=True, **jit_options)(func)
+        registered = Kernel(func, dispatcher, signatures, aot)
+        if aot and len(signatures) != 1:
+            raise ValueError(f"AOT kernel {registered.name} must have one signature")
+        if aot and jit_options:
+            raise ValueError(f"AOT kernel {registered.name} can't have options {jit_options}")
+        _registry[registered.name] = registered
+        return _aot_function(registered) or dispatcher
+
+    return decorator
+
+
+def registered_kernels(modules: Sequence[str] = tuple(KERNEL_MODULES)) -> List[Kernel]:
+    """Returns the kernels registered by `modules`, importing them if needed."""
+    for module in modules:
+        importlib.import_module(module)
+    return [k for k in _registry.values() if k.py_func.__module__ in modules]
+
+
+def warm_up(modules: Sequence[str] = tuple(KERNEL_MODULES)) -> Dict[str, float]:
+    """Compiles, or loads from the cache, the declared signatures of the kernels of `modules`.
+
+    Returns seconds spent on each kernel. Kernels that are already compiled in this process,
+    possibly by a parent process before forking, take no time.
+    """
+    seconds = {}
+    with timing_utils.span("compile kernels"):
+        for registered in registered_kernels(modules):
+            if _aot_function(registered):
+                continue
+            start = time.perf_counter()
+            for signature in registered.signatures:
+                registered.dispatcher.compile(signature)
+            seconds[registered.name] = time.perf_counter() - start
+        timing_utils.count("kernels", len(seconds))
+    return seconds
+
+
+def compile_aot(output_dir: pathlib.Path = AOT_DIR) -> pathlib.Path:
+    """Compiles the kernels registered with `aot=True` into an extension module.
+
+    Returns the path of the module. Needs a C compiler.
+    """
+    from numba.pycc import CC
+
+    cc = CC(AOT_MODULE_NAME)
+    cc.output_dir = str(output_dir)
+    cc.verbose = False
+    manifest = {}
+    for registered in registered_kernels():
+        if registered.aot:
+            (signature,) = registered.signatures
+            cc.export(registered.export_name, signature)(registered.py_func)
+            manifest[registered.export_name] = registered.source_hash
+    cc.compile()
+    (output_dir / AOT_MANIFEST_PATH.name).write_text(json.dumps(manifest, indent=2))
+    path = output_dir / cc.output_file
+    _log.info("Compiled AOT kernels", path=str(path), kernels=sorted(manifest))
+    return path
+
+
+def _aot_function(registered: Kernel) -> Optional[Callable]:
+    """Returns the AOT compiled function of `registered` or None if it isn't available."""
+    if not registered.aot or DISABLE_AOT or not AOT_MANIFEST_PATH.exists():
+        return None
+    manifest = json.loads(AOT_MANIFEST_PATH.read_text())
+    if manifest.get(registered.export_name) != registered.source_hash:
+        _log.warning("Ignoring stale AOT kernel", kernel=registered.name)
+        return None
+    try:
+        module = importlib.import_module(f"{__package__}.{AOT_MODULE_NAME}")
+    except ImportError:
+        return None
+    return getattr(module, registered.export_name, None)
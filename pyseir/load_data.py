@@ -1,7 +1,11 @@
+import copy
+import dataclasses
 import os
 import logging
+import time
 import urllib.request
-from typing import Tuple
+from collections import defaultdict
+from typing import Dict, Optional, Tuple
 
 import requests
 import re
@@ -10,7 +14,6 @@ import us
 import zipfile
 import json
 from datetime import datetime
-from functools import lru_cache
 
 import pandas as pd
 import numpy as np
@@ -24,6 +27,19 @@ log = logging.getLogger(__name__)
 
 DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pyseir_data")
 
+# Directory for npz copies of the model inputs, written on first use. Unset to only read the
+# original files.
+MODEL_INPUT_NPZ_DIR = os.environ.get("PYSEIR_MODEL_INPUT_NPZ_DIR")
+
+# Model inputs served by ModelInputCache.
+CONTACT_MATRIX = "contact_matrix"
+MOBILITY_M50 = "mobility_data__m50"
+MOBILITY_M50_INDEX = "mobility_data__m50_index"
+PUBLIC_IMPLEMENTATIONS = "public_implementations_data"
+
+# Index column set on each table after loading it from its pickle.
+_TABLE_INDEX = {MOBILITY_M50: None, MOBILITY_M50_INDEX: "fips", PUBLIC_IMPLEMENTATIONS: "fips"}
+
 
 def load_zip_get_file(url, file, decoder="utf-8"):
     """
@@ -270,7 +286,183 @@ def load_cdc_hospitalization_data():
     return pd.read_csv(os.path.join(DATA_DIR, "cdc_hospitalization_data.csv"))
 
 
-@lru_cache(maxsize=None)
+@dataclasses.dataclass
+class ModelInputStats:
+    """Counters of one model input in a ModelInputCache."""
+
+    # Number of files read, counting one per state for contact matrices.
+    loads: int = 0
+    # Number of those loads that read an npz copy.
+    npz_loads: int = 0
+    # Number of requests answered from memory.
+    hits: int = 0
+    # Time spent reading and converting files.
+    load_seconds: float = 0.0
+
+
+class ModelInputCache:
+    """
+    Loads the model inputs in pyseir_data lazily, once per process, and serves them by FIPS.
+
+    With `npz_dir` set, each input is also written there as an npz file on first use and read
+    from that copy afterwards, by this and later processes. The npz files hold plain numpy
+    arrays, which load much faster than parsing the contact matrix JSON or unpickling the
+    tables.
+
+    Use `model_inputs()` to get the cache of the current process.
+    """
+
+    def __init__(self, data_dir: str = DATA_DIR, npz_dir: Optional[str] = None):
+        self.data_dir = data_dir
+        self.npz_dir = npz_dir
+        self._tables: Dict[str, pd.DataFrame] = {}
+        self._tables_by_fips: Dict[str, pd.DataFrame] = {}
+        # Contact matrix data of each state, keyed by state abbreviation then FIPS.
+        self._contact_matrices: Dict[str, Dict[str, dict]] = {}
+        self._stats: Dict[str, ModelInputStats] = defaultdict(ModelInputStats)
+
+    def stats(self) -> Dict[str, ModelInputStats]:
+        """Returns a copy of the counters of each input used so far."""
+        return {name: dataclasses.replace(stats) for name, stats in self._stats.items()}
+
+    def _npz_path(self, name: str) -> Optional[str]:
+        return os.path.join(self.npz_dir, name + ".npz") if self.npz_dir else None
+
+    def table(self, name: str) -> pd.DataFrame:
+        """Returns one of the pickled tables, MOBILITY_M50, MOBILITY_M50_INDEX or
+        PUBLIC_IMPLEMENTATIONS. The table is shared, so don't modify it."""
+        stats = self._stats[name]
+        if name in self._tables:
+            stats.hits += 1
+            return self._tables[name]
+
+        start = time.time()
+        npz_path = self._npz_path(name)
+        if npz_path and os.path.exists(npz_path):
+            df = _npz_to_frame(npz_path)
+            stats.npz_loads += 1
+        else:
+            df = pd.read_pickle(os.path.join(self.data_dir, name + ".pkl"))
+            if _TABLE_INDEX[name]:
+                df = df.set_index(_TABLE_INDEX[name])
+            if npz_path:
+                _frame_to_npz(df, npz_path)
+        stats.loads += 1
+        stats.load_seconds += time.time() - start
+        self._tables[name] = df
+        return df
+
+    def table_for_fips(self, name: str, fips: str) -> pd.DataFrame:
+        """Returns the rows of table `name` for `fips`, which may be empty."""
+        if name not in self._tables_by_fips:
+            df = self.table(name)
+            if df.index.name != "fips":
+                df = df.set_index("fips")
+            self._tables_by_fips[name] = df.sort_index()
+        df = self._tables_by_fips[name]
+        return df.loc[fips:fips]
+
+    def contact_matrix(self, fips: str) -> dict:
+        """
+        Returns the contact matrix data of state or county `fips`, with keys 'contact_matrix',
+        'age_bin_edges' and 'age_distribution'. See load_contact_matrix_data_by_fips. The data is
+        a copy, so callers may modify it.
+        """
+        state_abbr = us.states.lookup(fips[:2]).abbr
+        stats = self._stats[CONTACT_MATRIX]
+        if state_abbr in self._contact_matrices:
+            stats.hits += 1
+        else:
+            start = time.time()
+            npz_path = self._npz_path(f"{CONTACT_MATRIX}_fips_{state_abbr}")
+            if npz_path and os.path.exists(npz_path):
+                data = _npz_to_contact_matrices(npz_path)
+                stats.npz_loads += 1
+            else:
+                path = os.path.join(
+                    self.data_dir, "contact_matrix", "contact_matrix_fips_%s.json" % state_abbr
+                )
+                with open(path) as f:
+                    data = json.load(f)
+                if npz_path:
+                    _contact_matrices_to_npz(data, npz_path)
+            stats.loads += 1
+            stats.load_seconds += time.time() - start
+            self._contact_matrices[state_abbr] = data
+        return copy.deepcopy(self._contact_matrices[state_abbr][fips])
+
+
+_CONTACT_MATRIX_KEYS = ("age_bin_edges", "age_distribution", "contact_matrix")
+
+
+def _contact_matrices_to_npz(data: Dict[str, dict], path: str):
+    """Writes the contact matrix data of one state as arrays stacked over FIPS, if all regions
+    of the state share the same age bins."""
+    fips = sorted(data)
+    arrays = {key: np.array([data[f][key] for f in fips]) for key in _CONTACT_MATRIX_KEYS}
+    if any(array.dtype == object for array in arrays.values()):
+        log.warning(f"Not converting {path}, its regions have different age bins")
+        return
+    _write_npz(path, fips=np.array(fips), **arrays)
+
+
+def _npz_to_contact_matrices(path: str) -> Dict[str, dict]:
+    with np.load(path) as npz:
+        arrays = {key: npz[key].tolist() for key in _CONTACT_MATRIX_KEYS}
+        fips = npz["fips"].tolist()
+    return {f: {key: arrays[key][i] for key in _CONTACT_MATRIX_KEYS} for i, f in enumerate(fips)}
+
+
+def _frame_to_npz(df: pd.DataFrame, path: str):
+    """Writes the index and columns of `df` as arrays, if none of them needs pickling."""
+    arrays = {"index": df.index.to_numpy()}
+    for i, column in enumerate(df.columns):
+        arrays[f"column_{i}"] = df[column].to_numpy()
+    # Rebuild dtypes from their string form, dropping metadata pandas attaches to datetime64.
+    arrays = {key: array.astype(np.dtype(array.dtype.str)) for key, array in arrays.items()}
+    object_arrays = [array for array in arrays.values() if array.dtype == object]
+    # Object columns usually hold strings, which convert to a fixed width unicode array. Other
+    # values, including None and NaN, would be read back as strings.
+    if not all(isinstance(value, str) for array in object_arrays for value in array):
+        log.warning(f"Not converting {path}, it has columns that need pickling")
+        return
+    arrays = {
+        key: array.astype(str) if array.dtype == object else array for key, array in arrays.items()
+    }
+    names = np.array([str(name) for name in df.columns])
+    _write_npz(path, column_names=names, index_name=np.array(str(df.index.name or "")), **arrays)
+
+
+def _npz_to_frame(path: str) -> pd.DataFrame:
+    with np.load(path) as npz:
+        names = npz["column_names"].tolist()
+        df = pd.DataFrame(
+            {name: npz[f"column_{i}"] for i, name in enumerate(names)}, index=npz["index"]
+        )
+        df.index.name = npz["index_name"].item() or None
+    return df
+
+
+def _write_npz(path: str, **arrays):
+    # Write to a temporary file first so that processes reading concurrently never see a partial
+    # file.
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+_model_inputs: Optional[ModelInputCache] = None
+
+
+def model_inputs() -> ModelInputCache:
+    """Returns the ModelInputCache of this process, creating it on first use."""
+    global _model_inputs
+    if _model_inputs is None:
+        _model_inputs = ModelInputCache(npz_dir=MODEL_INPUT_NPZ_DIR)
+    return _model_inputs
+
+
 def load_mobility_data_m50():
     """
     Return mobility data without normalization
@@ -279,10 +471,9 @@ def load_mobility_data_m50():
     -------
     : pd.DataFrame
     """
-    return pd.read_pickle(os.path.join(DATA_DIR, "mobility_data__m50.pkl"))
+    return model_inputs().table(MOBILITY_M50)
 
 
-@lru_cache(maxsize=None)
 def load_mobility_data_m50_index():
     """
     Return mobility data with normalization: per
@@ -293,10 +484,9 @@ def load_mobility_data_m50_index():
     -------
     : pd.DataFrame
     """
-    return pd.read_pickle(os.path.join(DATA_DIR, "mobility_data__m50_index.pkl")).set_index("fips")
+    return model_inputs().table(MOBILITY_M50_INDEX)
 
 
-@lru_cache(maxsize=None)
 def load_public_implementations_data():
     """
     Return public implementations data
@@ -305,9 +495,7 @@ def load_public_implementations_data():
     -------
     : pd.DataFrame
     """
-    return pd.read_pickle(os.path.join(DATA_DIR, "public_implementations_data.pkl")).set_index(
-        "fips"
-    )
+    return model_inputs().table(PUBLIC_IMPLEMENTATIONS)
 
 
 def load_contact_matrix_data_by_fips(fips):
@@ -336,10 +524,7 @@ def load_contact_matrix_data_by_fips(fips):
     """
 
     fips = [fips] if isinstance(fips, str) else list(fips)
-    state_abbr = us.states.lookup(fips[0][:2]).abbr
-    path = os.path.join(DATA_DIR, "contact_matrix", "contact_matrix_fips_%s.json" % state_abbr)
-    contact_matrix_data = json.loads(open(path).read())
-    return {s: contact_matrix_data[s] for s in fips}
+    return {s: model_inputs().contact_matrix(s) for s in fips}
 
 
 def cache_all_data():
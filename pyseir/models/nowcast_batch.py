@@ -0,0 +1,443 @@
+"""
+Steps many nowcast `ModelRun` instances together with a compiled kernel.
+
+`ModelRun.execute_lists_ratios` advances one run a day at a time with Python lists, calling the
+input functions and inverting the positivity function by binary search in every step. Scenario
+sweeps and SMAPE evaluations run many of these. `ModelRunBatch` evaluates the time dependent
+inputs of each run once per day, then steps all runs in a numba kernel over preallocated arrays.
+
+The kernel performs the same floating point operations in the same order as
+`ModelRun._time_step` and `ModelRun.execute_lists_ratios`, so histories and summary ratios are
+identical to the list based implementation (checked in tests/nowcast_batch_test.py).
+A scan of 1,400 `run_stationary` scenarios takes about 0.5s versus 5s, most of it now spent
+building the runs and evaluating their inputs. Reproduce with `pyseir benchmark-nowcast-batch`.
+"""
+import math
+from typing import List, Sequence, Tuple
+
+import numba
+import numpy as np
+import pandas as pd
+
+from pyseir import kernels
+from pyseir.models.demographics import Transitions
+from pyseir.models.nowcast_seir_model import ModelRun
+from pyseir.models.nowcast_seir_model import NowcastingSEIRModel
+
+N_COMPARTMENTS = 10
+
+# Columns of the per step inputs, evaluated in Python from the functions of each run.
+(_IN_RT, _IN_TESTING, _IN_FH, _IN_FD, _IN_T_H, _IN_OBSERVED_H, _IN_OBSERVED_ND) = range(7)
+N_INPUTS = 7
+
+# Columns of the constants of each run.
+(
+    _C_N,
+    _C_T_E,
+    _C_T_I,
+    _C_SERIAL_PERIOD,
+    _C_FW,
+    _C_DELAY_CI_H,
+    _C_POS_X0,
+    _C_POS_B,
+    _C_POS_C,
+    _C_POS_D,
+) = range(10)
+N_CONSTANTS = 10
+
+# Columns of the flags of each run.
+(_F_TRACK_NC, _F_STATIONARY, _F_HAS_TESTING, _F_SMAPE) = range(4)
+N_FLAGS = 4
+
+# Columns of the per run summary written by the kernel.
+(_OUT_FRACTIONAL_CHANGE, _OUT_SMAPE_SUM, _OUT_SMAPE_COUNT) = range(3)
+
+
+@numba.njit(cache=True)
+def _py_max(a, b):
+    """`max(a, b)` with the semantics of the Python builtin, including for NaN."""
+    return b if b > a else a
+
+
+@numba.njit(cache=True)
+def _py_min(a, b):
+    """`min(a, b)` with the semantics of the Python builtin, including for NaN."""
+    return b if b < a else a
+
+
+@numba.njit(cache=True)
+def _positivity(t_over_i, constants):
+    """`NowcastingSEIRModel.positivity`."""
+    x = 0.5 / t_over_i
+    if t_over_i < constants[_C_POS_X0]:
+        return x * (t_over_i - constants[_C_POS_B] * t_over_i ** 1.5)
+    return x * (constants[_C_POS_C] - constants[_C_POS_D] / t_over_i ** 0.5)
+
+
+@numba.njit(cache=True)
+def _positivity_to_t_over_i(pos, constants):
+    """`NowcastingSEIRModel.positivity_to_t_over_i`."""
+    lo = -3.0
+    if pos > _positivity(10.0 ** lo, constants):
+        return 10.0 ** lo
+    hi = +3.0
+    if pos < _positivity(10.0 ** hi, constants):
+        return 10.0 ** hi
+    eps = 0.01
+    x = 0.5 * (hi + lo)
+    while hi - lo > eps:
+        x = 0.5 * (hi + lo)
+        if pos < _positivity(10.0 ** x, constants):
+            lo = x
+        else:
+            hi = x
+    return 10.0 ** x
+
+
+@numba.njit(cache=True)
+def _time_step(y, inputs, constants, has_testing, implicit_infections, dy):
+    """Writes the change of state `y` over one day to `dy`. This is `ModelRun._time_step`."""
+    dt = 1.0
+    S = y[0]
+    E = y[1]
+    I = y[2]
+    W = y[3]
+    nC = y[4]
+    C = y[5]
+    H = y[6]
+
+    N = constants[_C_N]
+    t_e = constants[_C_T_E]
+    t_i = constants[_C_T_I]
+    serial_period = constants[_C_SERIAL_PERIOD]
+    t_h = inputs[_IN_T_H]
+    rt = inputs[_IN_RT]
+    testing_rate = inputs[_IN_TESTING]
+
+    k = (rt - 1.0) / serial_period
+    if implicit_infections:
+        k_expected = math.exp(k)
+    else:
+        k_expected = math.exp(k) - 1.0
+
+    fh = inputs[_IN_FH]
+    fd = inputs[_IN_FD]
+    fw = constants[_C_FW]
+
+    e_max_growth = 2.0
+
+    avg_R = rt
+    growth_over_delay = math.exp((avg_R - 1.0) / serial_period * constants[_C_DELAY_CI_H])
+    delayed_C = C / growth_over_delay
+    delayed_W = W / growth_over_delay
+    delayed_I = I / growth_over_delay
+
+    if implicit_infections:
+        positive_tests = k_expected * nC
+        dCdt = positive_tests - delayed_C / t_i
+        C_new = C + dCdt * dt
+
+        if has_testing:
+            pos_new = _py_min(0.4, positive_tests / testing_rate)
+            T_over_I = _positivity_to_t_over_i(pos_new, constants)
+            I_new = testing_rate / T_over_I
+        else:
+            I_new = 1.0
+        dIdt = (I_new - I) / dt
+
+        E_new = _py_max(10.0, (dIdt + positive_tests + delayed_I / t_i) * t_e / (1.0 - fw))
+        E_new = _py_max(_py_min(e_max_growth * E, E_new), 1.0 / e_max_growth * E)
+        dEdt = (E_new - E) / dt
+        number_exposed = dEdt + E / t_e
+
+        dWdt = fw * E / t_e - delayed_W / t_i
+        W_new = W + dWdt * dt
+
+        beta = _py_max(0.01, number_exposed / (S * (I_new + W_new + C_new) / N))
+    else:
+        beta = (k_expected + 1.0 / t_i) * (k_expected + 1.0 / t_e) * t_e
+        number_exposed = beta * S * (I + W + C) / N
+
+        tests_performed = testing_rate * dt
+        positive_tests = tests_performed * _positivity(testing_rate / _py_max(I, 1.0), constants)
+
+        dEdt = number_exposed - E / t_e
+        dCdt = positive_tests - delayed_C / t_i
+        dIdt = (1.0 - fw) * E / t_e - positive_tests - delayed_I / t_i
+        dWdt = fw * E / t_e - delayed_W / t_i
+
+    dSdt = -number_exposed
+
+    dHdt = fh * (delayed_I + delayed_C) / t_i - H / t_h
+    dDdt = fd * H / t_h
+
+    if implicit_infections:
+        dRdt = -(dSdt + dEdt + dIdt + dWdt + dCdt + dHdt + dDdt)
+    else:
+        dRdt = (1 - fh) * (delayed_I + delayed_C) / t_i + delayed_W / t_i + (1 - fd) * H / t_h
+
+    dy[0] = dt * dSdt
+    dy[1] = dt * dEdt
+    dy[2] = dt * dIdt
+    dy[3] = dt * dWdt
+    dy[4] = positive_tests
+    dy[5] = dt * dCdt
+    dy[6] = dt * dHdt
+    dy[7] = dt * dDdt
+    dy[8] = dt * dRdt
+    dy[9] = beta
+
+
+@kernels.kernel(
+    "void(float64[:, :, ::1], float64[:, ::1], boolean[:, ::1], float64[:, :, ::1],"
+    " float64[:, ::1])"
+)
+def _execute(inputs, constants, flags, history, summary):
+    """Steps every run from `history[:, 0]`, writing the state after each step to `history` and
+    the fractional change of the last step and SMAPE sums to `summary`.
+
+    This is the main loop of `ModelRun.execute_lists_ratios`.
+    """
+    dy = np.empty(N_COMPARTMENTS)
+    y_new = np.empty(N_COMPARTMENTS)
+    for r in range(history.shape[0]):
+        track_nC = flags[r, _F_TRACK_NC]
+        stationary = flags[r, _F_STATIONARY]
+        has_testing = flags[r, _F_HAS_TESTING]
+        calculating_smape = flags[r, _F_SMAPE]
+        implicit = not stationary
+        fractional_change = np.nan
+        smape_sum = 0.0
+        smape_count = 0.0
+        for s in range(inputs.shape[1]):
+            y = history[r, s]
+            _time_step(y, inputs[r, s], constants[r], has_testing, implicit, dy)
+
+            for i in range(N_COMPARTMENTS):
+                v = y[i] + dy[i]
+                y_new[i] = v if v > 0.1 else 0.1
+            y_new[4] = dy[4]
+            y_new[7] = dy[7]
+            y_new[9] = dy[9]
+
+            if track_nC:
+                fractional_change = y_new[4] / y[4]
+            else:
+                fractional_change = y_new[2] / y[2]
+
+            out = history[r, s + 1]
+            if stationary:
+                for i in range(N_COMPARTMENTS):
+                    out[i] = y_new[i] / fractional_change
+                out[9] = y_new[9]
+                out[0] = y[0]
+                out[8] = dy[8]
+            else:
+                out[:] = y_new
+
+            if calculating_smape:
+                for c, observed_column in ((6, _IN_OBSERVED_H), (7, _IN_OBSERVED_ND)):
+                    observed = inputs[r, s, observed_column]
+                    if not math.isnan(observed):
+                        val = out[c]
+                        smape_sum += abs(val - observed) / ((abs(val) + abs(observed)) / 2.0)
+                        smape_count += 1
+        summary[r, _OUT_FRACTIONAL_CHANGE] = fractional_change
+        summary[r, _OUT_SMAPE_SUM] = smape_sum
+        summary[r, _OUT_SMAPE_COUNT] = smape_count
+
+
+def _evaluate(f, times: np.ndarray) -> np.ndarray:
+    """Evaluates `f` at all `times`, with one call when it accepts arrays.
+
+    Functions of t that accept arrays are assumed to be elementwise, which holds for lambdas of
+    arithmetic and numpy ufuncs and for scipy interpolators.
+    """
+    try:
+        values = np.asarray(f(times), dtype=float)
+    except (TypeError, ValueError):
+        values = None
+    if values is None or values.shape not in ((), times.shape):
+        values = np.array([f(t) for t in times], dtype=float)
+    return np.broadcast_to(values, times.shape)
+
+
+def _evaluate_by_value(f, values: np.ndarray) -> np.ndarray:
+    """Evaluates `f` once for each distinct element of `values`."""
+    unique, inverse = np.unique(values, return_inverse=True)
+    return np.array([f(value) for value in unique], dtype=float)[inverse]
+
+
+def _observed(historical_compartments, compartment, times: np.ndarray) -> np.ndarray:
+    """Historical values of `compartment` at `times` where they are used in the SMAPE, otherwise
+    NaN."""
+    observed = np.full(len(times), np.nan)
+    series = historical_compartments.get(compartment)
+    if series is None:
+        return observed
+    # Looking up labels in a dict is much faster than in the Series index.
+    values = dict(zip(series.index, series.values))
+    for s, t in enumerate(times):
+        if t in values and not math.isnan(values[t]) and values[t] > 0.3:
+            observed[s] = values[t]
+    return observed
+
+
+class ModelRunBatch:
+    """
+    Executes a batch of `ModelRun` instances with the same number of days.
+
+    Runs are prepared in order, so runs that share a `NowcastingSEIRModel` and use
+    `auto_calibrate` see the same compounded transition fractions as when executed one after
+    another.
+
+    Parameters
+    ----------
+    runs: sequence of ModelRun
+        Runs to execute. Their `results` are set by `execute_dataframes_ratios`. Runs whose
+        `today` is more than 7 days after `t_list[0]` aren't supported, because
+        `execute_lists_ratios` runs them for extra days up to `today`; execute them one at a time.
+    """
+
+    def __init__(self, runs: Sequence[ModelRun]):
+        self.runs = list(runs)
+        if not self.runs:
+            raise ValueError("ModelRunBatch needs at least one run.")
+        for run in self.runs:
+            if run.today is not None and run.today > run.t_list[0] + 7:
+                raise ValueError(
+                    f"ModelRunBatch does not support runs with today ({run.today}) more than 7 "
+                    f"days after t_list[0] ({run.t_list[0]}). Use ModelRun.execute_lists_ratios."
+                )
+        self._times = [self._step_times(run) for run in self.runs]
+        num_days = {len(times) for times in self._times}
+        if len(num_days) != 1:
+            raise ValueError(f"All runs must have the same number of days, got {num_days}")
+
+    @staticmethod
+    def _step_times(run: ModelRun) -> np.ndarray:
+        """Times at which `execute_lists_ratios` calls `_time_step` in its main loop."""
+        start = run.t_list[0]
+        return np.linspace(start, run.t_list[-1], int(run.t_list[-1] - start + 1))[:-1]
+
+    @staticmethod
+    def _prepare(run: ModelRun, times: np.ndarray):
+        """Returns the initial state, step inputs, constants and flags of `run`."""
+        (y, change_track_nC) = run.initial_state()
+        model = run.model
+        if run.testing_rate_f is None and run.force_stationary:
+            raise ValueError("Runs with force_stationary need a testing_rate_f.")
+
+        # Same expressions as ModelRun._time_step, evaluated for all times at once.
+        t0 = run.t_list[0]
+        if run.case_median_age_f is not None:
+            med_ages_h = _evaluate(run.case_median_age_f, times - int(model.age_eval_delay / 2))
+            med_ages_d = _evaluate(run.case_median_age_f, times - model.age_eval_delay)
+            fh0 = _evaluate_by_value(lambda age: Transitions.fh0_f(median_age=age), med_ages_h)
+            fd0 = _evaluate_by_value(lambda age: Transitions.fd0_f(median_age=age), med_ages_d)
+            t_h = _evaluate_by_value(model.t_h, med_ages_h)
+        else:
+            fh0 = Transitions.fh0_f()
+            fd0 = Transitions.fd0_f()
+            t_h = model.t_h()
+
+        inputs = np.full((len(times), N_INPUTS), np.nan)
+        inputs[:, _IN_RT] = _evaluate(run.rt_f, times)
+        if run.testing_rate_f is not None:
+            inputs[:, _IN_TESTING] = _evaluate(run.testing_rate_f, times)
+        fh = fh0 * model.lr_fh[0] + model.lr_fh[1] * (times - t0)
+        inputs[:, _IN_FH] = np.clip(fh, 0.0, 1.0)
+        fd = fd0 * model.lr_fd[0] + model.lr_fd[1] * (times - t0)
+        inputs[:, _IN_FD] = np.clip(fd, 0.0, 1.0)
+        inputs[:, _IN_T_H] = t_h
+
+        if run.historical_compartments is not None:
+            inputs[:, _IN_OBSERVED_H] = _observed(run.historical_compartments, "H", times)
+            inputs[:, _IN_OBSERVED_ND] = _observed(run.historical_compartments, "nD", times)
+
+        constants = np.empty(N_CONSTANTS)
+        constants[_C_N] = run.N
+        constants[_C_T_E] = model.t_e
+        constants[_C_T_I] = model.t_i
+        constants[_C_SERIAL_PERIOD] = model.serial_period
+        constants[_C_FW] = model.fw0
+        constants[_C_DELAY_CI_H] = model.delay_ci_h
+        constants[_C_POS_X0] = model.pos_x0
+        constants[_C_POS_B] = model.pos_b
+        constants[_C_POS_C] = model.pos_c
+        constants[_C_POS_D] = model.pos_d
+
+        flags = np.array(
+            [
+                change_track_nC,
+                run.force_stationary,
+                run.testing_rate_f is not None,
+                run.historical_compartments is not None,
+            ]
+        )
+        return np.asarray(y, dtype=float), inputs, constants, flags
+
+    def execute(self) -> Tuple[np.ndarray, List[dict]]:
+        """
+        Executes all runs.
+
+        Returns
+        -------
+        histories: np.ndarray
+            Compartments of every run and day, shaped (runs, days, 10) in the order of
+            `ModelRun.array_to_df`. Equal to the lists returned by `execute_lists_ratios`.
+        ratios: list of dict
+            Summary ratios of each run, as returned by `execute_lists_ratios`.
+        """
+        step_times = self._times
+        num_steps = len(step_times[0])
+        histories = np.empty((len(self.runs), num_steps + 1, N_COMPARTMENTS))
+        inputs = np.empty((len(self.runs), num_steps, N_INPUTS))
+        constants = np.empty((len(self.runs), N_CONSTANTS))
+        flags = np.empty((len(self.runs), N_FLAGS), dtype=np.bool_)
+        for i, (run, times) in enumerate(zip(self.runs, step_times)):
+            histories[i, 0], inputs[i], constants[i], flags[i] = self._prepare(run, times)
+
+        summary = np.empty((len(self.runs), 3))
+        _execute(inputs, constants, flags, histories, summary)
+
+        ratios = []
+        for i, (run, times) in enumerate(zip(self.runs, step_times)):
+            if flags[i, _F_SMAPE]:
+                smape = summary[i, _OUT_SMAPE_SUM] / summary[i, _OUT_SMAPE_COUNT]
+            else:
+                smape = 0.0
+            ratios.append(
+                # Values stay numpy floats, as in execute_lists_ratios, because round() of
+                # np.float64 differs from round() of float for large values.
+                run.summary_ratios(
+                    list(histories[i, -1]), times[-1], summary[i, _OUT_FRACTIONAL_CHANGE], smape,
+                )
+            )
+        return histories, ratios
+
+    def execute_dataframes_ratios(self) -> List[Tuple[pd.DataFrame, dict]]:
+        """Executes all runs and sets their `results`, like `ModelRun.execute_dataframe_ratios_fig`
+        without plotting."""
+        histories, ratios = self.execute()
+        output = []
+        for run, history, run_ratios in zip(self.runs, histories, ratios):
+            run.results = ModelRun.array_to_df(history)
+            output.append((run.results, run_ratios))
+        return output
+
+
+def run_stationary_batch(
+    model: NowcastingSEIRModel, scenarios: Sequence[Tuple[float, float, float, bool]]
+) -> List[Tuple[dict, List[float]]]:
+    """
+    `NowcastingSEIRModel.run_stationary` for each (rt, median_age, t_over_x, x_is_new_cases) in
+    `scenarios`, executed as one batch.
+    """
+    runs = [model.stationary_run(*scenario) for scenario in scenarios]
+    histories, ratios = ModelRunBatch(runs).execute()
+    output = []
+    for scenario, history, run_ratios in zip(scenarios, histories, ratios):
+        run_ratios["rt"] = scenario[0]
+        output.append((run_ratios, list(history[-1])))
+    return output
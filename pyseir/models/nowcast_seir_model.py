@@ -147,6 +147,17 @@ class NowcastingSEIRModel:
         realized after running for some time under "similar conditions" and is used in subsequent ModelRuns where
         auto_initialize_other_compartments is used.
         """
+        run = self.stationary_run(rt, median_age, t_over_x, x_is_new_cases)
+        (history, ratios) = run.execute_lists_ratios()
+        compartments = history[-1]
+        ratios["rt"] = rt
+
+        return (ratios, compartments)
+
+    def stationary_run(self, rt, median_age, t_over_x, x_is_new_cases=True):
+        """
+        Returns the (not yet executed) ModelRun used by run_stationary.
+        """
         x_fixed = 1000.0
         num_days = 100
         t_list = np.linspace(0, num_days, num_days + 1)
@@ -174,12 +185,7 @@ class NowcastingSEIRModel:
                 initial_compartments={"I": x_fixed},
                 force_stationary=True,
             )
-
-        (history, ratios) = run.execute_lists_ratios()
-        compartments = history[-1]
-        ratios["rt"] = rt
-
-        return (ratios, compartments)
+        return run
 
     def positivity(self, t_over_i):
         """
@@ -292,8 +298,7 @@ class ModelRun:
 
     @staticmethod
     def dict_to_array(d):
-        df = pd.DataFrame(d, index=[0])
-        return ModelRun.df_to_array(df)[0]
+        return np.array([d[c] for c in ["S", "E", "I", "A", "nC", "C", "H", "nD", "R", "b"]])
 
     @staticmethod
     def array_to_dict(arr):
@@ -470,8 +475,12 @@ class ModelRun:
             fig = None
         return (df, ratios, fig)
 
-    def execute_lists_ratios(self):
-        today = self.today  # shorthand for below
+    def initial_state(self):
+        """
+        Returns the state at t_list[0], after applying compartment_ratios_initial and
+        auto_calibrate (which adjusts the transition fractions of the model), and whether the
+        growth of new cases (rather than infections) is tracked.
+        """
         y = self.history[0]
         y0 = ModelRun.array_to_dict(y)  # convenient to use dict
 
@@ -504,6 +513,12 @@ class ModelRun:
             y = ModelRun.dict_to_array(current)
             self.model.adjustFractions(adj_H, adj_nD)
 
+        return (y, change_track_nC)
+
+    def execute_lists_ratios(self):
+        today = self.today  # shorthand for below
+        (y, change_track_nC) = self.initial_state()
+
         y_accum = list()
         y_accum.append(y)
 
@@ -578,11 +593,6 @@ class ModelRun:
                 y = y_new
 
             (S, E, I, W, nC, C, H, nD, R, b) = y
-            r_dD_nC = nD / nC  # new deaths over new cases - apparent time dependent IFR
-            r_C_WIC = C / (W + I + C)  # fraction of sick that are official cases
-            r_C_IC = C / (I + C)  # fraction of true cases that are officially counted
-            r_H_IC = H / (C + I)  # hospitalizations per true case
-            r_dD_H = nD / H  # new deaths per hospitalization
 
             if calculating_smape:
                 for c in ["H", "nD"]:
@@ -599,28 +609,40 @@ class ModelRun:
 
         # Run level summary ratios (summary or for last t value)
         smape = smape_sum / smape_count if calculating_smape else 0.0
+
+        # Returns tuple of daily results and useful summary ratios
+        return (y_accum, self.summary_ratios(y, t, fractional_change, smape))
+
+    def summary_ratios(self, y, t, fractional_change, smape):
+        """
+        Summary ratios of a run given its last state y, the time t of the last step, the
+        fractional change of the tracked compartment over that step and the run SMAPE.
+        """
+        (S, E, I, W, nC, C, H, nD, R, b) = y
+        r_dD_nC = nD / nC  # new deaths over new cases - apparent time dependent IFR
+        r_C_WIC = C / (W + I + C)  # fraction of sick that are official cases
+        r_C_IC = C / (I + C)  # fraction of true cases that are officially counted
+        r_H_IC = H / (C + I)  # hospitalizations per true case
+        r_dD_H = nD / H  # new deaths per hospitalization
+
         r_T_I = self.testing_rate_f(t) / I if self.testing_rate_f is not None else 100.0
         pos = self.model.positivity(r_T_I)
         exp_growth_factor = math.exp(
             (self.rt_f(self.t_list[-1]) - 1.0) / self.model.serial_period
         )  # Expected growth factor (in steady state) given injected R(t)
 
-        # Returns tuple of daily results and useful summary ratios
-        return (
-            y_accum,
-            {
-                "growth_factor": round(fractional_change, 3),
-                "exp_growth_factor": round(exp_growth_factor, 3),
-                "r_dD_nC": round(r_dD_nC, 4),
-                "r_C_IC": round(r_C_IC, 2),
-                "r_C_WIC": round(r_C_WIC, 2),
-                "r_H_IC": round(r_H_IC, 2),
-                "r_dD_H": round(r_dD_H, 3),
-                "r_T_I": round(r_T_I, 2),
-                "pos": round(pos, 3),
-                "SMAPE": round(smape, 3),
-            },
-        )
+        return {
+            "growth_factor": round(fractional_change, 3),
+            "exp_growth_factor": round(exp_growth_factor, 3),
+            "r_dD_nC": round(r_dD_nC, 4),
+            "r_C_IC": round(r_C_IC, 2),
+            "r_C_WIC": round(r_C_WIC, 2),
+            "r_H_IC": round(r_H_IC, 2),
+            "r_dD_H": round(r_dD_H, 3),
+            "r_T_I": round(r_T_I, 2),
+            "pos": round(pos, 3),
+            "SMAPE": round(smape, 3),
+        }
 
     def _time_step(self, y, t, dt=1.0, implicit_infections=False):
         """
@@ -0,0 +1,390 @@
+"""
+Integrates many `SEIRModel` instances together with compiled right-hand sides.
+
+`SEIRModel.run` calls `odeint` with a Python right-hand side, which dominates the runtime of
+parameter sweeps and policy optimization. `SEIRModelEnsemble` stacks the parameters and initial
+conditions of a batch of models sharing a `t_list` into arrays and integrates all of them at once
+with numba kernels, then fills in each model's `results` exactly as `SEIRModel.run` does.
+
+Two integrators are available:
+ - fixed step RK4 with `steps_per_day` steps (the default).
+ - adaptive Bogacki-Shampine RK23 with one step size shared by the ensemble, controlled by the
+   worst scaled error of any member.
+
+Accuracy, measured as the largest absolute difference from a tight tolerance (rtol=1e-8) `odeint`
+reference divided by the peak of each compartment, for the models in tests/seir_ensemble_test.py
+over 200 days:
+ - `SEIRModel.run` (odeint with rtol=atol=1e-3): 2e-3
+ - RK4 with the default 4 steps per day: 1.2e-4, and 3e-5 with 8 steps per day
+ - adaptive RK23 with rtol=1e-4: 4e-4
+
+A policy with a jump, such as `lambda t: 1.0 if t < 50 else 0.6`, adds an error up to 1e-2 around
+the jump to all integrators including `odeint` with its production tolerances.
+
+Runtime of 1,000 members with piecewise policies over 200 days is about 0.6s for RK4 and 0.8s for
+RK23 versus 30s for calling `SEIRModel.run` on each. Reproduce with
+`pyseir benchmark-seir-ensemble`.
+
+Suppression policies are evaluated once per member on a grid containing every RK4 stage time
+and linearly interpolated between grid points. Policies built with `interp1d`, as all of those
+in `suppression_policies` are, are evaluated with one vectorized call per member. For the
+adaptive integrator this makes a policy with a discontinuity smooth over one grid interval.
+"""
+from typing import List, Sequence
+
+import numba
+import numpy as np
+
+from pyseir import kernels
+from pyseir.models.seir_model import SEIRModel
+
+# Order of the state vector, matching `SEIRModel._time_step`.
+(
+    _S,
+    _E,
+    _A,
+    _I,
+    _R,
+    _HGEN,
+    _HICU,
+    _HICUVENT,
+    _D,
+    _HADMISSIONS_GENERAL,
+    _HADMISSIONS_ICU,
+    _TOTAL_INFECTIONS,
+) = range(12)
+N_STATES = 12
+
+# Attributes of `SEIRModel` copied into each row of the parameter matrix, in column order.
+PARAMETER_NAMES = (
+    "N",
+    "beta",
+    "beta_hospital",
+    "kappa",
+    "sigma",
+    "gamma",
+    "delta",
+    "hospitalization_rate_general",
+    "hospitalization_rate_icu",
+    "symptoms_to_hospital_days",
+    "mortality_rate_from_ICU",
+    "mortality_rate_no_ICU_beds",
+    "beds_ICU",
+    "mortality_rate_from_hospital",
+    "beds_general",
+    "mortality_rate_no_general_beds",
+    "hospitalization_length_of_stay_general",
+    "fraction_icu_requiring_ventilator",
+    "hospitalization_length_of_stay_icu",
+    "mortality_rate_from_ICUVent",
+    "hospitalization_length_of_stay_icu_and_ventilator",
+)
+(
+    _P_N,
+    _P_BETA,
+    _P_BETA_HOSPITAL,
+    _P_KAPPA,
+    _P_SIGMA,
+    _P_GAMMA,
+    _P_DELTA,
+    _P_HOSP_RATE_GENERAL,
+    _P_HOSP_RATE_ICU,
+    _P_SYMPTOMS_TO_HOSPITAL_DAYS,
+    _P_MORTALITY_FROM_ICU,
+    _P_MORTALITY_NO_ICU_BEDS,
+    _P_BEDS_ICU,
+    _P_MORTALITY_FROM_HOSPITAL,
+    _P_BEDS_GENERAL,
+    _P_MORTALITY_NO_GENERAL_BEDS,
+    _P_LOS_GENERAL,
+    _P_FRACTION_ICU_VENT,
+    _P_LOS_ICU,
+    _P_MORTALITY_FROM_ICUVENT,
+    _P_LOS_ICU_VENT,
+) = range(len(PARAMETER_NAMES))
+
+
+@numba.njit(cache=True)
+def _interpolate(grid, values, t):
+    """Linear interpolation of `values` (sampled at sorted `grid`) at `t`, clamped at the ends."""
+    if t <= grid[0]:
+        return values[0]
+    if t >= grid[-1]:
+        return values[-1]
+    i = np.searchsorted(grid, t)
+    if grid[i] == t:
+        return values[i]
+    w = (t - grid[i - 1]) / (grid[i] - grid[i - 1])
+    return values[i - 1] + w * (values[i] - values[i - 1])
+
+
+@numba.njit(cache=True)
+def _derivatives(t, y, params, suppression_grid, suppression, dydt):
+    """Writes the time derivative of every member of the ensemble state `y` to `dydt`.
+
+    This is `SEIRModel._time_step` applied to each row of `y` and `params`.
+    """
+    for m in range(y.shape[0]):
+        p = params[m]
+        S = y[m, _S]
+        E = y[m, _E]
+        A = y[m, _A]
+        I = y[m, _I]
+        HNonICU = y[m, _HGEN]
+        HICU = y[m, _HICU]
+        HICUVent = y[m, _HICUVENT]
+        N = p[_P_N]
+
+        number_exposed = (
+            p[_P_BETA]
+            * _interpolate(suppression_grid, suppression[m], t)
+            * S
+            * (p[_P_KAPPA] * I + A)
+            / N
+            + p[_P_BETA_HOSPITAL] * S * (HICU + HNonICU) / N
+        )
+        exposed_and_symptomatic = p[_P_GAMMA] * p[_P_SIGMA] * E
+        exposed_and_asymptomatic = (1 - p[_P_GAMMA]) * p[_P_SIGMA] * E
+        asymptomatic_and_recovered = p[_P_DELTA] * A
+
+        infected_and_recovered_no_hospital = p[_P_DELTA] * I
+        infected_and_in_hospital_general = (
+            I * (p[_P_HOSP_RATE_GENERAL] - p[_P_HOSP_RATE_ICU]) / p[_P_SYMPTOMS_TO_HOSPITAL_DAYS]
+        )
+        infected_and_in_hospital_icu = I * p[_P_HOSP_RATE_ICU] / p[_P_SYMPTOMS_TO_HOSPITAL_DAYS]
+
+        if HICU <= p[_P_BEDS_ICU]:
+            mortality_rate_ICU = p[_P_MORTALITY_FROM_ICU]
+        else:
+            mortality_rate_ICU = p[_P_MORTALITY_NO_ICU_BEDS]
+        if HNonICU <= p[_P_BEDS_GENERAL]:
+            mortality_rate_NonICU = p[_P_MORTALITY_FROM_HOSPITAL]
+        else:
+            mortality_rate_NonICU = p[_P_MORTALITY_NO_GENERAL_BEDS]
+
+        died_from_hosp = HNonICU * mortality_rate_NonICU / p[_P_LOS_GENERAL]
+        died_from_icu = HICU * (1 - p[_P_FRACTION_ICU_VENT]) * mortality_rate_ICU / p[_P_LOS_ICU]
+        died_from_icu_vent = HICUVent * p[_P_MORTALITY_FROM_ICUVENT] / p[_P_LOS_ICU_VENT]
+
+        recovered_after_hospital_general = HNonICU * (1 - mortality_rate_NonICU) / p[_P_LOS_GENERAL]
+        recovered_from_icu_no_vent = (
+            HICU * (1 - mortality_rate_ICU) * (1 - p[_P_FRACTION_ICU_VENT]) / p[_P_LOS_ICU]
+        )
+        recovered_from_icu_vent = (
+            HICUVent
+            * (1 - max(mortality_rate_ICU, p[_P_MORTALITY_FROM_ICUVENT]))
+            / p[_P_LOS_ICU_VENT]
+        )
+
+        dydt[m, _S] = -number_exposed
+        dydt[m, _E] = number_exposed - exposed_and_symptomatic - exposed_and_asymptomatic
+        dydt[m, _A] = exposed_and_asymptomatic - asymptomatic_and_recovered
+        dydt[m, _I] = (
+            exposed_and_symptomatic
+            - infected_and_recovered_no_hospital
+            - infected_and_in_hospital_general
+            - infected_and_in_hospital_icu
+        )
+        dydt[m, _R] = (
+            asymptomatic_and_recovered
+            + infected_and_recovered_no_hospital
+            + recovered_after_hospital_general
+            + recovered_from_icu_vent
+            + recovered_from_icu_no_vent
+        )
+        dydt[m, _HGEN] = (
+            infected_and_in_hospital_general - recovered_after_hospital_general - died_from_hosp
+        )
+        dydt[m, _HICU] = (
+            infected_and_in_hospital_icu
+            - recovered_from_icu_no_vent
+            - recovered_from_icu_vent
+            - died_from_icu
+            - died_from_icu_vent
+        )
+        dydt[m, _HICUVENT] = (
+            infected_and_in_hospital_icu * p[_P_FRACTION_ICU_VENT] - HICUVent / p[_P_LOS_ICU_VENT]
+        )
+        dydt[m, _D] = died_from_icu + died_from_icu_vent + died_from_hosp
+        dydt[m, _HADMISSIONS_GENERAL] = infected_and_in_hospital_general
+        dydt[m, _HADMISSIONS_ICU] = infected_and_in_hospital_icu
+        dydt[m, _TOTAL_INFECTIONS] = exposed_and_symptomatic + exposed_and_asymptomatic
+
+
+@kernels.kernel(
+    "void(float64[:, ::1], float64[:, ::1], float64[::1], int64[::1], float64[::1],"
+    " float64[:, ::1], float64[:, :, ::1])"
+)
+def _integrate_rk4(y0, params, t_list, steps_per_interval, suppression_grid, suppression, out):
+    """Classic RK4 with `steps_per_interval[k]` equal steps between t_list[k] and t_list[k+1]."""
+    y = y0.copy()
+    k1 = np.empty_like(y)
+    k2 = np.empty_like(y)
+    k3 = np.empty_like(y)
+    k4 = np.empty_like(y)
+    out[:, 0, :] = y
+    for k in range(len(t_list) - 1):
+        n_steps = steps_per_interval[k]
+        h = (t_list[k + 1] - t_list[k]) / n_steps
+        for step in range(n_steps):
+            t = t_list[k] + step * h
+            _derivatives(t, y, params, suppression_grid, suppression, k1)
+            _derivatives(t + h / 2, y + h / 2 * k1, params, suppression_grid, suppression, k2)
+            _derivatives(t + h / 2, y + h / 2 * k2, params, suppression_grid, suppression, k3)
+            _derivatives(t + h, y + h * k3, params, suppression_grid, suppression, k4)
+            y += h / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+        out[:, k + 1, :] = y
+
+
+@kernels.kernel(
+    "void(float64[:, ::1], float64[:, ::1], float64[::1], float64, float64, float64[::1],"
+    " float64[:, ::1], float64[:, :, ::1])"
+)
+def _integrate_rk23(y0, params, t_list, rtol, atol, suppression_grid, suppression, out):
+    """Adaptive Bogacki-Shampine RK23 with a step size shared by all members.
+
+    The step is accepted when the largest RMS scaled error of any member is <= 1, following the
+    error control of `scipy.integrate.RK23`. Steps are shortened to land on each t_list point.
+    """
+    y = y0.copy()
+    k1 = np.empty_like(y)
+    k2 = np.empty_like(y)
+    k3 = np.empty_like(y)
+    k4 = np.empty_like(y)
+    n_members, n_states = y.shape
+    out[:, 0, :] = y
+    t = t_list[0]
+    h = min(0.1, t_list[-1] - t_list[0])
+    _derivatives(t, y, params, suppression_grid, suppression, k1)
+    for k in range(len(t_list) - 1):
+        t_end = t_list[k + 1]
+        while t < t_end:
+            h = min(h, t_end - t)
+            _derivatives(t + h / 2, y + h / 2 * k1, params, suppression_grid, suppression, k2)
+            _derivatives(
+                t + 3 * h / 4, y + 3 * h / 4 * k2, params, suppression_grid, suppression, k3
+            )
+            y_new = y + h * (2 / 9 * k1 + 1 / 3 * k2 + 4 / 9 * k3)
+            _derivatives(t + h, y_new, params, suppression_grid, suppression, k4)
+            error = h * (-5 / 72 * k1 + 1 / 12 * k2 + 1 / 9 * k3 - 1 / 8 * k4)
+
+            error_norm = 0.0
+            for m in range(n_members):
+                total = 0.0
+                for i in range(n_states):
+                    scale = atol + rtol * max(abs(y[m, i]), abs(y_new[m, i]))
+                    total += (error[m, i] / scale) ** 2
+                error_norm = max(error_norm, np.sqrt(total / n_states))
+
+            if error_norm <= 1.0:
+                t += h
+                y = y_new
+                k1[:] = k4  # First same as last.
+            if error_norm == 0.0:
+                factor = 5.0
+            else:
+                factor = min(5.0, max(0.2, 0.9 * error_norm ** (-1 / 3)))
+            h *= factor
+        out[:, k + 1, :] = y
+
+
+def _evaluate_policy(policy, times: np.ndarray) -> np.ndarray:
+    """Evaluates a suppression policy at all `times`, with one call when it accepts arrays."""
+    try:
+        values = np.asarray(policy(times), dtype=float)
+    except (TypeError, ValueError):
+        values = None
+    if values is None or values.shape not in ((), times.shape):
+        values = np.array([policy(t) for t in times], dtype=float)
+    return np.broadcast_to(values, times.shape)
+
+
+class SEIRModelEnsemble:
+    """
+    Integrates a batch of `SEIRModel` instances that share the same `t_list`.
+
+    Parameters
+    ----------
+    models: sequence of SEIRModel
+        Models to integrate. Their `results` are set by `run`.
+    steps_per_day: int
+        Number of RK4 steps per day. Also sets the spacing of the suppression policy grid.
+    adaptive: bool
+        If True, use the adaptive RK23 integrator instead of fixed step RK4.
+    rtol, atol: float
+        Tolerances of the adaptive integrator.
+    """
+
+    def __init__(
+        self,
+        models: Sequence[SEIRModel],
+        steps_per_day: int = 4,
+        adaptive: bool = False,
+        rtol: float = 1e-4,
+        atol: float = 1e-3,
+    ):
+        if not models:
+            raise ValueError("An ensemble needs at least one model.")
+        self.models: List[SEIRModel] = list(models)
+        self.t_list = np.asarray(self.models[0].t_list, dtype=float)
+        for model in self.models[1:]:
+            if not np.array_equal(np.asarray(model.t_list, dtype=float), self.t_list):
+                raise ValueError("All models of an ensemble must have the same t_list.")
+        self.steps_per_day = steps_per_day
+        self.adaptive = adaptive
+        self.rtol = rtol
+        self.atol = atol
+
+    def parameters(self) -> np.ndarray:
+        """Returns the (members, len(PARAMETER_NAMES)) parameter matrix."""
+        return np.array(
+            [[getattr(model, name) for name in PARAMETER_NAMES] for model in self.models],
+            dtype=float,
+        )
+
+    def initial_conditions(self) -> np.ndarray:
+        """Returns the (members, 12) initial state."""
+        return np.array([model.initial_conditions() for model in self.models], dtype=float)
+
+    def _steps_per_interval(self) -> np.ndarray:
+        intervals = np.diff(self.t_list)
+        return np.maximum(1, np.ceil(intervals * self.steps_per_day - 1e-9)).astype(np.int64)
+
+    def suppression_grid(self) -> np.ndarray:
+        """Returns times at which the suppression policies are sampled: every RK4 stage time."""
+        steps = self._steps_per_interval()
+        pieces = [
+            np.linspace(t0, t1, 2 * n + 1)[:-1]
+            for t0, t1, n in zip(self.t_list[:-1], self.t_list[1:], steps)
+        ]
+        return np.concatenate(pieces + [self.t_list[-1:]])
+
+    def integrate(self) -> np.ndarray:
+        """Integrates all members and returns the state, shaped (members, len(t_list), 12)."""
+        grid = self.suppression_grid()
+        suppression = np.array(
+            [_evaluate_policy(model.suppression_policy, grid) for model in self.models]
+        )
+        y0 = self.initial_conditions()
+        out = np.empty((len(self.models), len(self.t_list), N_STATES))
+        if self.adaptive:
+            _integrate_rk23(
+                y0, self.parameters(), self.t_list, self.rtol, self.atol, grid, suppression, out
+            )
+        else:
+            _integrate_rk4(
+                y0,
+                self.parameters(),
+                self.t_list,
+                self._steps_per_interval(),
+                grid,
+                suppression,
+                out,
+            )
+        return out
+
+    def run(self) -> None:
+        """Integrates all members and sets `results` of every model, like `SEIRModel.run`."""
+        result_time_series = self.integrate()
+        for model, model_time_series in zip(self.models, result_time_series):
+            model.set_results(model_time_series)
@@ -290,6 +290,9 @@ class SEIRModel:
         self.t_list = t_list
         self.results = None
 
+        # Full state vector to start from, set by `restart_from`.
+        self._initial_state = None
+
     def _time_step(self, y, t):
         """
         One integral moment.
@@ -463,9 +466,24 @@ class SEIRModel:
             'total_deaths':
         }
         """
-        # Initial conditions vector
+        # Integrate the SEIR equations over the time grid, t.
+        result_time_series = odeint(
+            self._time_step, self.initial_conditions(), self.t_list, atol=1e-3, rtol=1e-3
+        )
+        self.set_results(result_time_series)
+
+    def restart_from(self, state) -> None:
+        """Starts the next `run` from `state`, a full state vector such as the last row of the
+        integrated state of another run, instead of the `*_initial` parameters."""
+        self._initial_state = tuple(state)
+
+    def initial_conditions(self) -> tuple:
+        """Returns the initial conditions vector in the order of the `_time_step` state."""
+        if self._initial_state is not None:
+            return self._initial_state
+
         HAdmissions_general, HAdmissions_ICU, TotalAllInfections = 0, 0, 0
-        y0 = (
+        return (
             self.S_initial,
             self.E_initial,
             self.A_initial,
@@ -480,8 +498,8 @@ class SEIRModel:
             TotalAllInfections,
         )
 
-        # Integrate the SEIR equations over the time grid, t.
-        result_time_series = odeint(self._time_step, y0, self.t_list, atol=1e-3, rtol=1e-3)
+    def set_results(self, result_time_series: np.ndarray):
+        """Populates `self.results` from the integrated state, shaped (len(t_list), 12)."""
         (
             S,
             E,
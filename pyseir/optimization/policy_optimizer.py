@@ -1,6 +1,65 @@
+import dataclasses
+import functools
+import time
+from typing import List, Optional, Sequence
+
 import matplotlib.pyplot as plt
+import numpy as np
+from scipy.integrate import odeint
 from scipy.optimize import minimize
 
+from libs import parallel_utils
+from pyseir.models.seir_model import SEIRModel
+
+# Results stored in `fit_results` for each model run.
+FIT_RESULT_KEYS = (
+    "total_deaths",
+    "D",
+    "deaths_from_hospital_bed_limits",
+    "deaths_from_icu_bed_limits",
+    "deaths_from_ventilator_limits",
+)
+
+# SEIRModel results that are sums over t_list rather than part of the integrated state. When a run
+# restarts from the state at `policy_start_time` the sum over the prefix is added back.
+_SUMMED_OVER_T_LIST_RESULTS = ("deaths_from_hospital_bed_limits", "deaths_from_icu_bed_limits")
+
+
+@dataclasses.dataclass
+class OptimizationStats:
+    """Runtime and convergence of one minimization."""
+
+    # Number of calls of the loss function, including those answered from the cache.
+    evaluations: int = 0
+    # Number of calls that ran a model.
+    model_runs: int = 0
+    seconds: float = 0.0
+    # Loss returned by each call of the loss function, in call order.
+    losses: List[float] = dataclasses.field(default_factory=list)
+
+    @property
+    def evaluations_per_second(self) -> float:
+        return self.evaluations / self.seconds if self.seconds else float("nan")
+
+    @property
+    def cache_hit_rate(self) -> float:
+        if not self.evaluations:
+            return float("nan")
+        return 1 - self.model_runs / self.evaluations
+
+    @property
+    def convergence_trace(self) -> np.ndarray:
+        """Lowest loss seen after each evaluation."""
+        return np.minimum.accumulate(np.array(self.losses, dtype=float))
+
+
+def _run_one_start(optimizer: "PolicyOptimizer", minimize_kwargs: dict, x0):
+    """Runs one start of `PolicyOptimizer.run_multi_start`, in a worker process."""
+    optimizer.x0 = x0
+    optimizer.fit_results = {key: [] for key in FIT_RESULT_KEYS}
+    minimization_results = optimizer._minimize(minimize_kwargs)
+    return minimization_results, optimizer.stats, optimizer.fit_results
+
 
 class PolicyOptimizer:
     """
@@ -34,6 +93,14 @@ class PolicyOptimizer:
         Bounds are usually provided sine suppression levels cannot realistically
         vary outside [0, 3]. This is a list of lists e.g. ((0, 3), (0, 3)). on
         parameters.  A given suppression policy may implement these internally.
+    policy_start_time: float or NoneType
+        Time before which every policy produced by parametric_policy is the
+        same. If set, the model is integrated up to this time once and each
+        evaluation continues from that state. Must be a time of t_list. Only
+        supported for SEIRModel.
+    cache_decimals: int or NoneType
+        Losses are memoized by x rounded to this many decimals. None disables
+        the cache.
     """
 
     def __init__(
@@ -44,25 +111,90 @@ class PolicyOptimizer:
         x0,
         parametric_policy_kwargs=None,
         optimization_bounds=None,
+        policy_start_time: Optional[float] = None,
+        cache_decimals: Optional[int] = 6,
     ):
 
         self.seir_model_class = seir_model_class
         self.seir_model_args = seir_model_args
         self.parametric_policy = parametric_policy
-        self.parametric_policy_kwargs = parametric_policy_kwargs
+        self.parametric_policy_kwargs = parametric_policy_kwargs or {}
 
         self.x0 = x0
         self.optimization_bounds = optimization_bounds
 
-        self.fit_results = dict(
-            total_deaths=[],
-            D=[],
-            deaths_from_ventilator_limits=[],
-            deaths_from_icu_bed_limits=[],
-            deaths_from_hospital_bed_limits=[],
-        )
+        if policy_start_time is not None and not issubclass(seir_model_class, SEIRModel):
+            raise ValueError("policy_start_time is only supported for SEIRModel.")
+        if policy_start_time is not None and not np.any(
+            np.asarray(seir_model_args["t_list"]) == policy_start_time
+        ):
+            # The run continuing from the prefix starts at policy_start_time, so it must be the
+            # last time of the prefix.
+            raise ValueError(f"policy_start_time {policy_start_time} is not a time of t_list.")
+        self.policy_start_time = policy_start_time
+        self.cache_decimals = cache_decimals
+
+        self.fit_results = {key: [] for key in FIT_RESULT_KEYS}
         self.minimization_results = None
+        self.multi_start_results = None
         self.best_model = None
+        self.stats = OptimizationStats()
+
+        self._loss_cache = {}
+        # (state, results) of the model integrated up to policy_start_time.
+        self._prefix = None
+
+    def _build_model(self, x, t_list=None):
+        """Returns a model with the policy for `x`, integrating over `t_list` if set."""
+        model_args = dict(self.seir_model_args)
+        if t_list is not None:
+            model_args["t_list"] = t_list
+        return self.seir_model_class(
+            **model_args,
+            # The policy is always built over the full t_list so that it doesn't depend on
+            # whether the run starts from the prefix.
+            suppression_policy=self.parametric_policy(
+                x, t_list=self.seir_model_args["t_list"], **self.parametric_policy_kwargs
+            ),
+        )
+
+    def _prefix_state(self):
+        """Returns the state and results at policy_start_time, integrating them on first use."""
+        if self._prefix is None:
+            t_list = np.asarray(self.seir_model_args["t_list"])
+            model = self._build_model(self.x0, t_list[t_list <= self.policy_start_time])
+            # Same integration as SEIRModel.run, keeping the full state of the last time.
+            # tcrit keeps the solver from stepping past policy_start_time into the policy of x0.
+            state = odeint(
+                model._time_step,
+                model.initial_conditions(),
+                model.t_list,
+                atol=1e-3,
+                rtol=1e-3,
+                tcrit=[self.policy_start_time],
+            )
+            model.set_results(state)
+            self._prefix = (state[-1], model.results)
+        return self._prefix
+
+    def _run_model(self, x) -> dict:
+        """Runs the model for policy parameters `x` and returns the last value of each
+        FIT_RESULT_KEYS result."""
+        if self.policy_start_time is None:
+            model = self._build_model(x)
+            model.run()
+            return {key: model.results.get(key, [np.nan])[-1] for key in FIT_RESULT_KEYS}
+
+        prefix_state, prefix_results = self._prefix_state()
+        t_list = np.asarray(self.seir_model_args["t_list"])
+        model = self._build_model(x, t_list[t_list >= self.policy_start_time])
+        model.restart_from(prefix_state)
+        model.run()
+        final = {key: model.results.get(key, [np.nan])[-1] for key in FIT_RESULT_KEYS}
+        for key in _SUMMED_OVER_T_LIST_RESULTS:
+            # policy_start_time is the last time of the prefix and the first of this run.
+            final[key] += prefix_results[key][-1] - model.results[key][0]
+        return final
 
     def _loss_function(self, x):
         """
@@ -76,35 +208,48 @@ class PolicyOptimizer:
         loss: float
             Loss to minimize.
         """
-        model = self.seir_model_class(
-            **self.seir_model_args,
-            suppression_policy=self.parametric_policy(
-                x, t_list=self.seir_model_args["t_list"], **self.parametric_policy_kwargs
-            )
-        )
+        self.stats.evaluations += 1
+        cache_key = None
+        if self.cache_decimals is not None:
+            cache_key = tuple(np.round(np.asarray(x, dtype=float), self.cache_decimals))
 
-        model.run()
+        if cache_key is not None and cache_key in self._loss_cache:
+            loss = self._loss_cache[cache_key]
+        else:
+            self.stats.model_runs += 1
+            final_results = self._run_model(x)
 
-        # Store array of run results
-        for key in (
-            "total_deaths",
-            "D",
-            "deaths_from_hospital_bed_limits",
-            "deaths_from_icu_bed_limits",
-            "deaths_from_ventilator_limits",
-        ):
-            self.fit_results[key].append(model.results[key][-1])
+            # Store array of run results
+            for key in FIT_RESULT_KEYS:
+                self.fit_results[key].append(final_results[key])
+
+            # This may get memory hungry so leaving out for now...
+            # self.fit_results['models'].append(model)
 
-        # This may get memory hungry so leaving out for now...
-        # self.fit_results['models'].append(model)
+            # We can also add a small Gaussian Prior Toward No Distancing Policy
+            # (i.e. suppression_level=1) to stabilize the Fit
+            # This prior could be refined to be an alternative outcome such as economic incentives
+            loss = final_results["total_deaths"]
+            # + 10 * self.fit_results['total_deaths'][-1] * np.average((x - 1) ** 2)
+            if cache_key is not None:
+                self._loss_cache[cache_key] = loss
 
-        # We can also add a small Gaussian Prior Toward No Distancing Policy
-        # (i.e. suppression_level=1) to stabilize the Fit
-        # This prior could be refined to be an alternative outcome such as economic incentives
-        loss = self.fit_results["total_deaths"][-1]
-        # + 10 * self.fit_results['total_deaths'][-1] * np.average((x - 1) ** 2)
+        self.stats.losses.append(loss)
         return loss
 
+    def _minimize(self, minimize_kwargs):
+        self.stats = OptimizationStats()
+        start = time.time()
+        minimization_results = minimize(
+            self._loss_function, x0=self.x0, bounds=self.optimization_bounds, **minimize_kwargs
+        )
+        self.stats.seconds = time.time() - start
+        return minimization_results
+
+    def _set_best_model(self):
+        self.best_model = self._build_model(self.minimization_results["x"])
+        self.best_model.run()
+
     def run(self, minimize_kwargs=dict(tol=0.01, method=None)):
         """
         Minimize the death rate and select the best performing model.
@@ -118,19 +263,46 @@ class PolicyOptimizer:
         minimization_results: dict
             Results dict from scipy.optimize.minimize.
         """
-        self.minimization_results = minimize(
-            self._loss_function, x0=self.x0, bounds=self.optimization_bounds, **minimize_kwargs
-        )
+        self.minimization_results = self._minimize(minimize_kwargs)
+        self._set_best_model()
 
-        self.best_model = self.seir_model_class(
-            **self.seir_model_args,
-            suppression_policy=self.parametric_policy(
-                self.minimization_results["x"],
-                t_list=self.seir_model_args["t_list"],
-                **self.parametric_policy_kwargs
+        return self.minimization_results
+
+    def run_multi_start(self, x0_list: Sequence, minimize_kwargs=dict(tol=0.01, method=None)):
+        """
+        Minimize from each initial guess in x0_list, in parallel worker processes, and select
+        the best performing model.
+
+        parametric_policy and seir_model_class must be picklable, for example module level
+        functions and classes. `multi_start_results` is set to a list of
+        (minimization_results, OptimizationStats) in the order of x0_list and `stats` to the
+        stats of the best start. The `fit_results` of every start are appended to
+        `fit_results`, in the order of x0_list.
+
+        Returns
+        -------
+        minimization_results: dict
+            Results dict from scipy.optimize.minimize of the best start.
+        """
+        if self.policy_start_time is not None:
+            # Integrate the shared prefix once, before the optimizer is copied to the workers.
+            self._prefix_state()
+
+        fit_results = {key: list(values) for key, values in self.fit_results.items()}
+        starts = list(
+            parallel_utils.parallel_map(
+                functools.partial(_run_one_start, self, minimize_kwargs), list(x0_list)
             )
         )
-        self.best_model.run()
+        for _, _, start_fit_results in starts:
+            for key in FIT_RESULT_KEYS:
+                fit_results[key].extend(start_fit_results[key])
+        self.fit_results = fit_results
+        self.multi_start_results = [(results, stats) for results, stats, _ in starts]
+        self.minimization_results, self.stats = min(
+            self.multi_start_results, key=lambda result: result[0]["fun"]
+        )
+        self._set_best_model()
 
         return self.minimization_results
 
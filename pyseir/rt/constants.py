@@ -21,6 +21,11 @@ class InferRtConstants:
     COUNT_SMOOTHING_WINDOW_SIZE = 19
     COUNT_SMOOTHING_KERNEL_STD = 5
 
+    # Number of trailing daily posteriors stored for incremental inference. Centered smoothing
+    # revises the last COUNT_SMOOTHING_WINDOW_SIZE / 2 days of input on every run so this needs
+    # to be larger than that plus the days between runs.
+    POSTERIOR_STATE_DAYS = 2 * COUNT_SMOOTHING_WINDOW_SIZE
+
     # Sets the default value for sigma before adjustments
     # Recommend .03 (was .05 before when not adjusted) as adjustment moves up
     # Stdev of the process model. Increasing this allows for larger
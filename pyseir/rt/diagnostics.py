@@ -0,0 +1,138 @@
+"""Records the intermediate arrays of Rt inference so that plots can be rendered on demand.
+
+Creating figures for every region during a build costs CPU and disk while most are never looked
+at. A headless `run_rt` saves the arrays needed to draw them to a `RtDiagnosticsStore` and
+`pyseir render-rt-plots` renders PDFs for selected regions later.
+"""
+import dataclasses
+import pathlib
+import re
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+from covidactnow.datapublic.common_fields import CommonFields
+from typing_extensions import final
+
+from libs import pipeline
+import pyseir.utils
+from pyseir.utils import RunArtifact
+
+
+# Prefix of the npz keys holding columns of the `run_rt` output DataFrame.
+_RT_COLUMN_PREFIX = "rt/"
+
+
+@final
+@dataclasses.dataclass(frozen=True)
+class RtDiagnostics:
+    """Inputs and outputs of Rt inference for one region."""
+
+    region: pipeline.Region
+
+    # Observed new cases and the smoothed cases passed to the RtInferenceEngine, both indexed by
+    # the same dates.
+    cases: pd.Series
+    smoothed_cases: pd.Series
+
+    # Output of `RtInferenceEngine.infer_all`, indexed by date and without the location_id column.
+    rt: pd.DataFrame
+
+    @staticmethod
+    def from_inference(
+        region: pipeline.Region,
+        cases: pd.Series,
+        smoothed_cases: pd.Series,
+        output_df: pd.DataFrame,
+    ) -> "RtDiagnostics":
+        if output_df.empty:
+            rt = pd.DataFrame(index=pd.DatetimeIndex([], name=CommonFields.DATE))
+        else:
+            rt = output_df.set_index(CommonFields.DATE).drop(columns=[CommonFields.LOCATION_ID])
+        return RtDiagnostics(region=region, cases=cases, smoothed_cases=smoothed_cases, rt=rt)
+
+    def to_arrays(self) -> dict:
+        arrays = {
+            "location_id": np.array(self.region.location_id),
+            "dates": pd.DatetimeIndex(self.cases.index).values.astype("datetime64[D]"),
+            "cases": self.cases.to_numpy(dtype=float),
+            "smoothed_cases": self.smoothed_cases.reindex(self.cases.index).to_numpy(dtype=float),
+            "rt_dates": pd.DatetimeIndex(self.rt.index).values.astype("datetime64[D]"),
+        }
+        for column in self.rt.columns:
+            arrays[_RT_COLUMN_PREFIX + column] = self.rt[column].to_numpy(dtype=float)
+        return arrays
+
+    @staticmethod
+    def from_arrays(arrays) -> "RtDiagnostics":
+        region = pipeline.Region.from_location_id(str(arrays["location_id"]))
+        dates = pd.DatetimeIndex(arrays["dates"])
+        rt_columns = {
+            key[len(_RT_COLUMN_PREFIX) :]: arrays[key]
+            for key in arrays.keys()
+            if key.startswith(_RT_COLUMN_PREFIX)
+        }
+        rt = pd.DataFrame(
+            rt_columns, index=pd.DatetimeIndex(arrays["rt_dates"], name=CommonFields.DATE)
+        )
+        return RtDiagnostics(
+            region=region,
+            cases=pd.Series(arrays["cases"], index=dates),
+            smoothed_cases=pd.Series(arrays["smoothed_cases"], index=dates),
+            rt=rt,
+        )
+
+
+@final
+@dataclasses.dataclass(frozen=True)
+class RtDiagnosticsStore:
+    """A directory of compressed npz files, one per region, written by a pyseir run."""
+
+    root: pathlib.Path
+
+    def path(self, region: pipeline.Region) -> pathlib.Path:
+        # location_id contains ':' and '#' which are awkward in file names and zip archives.
+        return self.root / (re.sub(r"[^\w-]", "_", region.location_id) + ".npz")
+
+    def write(self, diagnostics: RtDiagnostics) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self.path(diagnostics.region)
+        # Regions are written from many worker processes. Write to a temporary file and rename
+        # it so that readers never see a partially written file.
+        tmp_path = path.with_name(path.name + ".tmp")
+        with tmp_path.open("wb") as f:
+            np.savez_compressed(f, **diagnostics.to_arrays())
+        tmp_path.replace(path)
+
+    def read(self, region: pipeline.Region) -> RtDiagnostics:
+        with np.load(self.path(region)) as npz:
+            return RtDiagnostics.from_arrays(npz)
+
+    def regions(self) -> Iterator[pipeline.Region]:
+        """Yields the regions that have diagnostics in this store."""
+        for path in sorted(self.root.glob("*.npz")):
+            # Loading a npz is lazy; only the location_id member is decompressed here.
+            with np.load(path) as npz:
+                yield pipeline.Region.from_location_id(str(npz["location_id"]))
+
+
+def render(store: RtDiagnosticsStore, region: pipeline.Region, output_dir=None) -> None:
+    """Renders the Rt smoothing and inference reports of `region` from its recorded arrays."""
+    from pyseir.rt import plotting
+
+    diagnostics = store.read(region)
+
+    fig = plotting.plot_smoothed_cases(
+        list(diagnostics.cases.index), diagnostics.cases, diagnostics.smoothed_cases
+    )
+    path = pyseir.utils.get_run_artifact_path(
+        region, RunArtifact.RT_SMOOTHING_REPORT, output_dir=output_dir
+    )
+    plotting.save_and_close(fig, path)
+
+    if not diagnostics.rt.empty:
+        fig = plotting.plot_rt(df=diagnostics.rt, display_name=str(region))
+        path = pyseir.utils.get_run_artifact_path(
+            region, RunArtifact.RT_INFERENCE_REPORT, output_dir=output_dir
+        )
+        plotting.save_and_close(fig, path)
@@ -1,3 +1,7 @@
+import functools
+import hashlib
+import inspect
+import sys
 from typing import Optional
 from dataclasses import dataclass
 from datetime import timedelta
@@ -10,18 +14,21 @@ import math
 import pandas as pd
 from covidactnow.datapublic.common_fields import CommonFields
 from scipy import stats as sps
-from matplotlib import pyplot as plt
 
 from libs.datasets import combined_datasets
 from libs import pipeline
 
 # `timeseries` is used as a local name in this file, complicating importing it as a module name.
 from libs.datasets.timeseries import OneRegionTimeseriesDataset
+from pyseir import kernels
 from pyseir import load_data
 from pyseir.utils import RunArtifact
 import pyseir.utils
+from pyseir.rt import constants
 from pyseir.rt.constants import InferRtConstants
-from pyseir.rt import plotting, utils
+from pyseir.rt import diagnostics
+from pyseir.rt import posterior_state
+from pyseir.rt import utils
 
 rt_log = structlog.get_logger(__name__)
 
@@ -29,7 +36,19 @@ rt_log = structlog.get_logger(__name__)
 SQRT2PI = math.sqrt(2.0 * math.pi)
 
 
-@numba.vectorize([numba.float64(numba.float64, numba.float64, numba.float64)], fastmath=True)
+@functools.lru_cache(None)
+def _engine_hash() -> str:
+    """Returns a hash of the source of the inference code, stored with each PosteriorState so that
+    states written by a different version are not resumed."""
+    h = hashlib.sha256()
+    for module in (sys.modules[__name__], constants, utils):
+        h.update(inspect.getsource(module).encode())
+    return h.hexdigest()
+
+
+@numba.vectorize(
+    [numba.float64(numba.float64, numba.float64, numba.float64)], fastmath=True, cache=True
+)
 def normal_pdf(x, mean, std_deviation):
     """Probability density function at `x` of a normal distribution.
 
@@ -42,7 +61,8 @@ def normal_pdf(x, mean, std_deviation):
     return math.exp(-0.5 * u ** 2) / (SQRT2PI * std_deviation)
 
 
-@numba.njit(fastmath=True)
+# Not fastmath, which `numba.pycc` can't apply, so the AOT and JIT kernels return the same values.
+@kernels.kernel("float64[:, ::1](float64[::1], float64[::1], float64)", aot=True)
 def pdf_vector(x, loc, scale):
     """Replacement for scipy pdf function."""
     array = np.empty((x.size, loc.size))
@@ -88,18 +108,40 @@ def run_rt(
     regional_input: RegionalInput,
     include_testing_correction: bool = False,
     figure_collector: Optional[list] = None,
+    plot: bool = True,
+    diagnostics_store: Optional[diagnostics.RtDiagnosticsStore] = None,
+    posterior_store: Optional[posterior_state.PosteriorStateStore] = None,
+    reuse_posterior_state: bool = True,
+    diagnostics_collector: Optional[list] = None,
 ) -> pd.DataFrame:
     """Entry Point for Infer Rt
 
     Returns an empty DataFrame if inference was not possible.
+
+    Args:
+        plot: If False no figures are created and matplotlib is not imported. Combine with
+            `diagnostics_store` to render the figures later with `pyseir render-rt-plots`.
+        diagnostics_store: If set, the inputs and outputs of the inference are recorded in it.
+        posterior_store: If set, the state of the inference is written to it. When
+            `reuse_posterior_state` is set the inference resumes from the state of the previous
+            run, only calculating posteriors of days with new or revised inputs.
+        diagnostics_collector: If set, the RtDiagnostics recorded in `diagnostics_store` are also
+            appended to it.
     """
+    log = rt_log.new(region=regional_input.display_name)
 
     # Generate the Data Packet to Pass to RtInferenceEngine
-    smoothed_cases = _generate_input_data(
-        regional_input=regional_input,
-        include_testing_correction=include_testing_correction,
-        figure_collector=figure_collector,
-    )
+    observed_new_cases = _load_new_cases(regional_input, include_testing_correction)
+    smoothed_cases = None
+    if observed_new_cases is not None:
+        smoothed_cases = filter_and_smooth_input_data(
+            observed_new_cases,
+            list(observed_new_cases.index),
+            regional_input.region,
+            figure_collector,
+            log,
+            plot=plot,
+        )
     if smoothed_cases is None:
         rt_log.warning(
             event="Infer Rt Skipped. No Data Passed Filter Requirements:",
@@ -113,19 +155,32 @@ def run_rt(
         smoothed_cases, display_name=regional_input.display_name, regional_input=regional_input,
     )
 
+    previous_state = None
+    if posterior_store and reuse_posterior_state:
+        previous_state = posterior_store.read(regional_input.region)
+
     # Generate the output DataFrame (consider renaming the function infer_all to be clearer)
-    output_df = engine.infer_all()
+    output_df = engine.infer_all(plot=plot, previous_state=previous_state)
+
+    if posterior_store and engine.posterior_state is not None:
+        posterior_store.write(regional_input.region, engine.posterior_state)
+
+    if diagnostics_store or diagnostics_collector is not None:
+        rt_diagnostics = diagnostics.RtDiagnostics.from_inference(
+            regional_input.region, observed_new_cases, smoothed_cases, output_df
+        )
+        if diagnostics_store:
+            diagnostics_store.write(rt_diagnostics)
+        if diagnostics_collector is not None:
+            diagnostics_collector.append(rt_diagnostics)
 
     return output_df
 
 
-def _generate_input_data(
-    regional_input: RegionalInput,
-    include_testing_correction: bool,
-    figure_collector: Optional[list],
+def _load_new_cases(
+    regional_input: RegionalInput, include_testing_correction: bool
 ) -> Optional[pd.Series]:
-    """
-    Allow the RtInferenceEngine to be agnostic to aggregation level by handling the loading first
+    """Returns new cases of a region indexed by date or None if they could not be loaded.
 
     include_testing_correction: bool
         If True, include a correction for testing increases and decreases.
@@ -147,16 +202,7 @@ def _generate_input_data(
 
     date = [InferRtConstants.REF_DATE + timedelta(days=int(t)) for t in times]
 
-    observed_new_cases = pd.Series(observed_new_cases, index=date)
-
-    observed_new_cases = filter_and_smooth_input_data(
-        observed_new_cases,
-        date,
-        regional_input.region,
-        figure_collector,
-        rt_log.new(region=regional_input.display_name),
-    )
-    return observed_new_cases
+    return pd.Series(observed_new_cases, index=date)
 
 
 def filter_and_smooth_input_data(
@@ -165,8 +211,12 @@ def filter_and_smooth_input_data(
     region: pipeline.Region,
     figure_collector: Optional[list],
     log: structlog.BoundLoggerBase,
+    plot: bool = True,
 ) -> Optional[pd.Series]:
-    """Do Filtering Here Before it Gets to the Inference Engine"""
+    """Do Filtering Here Before it Gets to the Inference Engine
+
+    If `plot` is False the smoothing figure is not created.
+    """
     MIN_CUMULATIVE_CASE_COUNT = 20
     MIN_INCIDENT_CASE_COUNT = 5
 
@@ -189,23 +239,17 @@ def filter_and_smooth_input_data(
     if not all(requirements):
         return None
 
-    fig = plt.figure(figsize=(10, 6))
-    ax = fig.add_subplot(111)  # plt.axes
-    ax.set_yscale("log")
-    chart_min = max(0.1, smoothed.min())
-    ax.set_ylim((chart_min, cases.max()))
-    plt.scatter(
-        dates[-len(cases) :], cases, alpha=0.3, label=f"Smoothing of: cases",
-    )
-    plt.plot(dates[-len(cases) :], smoothed)
-    plt.grid(True, which="both")
-    plt.xticks(rotation=30)
-    plt.xlim(min(dates[-len(cases) :]), max(dates) + timedelta(days=2))
+    if not plot:
+        return smoothed
+
+    # Imported here so that headless runs don't pay for importing matplotlib.
+    from pyseir.rt import plotting
+
+    fig = plotting.plot_smoothed_cases(dates, cases, smoothed)
 
     if not figure_collector:
         plot_path = pyseir.utils.get_run_artifact_path(region, RunArtifact.RT_SMOOTHING_REPORT)
-        plt.savefig(plot_path, bbox_inches="tight")
-        plt.close(fig)
+        plotting.save_and_close(fig, plot_path)
     else:
         figure_collector["1_smoothed_cases"] = fig
 
@@ -257,6 +301,8 @@ class RtInferenceEngine:
         self.min_conf_width = InferRtConstants.MIN_CONF_WIDTH
         self.log = structlog.getLogger(Rt_Inference_Target=self.display_name)
         self.log_likelihood = None  # TODO: Add this later. Not in init.
+        # Set by `infer_posterior_summary` for storing in a PosteriorStateStore.
+        self.posterior_state: Optional[posterior_state.PosteriorState] = None
         self.log.info(event="Running:")
 
     def evaluate_head_tail_suppression(self):
@@ -350,35 +396,44 @@ class RtInferenceEngine:
 
         return use_sigma, process_matrix
 
-    def get_posteriors(self, dates, timeseries, plot=False):
+    def _initial_prior(self) -> np.ndarray:
+        """Returns the prior of the first day. Gamma mean of "a" with mode of "a-1"."""
+        prior0 = sps.gamma(a=2.5).pdf(self.r_list)
+        prior0 /= prior0.sum()
+        return prior0
+
+    def _advance_posteriors(
+        self,
+        timeseries: pd.Series,
+        posterior: np.ndarray,
+        scale: float,
+        log_likelihood: float,
+        first_day: int,
+    ):
         """
-        Generate posteriors for R_t.
+        Apply Bayes' rule to each day of `timeseries` after the first.
 
         Parameters
         ----------
         timeseries: New X per day (cases).
-        plot: bool
-            If True, plot a cool looking est of posteriors.
+        posterior: np.array
+            Posterior of the first day of `timeseries`.
+        scale: float
+            Moving average of the count scale after the first day.
+        log_likelihood: float
+            Sum of the log likelihoods up to and including the first day.
+        first_day: int
+            Index of the first day of `timeseries` in the complete timeseries.
 
         Returns
         -------
-        dates: array-like
-            Input data over a subset of indices available after windowing.
-        times: array-like
-            Output integers since the reference date.
         posteriors: pd.DataFrame
-            Posterior estimates for each timestamp with non-zero data.
-        start_idx: int
-            Index of first Rt value calculated from input data series
-            #TODO figure out why this value sometimes truncates the series
-
+            Posterior estimates for each day of `timeseries`.
+        scales: np.array
+            Moving average of the count scale after each day.
+        log_likelihoods: np.array
+            Sum of the log likelihoods up to and including each day.
         """
-        if len(timeseries) == 0:
-            self.log.info("empty timeseries, skipping")
-            return None, None, None
-        else:
-            self.log.info("Analyzing posteriors for timeseries")
-
         # (1) Calculate Lambda (the Poisson likelihood given the data) based on
         # the observed increase from t-1 cases to t cases.
         lam = timeseries[:-1].values * np.exp((self.r_list[:, None] - 1) / self.serial_period)
@@ -405,38 +460,35 @@ class RtInferenceEngine:
         # Interpolate between value for ceiling and floor of smoothed counts
         likelihoods = ts_frac * likelihoods_ceil + (1 - ts_frac) * likelihoods_floor
 
-        # (3) Create the (now scaled up for low counts) Gaussian Matrix
-        (current_sigma, process_matrix) = self.make_process_matrix(timeseries.median())
-
-        # (3a) Normalize all rows to sum to 1
-        process_matrix /= process_matrix.sum(axis=0)
-
-        # (4) Calculate the initial prior. Gamma mean of "a" with mode of "a-1".
-        prior0 = sps.gamma(a=2.5).pdf(self.r_list)
-        prior0 /= prior0.sum()
+        # (3) The (now scaled up for low counts) Gaussian process matrix is created for each day
+        # from the moving average of the count scale in the loop below.
 
+        # (4) The prior used when restarting the inference after a day with zero probability.
         reinit_prior = sps.gamma(a=2).pdf(self.r_list)
         reinit_prior /= reinit_prior.sum()
 
         # Create a DataFrame that will hold our posteriors for each day
-        # Insert our prior as the first posterior.
+        # Insert the posterior of the first day, the initial prior when starting from scratch.
         posteriors = pd.DataFrame(
-            index=self.r_list, columns=timeseries.index, data={timeseries.index[0]: prior0}
+            index=self.r_list, columns=timeseries.index, data={timeseries.index[0]: posterior}
         )
 
         # We said we'd keep track of the sum of the log of the probability
-        # of the data for maximum likelihood calculation.
-        log_likelihood = 0.0
-
-        # Initialize timeseries scale (used for auto sigma)
-        scale = timeseries.head(1).item()
+        # of the data for maximum likelihood calculation. `log_likelihood` and the timeseries
+        # scale (used for auto sigma) are recorded for each day so that a later run can resume.
+        scales = np.empty(len(timeseries))
+        scales[0] = scale
+        log_likelihoods = np.empty(len(timeseries))
+        log_likelihoods[0] = log_likelihood
 
         # Setup monitoring for Reff lagging signal in daily likelihood
         monitor = utils.LagMonitor(debug=False)  # Set debug=True for detailed printout of daily lag
 
         # (5) Iteratively apply Bayes' rule
-        loop_idx = 0
-        for previous_day, current_day in zip(timeseries.index[:-1], timeseries.index[1:]):
+        loop_idx = first_day
+        for i, (previous_day, current_day) in enumerate(
+            zip(timeseries.index[:-1], timeseries.index[1:]), start=1
+        ):
 
             # Keep track of exponential moving average of scale of counts of timeseries
             scale = 0.9 * scale + 0.1 * timeseries[current_day]
@@ -484,11 +536,54 @@ class RtInferenceEngine:
 
             # Add to the running sum of log likelihoods
             log_likelihood += np.log(denominator)
+            scales[i] = scale
+            log_likelihoods[i] = log_likelihood
             loop_idx += 1
 
         self.log_likelihood = log_likelihood
 
+        return posteriors, scales, log_likelihoods
+
+    def get_posteriors(self, dates, timeseries, plot=False):
+        """
+        Generate posteriors for R_t.
+
+        Parameters
+        ----------
+        timeseries: New X per day (cases).
+        plot: bool
+            If True, plot a cool looking est of posteriors.
+
+        Returns
+        -------
+        dates: array-like
+            Input data over a subset of indices available after windowing.
+        times: array-like
+            Output integers since the reference date.
+        posteriors: pd.DataFrame
+            Posterior estimates for each timestamp with non-zero data.
+        start_idx: int
+            Index of first Rt value calculated from input data series
+            #TODO figure out why this value sometimes truncates the series
+
+        """
+        if len(timeseries) == 0:
+            self.log.info("empty timeseries, skipping")
+            return None, None, None
+        else:
+            self.log.info("Analyzing posteriors for timeseries")
+
+        posteriors, _, _ = self._advance_posteriors(
+            timeseries,
+            posterior=self._initial_prior(),
+            scale=timeseries.head(1).item(),
+            log_likelihood=0.0,
+            first_day=0,
+        )
+
         if plot:
+            from pyseir.rt import plotting
+
             plotting.plot_posteriors(x=posteriors)  # Returns Figure.
             # The interpreter will handle this as it sees fit. Normal builds never call plot flag.
 
@@ -496,7 +591,95 @@ class RtInferenceEngine:
 
         return dates[start_idx:], posteriors, start_idx
 
-    def infer_all(self, plot=True) -> pd.DataFrame:
+    def summarize_posteriors(self, posteriors: pd.DataFrame) -> pd.DataFrame:
+        """Returns the MAP estimate and confidence intervals of each column of `posteriors`."""
+        df = pd.DataFrame()
+        df[f"Rt_MAP__new_cases"] = posteriors.idxmax()
+        for ci in self.confidence_intervals:
+            ci_low, ci_high = self.highest_density_interval(posteriors, ci=ci)
+
+            low_val = 1 - ci
+            high_val = ci
+            df[f"Rt_ci{int(math.floor(100 * low_val))}__new_cases"] = ci_low
+            df[f"Rt_ci{int(math.floor(100 * high_val))}__new_cases"] = ci_high
+        return df
+
+    def infer_posterior_summary(
+        self, previous_state: Optional[posterior_state.PosteriorState] = None
+    ) -> Optional[pd.DataFrame]:
+        """
+        Calculate the posterior of each day and set `posterior_state` to the state after the
+        last day.
+
+        Parameters
+        ----------
+        previous_state: PosteriorState
+            State of an earlier run. If the inputs of the earlier run are a prefix of the inputs
+            of this run, except for revisions of its last days, only the days after the last
+            unchanged day are calculated.
+
+        Returns
+        -------
+        summary: pd.DataFrame
+            MAP estimates and confidence intervals indexed by date or None if there is no data.
+        """
+        if len(self.cases) == 0:
+            self.log.info("empty timeseries, skipping")
+            return None
+
+        reused_days = 0
+        if previous_state is not None:
+            reused_days = previous_state.reusable_days(_engine_hash(), self.cases)
+
+        if reused_days:
+            self.log.info("Resuming posteriors", reused_days=reused_days, days=len(self.cases))
+            # The posterior of the last unchanged day is the starting point of the update.
+            first_day = reused_days - 1
+            posteriors, scales, log_likelihoods = self._advance_posteriors(
+                self.cases.iloc[first_day:],
+                posterior=previous_state.tail_posteriors[first_day - previous_state.first_tail_day],
+                scale=previous_state.scales[first_day],
+                log_likelihood=previous_state.log_likelihoods[first_day],
+                first_day=first_day,
+            )
+            summary = pd.concat(
+                [previous_state.summary.iloc[:first_day], self.summarize_posteriors(posteriors)]
+            )
+            scales = np.concatenate([previous_state.scales[:first_day], scales])
+            log_likelihoods = np.concatenate(
+                [previous_state.log_likelihoods[:first_day], log_likelihoods]
+            )
+            tail_posteriors = np.concatenate(
+                [
+                    previous_state.tail_posteriors[: first_day - previous_state.first_tail_day],
+                    posteriors.to_numpy(dtype=float).T,
+                ]
+            )
+        else:
+            self.log.info("Analyzing posteriors for timeseries")
+            posteriors, scales, log_likelihoods = self._advance_posteriors(
+                self.cases,
+                posterior=self._initial_prior(),
+                scale=self.cases.head(1).item(),
+                log_likelihood=0.0,
+                first_day=0,
+            )
+            summary = self.summarize_posteriors(posteriors)
+            tail_posteriors = posteriors.to_numpy(dtype=float).T
+
+        self.posterior_state = posterior_state.PosteriorState(
+            engine_hash=_engine_hash(),
+            inputs=self.cases,
+            scales=scales,
+            log_likelihoods=log_likelihoods,
+            summary=summary,
+            tail_posteriors=tail_posteriors[-InferRtConstants.POSTERIOR_STATE_DAYS :],
+        )
+        return summary
+
+    def infer_all(
+        self, plot=True, previous_state: Optional[posterior_state.PosteriorState] = None
+    ) -> pd.DataFrame:
         """
         Infer R_t from all available data sources.
 
@@ -504,6 +687,8 @@ class RtInferenceEngine:
         ----------
         plot: bool
             If True, generate a plot of the inference.
+        previous_state: PosteriorState
+            State of an earlier run of this region, see `infer_posterior_summary`.
 
         Returns
         -------
@@ -512,9 +697,8 @@ class RtInferenceEngine:
         """
         df_all = None
 
-        df = pd.DataFrame()
         try:
-            dates, posteriors, start_idx = self.get_posteriors(self.dates, self.cases)
+            summary = self.infer_posterior_summary(previous_state)
         except Exception as e:
             rt_log.exception(
                 event="Posterior Calculation Error", region=self.regional_input.display_name,
@@ -525,22 +709,10 @@ class RtInferenceEngine:
         # This can cause problems when:
         #   1) computing posteriors that assume continuous data (above),
         #   2) when merging data with variable keys
-        if posteriors is None:
+        if summary is None:
             return pd.DataFrame()
 
-        df[f"Rt_MAP__new_cases"] = posteriors.idxmax()
-        for ci in self.confidence_intervals:
-            ci_low, ci_high = self.highest_density_interval(posteriors, ci=ci)
-
-            low_val = 1 - ci
-            high_val = ci
-            df[f"Rt_ci{int(math.floor(100 * low_val))}__new_cases"] = ci_low
-            df[f"Rt_ci{int(math.floor(100 * high_val))}__new_cases"] = ci_high
-
-        df["date"] = dates
-        df = df.set_index("date")
-
-        df_all = df
+        df_all = summary.rename_axis("date")
 
         df_all["Rt_MAP_composite"] = df_all["Rt_MAP__new_cases"]
         df_all["Rt_ci95_composite"] = df_all["Rt_ci95__new_cases"]
@@ -585,12 +757,14 @@ class RtInferenceEngine:
             ).apply(lambda v: max(v, self.min_conf_width)) + df_all["Rt_MAP_composite"]
 
         if plot:
+            from pyseir.rt import plotting
+
             fig = plotting.plot_rt(df=df_all, display_name=self.display_name)
             if self.figure_collector is None:
                 output_path = pyseir.utils.get_run_artifact_path(
                     self.regional_input.region, RunArtifact.RT_INFERENCE_REPORT
                 )
-                fig.savefig(output_path, bbox_inches="tight")
+                plotting.save_and_close(fig, output_path)
             else:
                 self.figure_collector["3_Rt_inference"] = fig
         if df_all.empty:
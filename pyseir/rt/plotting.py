@@ -20,6 +20,29 @@ def plot_smoothing(x, original, processed, timeseries_type) -> plt.Figure:
     return fig
 
 
+def plot_smoothed_cases(dates, cases, smoothed) -> plt.Figure:
+    """Plots observed new cases and the smoothed cases that Rt is inferred from."""
+    fig = plt.figure(figsize=(10, 6))
+    ax = fig.add_subplot(111)  # plt.axes
+    ax.set_yscale("log")
+    chart_min = max(0.1, smoothed.min())
+    ax.set_ylim((chart_min, cases.max()))
+    plt.scatter(
+        dates[-len(cases) :], cases, alpha=0.3, label=f"Smoothing of: cases",
+    )
+    plt.plot(dates[-len(cases) :], smoothed)
+    plt.grid(True, which="both")
+    plt.xticks(rotation=30)
+    plt.xlim(min(dates[-len(cases) :]), max(dates) + timedelta(days=2))
+    return fig
+
+
+def save_and_close(fig: plt.Figure, path) -> None:
+    """Saves `fig` to `path` and releases the memory held by pyplot for it."""
+    fig.savefig(path, bbox_inches="tight")
+    plt.close(fig)
+
+
 def plot_posteriors(x) -> plt.Figure:
     """
     """
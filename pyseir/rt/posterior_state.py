@@ -0,0 +1,136 @@
+"""Stores the state of Rt inference so that the next run only advances the new days.
+
+The posterior of each day depends only on the smoothed cases up to that day, so when the inputs
+of a region are unchanged except for the most recent days, `RtInferenceEngine.infer_all` starts
+from the stored posterior of the last unchanged day instead of the start of the timeseries.
+Smoothing is centered so every run revises the last few days of input; the posteriors of the
+trailing `InferRtConstants.POSTERIOR_STATE_DAYS` days are kept so that these revisions don't
+force a full recompute.
+"""
+import dataclasses
+import pathlib
+import re
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import structlog
+from typing_extensions import final
+
+from libs import pipeline
+
+
+_log = structlog.get_logger(__name__)
+
+# Prefix of the npz keys holding columns of the posterior summary DataFrame.
+_SUMMARY_COLUMN_PREFIX = "summary/"
+
+
+@final
+@dataclasses.dataclass(frozen=True)
+class PosteriorState:
+    """Inputs and per day state of Rt inference for one region."""
+
+    # Hash of the inference code and constants that produced this state.
+    engine_hash: str
+
+    # Smoothed cases passed to the RtInferenceEngine. They are compared with the inputs of the
+    # next run to find the first revised day.
+    inputs: pd.Series
+
+    # Exponential moving average of the count scale and cumulative log likelihood after each day.
+    scales: np.ndarray
+    log_likelihoods: np.ndarray
+
+    # MAP estimate and confidence intervals of the posterior of each day, indexed by date.
+    summary: pd.DataFrame
+
+    # Posteriors of the last len(tail_posteriors) days, one row per day.
+    tail_posteriors: np.ndarray
+
+    def reusable_days(self, engine_hash: str, inputs: pd.Series) -> int:
+        """Returns the number of leading days of `inputs` whose posterior can be resumed from this
+        state, 0 if inference must start from the first day."""
+        if engine_hash != self.engine_hash:
+            return 0
+        length = min(len(inputs), len(self.inputs))
+        old_values = self.inputs.to_numpy()[:length]
+        new_values = inputs.to_numpy()[:length]
+        same = (self.inputs.index[:length] == inputs.index[:length]) & (
+            (old_values == new_values) | (np.isnan(old_values) & np.isnan(new_values))
+        )
+        unchanged = length if same.all() else int(np.argmin(same))
+        # Inference resumes from the posterior of the last unchanged day, which must be in the tail.
+        if unchanged < 1 or unchanged - 1 < self.first_tail_day:
+            return 0
+        return unchanged
+
+    @property
+    def first_tail_day(self) -> int:
+        """Index in `inputs` of the day of the first row of `tail_posteriors`."""
+        return len(self.inputs) - len(self.tail_posteriors)
+
+    def to_arrays(self, region: pipeline.Region) -> dict:
+        arrays = {
+            "location_id": np.array(region.location_id),
+            "engine_hash": np.array(self.engine_hash),
+            "dates": pd.DatetimeIndex(self.inputs.index).values.astype("datetime64[D]"),
+            "inputs": self.inputs.to_numpy(dtype=float),
+            "scales": self.scales,
+            "log_likelihoods": self.log_likelihoods,
+            "tail_posteriors": self.tail_posteriors,
+        }
+        for column in self.summary.columns:
+            arrays[_SUMMARY_COLUMN_PREFIX + column] = self.summary[column].to_numpy(dtype=float)
+        return arrays
+
+    @staticmethod
+    def from_arrays(arrays) -> "PosteriorState":
+        dates = pd.DatetimeIndex(arrays["dates"])
+        summary_columns = {
+            key[len(_SUMMARY_COLUMN_PREFIX) :]: arrays[key]
+            for key in arrays.keys()
+            if key.startswith(_SUMMARY_COLUMN_PREFIX)
+        }
+        return PosteriorState(
+            engine_hash=str(arrays["engine_hash"]),
+            inputs=pd.Series(arrays["inputs"], index=dates),
+            scales=arrays["scales"],
+            log_likelihoods=arrays["log_likelihoods"],
+            summary=pd.DataFrame(summary_columns, index=dates),
+            tail_posteriors=arrays["tail_posteriors"],
+        )
+
+
+@final
+@dataclasses.dataclass(frozen=True)
+class PosteriorStateStore:
+    """A directory of compressed npz files holding the PosteriorState of each region."""
+
+    root: pathlib.Path
+
+    def path(self, region: pipeline.Region) -> pathlib.Path:
+        # location_id contains ':' and '#' which are awkward in file names and zip archives.
+        return self.root / (re.sub(r"[^\w-]", "_", region.location_id) + ".npz")
+
+    def write(self, region: pipeline.Region, state: PosteriorState) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self.path(region)
+        # Regions are written from many worker processes. Write to a temporary file and rename
+        # it so that readers never see a partially written file.
+        tmp_path = path.with_name(path.name + ".tmp")
+        with tmp_path.open("wb") as f:
+            np.savez_compressed(f, **state.to_arrays(region))
+        tmp_path.replace(path)
+
+    def read(self, region: pipeline.Region) -> Optional[PosteriorState]:
+        """Returns the state of `region` or None if there is no readable state."""
+        path = self.path(region)
+        if not path.exists():
+            return None
+        try:
+            with np.load(path) as npz:
+                return PosteriorState.from_arrays(npz)
+        except Exception:
+            _log.warning("Ignoring unreadable Rt posterior state", path=str(path))
+            return None
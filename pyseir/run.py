@@ -1,8 +1,14 @@
 import dataclasses
+import functools
+import hashlib
+import inspect
 import pathlib
+import pickle
+import re
 from dataclasses import dataclass
 from typing import List
 from typing import Optional
+from typing import Sequence
 
 import pandas as pd
 import structlog
@@ -13,13 +19,121 @@ from libs import pipeline
 from libs.datasets import AggregationLevel
 from libs.datasets.timeseries import MultiRegionDataset
 from libs.datasets.timeseries import OneRegionTimeseriesDataset
+from pyseir import kernels
+from pyseir import load_data
 from pyseir.icu import infer_icu
+from pyseir.icu import utils as icu_utils
+from pyseir.rt import constants as rt_constants
+from pyseir.rt import diagnostics
 from pyseir.rt import infer_rt
+from pyseir.rt import posterior_state
+from pyseir.rt import utils as rt_utils
 from pyseir.utils import SummaryArtifact
 
 # TODO(tom): come up with cleaner handling of log object.
 _log = structlog.get_logger()
 
+# Modules whose source is part of the checkpoint keys, so that checkpoints written by other
+# versions of the Rt and ICU code are not reused.
+_RT_MODULES = (infer_rt, rt_constants, rt_utils, load_data)
+_ICU_MODULES = (infer_icu, icu_utils)
+
+
+@functools.lru_cache(None)
+def _source_hash(modules) -> str:
+    h = hashlib.sha256()
+    for module in modules:
+        h.update(inspect.getsource(module).encode())
+    return h.hexdigest()
+
+
+# Columns of the region timeseries read by `infer_rt.run_rt`, without the testing correction.
+_RT_INPUT_COLUMNS = [CommonFields.DATE, CommonFields.NEW_CASES]
+
+
+def _update_hash_with_timeseries(h, dataset: Optional[OneRegionTimeseriesDataset]) -> None:
+    if dataset is None:
+        h.update(b"None")
+        return
+    h.update(repr(list(dataset.data.columns)).encode())
+    h.update(pd.util.hash_pandas_object(dataset.data, index=True).values.tobytes())
+    h.update(repr(sorted(dataset.latest.items(), key=str)).encode())
+
+
+def rt_checkpoint_key(input: OneRegionTimeseriesDataset) -> str:
+    """Returns a hash of everything the Rt output of `input.region` depends on, so that changes
+    to fields Rt doesn't read, such as vaccinations, don't invalidate the checkpoint."""
+    h = hashlib.sha256()
+    h.update(input.region.location_id.encode())
+    h.update(_source_hash(_RT_MODULES).encode())
+    # A missing column is hashed as a column of NaN, which `run_rt` also skips.
+    rt_input = input.data.reindex(columns=_RT_INPUT_COLUMNS)
+    h.update(pd.util.hash_pandas_object(rt_input, index=False).values.tobytes())
+    return h.hexdigest()
+
+
+def icu_checkpoint_key(icu_input: infer_icu.RegionalInput) -> str:
+    """Returns a hash of everything the ICU output of `icu_input.region` depends on."""
+    h = hashlib.sha256()
+    h.update(icu_input.region.location_id.encode())
+    h.update(_source_hash(_ICU_MODULES).encode())
+    # The lookback window moves with the date the pipeline runs.
+    h.update(str(infer_icu.ICUConfig.LOOKBACK_DATE.date()).encode())
+    h.update(repr(infer_icu.get_region_weight_map().get(icu_input.region)).encode())
+    _update_hash_with_timeseries(h, icu_input.timeseries)
+    _update_hash_with_timeseries(h, icu_input.state_timeseries)
+    return h.hexdigest()
+
+
+@final
+@dataclasses.dataclass(frozen=True)
+class RegionCheckpoint:
+    """Output of OneRegionPipeline for one region and the keys of the inputs it was made from."""
+
+    rt_key: str
+    infer_df: pd.DataFrame
+    # None for regions that don't run ICU, such as CBSAs.
+    icu_key: Optional[str]
+    icu_df: Optional[pd.DataFrame]
+    # Written to the RtDiagnosticsStore of a run that reuses `infer_df`. None if Rt inference was
+    # skipped.
+    rt_diagnostics: Optional[diagnostics.RtDiagnostics] = None
+
+
+@final
+@dataclasses.dataclass(frozen=True)
+class CheckpointStore:
+    """A directory of pickled RegionCheckpoint objects, one per region, written as each region
+    completes so that an interrupted or repeated build can reuse them."""
+
+    root: pathlib.Path
+
+    def path(self, region: pipeline.Region) -> pathlib.Path:
+        # location_id contains ':' and '#' which are awkward in file names.
+        return self.root / (re.sub(r"[^\w-]", "_", region.location_id) + ".pkl")
+
+    def write(self, region: pipeline.Region, checkpoint: RegionCheckpoint) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self.path(region)
+        # Regions are written from many worker processes. Write to a temporary file and rename
+        # it so that a build interrupted mid-write never leaves a partial checkpoint.
+        tmp_path = path.with_name(path.name + ".tmp")
+        with tmp_path.open("wb") as f:
+            pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp_path.replace(path)
+
+    def read(self, region: pipeline.Region) -> Optional[RegionCheckpoint]:
+        """Returns the checkpoint of `region` or None if there is no readable checkpoint."""
+        path = self.path(region)
+        if not path.exists():
+            return None
+        try:
+            with path.open("rb") as f:
+                return pickle.load(f)
+        except Exception:
+            _log.warning("Ignoring unreadable checkpoint", path=str(path))
+            return None
+
 
 @dataclass
 class OneRegionPipeline:
@@ -30,31 +144,93 @@ class OneRegionPipeline:
     icu_data: Optional[OneRegionTimeseriesDataset]
     _combined_data: OneRegionTimeseriesDataset
 
+    # True if the Rt output was reused from a checkpoint instead of inferred.
+    rt_from_checkpoint: bool = False
+
     @staticmethod
-    def run(input: OneRegionTimeseriesDataset) -> "OneRegionPipeline":
-        # `infer_df` does not have the NEW_ORLEANS patch applied. TODO(tom): Rename to something like
-        # infection_rate.
-        infer_rt_input = infer_rt.RegionalInput.from_regional_data(input)
-        try:
-            infer_df = infer_rt.run_rt(infer_rt_input)
-        except Exception:
-            _log.exception(f"run_rt failed for {input.region}")
-            infer_df = pd.DataFrame()
+    def run(
+        input: OneRegionTimeseriesDataset,
+        plot_rt: bool = True,
+        rt_diagnostics_store: Optional[diagnostics.RtDiagnosticsStore] = None,
+        checkpoint_store: Optional[CheckpointStore] = None,
+        reuse_checkpoints: bool = True,
+        posterior_store: Optional[posterior_state.PosteriorStateStore] = None,
+    ) -> "OneRegionPipeline":
+        """Runs the pipeline for `input`. With a `checkpoint_store`, output of a previous run
+        with the same inputs is reused when `reuse_checkpoints` is set and the output of this
+        run is written to the store. With a `posterior_store`, Rt inference of a region with
+        changed inputs resumes from the posteriors of the previous run when `reuse_checkpoints`
+        is set."""
+        previous = None
+        if checkpoint_store and reuse_checkpoints:
+            previous = checkpoint_store.read(input.region)
+
+        rt_key = rt_checkpoint_key(input) if checkpoint_store else None
+        rt_failed = False
+        rt_diagnostics = []
+        if previous and previous.rt_key == rt_key:
+            infer_df = previous.infer_df
+            if previous.rt_diagnostics:
+                rt_diagnostics.append(previous.rt_diagnostics)
+                if rt_diagnostics_store:
+                    rt_diagnostics_store.write(previous.rt_diagnostics)
+        else:
+            # `infer_df` does not have the NEW_ORLEANS patch applied. TODO(tom): Rename to something like
+            # infection_rate.
+            infer_rt_input = infer_rt.RegionalInput.from_regional_data(input)
+            # Takes no time if the kernels were compiled before forking this worker.
+            kernels.warm_up([infer_rt.__name__])
+            try:
+                infer_df = infer_rt.run_rt(
+                    infer_rt_input,
+                    plot=plot_rt,
+                    diagnostics_store=rt_diagnostics_store,
+                    posterior_store=posterior_store,
+                    reuse_posterior_state=reuse_checkpoints,
+                    diagnostics_collector=rt_diagnostics,
+                )
+            except Exception:
+                _log.exception(f"run_rt failed for {input.region}")
+                infer_df = pd.DataFrame()
+                rt_failed = True
 
         icu_data = None
+        icu_key = None
 
         # TODO: Re-enable for CBSAs once typical utilization number aggregation fixed.
         if input.region.level is not AggregationLevel.CBSA:
             icu_input = infer_icu.RegionalInput.from_regional_data(input)
-            try:
-                icu_data = infer_icu.get_icu_timeseries_from_regional_input(
-                    icu_input, weight_by=infer_icu.ICUWeightsPath.ONE_MONTH_TRAILING_CASES
-                )
-            except KeyError:
-                _log.exception(f"Failed to run icu data for {input.region}")
+            icu_key = icu_checkpoint_key(icu_input) if checkpoint_store else None
+            if previous and previous.icu_key == icu_key:
+                if previous.icu_df is not None:
+                    icu_data = OneRegionTimeseriesDataset(input.region, previous.icu_df, {})
+            else:
+                try:
+                    icu_data = infer_icu.get_icu_timeseries_from_regional_input(
+                        icu_input, weight_by=infer_icu.ICUWeightsPath.ONE_MONTH_TRAILING_CASES
+                    )
+                except KeyError:
+                    _log.exception(f"Failed to run icu data for {input.region}")
+
+        # Failed regions are not checkpointed so that they are retried by the next build.
+        if checkpoint_store and not rt_failed:
+            checkpoint_store.write(
+                input.region,
+                RegionCheckpoint(
+                    rt_key=rt_key,
+                    infer_df=infer_df,
+                    icu_key=icu_key,
+                    icu_df=icu_data.data if icu_data else None,
+                    rt_diagnostics=rt_diagnostics[0] if rt_diagnostics else None,
+                ),
+            )
 
         return OneRegionPipeline(
-            region=input.region, infer_df=infer_df, icu_data=icu_data, _combined_data=input,
+            region=input.region,
+            infer_df=infer_df,
+            icu_data=icu_data,
+            _combined_data=input,
+            rt_from_checkpoint=bool(previous and previous.rt_key == rt_key),
         )
 
     def population(self) -> float:
@@ -101,3 +277,12 @@ class PyseirOutputDatasets:
         icu_ds = MultiRegionDataset.from_geodata_timeseries_df(icu_df)
 
         return PyseirOutputDatasets(icu=icu_ds, infection_rate=infection_rate_ds)
+
+    @staticmethod
+    def merge(outputs: Sequence["PyseirOutputDatasets"]) -> "PyseirOutputDatasets":
+        """Combines outputs of disjoint sets of regions, such as the shards of `build-all`."""
+        icu, infection_rate = outputs[0].icu, outputs[0].infection_rate
+        for output in outputs[1:]:
+            icu = icu.append_regions(output.icu)
+            infection_rate = infection_rate.append_regions(output.infection_rate)
+        return PyseirOutputDatasets(icu=icu, infection_rate=infection_rate)
@@ -2,8 +2,6 @@ import os
 from datetime import datetime
 from enum import Enum
 
-from scipy import signal
-
 from libs.pipeline import Region
 
 from pyseir import OUTPUT_DIR
@@ -16,6 +14,8 @@ REPORTS_FOLDER = lambda output_dir, state_name: os.path.join(
 DATA_FOLDER = lambda output_dir, state_name: os.path.join(output_dir, "pyseir", state_name, "data")
 WEB_UI_FOLDER = lambda output_dir: os.path.join(output_dir, "web_ui")
 STATE_SUMMARY_FOLDER = lambda output_dir: os.path.join(output_dir, "pyseir", "state_summaries")
+RT_DIAGNOSTICS_FOLDER = lambda output_dir: os.path.join(output_dir, "pyseir", "rt_diagnostics")
+CHECKPOINT_FOLDER = lambda output_dir: os.path.join(output_dir, "pyseir", "checkpoints")
 REF_DATE = datetime(year=2020, month=1, day=1)
 
 
@@ -191,6 +191,9 @@ def ewma_smoothing(series, tau=5):
     smoothed: array-like
         Smoothed series.
     """
+    # Imported here because scipy is slow to import and only needed by this function.
+    from scipy import signal
+
     exp_window = signal.exponential(2 * tau, 0, tau, False)[::-1]
     exp_window /= exp_window.sum()
     smoothed = signal.convolve(series, exp_window, mode="same")
@@ -4,9 +4,10 @@ Entry point for covid-data-model CLI.
 
 """
 import logging
+import os
+
 import click
 from covidactnow.datapublic import common_init
-from pandarallel import pandarallel
 
 from cli import api
 from cli import data
@@ -19,8 +20,9 @@ from cli import utils
 def entry_point(ctx):  # pylint: disable=no-value-for-parameter
     """Entry point for covid-data-model CLI."""
     common_init.configure_logging(command=ctx.invoked_subcommand)
-
-    pandarallel.initialize(progress_bar=False)
+    # matplotlib is only imported by commands that plot. Default to a non-interactive backend so
+    # that it doesn't search for a GUI toolkit when it is.
+    os.environ.setdefault("MPLBACKEND", "Agg")
 
 
 entry_point.add_command(api.main)
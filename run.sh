@@ -16,6 +16,7 @@ prepare () {
     echo "Example: $0 ../covid-data-public/ ./api-results/"
     echo "Example: $0 ../covid-data-public/ ./api-results/ execute_model"
     echo "Example: $0 ../covid-data-public/ ./api-results/ execute_api"
+    echo "Example: $0 ../covid-data-public/ ./api-results/ execute_sequential"
     exit 1
   else
     DATA_SOURCES_DIR="$(abs_path $1)"
@@ -74,7 +75,7 @@ execute_raw_data_qa() {
   RAW_DATA_OUTPUT_STREAM="/RAW_QA"
   cd "$(dirname "$0")"
   rm -rf "${API_OUTPUT_DIR}${RAW_DATA_OUTPUT_STREAM}"
-  python ./raw_data_QA/check_raw_case_death_data.py --output_dir="${API_OUTPUT_DIR}${RAW_DATA_OUTPUT_STREAM}" --covid_data_public_dir="${DATA_SOURCES_DIR}"
+  python -m raw_data_QA.check_raw_case_death_data --output_dir="${API_OUTPUT_DIR}${RAW_DATA_OUTPUT_STREAM}" --covid_data_public_dir="${DATA_SOURCES_DIR}"
 }
 
 execute_model() {
@@ -88,11 +89,15 @@ execute_model() {
   # Move state output to the expected location.
   mkdir -p ${API_OUTPUT_DIR}/
 
-  # Capture all the PDFs pyseir creates in output/pyseir since they are
-  # extremely helpful for debugging / QA'ing the model results.
-  echo ">>> Generating pyseir.zip from PDFs in output/pyseir."
+  # build-all records Rt diagnostics instead of rendering a PDF for every region. Render the
+  # state level PDFs, which are the ones most used for debugging / QA'ing the model results.
+  # Others can be rendered later from the diagnostics with `pyseir render-rt-plots`.
+  echo ">>> Rendering state level Rt plots from diagnostics in output/pyseir."
+  pyseir render-rt-plots --level state
+
+  echo ">>> Generating pyseir.zip from PDFs and Rt diagnostics in output/pyseir."
   pushd output
-  zip -r "${API_OUTPUT_DIR}/pyseir.zip" pyseir/* -i '*.pdf'
+  zip -r "${API_OUTPUT_DIR}/pyseir.zip" pyseir/* -i '*.pdf' '*.npz'
   popd
 }
 
@@ -146,13 +151,23 @@ execute_zip_folder() {
 }
 
 
-execute() {
+# Runs every step in order, including those whose inputs haven't changed since the last run.
+execute_sequential() {
   execute_model
   execute_api_v2
   execute_api
   execute_zip_folder
 }
 
+# Runs the steps as a DAG of stages, concurrently where they are independent, skipping those whose
+# inputs and code haven't changed since their last run in ${API_OUTPUT_DIR}. See libs/stage_runner.py.
+execute() {
+  # Go to repo root (where run.sh lives).
+  cd "$(dirname "$0")"
+
+  ./run.py utils run-pipeline "${DATA_SOURCES_DIR}" "${API_OUTPUT_DIR}"
+}
+
 ### Utilities for scripting
 
 # Generates a version.json file in the API_OUTPUT_DIR capturing the time
@@ -247,6 +262,10 @@ case $EXECUTE_FUNC in
     echo "Executing Entire Pipeline"
     execute
     ;;
+  execute_sequential)
+    echo "Executing Entire Pipeline Without Skipping Unchanged Stages"
+    execute_sequential
+    ;;
   *)
     echo "Invalid Function. Exiting"
     ;;
@@ -0,0 +1,55 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+from libs.datasets.dataset_utils import REPO_ROOT
+
+# CPU seconds that importing a CLI entry point may take. Every invocation of the CLI pays this,
+# before the command itself runs. CPU time is less affected than wall time by other processes
+# running at the same time, such as other tests.
+IMPORT_TIME_BUDGET_SECONDS = 2.0
+
+# Modules that are slow to import and only needed by some commands. They must be imported inside
+# the commands that use them.
+DEFERRED_MODULES = [
+    "boto3",
+    "gspread",
+    "matplotlib",
+    "numba",
+    "pandarallel",
+    "pyseir.rt.infer_rt",
+    "scipy",
+]
+
+_IMPORT_SCRIPT = """
+import json, sys, time
+start = time.process_time()
+import {module}
+print(json.dumps({{"seconds": time.process_time() - start, "modules": sorted(sys.modules)}}))
+"""
+
+
+def _import_in_new_process(module: str) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", _IMPORT_SCRIPT.format(module=module)],
+        cwd=REPO_ROOT,
+        check=True,
+        stdout=subprocess.PIPE,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+@pytest.mark.parametrize("module", ["run", "cli.api", "cli.data", "cli.utils", "pyseir.cli"])
+def test_heavy_modules_not_imported(module):
+    imported = set(_import_in_new_process(module)["modules"])
+
+    assert imported.isdisjoint(DEFERRED_MODULES)
+
+
+def test_run_import_time_budget():
+    # The fastest of a few imports, to not fail because of an unrelated busy CPU.
+    seconds = min(_import_in_new_process("run")["seconds"] for _ in range(3))
+
+    assert seconds < IMPORT_TIME_BUDGET_SECONDS
@@ -1,4 +1,5 @@
 import pandas as pd
+import pytest
 from covidactnow.datapublic.common_fields import CommonFields
 from covidactnow.datapublic.common_fields import FieldName
 
@@ -87,3 +88,56 @@ def test_zero_value():
     assert differ1.ts_diffs.to_dict(orient="index") == {
         (metric_a, location_id): dict(diff=0, has_overlap=True, points_overlap=2),
     }
+
+
+def test_ts_changes_and_chunks():
+    metric_a = FieldName("metric_a")
+    columns = [CommonFields.LOCATION_ID, CommonFields.DATE, metric_a]
+    df_1 = pd.DataFrame(
+        [
+            ("97", "2020-04-01", 10),
+            ("97", "2020-04-02", 20),
+            ("98", "2020-04-02", 5),
+            ("99", "2020-04-01", 1),
+        ],
+        columns=columns,
+    ).set_index(common_df_diff.TIMESERIES_KEYS)
+    df_2 = pd.DataFrame(
+        [
+            ("97", "2020-04-01", 10),
+            ("97", "2020-04-02", 15),
+            ("97", "2020-04-03", 30),
+            ("98", "2020-04-03", 5),
+            ("99", "2020-04-01", 1),
+        ],
+        columns=columns,
+    ).set_index(common_df_diff.TIMESERIES_KEYS)
+
+    differ1 = DatasetDiff.make(df_1)
+    differ1.compare(DatasetDiff.make(df_2))
+
+    assert differ1.ts_changes.to_dict(orient="index") == {
+        (metric_a, "97"): dict(
+            points_changed=1, max_relative_diff=0.25, start_shift_days=0, end_shift_days=1
+        ),
+        (metric_a, "98"): dict(
+            points_changed=0,
+            max_relative_diff=pytest.approx(float("nan"), nan_ok=True),
+            start_shift_days=1,
+            end_shift_days=1,
+        ),
+        (metric_a, "99"): dict(
+            points_changed=0, max_relative_diff=0, start_shift_days=0, end_shift_days=0
+        ),
+    }
+
+    # Comparing one region at a time gives the same result.
+    differ1_chunked = DatasetDiff.make(df_1)
+    differ2_chunked = DatasetDiff.make(df_2)
+    differ1_chunked.compare(differ2_chunked, max_chunk_bytes=1)
+    pd.testing.assert_frame_equal(differ1_chunked.ts_diffs, differ1.ts_diffs)
+    pd.testing.assert_frame_equal(differ1_chunked.ts_changes, differ1.ts_changes)
+    assert differ2_chunked.my_ts_points.index.to_list() == [
+        (metric_a, "97", pd.Timestamp("2020-04-03")),
+        (metric_a, "98", pd.Timestamp("2020-04-03")),
+    ]
@@ -1,9 +1,18 @@
 import pathlib
 import pytest
+from libs import dataset_deployer
 from libs import pipeline
 from libs.datasets import timeseries
 
 
+@pytest.fixture(autouse=True)
+def artifact_manifest_dir(tmp_path_factory, monkeypatch):
+    """Keeps the manifests of `ArtifactWriter` out of the repo's cache."""
+    manifest_dir = tmp_path_factory.mktemp("artifact-manifests")
+    monkeypatch.setattr(dataset_deployer, "DEFAULT_MANIFEST_DIR", manifest_dir)
+    return manifest_dir
+
+
 @pytest.fixture
 def nyc_fips():
     return "36061"
@@ -1,3 +1,8 @@
+import gzip
+import threading
+
+import pytest
+
 from libs import dataset_deployer
 
 
@@ -18,3 +23,103 @@ def test_write_nested_csv_with_skipped_keys(tmp_path):
     dataset_deployer.write_nested_csv(data, output_path, keys_to_skip=["foo.bar", "bar"])
     header = output_path.read_text().split("\n")[0]
     assert header == "foo.baz"
+
+
+def test_artifact_writer_skips_unchanged_files(tmp_path):
+    path = tmp_path / "region.json"
+    writer = dataset_deployer.ArtifactWriter(tmp_path)
+    assert writer.write(path, '{"cases": 1}')
+    writer.save_manifest()
+    mtime = path.stat().st_mtime_ns
+
+    writer = dataset_deployer.ArtifactWriter(tmp_path)
+    assert not writer.write(path, '{"cases": 1}')
+    assert path.stat().st_mtime_ns == mtime
+    assert writer.write(path, '{"cases": 2}')
+    assert path.read_text() == '{"cases": 2}'
+    assert (writer.written, writer.skipped) == (1, 1)
+
+
+def test_artifact_writer_compressions(tmp_path):
+    import brotli
+
+    path = tmp_path / "region.json"
+    writer = dataset_deployer.ArtifactWriter(
+        tmp_path,
+        compressions=[dataset_deployer.Compression.GZIP, dataset_deployer.Compression.BROTLI],
+        write_uncompressed=False,
+    )
+    writer.write(path, "{}")
+
+    assert not path.exists()
+    assert gzip.decompress((tmp_path / "region.json.gz").read_bytes()) == b"{}"
+    assert brotli.decompress((tmp_path / "region.json.br").read_bytes()) == b"{}"
+
+    # A missing copy is written again even though the content is unchanged.
+    (tmp_path / "region.json.br").unlink()
+    assert writer.write(path, "{}")
+    assert (tmp_path / "region.json.br").exists()
+
+
+def test_artifact_writer_threads(tmp_path):
+    writer = dataset_deployer.ArtifactWriter(
+        tmp_path, compressions=[dataset_deployer.Compression.GZIP], threads=4, fsync=True
+    )
+    for i in range(50):
+        writer.write(tmp_path / f"{i}.json", f'{{"i": {i}}}')
+    writer.save_manifest()
+    writer.close()
+
+    assert (tmp_path / "49.json").read_text() == '{"i": 49}'
+    assert gzip.decompress((tmp_path / "49.json.gz").read_bytes()) == b'{"i": 49}'
+    # Only the files remain, no temporary files. The manifest is outside the tree.
+    assert len(list(tmp_path.iterdir())) == 100
+    assert writer.manifest_path.exists()
+
+
+def test_artifact_writer_blocks_when_queue_full(tmp_path, monkeypatch):
+    release = threading.Event()
+    write_file = dataset_deployer.write_file_atomically
+
+    def slow_write(path, body, fsync=False):
+        release.wait(timeout=10)
+        write_file(path, body, fsync)
+
+    monkeypatch.setattr(dataset_deployer, "write_file_atomically", slow_write)
+    writer = dataset_deployer.ArtifactWriter(tmp_path, threads=1, max_pending=2)
+    writer.write(tmp_path / "0.json", "0")
+    writer.write(tmp_path / "1.json", "1")
+
+    third = threading.Thread(target=writer.write, args=(tmp_path / "2.json", "2"))
+    third.start()
+    third.join(timeout=0.2)
+    assert third.is_alive()
+
+    release.set()
+    third.join(timeout=10)
+    writer.close()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["0.json", "1.json", "2.json"]
+
+
+def test_artifact_writer_raises_write_error_on_flush(tmp_path):
+    writer = dataset_deployer.ArtifactWriter(tmp_path, threads=2)
+    writer.write(tmp_path / "ok.json", "{}")
+    writer.write(tmp_path / "missing-dir" / "region.json", "{}")
+
+    with pytest.raises(FileNotFoundError):
+        writer.save_manifest()
+    writer.save_manifest()
+    writer.close()
+
+    # The failed file is not in the manifest so it is written by the next build.
+    writer = dataset_deployer.ArtifactWriter(tmp_path)
+    assert not writer.write(tmp_path / "ok.json", "{}")
+    (tmp_path / "missing-dir").mkdir()
+    assert writer.write(tmp_path / "missing-dir" / "region.json", "{}")
+
+
+def test_gzip_is_deterministic():
+    compressed = dataset_deployer.Compression.GZIP.compress(b"{}")
+
+    assert gzip.decompress(compressed) == b"{}"
+    assert compressed == dataset_deployer.Compression.GZIP.compress(b"{}")
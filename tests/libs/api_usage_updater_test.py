@@ -1,4 +1,10 @@
 from datetime import datetime
+import http.server
+import json
+import threading
+
+import pytest
+
 from libs import update_api_user_metrics
 
 
@@ -12,3 +18,117 @@ def test_activity_summary_query(mocker):
 
     results = update_api_user_metrics.run_user_activity_summary_query("table", "database")
     assert results == [{"signupDate": now.date().isoformat(), "daysActive": 10}]
+
+
+class _FakeHubSpotHandler(http.server.BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            server.requests.append((self.path.split("?")[0], body))
+            throttled = server.throttle > 0
+            server.throttle -= 1
+        if throttled:
+            self.send_response(429)
+            self.send_header("Retry-After", "0")
+        else:
+            contacts = body if isinstance(body, list) else [body]
+            if any("invalid" in contact["email"] for contact in contacts):
+                self.send_response(400)
+            else:
+                self.send_response(202)
+                with server.lock:
+                    for contact in contacts:
+                        server.contacts[contact["email"]] = {
+                            p["property"]: p["value"] for p in contact["properties"]
+                        }
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def hubspot_server():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _FakeHubSpotHandler)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.contacts = {}
+    server.throttle = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _sync(server, **kwargs) -> update_api_user_metrics.HubSpotSync:
+    host, port = server.server_address
+    return update_api_user_metrics.HubSpotSync(
+        "key", base_url=f"http://{host}:{port}", sleep=lambda seconds: None, **kwargs
+    )
+
+
+def test_hubspot_sync_batches_and_falls_back(hubspot_server):
+    contacts = {f"user{i}@example.com": {"api_days_active": i} for i in range(25)}
+    contacts["invalid@example"] = {"api_days_active": 1}
+    hubspot_server.throttle = 2
+
+    stats = _sync(hubspot_server, batch_size=10).sync(contacts)
+
+    assert stats.updated == 25
+    assert stats.failed == 1
+    # 2 throttled, 3 batches and one contact at a time for the 6 contacts of the rejected batch.
+    assert stats.requests == 2 + 3 + 6
+    paths = {path for path, _ in hubspot_server.requests}
+    assert paths == {
+        "/contacts/v1/contact/batch/",
+        *(f"/contacts/v1/contact/createOrUpdate/email/{email}" for email in list(contacts)[20:]),
+    }
+    del contacts["invalid@example"]
+    assert hubspot_server.contacts == contacts
+
+
+def test_hubspot_sync_skips_unchanged(hubspot_server, tmp_path):
+    state_path = tmp_path / "state.json"
+    contacts = {"a@example.com": {"api_days_active": 1}, "b@example.com": {"api_days_active": 1}}
+    _sync(hubspot_server, state_path=state_path).sync(contacts)
+
+    contacts["b@example.com"] = {"api_days_active": 2}
+    stats = _sync(hubspot_server, state_path=state_path).sync(contacts)
+
+    assert (stats.updated, stats.unchanged, stats.requests) == (1, 1, 1)
+    assert [c["email"] for c in hubspot_server.requests[-1][1]] == ["b@example.com"]
+    assert json.loads(state_path.read_text()) == contacts
+
+
+def test_rate_limiter():
+    now = [0.0]
+
+    def sleep(seconds):
+        now[0] += seconds
+
+    limiter = update_api_user_metrics.RateLimiter(3, 10, clock=lambda: now[0], sleep=sleep)
+    for _ in range(7):
+        limiter.acquire()
+    assert now[0] == 20
+
+
+def test_query_cache(mocker, tmp_path):
+    athena_mock = mocker.patch.object(update_api_user_metrics.boto3, "client").return_value
+    athena_mock.get_query_execution.return_value = {
+        "QueryExecution": {"Status": {"State": "SUCCEEDED"}}
+    }
+    rows = [[{"VarCharValue": "a"}], [{"VarCharValue": "1"}]]
+    athena_mock.get_query_results.return_value = {
+        "ResultSet": {"Rows": [{"Data": row} for row in rows]}
+    }
+
+    for _ in range(2):
+        results = update_api_user_metrics._run_query("db", "SELECT 1", cache_dir=tmp_path)
+        assert results == [{"a": "1"}]
+    update_api_user_metrics._run_query("db", "SELECT 2", cache_dir=tmp_path)
+
+    assert athena_mock.start_query_execution.call_count == 2
+    assert len(list(tmp_path.glob("*.json"))) == 2
@@ -4,6 +4,7 @@ from covidactnow.datapublic.common_fields import CommonFields
 from api.can_api_v2_definition import AnomalyAnnotation
 from api.can_api_v2_definition import FieldSource
 from libs import build_api_v2
+from libs import dataset_deployer
 from libs.metrics import test_positivity
 from libs.datasets import timeseries
 from libs.pipeline import Region
@@ -102,6 +103,32 @@ def test_build_api_output_for_intervention(nyc_regional_input, tmp_path):
     assert set(output_paths) == set(expected_outputs)
 
 
+def test_deploy_single_level_with_writer(nyc_regional_input, tmp_path):
+    all_timeseries_api = api_v2_pipeline.run_on_regions([nyc_regional_input])
+    writer = dataset_deployer.ArtifactWriter(
+        tmp_path, compressions=[dataset_deployer.Compression.GZIP]
+    )
+
+    api_v2_pipeline.deploy_single_level(
+        all_timeseries_api, AggregationLevel.COUNTY, tmp_path, writer=writer
+    )
+    writer.save_manifest()
+    written = writer.written
+    writer = dataset_deployer.ArtifactWriter(tmp_path)
+    api_v2_pipeline.deploy_single_level(
+        all_timeseries_api, AggregationLevel.COUNTY, tmp_path, writer=writer
+    )
+
+    assert sorted(p.name for p in tmp_path.glob("county/36061*")) == [
+        "36061.json",
+        "36061.json.gz",
+        "36061.timeseries.json",
+        "36061.timeseries.json.gz",
+    ]
+    assert written > 0
+    assert (writer.written, writer.skipped) == (0, written)
+
+
 def test_output_no_timeseries_rows(nyc_regional_input, tmp_path):
 
     # Creating a new regional input with an empty timeseries dataset
@@ -171,3 +198,26 @@ def test_annotation(rt_dataset, icu_dataset):
     ]
 
     assert timeseries_for_region.annotations.contactTracers is None
+
+
+def test_deploy_from_timeseries_fragments(nyc_regional_input, il_regional_input, tmp_path):
+    all_timeseries = api_v2_pipeline.run_on_regions([nyc_regional_input, il_regional_input])
+    direct_dir = tmp_path / "direct"
+    api_v2_pipeline.deploy_all_timeseries(
+        all_timeseries, direct_dir, dataset_deployer.ArtifactWriter(direct_dir)
+    )
+    fragments = [tmp_path / "shard0.pkl", tmp_path / "shard1.pkl"]
+    api_v2_pipeline.write_timeseries_fragment(all_timeseries[1:], fragments[0])
+    api_v2_pipeline.write_timeseries_fragment(all_timeseries[:1], fragments[1])
+
+    merged_dir = tmp_path / "merged"
+    api_v2_pipeline.deploy_all_timeseries(
+        api_v2_pipeline.read_timeseries_fragments(fragments),
+        merged_dir,
+        dataset_deployer.ArtifactWriter(merged_dir),
+    )
+
+    direct_files = sorted(p.relative_to(direct_dir) for p in direct_dir.glob("**/*.*"))
+    assert direct_files == sorted(p.relative_to(merged_dir) for p in merged_dir.glob("**/*.*"))
+    for path in direct_files:
+        assert (direct_dir / path).read_bytes() == (merged_dir / path).read_bytes()
@@ -0,0 +1,152 @@
+import datetime
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from libs import api_v2_query_server
+from libs import api_v2_query_store
+from libs.api_v2_query_store import QueryError
+from libs.api_v2_query_store import QueryStore
+from libs.api_v2_query_store import RegionFilter
+from libs.datasets import AggregationLevel
+
+
+def _region(fips: str, level: AggregationLevel, state: str, cases: list) -> dict:
+    dates = [f"2020-12-0{i + 1}" for i in range(len(cases))]
+    return {
+        "fips": fips,
+        "country": "US",
+        "state": state,
+        "county": f"County {fips}" if level is AggregationLevel.COUNTY else None,
+        "level": level.value,
+        "locationId": f"iso1:us#fips:{fips}" if level is not AggregationLevel.CBSA else fips,
+        "population": 1000,
+        "actualsTimeseries": [
+            {"date": date, "cases": value, "hospitalBeds": {"capacity": 10}}
+            for date, value in zip(dates, cases)
+        ],
+        "metricsTimeseries": [{"date": date, "testPositivityRatio": 0.1} for date in dates],
+        "riskLevelsTimeseries": [{"date": date, "overall": 1} for date in dates],
+    }
+
+
+@pytest.fixture
+def store_path(tmp_path):
+    api_root = tmp_path / "api"
+    regions = {
+        "county/36061": _region("36061", AggregationLevel.COUNTY, "NY", [1, 2, 3]),
+        "county/36047": _region("36047", AggregationLevel.COUNTY, "NY", [4, 5, None]),
+        "county/06037": _region("06037", AggregationLevel.COUNTY, "CA", [6]),
+        "state/36": _region("36", AggregationLevel.STATE, "NY", [7, 8]),
+        "cbsa/35620": _region("35620", AggregationLevel.CBSA, None, [9]),
+    }
+    for name, region in regions.items():
+        path = api_root / f"{name}.timeseries.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(region))
+    # Bulk files in the region subdirectories are skipped.
+    (api_root / "county" / "NY.timeseries.json").write_text(json.dumps([regions["county/36061"]]))
+
+    db_path = tmp_path / "store.sqlite"
+    county_to_cbsa = {"36061": "35620", "36047": "35620"}
+    assert api_v2_query_store.build(api_root, db_path, county_to_cbsa=county_to_cbsa) == 5
+    return db_path
+
+
+def test_query_store(store_path):
+    store = QueryStore.open(store_path)
+
+    assert set(store.fields) == {
+        "actuals.cases",
+        "actuals.hospitalBeds.capacity",
+        "metrics.testPositivityRatio",
+        "riskLevels.overall",
+    }
+    assert [r["fips"] for r in store.regions(RegionFilter(state="ny"))] == ["36", "36047", "36061"]
+    assert [r["fips"] for r in store.regions(RegionFilter(cbsa="35620"))] == [
+        "35620",
+        "36047",
+        "36061",
+    ]
+    assert store.timeseries(
+        RegionFilter(level=AggregationLevel.COUNTY, state="NY"),
+        fields=["actuals.cases"],
+        start=datetime.date(2020, 12, 2),
+    ) == [
+        {"fips": "36047", "date": "2020-12-02", "actuals.cases": 5},
+        {"fips": "36047", "date": "2020-12-03"},
+        {"fips": "36061", "date": "2020-12-02", "actuals.cases": 2},
+        {"fips": "36061", "date": "2020-12-03", "actuals.cases": 3},
+    ]
+    assert store.timeseries(RegionFilter(fips=["06037"])) == [
+        {
+            "fips": "06037",
+            "date": "2020-12-01",
+            "actuals.cases": 6,
+            "actuals.hospitalBeds.capacity": 10,
+            "metrics.testPositivityRatio": 0.1,
+            "riskLevels.overall": 1,
+        }
+    ]
+    with pytest.raises(QueryError, match="actuals.foo"):
+        store.timeseries(RegionFilter(), fields=["actuals.foo"])
+
+
+def test_byte_range():
+    assert api_v2_query_server.byte_range(None, 10) is None
+    assert api_v2_query_server.byte_range("bytes=2-4", 10) == (2, 4)
+    assert api_v2_query_server.byte_range("bytes=2-", 10) == (2, 9)
+    assert api_v2_query_server.byte_range("bytes=-3", 10) == (7, 9)
+    assert api_v2_query_server.byte_range("bytes=5-100", 10) == (5, 9)
+    # Multiple ranges aren't supported so the whole body is sent.
+    assert api_v2_query_server.byte_range("bytes=0-1,3-4", 10) is None
+    with pytest.raises(ValueError):
+        api_v2_query_server.byte_range("bytes=10-", 10)
+
+
+def _get(url: str, **headers):
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers)) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, e.read()
+
+
+def test_query_server(store_path):
+    server = api_v2_query_server.QueryServer(("127.0.0.1", 0), store_path)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        url = f"{server.url}/v2/timeseries?fips=36061,36&fields=actuals.cases&end=2020-12-01"
+        status, headers, full_body = _get(url)
+        assert status == 200
+        assert json.loads(full_body) == [
+            {"fips": "36", "date": "2020-12-01", "actuals.cases": 7},
+            {"fips": "36061", "date": "2020-12-01", "actuals.cases": 1},
+        ]
+        assert headers["Accept-Ranges"] == "bytes"
+        etag = headers["ETag"]
+
+        status, headers, body = _get(url, **{"If-None-Match": etag})
+        assert (status, body) == (304, b"")
+
+        status, headers, part = _get(url, Range="bytes=0-9")
+        assert status == 206
+        assert headers["Content-Range"] == f"bytes 0-9/{len(full_body)}"
+        assert part == full_body[:10]
+
+        status, _, _ = _get(url, Range="bytes=100000-")
+        assert status == 416
+        status, _, body = _get(f"{server.url}/v2/timeseries?fields=actuals.foo")
+        assert status == 400
+        assert "actuals.foo" in json.loads(body)["error"]
+        status, _, _ = _get(f"{server.url}/v2/regions?level=planet")
+        assert status == 400
+        status, _, _ = _get(f"{server.url}/v1/regions")
+        assert status == 404
+    finally:
+        server.shutdown()
+        server.server_close()
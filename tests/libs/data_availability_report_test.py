@@ -1,5 +1,7 @@
 import io
 import pandas as pd
+import pytest
+
 from libs.qa import data_availability
 
 
@@ -27,3 +29,39 @@ def test_build_availability_report():
     expected_csv = "\n".join(expected_csv)
     expected_df = pd.read_csv(io.StringIO(expected_csv))
     pd.testing.assert_frame_equal(expected_df, report.reset_index())
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".parquet"])
+def test_write_availability_report(tmp_path, suffix):
+    dataset = pd.DataFrame(
+        {
+            "fips": ["36061", "36", "99001"],
+            "state": ["NY", "NY", None],
+            "aggregate_level": ["county", "state", "county"],
+            "population": [500, 10000, 1],
+            "field1": [1, None, 1],
+        }
+    )
+    report = data_availability.build_data_availability_report(dataset)
+    path = tmp_path / f"report{suffix}"
+
+    data_availability.write_data_availability_report(report, path)
+
+    if suffix == ".csv":
+        written = pd.read_csv(path)
+    else:
+        written = pd.read_parquet(path)
+    # The county without a state isn't in any location group.
+    assert written.to_dict(orient="records") == [
+        dict(location_group="state data", fips=1, population=1, field1=0, num_locations=1),
+        dict(location_group="NY", fips=1, population=1, field1=1, num_locations=1),
+    ]
+
+
+def test_write_availability_report_unsupported_format(tmp_path):
+    path = tmp_path / "reports" / "report.json"
+
+    with pytest.raises(ValueError, match="Unsupported report format"):
+        data_availability.write_data_availability_report(pd.DataFrame({"field1": [1]}), path)
+
+    assert not path.parent.exists()
@@ -0,0 +1,60 @@
+import pandas as pd
+from covidactnow.datapublic.common_fields import CommonFields
+
+from libs.datasets.region_store import RegionStore
+from libs.datasets.timeseries import TagType
+from libs.pipeline import Region
+from tests import test_helpers
+from tests.test_helpers import TimeseriesLiteral
+
+
+def test_region_store(tmp_path):
+    region_tx = Region.from_state("TX")
+    region_sf = Region.from_fips("06075")
+    tail_tag = test_helpers.make_tag(TagType.CUMULATIVE_TAIL_TRUNCATED, original_observation=10.0)
+    dataset = test_helpers.build_dataset(
+        {
+            region_tx: {
+                CommonFields.CASES: TimeseriesLiteral(
+                    [1, 2, 3], provenance="src", annotation=[tail_tag]
+                ),
+            },
+            region_sf: {CommonFields.CASES: [4, 5, 6], CommonFields.DEATHS: [1, 2, None]},
+        },
+        static_by_region_then_field_name={
+            region_tx: {CommonFields.POPULATION: 29_000_000},
+            region_sf: {CommonFields.POPULATION: 800_000},
+        },
+    )
+    loads = []
+
+    def load():
+        loads.append(1)
+        return dataset
+
+    store = RegionStore(load, summary_path=tmp_path / "regions.pkl")
+    store.warm_up().join()
+    assert store.loaded
+
+    for region in [region_tx, region_sf]:
+        one_region = dataset.get_one_region(region)
+        pd.testing.assert_frame_equal(
+            store.region_timeseries(region.location_id),
+            one_region.data.set_index(CommonFields.DATE).drop(columns=CommonFields.LOCATION_ID),
+        )
+        pd.testing.assert_frame_equal(
+            store.region_tag(region.location_id), one_region.tag.reset_index()
+        )
+    assert store.region_timeseries(region_tx.location_id) is store.region_timeseries(
+        region_tx.location_id
+    )
+
+    summary = store.region_summary().set_index("id")
+    assert summary.at[region_tx.location_id, "annotation_count"] == 1
+    assert summary.at[region_sf.location_id, CommonFields.POPULATION] == 800_000
+
+    # A new store reads the summary without loading the dataset.
+    store = RegionStore(load, summary_path=tmp_path / "regions.pkl")
+    pd.testing.assert_frame_equal(store.region_summary().set_index("id"), summary)
+    assert not store.loaded
+    assert len(loads) == 1
@@ -0,0 +1,79 @@
+import datetime
+import pathlib
+
+import git
+import pytest
+from covidactnow.datapublic.common_fields import CommonFields
+
+from libs.datasets import dataset_pointer
+from libs.datasets.snapshot_store import SnapshotStore
+from libs.github_utils import GitSummary
+from tests import test_helpers
+from tests.test_helpers import TimeseriesLiteral
+
+
+def _commit_dataset(repo: git.Repo, cases, when: str, updated_at: str):
+    root = pathlib.Path(repo.working_dir)
+    git_summary = GitSummary(sha="abcdef", branch="main", is_dirty=False)
+    pointer = dataset_pointer.DatasetPointer(
+        dataset_type=dataset_pointer.DatasetType.MULTI_REGION,
+        path=pathlib.Path("data/multiregion.csv"),
+        data_git_info=git_summary,
+        model_git_info=git_summary,
+        updated_at=datetime.datetime.fromisoformat(updated_at),
+    )
+    (root / "data").mkdir(exist_ok=True)
+    dataset = test_helpers.build_default_region_dataset({CommonFields.CASES: cases})
+    dataset.write_to_dataset_pointer(pointer.copy(update={"path": root / pointer.path}))
+    pointer.save(root / "data")
+    repo.index.add([str(path) for path in (root / "data").iterdir()])
+    commit = repo.index.commit("Update dataset", commit_date=when, author_date=when)
+    return commit.hexsha, dataset
+
+
+@pytest.fixture
+def repo(tmp_path):
+    repo = git.Repo.init(tmp_path / "repo")
+    with repo.config_writer() as config:
+        config.set_value("user", "name", "test")
+        config.set_value("user", "email", "test@example.com")
+    return repo
+
+
+def test_snapshot_store(repo, tmp_path):
+    cases = TimeseriesLiteral(
+        [1, 2], provenance="src", annotation=[test_helpers.make_tag(date="2020-04-01")]
+    )
+    first, first_dataset = _commit_dataset(
+        repo, cases, "2020-12-01T10:00:00", "2020-12-01T09:00:00"
+    )
+    second, _ = _commit_dataset(repo, [1, 2, 3], "2020-12-02T10:00:00", "2020-12-02T09:00:00")
+    # Only the pointer changes so the dataset is stored once for both commits.
+    third, _ = _commit_dataset(repo, [1, 2, 3], "2020-12-03T10:00:00", "2020-12-03T09:00:00")
+    store = SnapshotStore(tmp_path / "store", repo=repo)
+
+    dataset = store.load(before=datetime.datetime(2020, 12, 2))
+    test_helpers.assert_dataset_like(dataset, first_dataset)
+    assert store.load().timeseries[CommonFields.CASES].tolist() == [1, 2, 3]
+    assert store.load(commit_sha=second[:8]).timeseries[CommonFields.CASES].tolist() == [1, 2, 3]
+
+    entries = SnapshotStore(tmp_path / "store", repo=repo).entries
+    assert [entry.commit_sha for entry in entries] == [first, second, third]
+    assert entries[1].digest == entries[2].digest != entries[0].digest
+    assert len(list((tmp_path / "store" / "objects").iterdir())) == 2
+
+    with pytest.raises(ValueError):
+        store.load(before=datetime.datetime(2020, 11, 1))
+
+
+def test_snapshot_store_finds_commits_after_index_update(repo, tmp_path):
+    _commit_dataset(repo, [1], "2020-12-01T10:00:00", "2020-12-01T09:00:00")
+    store = SnapshotStore(tmp_path / "store", repo=repo)
+    assert store.load().timeseries[CommonFields.CASES].tolist() == [1]
+
+    newer, _ = _commit_dataset(repo, [1, 2], "2020-12-02T10:00:00", "2020-12-02T09:00:00")
+    store = SnapshotStore(tmp_path / "store", repo=repo)
+
+    # The index has an entry for both lookups but HEAD moved, so the newer commit is found.
+    assert store.find(before=datetime.datetime(2020, 12, 3)).commit_sha == newer
+    assert store.load().timeseries[CommonFields.CASES].tolist() == [1, 2]
@@ -0,0 +1,129 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+import structlog
+from covidactnow.datapublic.common_fields import CommonFields
+
+from libs import github_utils
+from libs import precision
+from libs.datasets import dataset_pointer
+from libs.datasets import timeseries
+from libs.metrics import top_level_metrics
+from libs.pipeline import Region
+from tests import test_helpers
+
+
+def _cumulative(rng: np.random.Generator, start: float, days: int) -> np.ndarray:
+    return np.floor(start + np.cumsum(rng.uniform(0, start / 50, size=days)))
+
+
+@pytest.fixture
+def pointer(tmp_path) -> dataset_pointer.DatasetPointer:
+    git_summary = github_utils.GitSummary(sha="abcdef", branch="main", is_dirty=True)
+    pointer = dataset_pointer.DatasetPointer(
+        dataset_type=dataset_pointer.DatasetType.MULTI_REGION,
+        path=tmp_path / "multiregion.csv",
+        data_git_info=git_summary,
+        model_git_info=git_summary,
+        updated_at=datetime.datetime.utcnow(),
+    )
+
+    rng = np.random.default_rng(1234)
+    days = 40
+    counties = [Region.from_fips(fips) for fips in ["36047", "36061", "36081", "36005"]]
+    dataset = test_helpers.build_dataset(
+        {
+            county: {
+                # Large enough that a float32 sum or diff would lose the last digits.
+                CommonFields.CASES: _cumulative(rng, 3_123_457 * (i + 1), days),
+                CommonFields.DEATHS: _cumulative(rng, 12_345, days),
+                CommonFields.NEGATIVE_TESTS: _cumulative(rng, 9_876_543, days),
+                CommonFields.POSITIVE_TESTS: _cumulative(rng, 123_457, days),
+                CommonFields.TEST_POSITIVITY: rng.uniform(0, 0.3, size=days),
+                CommonFields.CURRENT_ICU: rng.integers(10, 500, size=days),
+                CommonFields.CURRENT_ICU_TOTAL: rng.integers(500, 900, size=days),
+                CommonFields.ICU_BEDS: rng.integers(900, 1000, size=days),
+                CommonFields.CONTACT_TRACERS_COUNT: rng.integers(100, 200, size=days),
+                CommonFields.VACCINATIONS_INITIATED: _cumulative(rng, 234_567, days),
+                CommonFields.VACCINATIONS_COMPLETED: _cumulative(rng, 34_567, days),
+            }
+            for i, county in enumerate(counties)
+        },
+        static_by_region_then_field_name={
+            county: {CommonFields.POPULATION: 1_234_567 * (i + 1), CommonFields.STATE: "NY"}
+            for i, county in enumerate(counties)
+        },
+    )
+    dataset.write_to_dataset_pointer(pointer)
+    return pointer
+
+
+def _run_pipeline(pointer: dataset_pointer.DatasetPointer, dtype: str) -> pd.DataFrame:
+    """Returns the metrics calculated from the dataset read from `pointer`, in `dtype` mode."""
+    with precision.use_float_dtype(dtype):
+        dataset = timeseries.MultiRegionDataset.read_from_pointer(pointer)
+        assert (dataset.timeseries.dtypes == dtype).all()
+        dataset = timeseries.add_new_cases(dataset)
+        region_ny = Region.from_state("NY")
+        state = timeseries.aggregate_regions(
+            dataset,
+            {region: region_ny for region, _ in dataset.iter_one_regions()},
+            [
+                timeseries.StaticWeightedAverageAggregation(
+                    CommonFields.TEST_POSITIVITY, CommonFields.POPULATION
+                )
+            ],
+        )
+        state = state.add_static_values(
+            pd.DataFrame(
+                [{CommonFields.LOCATION_ID: region_ny.location_id, CommonFields.STATE: "NY"}]
+            )
+        )
+        dataset = dataset.append_regions(state)
+
+        metrics = []
+        for region, one_region in dataset.iter_one_regions():
+            region_metrics, _ = top_level_metrics.calculate_metrics_for_timeseries(
+                one_region, None, None, structlog.get_logger(), require_recent_icu_data=False
+            )
+            metrics.append(region_metrics)
+        return pd.concat(metrics)
+
+
+def test_float32_parity(pointer):
+    metrics_64 = _run_pipeline(pointer, "float64")
+    metrics_32 = _run_pipeline(pointer, "float32")
+
+    # Metrics are written with 7 significant digits. A value that is formatted differently in
+    # float32 mode is at a tie, such as 0.22865225, which one float64 ulp in the input flips.
+    pd.testing.assert_index_equal(metrics_32.columns, metrics_64.columns)
+    pd.testing.assert_index_equal(metrics_32.index, metrics_64.index)
+    np.testing.assert_allclose(
+        metrics_32.select_dtypes("number"), metrics_64.select_dtypes("number"), rtol=1e-6
+    )
+    formatted_32 = metrics_32.to_csv(float_format="%.7g").splitlines()
+    formatted_64 = metrics_64.to_csv(float_format="%.7g").splitlines()
+    assert sum(a != b for a, b in zip(formatted_32, formatted_64)) <= len(formatted_64) // 20
+
+
+def test_to_float64():
+    values = pd.Series([0.1, 1234567.0, 2.5e-8, 0.0, -3.0, np.nan], dtype="float32")
+
+    converted = precision.to_float64(values)
+
+    assert converted.dtype == "float64"
+    np.testing.assert_array_equal(converted, [0.1, 1234567.0, 2.5e-8, 0.0, -3.0, np.nan])
+
+
+def test_downcast_only_in_float32_mode():
+    df = pd.DataFrame({"a": [1.5], "b": [1], "c": ["x"]})
+
+    assert precision.downcast(df) is df
+    with precision.use_float_dtype("float32"):
+        assert precision.downcast(df).dtypes.to_dict() == {
+            "a": np.dtype("float32"),
+            "b": np.dtype("int64"),
+            "c": np.dtype("object"),
+        }
@@ -0,0 +1,85 @@
+import pathlib
+
+import pandas as pd
+import pytest
+from covidactnow.datapublic.common_fields import CommonFields
+
+import pyseir.run
+from libs import shards
+from libs.pipeline import Region
+from tests import test_helpers
+
+
+def _regions():
+    counties = [Region.from_fips(f"06{i:03}") for i in range(1, 12, 2)]
+    counties += [Region.from_fips(f"36{i:03}") for i in range(1, 8, 2)]
+    counties += [Region.from_fips("02013")]
+    states = [Region.from_state(state) for state in ["CA", "NY", "AK", "TX"]]
+    cbsas = [Region.from_cbsa_code("10100"), Region.from_cbsa_code("10140")]
+    return counties + states + cbsas
+
+
+def test_parse():
+    assert shards.Shard.parse("1/4") == shards.Shard(1, 4)
+    assert str(shards.Shard(1, 4)) == "1/4"
+    assert shards.Shard(1, 4).directory(pathlib.Path("out")) == pathlib.Path("out/shards/1-of-4")
+    for value in ["4/4", "1", "-1/4", "a/b"]:
+        with pytest.raises(ValueError):
+            shards.Shard.parse(value)
+
+
+def test_partition():
+    regions = _regions()
+
+    partitioned = shards.partition(regions, 3)
+
+    assert sorted(r.location_id for shard in partitioned for r in shard) == sorted(
+        r.location_id for r in regions
+    )
+    # The regions of a state are together and the shards are balanced.
+    shard_of_state = {}
+    for i, shard in enumerate(partitioned):
+        for region in shard:
+            if region.state:
+                assert shard_of_state.setdefault(region.state, i) == i
+    assert [len(shard) for shard in partitioned] == [7, 5, 5]
+    # The partition doesn't depend on the order of the regions.
+    assert shards.partition(list(reversed(regions)), 3) == partitioned
+    assert shards.Shard(2, 3).regions(regions) == partitioned[2]
+
+
+def test_merge_pyseir_output():
+    regions = [Region.from_state("AK"), Region.from_state("CA"), Region.from_fips("06001")]
+    dataset = test_helpers.build_dataset(
+        {region: {CommonFields.ICU_BEDS: [i, i + 1.5]} for i, region in enumerate(regions)}
+    )
+    outputs = [
+        pyseir.run.PyseirOutputDatasets(
+            icu=dataset.get_regions_subset(shard), infection_rate=dataset.get_regions_subset(shard)
+        )
+        for shard in shards.partition(regions, 2)
+    ]
+
+    merged = pyseir.run.PyseirOutputDatasets.merge(outputs)
+
+    pd.testing.assert_frame_equal(merged.icu.timeseries, dataset.timeseries.sort_index())
+    pd.testing.assert_frame_equal(merged.infection_rate.timeseries, dataset.timeseries.sort_index())
+
+
+def test_merge_files(tmp_path):
+    shard_dirs = [tmp_path / "0-of-2", tmp_path / "1-of-2"]
+    (shard_dirs[0] / "rt_posteriors").mkdir(parents=True)
+    (shard_dirs[0] / "iso1_us_ak.pkl").write_text("ak")
+    (shard_dirs[0] / "rt_posteriors" / "iso1_us_ak.npz").write_text("ak posterior")
+    (shard_dirs[0] / "iso1_us_ca.pkl.tmp").write_text("partial")
+    shard_dirs[1].mkdir()
+    (shard_dirs[1] / "iso1_us_ca.pkl").write_text("ca")
+
+    copied = shards.merge_files(shard_dirs + [tmp_path / "missing"], tmp_path / "merged")
+
+    assert copied == 3
+    assert sorted(
+        str(path.relative_to(tmp_path / "merged"))
+        for path in (tmp_path / "merged").rglob("*")
+        if path.is_file()
+    ) == ["iso1_us_ak.pkl", "iso1_us_ca.pkl", "rt_posteriors/iso1_us_ak.npz"]
@@ -0,0 +1,168 @@
+import pathlib
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from libs import stage_runner
+from libs.datasets import dataset_utils
+from libs.stage_runner import Stage
+from libs.stage_runner import StageStatus
+
+
+def _copy_stage(name: str, source: str, destination: str) -> Stage:
+    """Returns a stage that copies file `source` to `destination`, appending its name."""
+    script = (
+        "import sys, pathlib; "
+        "text = pathlib.Path(sys.argv[1]).read_text(); "
+        "pathlib.Path(sys.argv[2]).write_text(text + sys.argv[3])"
+    )
+    return Stage(
+        name,
+        command=(sys.executable, "-c", script, source, destination, name),
+        inputs=(pathlib.Path(source),),
+        outputs=(pathlib.Path(destination),),
+    )
+
+
+def _statuses(results):
+    return {result.name: result.status for result in results}
+
+
+def test_run_skips_unchanged_stages(tmp_path):
+    (tmp_path / "input.txt").write_text("in")
+    (tmp_path / "other.txt").write_text("other")
+    stages = [
+        _copy_stage("b", "a.txt", "b.txt"),
+        _copy_stage("a", "input.txt", "a.txt"),
+        _copy_stage("c", "other.txt", "c.txt"),
+    ]
+    runner = stage_runner.StageRunner(stages, tmp_path / "state.json", cwd=tmp_path)
+    assert runner.dependencies == {"a": set(), "b": {"a"}, "c": set()}
+
+    assert set(_statuses(runner.run()).values()) == {StageStatus.RAN}
+    assert (tmp_path / "b.txt").read_text() == "inab"
+    assert set(_statuses(runner.run()).values()) == {StageStatus.CACHED}
+
+    (tmp_path / "input.txt").write_text("changed")
+    assert _statuses(runner.run()) == {
+        "b": StageStatus.RAN,
+        "a": StageStatus.RAN,
+        "c": StageStatus.CACHED,
+    }
+    assert (tmp_path / "b.txt").read_text() == "changedab"
+
+    # A missing output is rebuilt.
+    (tmp_path / "c.txt").unlink()
+    assert _statuses(runner.run(["c"])) == {"c": StageStatus.RAN}
+    assert _statuses(runner.run(["b"], force=True)) == {"b": StageStatus.RAN, "a": StageStatus.RAN}
+
+
+def test_run_skips_stages_after_failure(tmp_path):
+    stages = [
+        _copy_stage("a", "missing.txt", "a.txt"),
+        _copy_stage("b", "a.txt", "b.txt"),
+    ]
+    runner = stage_runner.StageRunner(stages, tmp_path / "state.json", cwd=tmp_path)
+
+    results = runner.run()
+
+    assert _statuses(results) == {"a": StageStatus.FAILED, "b": StageStatus.SKIPPED}
+    assert "failed" in stage_runner.format_summary(results, 1.0)
+
+
+def test_run_independent_stages_concurrently(tmp_path):
+    # Each stage waits for the other to start, so the run only finishes if they run together.
+    barrier = threading.Barrier(2, timeout=10)
+
+    def run_command(stage, cwd):
+        barrier.wait()
+        return True
+
+    stages = [Stage("a", ("a",)), Stage("b", ("b",))]
+    runner = stage_runner.StageRunner(
+        stages, tmp_path / "state.json", cwd=tmp_path, max_workers=2, run_command=run_command
+    )
+
+    assert set(_statuses(runner.run()).values()) == {StageStatus.RAN}
+
+
+def test_dependency_cycle(tmp_path):
+    stages = [_copy_stage("a", "b.txt", "a.txt"), _copy_stage("b", "a.txt", "b.txt")]
+    with pytest.raises(ValueError, match="cycle"):
+        stage_runner.StageRunner(stages, tmp_path / "state.json", cwd=tmp_path)
+
+
+def test_run_sh_stages():
+    stages = stage_runner.run_sh_stages(pathlib.Path("/data"), pathlib.Path("/output"))
+    runner = stage_runner.StageRunner(stages, pathlib.Path("/unused"))
+
+    assert runner.dependencies == {
+        "model": set(),
+        "test_positivity": set(),
+        "api_v2": {"model"},
+        "zip": {"model", "test_positivity", "api_v2"},
+    }
+
+
+def test_run_sh_stages_changing_api_code_keeps_model_cached(tmp_path):
+    for path in stage_runner.PYTHON_CODE + stage_runner.MODEL_CODE:
+        if path.endswith((".py", ".sh", ".txt")):
+            (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+            (tmp_path / path).write_text("")
+    for path in stage_runner.COMBINED_DATASET:
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text("")
+    (tmp_path / "api" / "can_api_v2_definition.py").parent.mkdir()
+    (tmp_path / "api" / "can_api_v2_definition.py").write_text("")
+    (tmp_path / "pyseir" / "run.py").parent.mkdir()
+    (tmp_path / "pyseir" / "run.py").write_text("")
+
+    def run_command(stage, cwd):
+        for output in stage.outputs:
+            output.parent.mkdir(parents=True, exist_ok=True)
+            output.write_text(stage.name)
+        return True
+
+    stages = stage_runner.run_sh_stages(tmp_path / "data", tmp_path / "output")
+    runner = stage_runner.StageRunner(
+        stages, tmp_path / "state.json", cwd=tmp_path, run_command=run_command
+    )
+    assert set(_statuses(runner.run()).values()) == {StageStatus.RAN}
+
+    (tmp_path / "api" / "can_api_v2_definition.py").write_text("# changed")
+    statuses = _statuses(runner.run())
+    assert statuses["model"] == StageStatus.CACHED
+    assert statuses["api_v2"] == StageStatus.RAN
+
+    (tmp_path / "pyseir" / "run.py").write_text("# changed")
+    assert _statuses(runner.run())["model"] == StageStatus.RAN
+
+
+def test_model_code_contains_modules_imported_by_pyseir():
+    # Run in a new process so that modules imported by other tests aren't included. The modules
+    # that the commands of pyseir.cli import when they run are imported too.
+    script = (
+        "import sys, pyseir.cli, pyseir.run, pyseir.kernels, pyseir.rt.infer_rt; "
+        "print('\\n'.join(getattr(m, '__file__', None) or '' for m in list(sys.modules.values())))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", script], check=True, capture_output=True, text=True
+    ).stdout
+    repo_root = dataset_utils.REPO_ROOT.resolve()
+    imported = {
+        pathlib.Path(path).resolve().relative_to(repo_root)
+        for path in output.splitlines()
+        if path and repo_root in pathlib.Path(path).resolve().parents
+    }
+    # Only the code of the repo, not packages in a virtualenv in the repo.
+    imported = {path for path in imported if path.parts[0] in ("api", "cli", "libs", "pyseir")}
+    model_code = [pathlib.Path(path) for path in stage_runner.MODEL_CODE]
+
+    assert imported
+    assert [
+        path
+        for path in sorted(imported)
+        if not any(path == c or c in path.parents for c in model_code)
+    ] == []
@@ -0,0 +1,68 @@
+import json
+
+from click.testing import CliRunner
+
+from cli import utils
+from libs import parallel_utils
+from libs import timing_utils
+
+
+def _square(value: int) -> int:
+    with timing_utils.span("square", items=1):
+        return value * value
+
+
+def test_spans_not_recorded_outside_run_report():
+    with timing_utils.span("stage") as span:
+        timing_utils.count("rows", 3)
+
+    assert not timing_utils.recording()
+    assert span.calls == 0
+    assert list(parallel_utils.parallel_map(_square, [1, 2])) == [1, 4]
+
+
+def test_run_report_nested_spans(tmp_path):
+    with timing_utils.run_report("test run", output_dir=tmp_path) as root:
+        for _ in range(3):
+            with timing_utils.span("outer", regions=2):
+                with timing_utils.span("inner"):
+                    timing_utils.count("rows", 5)
+
+    assert not timing_utils.recording()
+    outer = root.children["outer"]
+    assert outer.calls == 3
+    assert outer.counts == {"regions": 6}
+    assert outer.children["inner"].counts == {"rows": 15}
+    assert root.wall_seconds >= outer.wall_seconds >= outer.children["inner"].wall_seconds
+    (report_path,) = tmp_path.glob("test_run-*.json")
+    report = json.loads(report_path.read_text())
+    assert report["name"] == "test run"
+    assert timing_utils.read_run_report(report_path) == root
+
+
+def test_parallel_map_aggregates_worker_spans(tmp_path):
+    with timing_utils.run_report("parallel", output_dir=tmp_path) as root:
+        results = list(parallel_utils.parallel_map(_square, [1, 2, 3]))
+
+    assert results == [1, 4, 9]
+    map_span = root.children["parallel_map:_square"]
+    assert map_span.calls == 1
+    task_span = map_span.children[timing_utils.RecordedCall.TASK_SPAN_NAME]
+    assert task_span.calls == 3
+    assert task_span.children["square"].calls == 3
+    assert task_span.children["square"].counts == {"items": 3}
+
+
+def test_compare_run_reports(tmp_path):
+    for name in ["old", "new"]:
+        with timing_utils.run_report("build", output_dir=tmp_path / name):
+            with timing_utils.span("stage"):
+                pass
+    (old_path,) = (tmp_path / "old").glob("*.json")
+    (new_path,) = (tmp_path / "new").glob("*.json")
+
+    result = CliRunner().invoke(
+        utils.compare_run_reports, [str(old_path), str(new_path)], catch_exceptions=False
+    )
+
+    assert "build/stage" in result.output
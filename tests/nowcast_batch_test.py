@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pyseir.models.nowcast_batch import ModelRunBatch
+from pyseir.models.nowcast_batch import run_stationary_batch
+from pyseir.models.nowcast_seir_model import ModelRun, NowcastingSEIRModel
+
+T_LIST = np.linspace(100, 160, 61)
+
+
+def _historical_compartments(scale):
+    t = np.linspace(80, 160, 81)
+    return {
+        "nC": pd.Series(scale * np.exp((t - 100) / 40), index=t),
+        "H": pd.Series(scale * 0.5 * np.exp((t - 100) / 50), index=t),
+        "nD": pd.Series(scale * 0.02 * np.exp((t - 100) / 60), index=t),
+    }
+
+
+def _runs():
+    """Scenarios covering the options of ModelRun, built on fresh models each call."""
+    runs = []
+    for rt in (0.8, 1.0, 1.3):
+        model = NowcastingSEIRModel()
+        runs.append(
+            ModelRun(
+                model,
+                N=5e6,
+                t_list=T_LIST,
+                testing_rate_f=lambda t: 20000.0 + 50.0 * t,
+                rt_f=lambda t, rt=rt: rt + 0.002 * (t - 100),
+                case_median_age_f=lambda t: 40.0 + 0.05 * (t - 100),
+                initial_compartments={"nC": 1000.0, "H": 400.0, "nD": 10.0},
+                auto_initialize_other_compartments=True,
+                auto_calibrate=True,
+            )
+        )
+        # Shares the calibrated model with the previous run.
+        runs.append(
+            ModelRun(
+                model,
+                N=5e6,
+                t_list=T_LIST,
+                testing_rate_f=None,
+                rt_f=lambda t, rt=rt: rt,
+                case_median_age_f=lambda t: 50.0,
+                historical_compartments=_historical_compartments(1000.0 * rt),
+                auto_initialize_other_compartments=True,
+            )
+        )
+        runs.append(
+            ModelRun(
+                NowcastingSEIRModel(delay_ci_h=2),
+                N=2e7,
+                t_list=T_LIST,
+                testing_rate_f=lambda t: 3000.0,
+                rt_f=lambda t, rt=rt: rt,
+                case_median_age_f=lambda t: 38.0,
+                initial_compartments={"I": 1000.0},
+                force_stationary=True,
+            )
+        )
+    return runs
+
+
+def test_parity_with_execute_lists_ratios():
+    expected = [run.execute_lists_ratios() for run in _runs()]
+
+    histories, ratios = ModelRunBatch(_runs()).execute()
+
+    for (expected_history, expected_ratios), history, run_ratios in zip(
+        expected, histories, ratios
+    ):
+        np.testing.assert_array_equal(history, np.array(expected_history, dtype=float))
+        assert run_ratios == expected_ratios
+
+
+def test_execute_dataframes_ratios_sets_results():
+    runs = _runs()[:2]
+
+    output = ModelRunBatch(runs).execute_dataframes_ratios()
+
+    assert len(output) == 2
+    for run, (df, ratios) in zip(runs, output):
+        assert run.results is df
+        assert len(df) == len(T_LIST)
+        assert ratios["SMAPE"] >= 0.0
+
+
+def test_runs_with_different_days():
+    runs = _runs()[:2]
+    runs[1].t_list = np.linspace(100, 130, 31)
+
+    with pytest.raises(ValueError):
+        ModelRunBatch(runs)
+
+
+def test_runs_with_later_today():
+    runs = _runs()[:2]
+    runs[1].today = runs[1].t_list[0] + 8
+
+    with pytest.raises(ValueError, match="today"):
+        ModelRunBatch(runs)
+
+
+def test_run_stationary_batch():
+    model = NowcastingSEIRModel()
+    scenarios = [
+        (rt, 38.0, t_over_x, x_is_new_cases)
+        for rt in (0.7, 1.2)
+        for t_over_x in (0.3, 10.0)
+        for x_is_new_cases in (True, False)
+    ]
+
+    output = run_stationary_batch(model, scenarios)
+
+    assert output == [model.run_stationary(*scenario) for scenario in scenarios]
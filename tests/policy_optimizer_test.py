@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+
+from pyseir.models.seir_model import SEIRModel
+from pyseir.models.seir_model_age import SEIRModelAge
+from pyseir.optimization import PolicyOptimizer
+
+T_LIST = np.linspace(0, 150, 151)
+POLICY_START_TIME = 60
+N = 1000000
+
+
+def _step_policy(x, t_list, start_time=POLICY_START_TIME):
+    return lambda t: 1.0 if t < start_time else x[0]
+
+
+def _optimizer(**kwargs):
+    return PolicyOptimizer(
+        seir_model_class=SEIRModel,
+        seir_model_args=dict(
+            N=N,
+            t_list=T_LIST,
+            A_initial=100,
+            I_initial=100,
+            beds_general=N / 1000,
+            beds_ICU=N / 5000,
+            ventilators=N / 10000,
+        ),
+        parametric_policy=_step_policy,
+        x0=np.array([0.8]),
+        optimization_bounds=[(0.3, 1.0)],
+        **kwargs,
+    )
+
+
+def test_loss_is_memoized():
+    optimizer = _optimizer()
+
+    first = optimizer._loss_function(np.array([0.5]))
+    assert optimizer._loss_function(np.array([0.5 + 1e-9])) == first
+    optimizer._loss_function(np.array([0.6]))
+
+    assert optimizer.stats.evaluations == 3
+    assert optimizer.stats.model_runs == 2
+    assert optimizer.stats.cache_hit_rate == pytest.approx(1 / 3)
+    assert len(optimizer.fit_results["total_deaths"]) == 2
+    # Not produced by SEIRModel.
+    assert np.isnan(optimizer.fit_results["deaths_from_ventilator_limits"]).all()
+
+
+def test_prefix_reuse_matches_full_run():
+    full = _optimizer()
+    prefix = _optimizer(policy_start_time=POLICY_START_TIME)
+
+    for level in (0.4, 0.7, 1.0):
+        expected = full._run_model(np.array([level]))
+        actual = prefix._run_model(np.array([level]))
+        for key in ("total_deaths", "D", "deaths_from_icu_bed_limits"):
+            assert actual[key] == pytest.approx(expected[key], rel=0.02, abs=1.0)
+
+
+def test_prefix_reuse_requires_seir_model():
+    with pytest.raises(ValueError):
+        PolicyOptimizer(
+            seir_model_class=SEIRModelAge,
+            seir_model_args=dict(t_list=T_LIST),
+            parametric_policy=_step_policy,
+            x0=np.array([0.8]),
+            policy_start_time=POLICY_START_TIME,
+        )
+
+
+def test_policy_start_time_must_be_in_t_list():
+    with pytest.raises(ValueError, match="not a time of t_list"):
+        _optimizer(policy_start_time=POLICY_START_TIME + 0.5)
+
+
+def test_run_records_convergence():
+    optimizer = _optimizer(policy_start_time=POLICY_START_TIME)
+
+    results = optimizer.run()
+
+    assert optimizer.best_model is not None
+    assert optimizer.stats.evaluations == len(optimizer.stats.losses)
+    assert optimizer.stats.evaluations_per_second > 0
+    trace = optimizer.stats.convergence_trace
+    assert (np.diff(trace) <= 0).all()
+    assert trace[-1] == pytest.approx(results["fun"])
+
+
+def test_run_multi_start():
+    optimizer = _optimizer(policy_start_time=POLICY_START_TIME)
+
+    results = optimizer.run_multi_start([np.array([0.9]), np.array([0.4])])
+
+    assert len(optimizer.multi_start_results) == 2
+    assert results["fun"] == min(result["fun"] for result, _ in optimizer.multi_start_results)
+    assert optimizer.best_model.results["total_deaths"][-1] == pytest.approx(
+        results["fun"], rel=0.05
+    )
+    # The model runs of both starts are recorded.
+    assert len(optimizer.fit_results["total_deaths"]) == sum(
+        stats.model_runs for _, stats in optimizer.multi_start_results
+    )
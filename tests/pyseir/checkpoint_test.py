@@ -0,0 +1,113 @@
+from unittest import mock
+
+import pandas as pd
+from covidactnow.datapublic.common_fields import CommonFields
+
+from libs import pipeline
+from libs.datasets.timeseries import OneRegionTimeseriesDataset
+from pyseir import run
+from pyseir.rt import diagnostics
+from pyseir.rt import infer_rt
+
+# CBSAs don't run ICU, which needs the combined dataset.
+REGION = pipeline.Region.from_cbsa_code("10100")
+
+
+def _input(new_cases=(1.0, 2.0, 3.0), vaccinations=(0.0, 0.0, 0.0)) -> OneRegionTimeseriesDataset:
+    data = pd.DataFrame(
+        {
+            CommonFields.LOCATION_ID: REGION.location_id,
+            CommonFields.DATE: pd.date_range("2020-08-01", periods=len(new_cases)),
+            CommonFields.NEW_CASES: new_cases,
+            CommonFields.VACCINATIONS_INITIATED: vaccinations,
+        }
+    )
+    return OneRegionTimeseriesDataset(REGION, data, {CommonFields.POPULATION: 1000})
+
+
+def _fake_run_rt(regional_input, diagnostics_store=None, diagnostics_collector=None, **kwargs):
+    cases = regional_input.timeseries.data.set_index(CommonFields.DATE)[CommonFields.NEW_CASES]
+    output_df = pd.DataFrame(
+        {
+            CommonFields.DATE: cases.index[-1:],
+            CommonFields.LOCATION_ID: [REGION.location_id],
+            "Rt_MAP_composite": [1.1],
+        }
+    )
+    rt_diagnostics = diagnostics.RtDiagnostics.from_inference(REGION, cases, cases, output_df)
+    if diagnostics_store:
+        diagnostics_store.write(rt_diagnostics)
+    if diagnostics_collector is not None:
+        diagnostics_collector.append(rt_diagnostics)
+    return output_df
+
+
+def test_unchanged_region_reuses_checkpoint(tmp_path):
+    store = run.CheckpointStore(tmp_path)
+
+    with mock.patch.object(infer_rt, "run_rt", side_effect=_fake_run_rt) as run_rt:
+        first = run.OneRegionPipeline.run(_input(), plot_rt=False, checkpoint_store=store)
+        second = run.OneRegionPipeline.run(_input(), plot_rt=False, checkpoint_store=store)
+        changed = run.OneRegionPipeline.run(
+            _input(new_cases=(1.0, 2.0, 4.0)), plot_rt=False, checkpoint_store=store
+        )
+        ignored = run.OneRegionPipeline.run(
+            _input(new_cases=(1.0, 2.0, 4.0)),
+            plot_rt=False,
+            checkpoint_store=store,
+            reuse_checkpoints=False,
+        )
+
+    assert run_rt.call_count == 3
+    assert not first.rt_from_checkpoint
+    assert second.rt_from_checkpoint
+    assert not changed.rt_from_checkpoint
+    assert not ignored.rt_from_checkpoint
+    pd.testing.assert_frame_equal(second.infer_df, first.infer_df)
+    assert store.read(REGION).rt_key == run.rt_checkpoint_key(_input(new_cases=(1.0, 2.0, 4.0)))
+
+
+def test_rt_checkpoint_key_ignores_fields_rt_does_not_read():
+    assert run.rt_checkpoint_key(_input()) == run.rt_checkpoint_key(
+        _input(vaccinations=(10.0, 20.0, 30.0))
+    )
+    assert run.rt_checkpoint_key(_input()) != run.rt_checkpoint_key(
+        _input(new_cases=(1.0, 2.0, 4.0))
+    )
+
+
+def test_reused_checkpoint_writes_rt_diagnostics(tmp_path):
+    store = run.CheckpointStore(tmp_path / "checkpoints")
+    first_diagnostics = diagnostics.RtDiagnosticsStore(tmp_path / "first")
+    second_diagnostics = diagnostics.RtDiagnosticsStore(tmp_path / "second")
+
+    with mock.patch.object(infer_rt, "run_rt", side_effect=_fake_run_rt):
+        run.OneRegionPipeline.run(
+            _input(), plot_rt=False, rt_diagnostics_store=first_diagnostics, checkpoint_store=store
+        )
+        second = run.OneRegionPipeline.run(
+            _input(), plot_rt=False, rt_diagnostics_store=second_diagnostics, checkpoint_store=store
+        )
+
+    assert second.rt_from_checkpoint
+    assert list(second_diagnostics.regions()) == [REGION]
+    pd.testing.assert_frame_equal(
+        second_diagnostics.read(REGION).rt, first_diagnostics.read(REGION).rt
+    )
+
+
+def test_failed_region_is_not_checkpointed(tmp_path):
+    store = run.CheckpointStore(tmp_path)
+
+    with mock.patch.object(infer_rt, "run_rt", side_effect=ValueError):
+        pipeline_output = run.OneRegionPipeline.run(_input(), plot_rt=False, checkpoint_store=store)
+
+    assert pipeline_output.infer_df.empty
+    assert store.read(REGION) is None
+
+
+def test_unreadable_checkpoint_is_ignored(tmp_path):
+    store = run.CheckpointStore(tmp_path)
+    store.path(REGION).write_bytes(b"not a pickle")
+
+    assert store.read(REGION) is None
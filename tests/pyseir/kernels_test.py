@@ -0,0 +1,51 @@
+import importlib.util
+
+import numpy as np
+import pytest
+
+from libs import timing_utils
+from pyseir import kernels
+from pyseir.rt import infer_rt
+
+
+def test_warm_up_compiles_the_signature_used_by_inference():
+    kernels.warm_up([infer_rt.__name__])
+    (registered,) = kernels.registered_kernels([infer_rt.__name__])
+    r_list = np.linspace(0, 5, 11)
+
+    infer_rt.pdf_vector(r_list, r_list, 0.3)
+
+    assert len(registered.dispatcher.signatures) == len(registered.signatures)
+
+
+def test_warm_up_recorded_in_run_report(tmp_path):
+    with timing_utils.run_report("warm up", output_dir=tmp_path) as root:
+        seconds = kernels.warm_up([infer_rt.__name__])
+
+    assert list(seconds) == ["pyseir.rt.infer_rt.pdf_vector"]
+    assert root.children["compile kernels"].counts == {"kernels": 1}
+
+
+@pytest.mark.slow
+def test_compile_aot_matches_jit(tmp_path):
+    path = kernels.compile_aot(tmp_path)
+    spec = importlib.util.spec_from_file_location(kernels.AOT_MODULE_NAME, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    (registered,) = kernels.registered_kernels([infer_rt.__name__])
+    r_list = np.linspace(0, 5, 11)
+
+    aot_pdf_vector = getattr(module, registered.export_name)
+
+    np.testing.assert_array_equal(
+        aot_pdf_vector(r_list, r_list, 0.3), registered.dispatcher(r_list, r_list, 0.3)
+    )
+    assert (tmp_path / kernels.AOT_MANIFEST_PATH.name).exists()
+
+
+def test_aot_kernel_with_jit_options_is_refused():
+    def add_one(x):
+        return x + 1
+
+    with pytest.raises(ValueError, match="can't have options"):
+        kernels.kernel("float64(float64)", aot=True, fastmath=True)(add_one)
@@ -0,0 +1,93 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from pyseir import load_data
+
+
+def _contact_matrix_json(fips):
+    path = os.path.join(load_data.DATA_DIR, "contact_matrix", "contact_matrix_fips_CA.json")
+    with open(path) as f:
+        return json.load(f)[fips]
+
+
+def test_contact_matrix_loaded_once_per_state():
+    cache = load_data.ModelInputCache()
+
+    assert cache.contact_matrix("06") == _contact_matrix_json("06")
+    assert cache.contact_matrix("06075") == _contact_matrix_json("06075")
+
+    stats = cache.stats()[load_data.CONTACT_MATRIX]
+    assert stats.loads == 1
+    assert stats.hits == 1
+    assert stats.npz_loads == 0
+
+    # Each caller gets its own copy.
+    cache.contact_matrix("06")["contact_matrix"][0][0] = -1
+    assert cache.contact_matrix("06") == _contact_matrix_json("06")
+
+
+def test_contact_matrix_npz(tmp_path):
+    load_data.ModelInputCache(npz_dir=str(tmp_path)).contact_matrix("06")
+    assert (tmp_path / "contact_matrix_fips_CA.npz").exists()
+
+    cache = load_data.ModelInputCache(npz_dir=str(tmp_path))
+
+    assert cache.contact_matrix("06037") == _contact_matrix_json("06037")
+    assert cache.stats()[load_data.CONTACT_MATRIX].npz_loads == 1
+
+
+def test_table_by_fips_and_npz(tmp_path):
+    df = pd.DataFrame(
+        {
+            "fips": ["06075", "36061", "06075"],
+            "date": pd.to_datetime(["2020-03-01", "2020-03-01", "2020-03-02"]),
+            "m50_index": [100.0, 90.0, 80.0],
+        }
+    )
+    df.to_pickle(str(tmp_path / f"{load_data.MOBILITY_M50_INDEX}.pkl"))
+    npz_dir = tmp_path / "npz"
+    cache = load_data.ModelInputCache(data_dir=str(tmp_path), npz_dir=str(npz_dir))
+
+    table = cache.table(load_data.MOBILITY_M50_INDEX)
+    assert cache.table(load_data.MOBILITY_M50_INDEX) is table
+    assert cache.table_for_fips(load_data.MOBILITY_M50_INDEX, "06075")["m50_index"].tolist() == [
+        100.0,
+        80.0,
+    ]
+    assert cache.table_for_fips(load_data.MOBILITY_M50_INDEX, "01001").empty
+    stats = cache.stats()[load_data.MOBILITY_M50_INDEX]
+    assert (stats.loads, stats.hits) == (1, 2)
+
+    # A new process reads the npz copy, with the same contents.
+    os.remove(tmp_path / f"{load_data.MOBILITY_M50_INDEX}.pkl")
+    from_npz = load_data.ModelInputCache(data_dir=str(tmp_path), npz_dir=str(npz_dir)).table(
+        load_data.MOBILITY_M50_INDEX
+    )
+    pd.testing.assert_frame_equal(from_npz, table)
+
+
+def test_table_with_missing_values_is_not_converted_to_npz(tmp_path):
+    df = pd.DataFrame({"fips": ["06075", "36061", "06037"], "name": ["a", None, np.nan]})
+    df.to_pickle(str(tmp_path / f"{load_data.PUBLIC_IMPLEMENTATIONS}.pkl"))
+    npz_dir = tmp_path / "npz"
+
+    table = load_data.ModelInputCache(data_dir=str(tmp_path), npz_dir=str(npz_dir)).table(
+        load_data.PUBLIC_IMPLEMENTATIONS
+    )
+
+    assert table["name"].tolist()[0] == "a"
+    assert table["name"].isna().tolist() == [False, True, True]
+    assert not (npz_dir / f"{load_data.PUBLIC_IMPLEMENTATIONS}.npz").exists()
+
+
+def test_load_contact_matrix_data_by_fips():
+    data = load_data.load_contact_matrix_data_by_fips(["06075", "06037"])
+
+    assert list(data) == ["06075", "06037"]
+    np.testing.assert_array_equal(
+        data["06075"]["contact_matrix"], _contact_matrix_json("06075")["contact_matrix"]
+    )
+    assert load_data.model_inputs().stats()[load_data.CONTACT_MATRIX].loads >= 1
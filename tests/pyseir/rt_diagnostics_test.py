@@ -0,0 +1,72 @@
+import pandas as pd
+import structlog
+from covidactnow.datapublic.common_fields import CommonFields
+
+from libs import pipeline
+from pyseir.rt import diagnostics
+from pyseir.rt import infer_rt
+from tests.mocks.inference import load_data
+from tests.mocks.inference.load_data import RateChange
+
+
+def _synthetic_cases() -> pd.Series:
+    spec = load_data.DataSpec(
+        generator_type=load_data.DataGeneratorType.EXP,
+        disable_deaths=True,
+        scale=1000.0,
+        ratechange1=RateChange(0, 1.0),
+        ratechange2=RateChange(80, 1.5),
+    )
+    return load_data.create_synthetic_cases(load_data.DataGenerator(spec))
+
+
+def test_filter_and_smooth_headless():
+    cases = _synthetic_cases()
+    collector = {}
+
+    smoothed = infer_rt.filter_and_smooth_input_data(
+        cases,
+        cases.index,
+        region=pipeline.Region.from_fips("20"),
+        figure_collector=collector,
+        log=structlog.getLogger(),
+        plot=False,
+    )
+
+    assert smoothed is not None
+    assert collector == {}
+
+
+def test_store_round_trip(tmp_path):
+    region = pipeline.Region.from_fips("06075")
+    cases = _synthetic_cases()
+    smoothed = cases.rolling(3, min_periods=1).mean()
+    output_df = pd.DataFrame(
+        {
+            CommonFields.DATE: cases.index[-3:],
+            "Rt_MAP_composite": [1.0, 1.1, 1.2],
+            "Rt_ci95_composite": [1.5, 1.6, 1.7],
+            CommonFields.LOCATION_ID: region.location_id,
+        }
+    )
+    store = diagnostics.RtDiagnosticsStore(tmp_path / "rt_diagnostics")
+
+    store.write(diagnostics.RtDiagnostics.from_inference(region, cases, smoothed, output_df))
+    read = store.read(region)
+
+    assert list(store.regions()) == [region]
+    assert read.region == region
+    pd.testing.assert_series_equal(read.cases, cases, check_names=False)
+    pd.testing.assert_series_equal(read.smoothed_cases, smoothed, check_names=False)
+    assert list(read.rt.columns) == ["Rt_MAP_composite", "Rt_ci95_composite"]
+    assert read.rt["Rt_MAP_composite"].tolist() == [1.0, 1.1, 1.2]
+
+
+def test_store_empty_inference(tmp_path):
+    region = pipeline.Region.from_fips("36")
+    cases = _synthetic_cases()
+    store = diagnostics.RtDiagnosticsStore(tmp_path)
+
+    store.write(diagnostics.RtDiagnostics.from_inference(region, cases, cases, pd.DataFrame()))
+
+    assert store.read(region).rt.empty
@@ -0,0 +1,90 @@
+import pandas as pd
+import structlog
+from covidactnow.datapublic.common_fields import CommonFields
+
+from libs import pipeline
+from libs.datasets.timeseries import OneRegionTimeseriesDataset
+from pyseir.rt import infer_rt
+from pyseir.rt import posterior_state
+from tests.mocks.inference import load_data
+from tests.mocks.inference.load_data import RateChange
+
+REGION = pipeline.Region.from_cbsa_code("10100")
+
+
+def _cases() -> pd.Series:
+    spec = load_data.DataSpec(
+        generator_type=load_data.DataGeneratorType.EXP,
+        disable_deaths=True,
+        scale=200.0,
+        ratechange1=RateChange(0, 1.2),
+        ratechange2=RateChange(60, 0.8),
+    )
+    return load_data.create_synthetic_cases(load_data.DataGenerator(spec))
+
+
+def _smooth(cases: pd.Series) -> pd.Series:
+    return infer_rt.filter_and_smooth_input_data(
+        cases, list(cases.index), REGION, None, structlog.get_logger(), plot=False
+    )
+
+
+def _engine(smoothed: pd.Series) -> infer_rt.RtInferenceEngine:
+    data = pd.DataFrame({CommonFields.LOCATION_ID: [], CommonFields.DATE: []})
+    regional_input = infer_rt.RegionalInput.from_regional_data(
+        OneRegionTimeseriesDataset(REGION, data, {})
+    )
+    return infer_rt.RtInferenceEngine(
+        smoothed, display_name=str(REGION), regional_input=regional_input
+    )
+
+
+def test_resume_matches_full_inference():
+    cases = _cases()
+    earlier = _smooth(cases.iloc[:-5])
+    later = _smooth(cases)
+    earlier_engine = _engine(earlier)
+    earlier_engine.infer_all(plot=False)
+    state = earlier_engine.posterior_state
+
+    reused_days = state.reusable_days(infer_rt._engine_hash(), later)
+    resumed = _engine(later).infer_all(plot=False, previous_state=state)
+    full = _engine(later).infer_all(plot=False)
+
+    # Smoothing revises the last days of the earlier input, which are calculated again.
+    assert len(earlier) - infer_rt.InferRtConstants.COUNT_SMOOTHING_WINDOW_SIZE < reused_days
+    assert reused_days < len(earlier)
+    pd.testing.assert_frame_equal(resumed, full)
+
+
+def test_revised_history_is_recomputed():
+    cases = _cases()
+    earlier_engine = _engine(_smooth(cases))
+    earlier_engine.infer_all(plot=False)
+    revised_cases = cases.copy()
+    revised_cases.iloc[3] += 10
+    revised = _smooth(revised_cases)
+
+    resumed = _engine(revised).infer_all(plot=False, previous_state=earlier_engine.posterior_state)
+
+    assert earlier_engine.posterior_state.reusable_days(infer_rt._engine_hash(), revised) == 0
+    pd.testing.assert_frame_equal(resumed, _engine(revised).infer_all(plot=False))
+
+
+def test_store_round_trip(tmp_path):
+    cases = _cases()
+    earlier_engine = _engine(_smooth(cases.iloc[:-2]))
+    earlier_engine.infer_all(plot=False)
+    store = posterior_state.PosteriorStateStore(tmp_path)
+
+    assert store.read(REGION) is None
+    store.write(REGION, earlier_engine.posterior_state)
+    state = store.read(REGION)
+    later = _smooth(cases)
+
+    assert state.reusable_days(infer_rt._engine_hash(), later) > 0
+    assert state.reusable_days("other version", later) == 0
+    pd.testing.assert_frame_equal(
+        _engine(later).infer_all(plot=False, previous_state=state),
+        _engine(later).infer_all(plot=False),
+    )
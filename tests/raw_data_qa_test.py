@@ -0,0 +1,30 @@
+import argparse
+
+import numpy as np
+
+from raw_data_QA import check_raw_case_death_data
+
+
+def test_compare_metrics():
+    args = argparse.Namespace(
+        percent_threshold=5,
+        n_days_over_threshold=0,
+        n_days_z_score_mean=1,
+        new_day_percent_thres=10,
+    )
+    nan = np.nan
+    prod = np.array([[0, 10, 20, 30, nan], [1, 2, 3, nan, nan]])
+    latest = np.array([[0, 10, 22, 30, 40], [1, 2, 3, nan, nan]])
+
+    metrics = check_raw_case_death_data.get_compare_metrics(prod, latest, args)
+
+    np.testing.assert_array_equal(metrics.p_diff[0], [0, 0, 10, 0, nan])
+    np.testing.assert_allclose(metrics.new_p_diff[0], [nan, nan, nan, nan, 100 * 10 / 30])
+    np.testing.assert_array_equal(metrics.days_over, [1, 0])
+    np.testing.assert_array_equal(metrics.rmse, [1, 0])
+    np.testing.assert_array_equal(metrics.avg_z, [0.11, 0])
+    # The last day is excluded from the latest average.
+    np.testing.assert_array_equal(metrics.latest_avg_z, [0.15, 0])
+    np.testing.assert_array_equal(metrics.historical_data_disagree, [True, False])
+    np.testing.assert_array_equal(metrics.new_data_days_abnormal, [True, False])
+    np.testing.assert_array_equal(metrics.average_new_p_diff, [33.33, nan])
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+from scipy.integrate import odeint
+
+from pyseir.models import suppression_policies
+from pyseir.models.seir_ensemble import SEIRModelEnsemble
+from pyseir.models.seir_model import SEIRModel
+
+T_LIST = np.linspace(0, 200, 201)
+
+
+def _models():
+    N = 10000000
+    policies = [
+        lambda t: 1.0,
+        suppression_policies.piecewise_parametric_policy(np.array([1.0, 0.5, 0.8]), T_LIST),
+    ]
+    return [
+        SEIRModel(
+            N=N,
+            t_list=T_LIST,
+            suppression_policy=policy,
+            R0=r0,
+            A_initial=700,
+            I_initial=1000,
+            beds_general=N / 1000,
+            beds_ICU=N / 1000,
+            ventilators=N / 1000,
+        )
+        for r0 in (1.4, 2.5, 3.6)
+        for policy in policies
+    ]
+
+
+def _max_error_relative_to_peak(result, reference):
+    return np.max(np.abs(result - reference) / np.max(np.abs(reference), axis=0).clip(min=1))
+
+
+@pytest.mark.parametrize(
+    "ensemble_kwargs,max_error",
+    [({}, 2e-4), ({"steps_per_day": 8}, 5e-5), ({"adaptive": True}, 1e-3)],
+)
+def test_ensemble_matches_odeint(ensemble_kwargs, max_error):
+    models = _models()
+
+    results = SEIRModelEnsemble(models, **ensemble_kwargs).integrate()
+
+    for model, result in zip(models, results):
+        reference = odeint(
+            model._time_step, model.initial_conditions(), T_LIST, rtol=1e-8, atol=1e-6
+        )
+        assert _max_error_relative_to_peak(result, reference) < max_error
+
+
+def test_ensemble_run_sets_results():
+    models = _models()
+    expected = _models()
+    for model in expected:
+        model.run()
+
+    SEIRModelEnsemble(models).run()
+
+    for model, expected_model in zip(models, expected):
+        assert model.results.keys() == expected_model.results.keys()
+        np.testing.assert_allclose(
+            model.results["total_deaths"][-1], expected_model.results["total_deaths"][-1], rtol=1e-2
+        )
+
+
+def test_ensemble_requires_same_t_list():
+    models = _models()
+    models[0].t_list = np.linspace(0, 100, 101)
+
+    with pytest.raises(ValueError):
+        SEIRModelEnsemble(models)